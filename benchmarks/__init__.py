@@ -0,0 +1,6 @@
+"""Benchmarks for the Fixpoint SDK
+
+Each benchmark is a script you can run from the repository root, e.g.:
+
+    python -m benchmarks.callcache_deserialize
+"""
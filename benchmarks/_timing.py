@@ -0,0 +1,24 @@
+"""Timing helpers shared by the benchmarks"""
+
+__all__ = ["best_of", "print_result"]
+
+import time
+from typing import Any, Callable
+
+
+def best_of(fn: Callable[[], Any], repeat: int) -> float:
+    """Run `fn` `repeat` times and return the fastest wall-clock time, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def print_result(name: str, seconds: float, per: int = 1, unit: str = "op") -> None:
+    """Print a benchmark result, optionally with the time per operation"""
+    line = f"{name:<48} {seconds * 1000:>10.2f} ms"
+    if per > 1:
+        line += f"   ({seconds / per * 1e6:.2f} us/{unit})"
+    print(line)
@@ -0,0 +1,118 @@
+"""Benchmark deserializing cached step results from the on-disk call cache
+
+We store a `List[SomeDataclass]` step result with 100k items in a
+`StepDiskCallCache`, and then measure loading it back into that type. We
+compare the compiled type converters against interpreting the type hint on
+every conversion.
+
+Run it with:
+
+    python -m benchmarks.callcache_deserialize [--items N] [--repeat N]
+"""
+
+import argparse
+from dataclasses import dataclass
+import json
+from typing import Any, Dict, List, Optional, Type
+
+from fixpoint.workflows.structured._callcache import StepDiskCallCache
+from fixpoint.workflows.structured._callcache._converter import (
+    JSONTypeConverter,
+    compile_converter,
+    value_to_type,
+)
+
+from ._timing import best_of, print_result
+
+
+@dataclass
+class Address:
+    """A nested dataclass"""
+
+    street: str
+    city: str
+    zip_code: Optional[str]
+
+
+@dataclass
+class SomeDataclass:
+    """An item of the cached step result"""
+
+    id: int
+    name: str
+    score: float
+    tags: List[str]
+    address: Address
+    attributes: Dict[str, int]
+
+
+class _NeverConverts(JSONTypeConverter):
+    """A custom converter that forces the per-call type hint interpretation"""
+
+    # pylint: disable=unused-argument
+    def to_typed_value(self, hint: Type[Any], value: Any) -> Any:
+        """Always leave the conversion to the default behavior"""
+        return JSONTypeConverter.Unhandled
+
+
+def _make_items(n: int) -> List[SomeDataclass]:
+    return [
+        SomeDataclass(
+            id=i,
+            name=f"item-{i}",
+            score=i / 7,
+            tags=["a", "b"],
+            address=Address(street=f"{i} Main St", city="Springfield", zip_code=None),
+            attributes={"x": i, "y": 2 * i},
+        )
+        for i in range(n)
+    ]
+
+
+def main() -> None:
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    opts = parser.parse_args()
+
+    hint = List[SomeDataclass]
+    items = _make_items(opts.items)
+    cache = StepDiskCallCache.from_tmpdir(size_limit_bytes=2**32)
+    cache.store_result(run_id="run", kind_id="step", serialized_args="", res=items)
+    # pylint: disable=protected-access
+    raw_str = cache._cache[cache._serialize_key("run", "step", "")]
+    raw = json.loads(raw_str)
+
+    print(f"Deserializing List[SomeDataclass] with {opts.items} items")
+    print_result("json.loads only", best_of(lambda: json.loads(raw_str), opts.repeat))
+
+    interpreted = best_of(
+        lambda: value_to_type(hint, raw, custom_converters=[_NeverConverts()]),
+        opts.repeat,
+    )
+    print_result("convert: interpret hint per value", interpreted, opts.items, "item")
+
+    compile_start = best_of(lambda: compile_converter(hint), 1)
+    converter = compile_converter(hint)
+    compiled = best_of(lambda: converter(raw), opts.repeat)
+    print_result("convert: compiled converter", compiled, opts.items, "item")
+    print_result("compile converter (cached after first call)", compile_start)
+
+    def check_cache() -> Any:
+        return cache.check_cache(
+            run_id="run", kind_id="step", serialized_args="", type_hint=hint
+        )
+
+    assert check_cache().result == items
+    print_result(
+        "StepDiskCallCache.check_cache(type_hint=...)",
+        best_of(check_cache, opts.repeat),
+        opts.items,
+        "item",
+    )
+    print(f"speedup of compiled conversion: {interpreted / compiled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark cloning the workflow context for each task and step call
+
+Every `call_task` and `call_step` clones the workflow context, so the task or
+step gets its own view of the current node. We measure the cost of a clone, and
+of a trivial step call, for a workflow with many agents.
+
+Run it with:
+
+    python -m benchmarks.context_clone [--agents N] [--calls N] [--repeat N]
+"""
+
+import argparse
+import asyncio
+from typing import List
+
+from fixpoint.agents import AsyncBaseAgent
+from fixpoint.agents.openai import AsyncOpenAIAgent, AsyncOpenAIClients
+from fixpoint.workflows import imperative, structured
+
+from ._timing import best_of, print_result
+
+
+@structured.step(id="noop")
+async def noop(_ctx: structured.WorkflowContext) -> None:
+    """A step that does nothing"""
+
+
+def _new_agents(num_agents: int) -> List[AsyncBaseAgent]:
+    # the agents never make a request, so the API key does not matter
+    clients = AsyncOpenAIClients.from_api_key(api_key="unused")
+    return [
+        AsyncOpenAIAgent(
+            agent_id=f"agent-{i}", model_name="gpt-4o", openai_clients=clients
+        )
+        for i in range(num_agents)
+    ]
+
+
+def main() -> None:
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--agents", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    opts = parser.parse_args()
+    calls = opts.calls
+
+    ctx = structured.WorkflowContext(
+        run_config=structured.RunConfig.with_in_memory(),
+        agents=_new_agents(opts.agents),
+        workflow_run=imperative.Workflow(id="benchmark").run(),
+    )
+
+    def clones() -> None:
+        for _ in range(calls):
+            ctx.clone(new_step="noop")
+
+    async def steps() -> None:
+        for _ in range(calls):
+            await structured.call_step(ctx, noop)
+
+    print(f"Workflow context with {opts.agents} agents")
+    elapsed = best_of(clones, opts.repeat)
+    print_result("WorkflowContext.clone", elapsed, calls, "clone")
+    elapsed = best_of(lambda: asyncio.run(steps()), opts.repeat)
+    print_result("call_step, call-cache hits", elapsed, calls, "step")
+
+
+if __name__ == "__main__":
+    main()
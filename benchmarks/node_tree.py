@@ -0,0 +1,62 @@
+"""Benchmark the memory and serialization cost of a run's tree of nodes
+
+Every task and step call adds a node to the workflow run's tree, and the tree
+is never trimmed. We make a run with many step calls, and measure how long the
+calls take, how much memory the tree holds, and how long it takes to serialize
+the tree for the workflow run storage.
+
+Run it with:
+
+    python -m benchmarks.node_tree [--steps N] [--repeat N]
+"""
+
+import argparse
+import json
+import tracemalloc
+
+from fixpoint.workflows import WorkflowStatus, imperative
+from fixpoint.workflows.imperative.workflow import WorkflowRun
+
+from ._timing import best_of, print_result
+
+
+def _run_steps(num_steps: int) -> WorkflowRun:
+    run = imperative.Workflow(id="benchmark").run()
+    task = run.call_task("task")
+    for i in range(num_steps):
+        run.call_step(f"step-{i % 100}").close(WorkflowStatus.COMPLETED)
+    task.close(WorkflowStatus.COMPLETED)
+    return run
+
+
+def main() -> None:
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    opts = parser.parse_args()
+    steps = opts.steps
+
+    elapsed = best_of(lambda: _run_steps(steps), opts.repeat)
+    print_result("call_step + close", elapsed, steps, "step")
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    run = _run_steps(steps)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    node_bytes = (after - before) / steps
+    print(
+        f"{'memory held by the run':<48} {(after - before) / 2**20:>10.2f} MiB", end=""
+    )
+    print(f"   ({node_bytes:.0f} B/node)")
+
+    # pylint: disable=protected-access
+    elapsed = best_of(run._to_data, opts.repeat)
+    print_result("serialize the run", elapsed)
+    size = len(json.dumps(run._to_data().node_tree))
+    print(f"{'serialized node tree':<48} {size / 2**20:>10.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
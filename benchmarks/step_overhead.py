@@ -0,0 +1,81 @@
+"""Benchmark the fixed overhead of calling a structured workflow step
+
+We call a trivial step many times from one workflow context, and compare that
+with awaiting the same function directly. The difference is the framework's
+overhead per step: creating the step node, cloning the context, serializing the
+arguments, and checking and storing the call-cache result. We measure both
+cache misses (each call has new arguments) and cache hits (replaying a run).
+
+Run it with:
+
+    python -m benchmarks.step_overhead [--calls N] [--repeat N]
+"""
+
+import argparse
+import asyncio
+
+from fixpoint.workflows import imperative, structured
+
+from ._timing import best_of, print_result
+
+
+@structured.step(id="add-one")
+async def add_one(_ctx: structured.WorkflowContext, x: int) -> int:
+    """A step that does almost no work"""
+    return x + 1
+
+
+async def _add_one_plain(_ctx: structured.WorkflowContext, x: int) -> int:
+    return x + 1
+
+
+def _new_ctx() -> structured.WorkflowContext:
+    workflow = imperative.Workflow(id="benchmark")
+    return structured.WorkflowContext(
+        run_config=structured.RunConfig.with_in_memory(),
+        agents=[],
+        workflow_run=workflow.run(),
+    )
+
+
+def main() -> None:
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    opts = parser.parse_args()
+    calls = opts.calls
+
+    async def plain() -> None:
+        ctx = _new_ctx()
+        for i in range(calls):
+            await _add_one_plain(ctx, i)
+
+    async def steps(ctx: structured.WorkflowContext) -> None:
+        for i in range(calls):
+            await structured.call_step(ctx, add_one, args=[i])
+
+    def run_misses() -> None:
+        asyncio.run(steps(_new_ctx()))
+
+    hit_ctx = _new_ctx()
+    asyncio.run(steps(hit_ctx))
+
+    def run_hits() -> None:
+        asyncio.run(steps(hit_ctx))
+
+    print(f"Calling a trivial step {calls} times")
+    baseline = best_of(lambda: asyncio.run(plain()), opts.repeat)
+    print_result("await the function directly", baseline, calls, "call")
+    misses = best_of(run_misses, opts.repeat)
+    print_result("call_step, call-cache misses", misses, calls, "step")
+    hits = best_of(run_hits, opts.repeat)
+    print_result("call_step, call-cache hits", hits, calls, "step")
+    print(
+        f"overhead per step: {(misses - baseline) / calls * 1e6:.2f} us (miss),"
+        f" {(hits - baseline) / calls * 1e6:.2f} us (hit)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
 """Definitions for storage tables"""
 
-__all__ = ["DOCS_SQLITE_TABLE", "DOCS_POSTGRES_TABLE"]
+__all__ = [
+    "DOCS_SQLITE_TABLE",
+    "DOCS_POSTGRES_TABLE",
+    "WORKFLOW_JOBS_SQLITE_TABLE",
+    "WORKFLOW_JOBS_POSTGRES_TABLE",
+    "WORKFLOW_RUNS_SQLITE_TABLE",
+    "WORKFLOW_RUNS_POSTGRES_TABLE",
+    "WORKFLOW_RUN_JOURNAL_SQLITE_TABLES",
+]
 
 DOCS_SQLITE_TABLE = """
 CREATE TABLE IF NOT EXISTS documents (
@@ -31,3 +39,100 @@ CREATE TABLE if NOT EXISTS public.documents (
     PRIMARY KEY (id, workflow_id, workflow_run_id)
 );
 """
+
+WORKFLOW_JOBS_SQLITE_TABLE = """
+CREATE TABLE IF NOT EXISTS workflow_jobs (
+    id text PRIMARY KEY,
+    workflow_id text NOT NULL,
+    run_id text NOT NULL,
+    args jsonb NOT NULL,
+    kwargs jsonb NOT NULL,
+    priority integer NOT NULL,
+    status text NOT NULL,
+    attempts integer NOT NULL,
+    max_attempts integer NOT NULL,
+    lease_owner text,
+    lease_expires_at real,
+    result jsonb,
+    error text,
+    created_at real NOT NULL,
+    updated_at real NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS workflow_jobs_claim_idx
+    ON workflow_jobs (status, priority DESC, created_at);
+"""
+
+WORKFLOW_JOBS_POSTGRES_TABLE = """
+CREATE TABLE IF NOT EXISTS public.workflow_jobs (
+    id text PRIMARY KEY,
+    workflow_id text NOT NULL,
+    run_id text NOT NULL,
+    args jsonb NOT NULL,
+    kwargs jsonb NOT NULL,
+    priority integer NOT NULL,
+    status text NOT NULL,
+    attempts integer NOT NULL,
+    max_attempts integer NOT NULL,
+    lease_owner text,
+    lease_expires_at double precision,
+    result jsonb,
+    error text,
+    created_at double precision NOT NULL,
+    updated_at double precision NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS workflow_jobs_claim_idx
+    ON public.workflow_jobs (status, priority DESC, created_at);
+"""
+
+WORKFLOW_RUNS_SQLITE_TABLE = """
+CREATE TABLE IF NOT EXISTS workflow_runs (
+    id text PRIMARY KEY,
+    workflow_id text NOT NULL,
+    attempt_id text NOT NULL,
+    status text NOT NULL,
+    state jsonb NOT NULL,
+    node_tree jsonb NOT NULL,
+    created_at real NOT NULL,
+    updated_at real NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS workflow_runs_workflow_status_idx
+    ON workflow_runs (workflow_id, status);
+"""
+
+WORKFLOW_RUNS_POSTGRES_TABLE = """
+CREATE TABLE IF NOT EXISTS public.workflow_runs (
+    id text PRIMARY KEY,
+    workflow_id text NOT NULL,
+    attempt_id text NOT NULL,
+    status text NOT NULL,
+    state jsonb NOT NULL,
+    node_tree jsonb NOT NULL,
+    created_at double precision NOT NULL,
+    updated_at double precision NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS workflow_runs_workflow_status_idx
+    ON public.workflow_runs (workflow_id, status);
+"""
+
+WORKFLOW_RUN_JOURNAL_SQLITE_TABLES = """
+CREATE TABLE IF NOT EXISTS workflow_run_events (
+    workflow_run_id text NOT NULL,
+    seq integer NOT NULL,
+    kind text NOT NULL,
+    data jsonb NOT NULL,
+    created_at real NOT NULL,
+    PRIMARY KEY (workflow_run_id, seq)
+);
+
+CREATE TABLE IF NOT EXISTS workflow_run_snapshots (
+    workflow_run_id text NOT NULL,
+    seq integer NOT NULL,
+    snapshot jsonb NOT NULL,
+    created_at real NOT NULL,
+    PRIMARY KEY (workflow_run_id, seq)
+);
+"""
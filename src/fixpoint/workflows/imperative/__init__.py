@@ -7,6 +7,19 @@ __all__ = [
     "Form",
     "WorkflowContext",
     "StorageConfig",
+    "WorkflowRunData",
+    "WorkflowRunStorage",
+    "InMemWorkflowRunStorage",
+    "OnDiskWorkflowRunStorage",
+    "PostgresWorkflowRunStorage",
+    "RunRegistryStats",
+    "JournalEventKind",
+    "JournalEvent",
+    "RunSnapshot",
+    "RunJournal",
+    "InMemRunJournal",
+    "OnDiskRunJournal",
+    "RunJournalRecorder",
 ]
 
 from .workflow import Workflow, WorkflowRun
@@ -14,3 +27,20 @@ from .document import Document
 from .form import Form
 from .workflow_context import WorkflowContext
 from .config import StorageConfig
+from ._workflow_run_storage import (
+    WorkflowRunData,
+    WorkflowRunStorage,
+    InMemWorkflowRunStorage,
+    OnDiskWorkflowRunStorage,
+    PostgresWorkflowRunStorage,
+)
+from ._run_registry import RunRegistryStats
+from ._journal import (
+    JournalEventKind,
+    JournalEvent,
+    RunSnapshot,
+    RunJournal,
+    InMemRunJournal,
+    OnDiskRunJournal,
+    RunJournalRecorder,
+)
@@ -0,0 +1,569 @@
+"""Workflow run journals
+
+A run journal is an append-only log of everything a workflow run did: the task
+and step nodes it started and closed, which task and step results it wrote to
+the call cache, the documents and forms it stored or updated, and the agent calls it
+made. Every so often we fold the events into a snapshot of the run's state, so
+loading a run reads its latest snapshot plus the few events after it, in one
+pass over the journal. We only keep a run's latest snapshot. Loading the run as
+of an earlier event folds the events up to it, which lets you inspect the run
+at any point in its history.
+"""
+
+__all__ = [
+    "JournalEventKind",
+    "JournalEvent",
+    "RunSnapshot",
+    "RunJournal",
+    "InMemRunJournal",
+    "OnDiskRunJournal",
+    "RunJournalRecorder",
+]
+
+import copy
+from enum import Enum
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Annotated, Any, Dict, List, Optional, Protocol, Tuple
+
+from pydantic import BaseModel, Field
+
+from fixpoint._storage import definitions as storage_definitions
+from fixpoint.workflows.node_state import NodeState, NodeTree, WorkflowStatus
+
+
+DEFAULT_SNAPSHOT_EVERY = 100
+DEFAULT_FLUSH_EVERY = 50
+
+
+class JournalEventKind(Enum):
+    """The kinds of events in a run journal"""
+
+    RUN_STATUS = "RUN_STATUS"
+    NODE_STARTED = "NODE_STARTED"
+    NODE_CLOSED = "NODE_CLOSED"
+    CACHE_WRITE = "CACHE_WRITE"
+    DOCUMENT_STORED = "DOCUMENT_STORED"
+    FORM_STORED = "FORM_STORED"
+    AGENT_CALL = "AGENT_CALL"
+
+
+class JournalEvent(BaseModel):
+    """An event in a run journal"""
+
+    workflow_run_id: str = Field(description="The workflow run ID")
+    seq: int = Field(description="The event's position in the run's journal")
+    kind: JournalEventKind = Field(description="The kind of event")
+    data: Dict[str, Any] = Field(description="The event's data", default_factory=dict)
+    created_at: float = Field(
+        description="When the event happened, in seconds since the epoch",
+        default_factory=time.time,
+    )
+
+
+class RunSnapshot(BaseModel):
+    """The state of a workflow run, as of an event in its journal
+
+    Nodes are stored in the order they started, and each node refers to its
+    parent by its position in that list. The root node is first.
+    """
+
+    workflow_run_id: str = Field(description="The workflow run ID")
+    workflow_id: str = Field(description="The ID of the workflow", default="")
+    seq: int = Field(description="The last event folded into the snapshot", default=0)
+    attempt_id: str = Field(description="The ID of the run's attempt", default="")
+    status: WorkflowStatus = Field(
+        description="The status of the run", default=WorkflowStatus.RUNNING
+    )
+    state: Dict[str, Any] = Field(
+        description="The state of the run", default_factory=dict
+    )
+    nodes: Annotated[
+        List[Dict[str, Any]], Field(description="The run's task and step nodes")
+    ] = []
+    cache: Annotated[
+        Dict[str, Dict[str, int]],
+        Field(
+            description=(
+                "The task and step results written to the call cache, keyed on"
+                ' "{task|step}/{task or step ID}" and then the digest of the'
+                " serialized arguments, with the seq of the latest write. The"
+                " results themselves live in the call cache."
+            )
+        ),
+    ] = {}
+    documents: Annotated[
+        Dict[str, Dict[str, Any]],
+        Field(description="The latest version of each document"),
+    ] = {}
+    forms: Annotated[
+        Dict[str, Dict[str, Any]],
+        Field(description="The latest version of each form"),
+    ] = {}
+    agent_calls: int = Field(
+        description="The number of agent calls the run made", default=0
+    )
+
+    def apply(self, event: JournalEvent) -> None:
+        """Fold an event into the snapshot"""
+        data = event.data
+        if event.kind == JournalEventKind.RUN_STATUS:
+            self.workflow_id = data["workflow_id"]
+            self.attempt_id = data["attempt_id"]
+            self.status = WorkflowStatus(data["status"])
+            self.state = data["state"]
+            if not self.nodes:
+                self.nodes.append(_new_node(None, data["task"], data["step"]))
+            self.nodes[0]["status"] = data["status"]
+        elif event.kind == JournalEventKind.NODE_STARTED:
+            self.nodes.append(_new_node(data["parent"], data["task"], data["step"]))
+        elif event.kind == JournalEventKind.NODE_CLOSED:
+            self.nodes[data["node"]]["status"] = data["status"]
+        elif event.kind == JournalEventKind.CACHE_WRITE:
+            results = self.cache.setdefault(f"{data['cache']}/{data['kind_id']}", {})
+            results[data["args_digest"]] = event.seq
+        elif event.kind == JournalEventKind.DOCUMENT_STORED:
+            self.documents[data["id"]] = data
+        elif event.kind == JournalEventKind.FORM_STORED:
+            self.forms[data["id"]] = data
+        elif event.kind == JournalEventKind.AGENT_CALL:
+            self.agent_calls += 1
+        self.seq = event.seq
+
+    def build_nodes(self) -> List[NodeState]:
+        """Build the run's tree of nodes
+
+        Returns every node, in the same order as `nodes`, so the first node is
+        the root of the tree.
+        """
+        tree = NodeTree()
+        for node in self.nodes:
+            status = node["status"]
+            tree.append(
+                node["parent"],
+                node["task"],
+                node["step"],
+                None if status is None else WorkflowStatus(status),
+            )
+        return [tree.node(index) for index in range(len(tree))]
+
+
+class RunJournal(Protocol):
+    """Storage for run journals"""
+
+    # fold the journal into a new snapshot after this many events
+    snapshot_every: int
+
+    def append(self, event: JournalEvent) -> None:
+        """Append an event to a run's journal"""
+
+    def events(
+        self,
+        workflow_run_id: str,
+        after_seq: int = 0,
+        until_seq: Optional[int] = None,
+    ) -> List[JournalEvent]:
+        """List a run's events, in order"""
+
+    def store_snapshot(self, snapshot: RunSnapshot) -> None:
+        """Store a snapshot of a run, replacing its older snapshots"""
+
+    def flush(self) -> None:
+        """Write any buffered events to storage"""
+
+    def load(
+        self, workflow_run_id: str, at_seq: Optional[int] = None
+    ) -> Optional[RunSnapshot]:
+        """Load the state of a run
+
+        We start from the latest snapshot and fold in the events after it. If
+        you pass in `at_seq`, we load the state of the run as of that event.
+        Returns None if the run has no events.
+        """
+
+
+class InMemRunJournal(RunJournal):
+    """In-memory run journal
+
+    Useful for tests. Journals are only visible within the process.
+    """
+
+    snapshot_every: int
+    _events: Dict[str, List[JournalEvent]]
+    # the run ID -> the seq and JSON of its latest snapshot
+    _snapshots: Dict[str, Tuple[int, str]]
+    _lock: threading.Lock
+
+    def __init__(self, snapshot_every: int = DEFAULT_SNAPSHOT_EVERY) -> None:
+        self.snapshot_every = snapshot_every
+        self._events = {}
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def append(self, event: JournalEvent) -> None:
+        with self._lock:
+            events = self._events.setdefault(event.workflow_run_id, [])
+            events.append(event.model_copy(deep=True))
+
+    def events(
+        self,
+        workflow_run_id: str,
+        after_seq: int = 0,
+        until_seq: Optional[int] = None,
+    ) -> List[JournalEvent]:
+        with self._lock:
+            return [
+                event.model_copy(deep=True)
+                for event in self._events.get(workflow_run_id, [])
+                if event.seq > after_seq
+                and (until_seq is None or event.seq <= until_seq)
+            ]
+
+    def store_snapshot(self, snapshot: RunSnapshot) -> None:
+        serialized = snapshot.model_dump_json()
+        with self._lock:
+            self._snapshots[snapshot.workflow_run_id] = (snapshot.seq, serialized)
+
+    def flush(self) -> None:
+        pass
+
+    def load(
+        self, workflow_run_id: str, at_seq: Optional[int] = None
+    ) -> Optional[RunSnapshot]:
+        with self._lock:
+            seq, serialized = self._snapshots.get(workflow_run_id, (0, None))
+        snapshot = None
+        if serialized is not None and (at_seq is None or seq <= at_seq):
+            snapshot = RunSnapshot.model_validate_json(serialized)
+        after_seq = snapshot.seq if snapshot else 0
+        return _fold(
+            workflow_run_id, snapshot, self.events(workflow_run_id, after_seq, at_seq)
+        )
+
+
+class OnDiskRunJournal(RunJournal):
+    """On-disk run journal, backed by SQLite
+
+    We buffer events and write them in one transaction once `flush_every` of
+    them are buffered, when the run's status changes, and before any read. If
+    the process crashes, it loses the events that weren't written yet.
+
+    The journal serializes its use of the connection, so runs on several
+    threads can share it, as long as the connection was opened with
+    `check_same_thread=False`.
+    """
+
+    snapshot_every: int
+    flush_every: int
+    _conn: sqlite3.Connection
+    _lock: threading.Lock
+    _pending: List[JournalEvent]
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        snapshot_every: int = DEFAULT_SNAPSHOT_EVERY,
+        flush_every: int = DEFAULT_FLUSH_EVERY,
+    ) -> None:
+        self.snapshot_every = snapshot_every
+        self.flush_every = flush_every
+        self._conn = conn
+        self._lock = threading.Lock()
+        self._pending = []
+        with self._conn:
+            self._conn.executescript(
+                storage_definitions.WORKFLOW_RUN_JOURNAL_SQLITE_TABLES
+            )
+
+    def append(self, event: JournalEvent) -> None:
+        with self._lock:
+            self._pending.append(event)
+            if len(self._pending) >= self.flush_every:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def events(
+        self,
+        workflow_run_id: str,
+        after_seq: int = 0,
+        until_seq: Optional[int] = None,
+    ) -> List[JournalEvent]:
+        with self._lock:
+            self._flush()
+            with self._conn:
+                return self._read_events(workflow_run_id, after_seq, until_seq)
+
+    def store_snapshot(self, snapshot: RunSnapshot) -> None:
+        params = {
+            "workflow_run_id": snapshot.workflow_run_id,
+            "seq": snapshot.seq,
+            "snapshot": snapshot.model_dump_json(),
+            "created_at": time.time(),
+        }
+        with self._lock:
+            self._flush()
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO workflow_run_snapshots (
+                        workflow_run_id, seq, snapshot, created_at
+                    ) VALUES (:workflow_run_id, :seq, :snapshot, :created_at)
+                    """,
+                    params,
+                )
+                self._conn.execute(
+                    """
+                    DELETE FROM workflow_run_snapshots
+                    WHERE workflow_run_id = :workflow_run_id AND seq < :seq
+                    """,
+                    params,
+                )
+
+    def load(
+        self, workflow_run_id: str, at_seq: Optional[int] = None
+    ) -> Optional[RunSnapshot]:
+        with self._lock:
+            self._flush()
+            return self._load(workflow_run_id, at_seq)
+
+    def _load(
+        self, workflow_run_id: str, at_seq: Optional[int]
+    ) -> Optional[RunSnapshot]:
+        with self._conn:
+            row = self._conn.execute(
+                """
+                SELECT snapshot FROM workflow_run_snapshots
+                WHERE workflow_run_id = :workflow_run_id AND seq <= :at_seq
+                ORDER BY seq DESC
+                LIMIT 1
+                """,
+                {"workflow_run_id": workflow_run_id, "at_seq": _seq_bound(at_seq)},
+            ).fetchone()
+            snapshot = RunSnapshot.model_validate_json(row[0]) if row else None
+            after_seq = snapshot.seq if snapshot else 0
+            events = self._read_events(workflow_run_id, after_seq, at_seq)
+        return _fold(workflow_run_id, snapshot, events)
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO workflow_run_events (
+                    workflow_run_id, seq, kind, data, created_at
+                ) VALUES (:workflow_run_id, :seq, :kind, :data, :created_at)
+                """,
+                [
+                    {
+                        "workflow_run_id": event.workflow_run_id,
+                        "seq": event.seq,
+                        "kind": event.kind.value,
+                        "data": json.dumps(event.data),
+                        "created_at": event.created_at,
+                    }
+                    for event in self._pending
+                ],
+            )
+        self._pending = []
+
+    def _read_events(
+        self, workflow_run_id: str, after_seq: int, until_seq: Optional[int]
+    ) -> List[JournalEvent]:
+        dbcursor = self._conn.execute(
+            """
+            SELECT seq, kind, data, created_at FROM workflow_run_events
+            WHERE workflow_run_id = :workflow_run_id
+                AND seq > :after_seq AND seq <= :until_seq
+            ORDER BY seq
+            """,
+            {
+                "workflow_run_id": workflow_run_id,
+                "after_seq": after_seq,
+                "until_seq": _seq_bound(until_seq),
+            },
+        )
+        return [
+            JournalEvent(
+                workflow_run_id=workflow_run_id,
+                seq=row[0],
+                kind=JournalEventKind(row[1]),
+                data=json.loads(row[2]),
+                created_at=row[3],
+            )
+            for row in dbcursor
+        ]
+
+
+class RunJournalRecorder:
+    """Records the events of one workflow run to its journal
+
+    The recorder only keeps the run's latest seq and where its nodes are in
+    memory. Every `snapshot_every` events, it loads the run from the journal,
+    which folds the events since the last snapshot into it, and stores that as
+    the new snapshot. A run and its clones share one recorder.
+    """
+
+    _journal: RunJournal
+    _workflow_run_id: str
+    _seq: int
+    _node_count: int
+    _lock: threading.Lock
+    # the node's index in the run's tree -> its position in the snapshot's nodes
+    _node_positions: Dict[int, int]
+
+    def __init__(
+        self,
+        journal: RunJournal,
+        snapshot: RunSnapshot,
+        nodes: Optional[List[NodeState]] = None,
+    ) -> None:
+        self._journal = journal
+        self._workflow_run_id = snapshot.workflow_run_id
+        self._seq = snapshot.seq
+        self._node_count = len(snapshot.nodes)
+        self._lock = threading.Lock()
+        self._node_positions = {node.index: pos for pos, node in enumerate(nodes or [])}
+
+    def run_status(
+        self, workflow_id: str, attempt_id: str, root: NodeState, state: Dict[str, Any]
+    ) -> None:
+        """Record the status, attempt, and state of the run"""
+        with self._lock:
+            self._node_positions.setdefault(root.index, 0)
+            self._record(
+                JournalEventKind.RUN_STATUS,
+                {
+                    "workflow_id": workflow_id,
+                    "attempt_id": attempt_id,
+                    "status": (root.info.status or WorkflowStatus.RUNNING).value,
+                    "state": copy.deepcopy(state),
+                    "task": root.info.task,
+                    "step": root.info.step,
+                },
+            )
+            if self._node_count == 0:
+                self._node_count = 1
+            self._journal.flush()
+
+    def node_started(self, node: NodeState) -> None:
+        """Record that a task or step node started"""
+        with self._lock:
+            parent = node.prev_state
+            self._node_positions[node.index] = self._node_count
+            self._node_count += 1
+            self._record(
+                JournalEventKind.NODE_STARTED,
+                {
+                    "parent": (
+                        None
+                        if parent is None
+                        else self._node_positions.get(parent.index, 0)
+                    ),
+                    "task": node.info.task,
+                    "step": node.info.step,
+                },
+            )
+
+    def node_closed(self, node: NodeState) -> None:
+        """Record that a task or step node closed"""
+        with self._lock:
+            pos = self._node_positions.get(node.index)
+            if pos is None:
+                return
+            status = node.info.status
+            self._record(
+                JournalEventKind.NODE_CLOSED,
+                {"node": pos, "status": None if status is None else status.value},
+            )
+
+    def cache_write(self, cache: str, kind_id: str, serialized_args: str) -> None:
+        """Record that a task or step result was written to the call cache
+
+        We only record a reference to the result, since the call cache already
+        stores it and its codec may not produce JSON.
+        """
+        with self._lock:
+            self._record(
+                JournalEventKind.CACHE_WRITE,
+                {
+                    "cache": cache,
+                    "kind_id": kind_id,
+                    "args_digest": _args_digest(serialized_args),
+                },
+            )
+
+    def document_stored(self, document: BaseModel) -> None:
+        """Record that a document was stored or updated"""
+        with self._lock:
+            self._record(
+                JournalEventKind.DOCUMENT_STORED,
+                document.model_dump(mode="json", exclude={"versions"}),
+            )
+
+    def form_stored(self, form: BaseModel) -> None:
+        """Record that a form was stored or updated"""
+        with self._lock:
+            self._record(
+                JournalEventKind.FORM_STORED,
+                form.model_dump(mode="json", exclude={"versions", "form_schema"}),
+            )
+
+    def agent_call(self, agent_id: str, model: Optional[str]) -> None:
+        """Record that an agent was called"""
+        with self._lock:
+            self._record(
+                JournalEventKind.AGENT_CALL, {"agent_id": agent_id, "model": model}
+            )
+
+    def _record(self, kind: JournalEventKind, data: Dict[str, Any]) -> None:
+        self._seq += 1
+        self._journal.append(
+            JournalEvent(
+                workflow_run_id=self._workflow_run_id,
+                seq=self._seq,
+                kind=kind,
+                data=data,
+            )
+        )
+        if self._seq % self._journal.snapshot_every == 0:
+            snapshot = self._journal.load(self._workflow_run_id)
+            if snapshot is not None:
+                self._journal.store_snapshot(snapshot)
+
+
+def _args_digest(serialized_args: str) -> str:
+    """The digest of a call's serialized arguments, as recorded in a journal"""
+    return hashlib.sha256(serialized_args.encode()).hexdigest()
+
+
+def _new_node(parent: Optional[int], task: str, step: str) -> Dict[str, Any]:
+    return {
+        "parent": parent,
+        "task": task,
+        "step": step,
+        "status": WorkflowStatus.RUNNING.value,
+    }
+
+
+def _fold(
+    workflow_run_id: str, snapshot: Optional[RunSnapshot], events: List[JournalEvent]
+) -> Optional[RunSnapshot]:
+    if snapshot is None:
+        if not events:
+            return None
+        snapshot = RunSnapshot(workflow_run_id=workflow_run_id)
+    for event in events:
+        snapshot.apply(event)
+    return snapshot
+
+
+def _seq_bound(seq: Optional[int]) -> int:
+    # SQLite integers are at most 2**63 - 1
+    return (2**63 - 1) if seq is None else seq
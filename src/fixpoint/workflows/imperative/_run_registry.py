@@ -0,0 +1,163 @@
+"""The in-process registry of a workflow's runs
+
+A workflow keeps its runs in memory so that it can hand back the same run
+object when a run is loaded or retried. Runs hold their documents, forms, node
+tree, and more, so a long-lived process can't keep every run it has ever
+started. Closed runs, and optionally open runs, are each kept in a least
+recently used list of bounded size, and evicted runs are reloaded from the
+workflow run storage when they are needed again.
+"""
+
+__all__ = ["RunRegistryStats", "WorkflowRunRegistry"]
+
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+import threading
+from typing import Generic, Optional, TypeVar
+import weakref
+
+
+R = TypeVar("R")
+
+
+@dataclass
+class RunRegistryStats:
+    """Metrics about a workflow's in-process run registry"""
+
+    open_runs: int = 0
+    closed_runs: int = 0
+    max_closed_runs: Optional[int] = None
+    max_open_runs: Optional[int] = None
+    evicted_runs: int = 0
+
+    @property
+    def size(self) -> int:
+        """The number of runs the registry holds"""
+        return self.open_runs + self.closed_runs
+
+
+class WorkflowRunRegistry(Generic[R]):
+    """The in-process registry of a workflow's runs
+
+    Open runs past `max_open_runs` and closed runs past `max_closed_runs` are
+    evicted, least recently used first. We keep a weak reference to evicted
+    runs, so that if something else in the process still holds an evicted run,
+    looking it up returns that same object. So an open run is only dropped once
+    nothing else references it.
+    """
+
+    _max_open_runs: Optional[int]
+    _max_closed_runs: Optional[int]
+    _lock: threading.Lock
+    # least recently used runs come first
+    _open: "OrderedDict[str, R]"
+    _closed: "OrderedDict[str, R]"
+    _evicted_open: "weakref.WeakValueDictionary[str, R]"
+    _evicted: "weakref.WeakValueDictionary[str, R]"
+    _stats: RunRegistryStats
+
+    def __init__(
+        self,
+        max_closed_runs: Optional[int] = None,
+        max_open_runs: Optional[int] = None,
+    ) -> None:
+        """
+        max_closed_runs: the max number of closed runs to keep. If None, we
+            keep every closed run.
+        max_open_runs: the max number of open runs to keep. If None, we keep
+            every open run.
+        """
+        self._max_open_runs = max_open_runs
+        self._max_closed_runs = max_closed_runs
+        self._lock = threading.Lock()
+        self._open = OrderedDict()
+        self._closed = OrderedDict()
+        self._evicted_open = weakref.WeakValueDictionary()
+        self._evicted = weakref.WeakValueDictionary()
+        self._stats = RunRegistryStats(
+            max_closed_runs=max_closed_runs, max_open_runs=max_open_runs
+        )
+
+    def get(self, run_id: str) -> Optional[R]:
+        """Get a run, if the registry holds it"""
+        with self._lock:
+            for held in (self._open, self._closed):
+                run = held.get(run_id)
+                if run is not None:
+                    held.move_to_end(run_id)
+                    return run
+            # if an evicted run is still alive elsewhere in the process, we
+            # hold it again
+            run = self._evicted_open.pop(run_id, None)
+            if run is not None:
+                self._add(run_id, run, closed=False)
+                return run
+            run = self._evicted.pop(run_id, None)
+            if run is not None:
+                self._add(run_id, run, closed=True)
+            return run
+
+    def add(self, run_id: str, run: R, closed: bool = False) -> None:
+        """Add a run, replacing any run with the same ID"""
+        with self._lock:
+            self._pop(run_id)
+            self._add(run_id, run, closed)
+
+    def mark(self, run_id: str, closed: bool) -> None:
+        """Mark a run we hold as open or closed"""
+        with self._lock:
+            run = self._pop(run_id)
+            if run is not None:
+                self._add(run_id, run, closed)
+
+    def clear(self) -> None:
+        """Drop every run"""
+        with self._lock:
+            self._open.clear()
+            self._closed.clear()
+            self._evicted_open.clear()
+            self._evicted.clear()
+
+    def stats(self) -> RunRegistryStats:
+        """Get a snapshot of the registry's metrics"""
+        with self._lock:
+            return replace(
+                self._stats,
+                open_runs=len(self._open),
+                closed_runs=len(self._closed),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._open) + len(self._closed)
+
+    def _pop(self, run_id: str) -> Optional[R]:
+        run = self._open.pop(run_id, None)
+        if run is None:
+            run = self._closed.pop(run_id, None)
+        if run is None:
+            run = self._evicted_open.pop(run_id, None)
+        if run is None:
+            run = self._evicted.pop(run_id, None)
+        return run
+
+    def _add(self, run_id: str, run: R, closed: bool) -> None:
+        if closed:
+            held, max_runs, evicted = self._closed, self._max_closed_runs, self._evicted
+        else:
+            held, max_runs, evicted = (
+                self._open,
+                self._max_open_runs,
+                self._evicted_open,
+            )
+        held[run_id] = run
+        if max_runs is None:
+            return
+        while len(held) > max_runs:
+            evicted_id, evicted_run = held.popitem(last=False)
+            try:
+                evicted[evicted_id] = evicted_run
+            except TypeError:
+                # the run does not support weak references
+                pass
+            self._stats.evicted_runs += 1
@@ -15,6 +15,7 @@ from fixpoint.agents import CacheMode
 from fixpoint.memory import SupportsMemory
 from fixpoint.agents.protocol import BaseAgent, AsyncBaseAgent, T_contra
 from fixpoint._protocols.workflow_run import WorkflowRunData
+from fixpoint.workflows import tracing
 
 
 class AsyncWorkflowAgent(AsyncBaseAgent):
@@ -102,35 +103,40 @@ class AsyncWorkflowAgent(AsyncBaseAgent):
             raise ValueError(
                 "workflow_run cannot be passed in. It is inferred from the workflow"
             )
-        # we need to have this if/else check so that type-checking works
-        async with asyncio.TaskGroup() as tg:
-            if response_model:
-                task = tg.create_task(
-                    self._inner_agent.create_completion(
-                        messages=messages,
-                        response_model=response_model,
-                        model=model,
-                        tool_choice=tool_choice,
-                        tools=tools,
-                        temperature=temperature,
-                        cache_mode=cache_mode,
-                        workflow_run=self._workflow_run,
-                        **kwargs,
+        with tracing.span(
+            f"agent {self.id}", self._workflow_run, **{"agent.model": model}
+        ) as span:
+            # we need to have this if/else check so that type-checking works
+            async with asyncio.TaskGroup() as tg:
+                if response_model:
+                    task = tg.create_task(
+                        self._inner_agent.create_completion(
+                            messages=messages,
+                            response_model=response_model,
+                            model=model,
+                            tool_choice=tool_choice,
+                            tools=tools,
+                            temperature=temperature,
+                            cache_mode=cache_mode,
+                            workflow_run=self._workflow_run,
+                            **kwargs,
+                        )
                     )
-                )
-            else:
-                task = tg.create_task(
-                    self._inner_agent.create_completion(
-                        messages=messages,
-                        model=model,
-                        tool_choice=tool_choice,
-                        tools=tools,
-                        temperature=temperature,
-                        cache_mode=cache_mode,
-                        workflow_run=self._workflow_run,
-                        **kwargs,
+                else:
+                    task = tg.create_task(
+                        self._inner_agent.create_completion(
+                            messages=messages,
+                            model=model,
+                            tool_choice=tool_choice,
+                            tools=tools,
+                            temperature=temperature,
+                            cache_mode=cache_mode,
+                            workflow_run=self._workflow_run,
+                            **kwargs,
+                        )
                     )
-                )
+            _set_usage(span, task.result())
+        _record_agent_call(self._workflow_run, self.id, model)
         return task.result()
 
     def count_tokens(self, s: str) -> int:
@@ -229,30 +235,36 @@ class WorkflowAgent(BaseAgent):
             raise ValueError(
                 "workflow_run cannot be passed in. It is inferred from the workflow"
             )
-        # we need to have this if/else check so that type-checking works
-        if response_model:
-            return self._inner_agent.create_completion(
-                messages=messages,
-                response_model=response_model,
-                model=model,
-                tool_choice=tool_choice,
-                tools=tools,
-                temperature=temperature,
-                cache_mode=cache_mode,
-                workflow_run=self._workflow_run,
-                **kwargs,
-            )
-        else:
-            return self._inner_agent.create_completion(
-                messages=messages,
-                model=model,
-                tool_choice=tool_choice,
-                tools=tools,
-                temperature=temperature,
-                cache_mode=cache_mode,
-                workflow_run=self._workflow_run,
-                **kwargs,
-            )
+        with tracing.span(
+            f"agent {self.id}", self._workflow_run, **{"agent.model": model}
+        ) as span:
+            # we need to have this if/else check so that type-checking works
+            if response_model:
+                completion = self._inner_agent.create_completion(
+                    messages=messages,
+                    response_model=response_model,
+                    model=model,
+                    tool_choice=tool_choice,
+                    tools=tools,
+                    temperature=temperature,
+                    cache_mode=cache_mode,
+                    workflow_run=self._workflow_run,
+                    **kwargs,
+                )
+            else:
+                completion = self._inner_agent.create_completion(
+                    messages=messages,
+                    model=model,
+                    tool_choice=tool_choice,
+                    tools=tools,
+                    temperature=temperature,
+                    cache_mode=cache_mode,
+                    workflow_run=self._workflow_run,
+                    **kwargs,
+                )
+            _set_usage(span, completion)
+        _record_agent_call(self._workflow_run, self.id, model)
+        return completion
 
     def count_tokens(self, s: str) -> int:
         """Count the tokens in the string, according to the model's agent(s)"""
@@ -265,3 +277,23 @@ class WorkflowAgent(BaseAgent):
     def get_cache_mode(self) -> CacheMode:
         """If the agent has a cache, set its cache mode"""
         return self._inner_agent.get_cache_mode()
+
+
+def _set_usage(span: Optional[tracing.Span], completion: ChatCompletion[Any]) -> None:
+    """Record the token usage of a completion on its span"""
+    if span is None or completion.usage is None:
+        return
+    span.set_attribute("llm.usage.prompt_tokens", completion.usage.prompt_tokens)
+    span.set_attribute(
+        "llm.usage.completion_tokens", completion.usage.completion_tokens
+    )
+    span.set_attribute("llm.usage.total_tokens", completion.usage.total_tokens)
+
+
+def _record_agent_call(
+    workflow_run: WorkflowRunData, agent_id: str, model: Optional[str]
+) -> None:
+    # A WorkflowRun has a journal, but other WorkflowRunData might not
+    journal = getattr(workflow_run, "journal", None)
+    if journal is not None:
+        journal.agent_call(agent_id, model)
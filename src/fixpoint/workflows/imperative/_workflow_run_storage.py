@@ -0,0 +1,341 @@
+"""Workflow run storage
+
+Stores workflow runs, so that any process sharing the storage can load, retry,
+or inspect a run, not just the process that started it.
+"""
+
+__all__ = [
+    "WorkflowRunData",
+    "WorkflowRunStorage",
+    "InMemWorkflowRunStorage",
+    "OnDiskWorkflowRunStorage",
+    "PostgresWorkflowRunStorage",
+]
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import ConnectionPool
+from pydantic import BaseModel, Field
+
+from fixpoint._storage import definitions as storage_definitions
+from fixpoint._storage.sql import format_where_clause
+from fixpoint.workflows.node_state import (
+    NodeInfo,
+    NodeState,
+    NodeTree,
+    WorkflowStatus,
+)
+
+
+class WorkflowRunData(BaseModel):
+    """The stored state of a workflow run"""
+
+    id: str = Field(description="The workflow run ID")
+    workflow_id: str = Field(description="The ID of the workflow")
+    attempt_id: str = Field(description="The ID of the run's latest attempt")
+    status: WorkflowStatus = Field(description="The status of the workflow run")
+    state: Dict[str, Any] = Field(
+        description="The state of the workflow run", default_factory=dict
+    )
+    node_tree: Dict[str, Any] = Field(
+        description="The tree of task and step nodes the run has executed",
+        default_factory=dict,
+    )
+    created_at: float = Field(
+        description="When the run was first stored, in seconds since the epoch",
+        default=0.0,
+    )
+    updated_at: float = Field(
+        description="When the run was last stored, in seconds since the epoch",
+        default=0.0,
+    )
+
+
+class WorkflowRunStorage(Protocol):
+    """Storage for workflow runs"""
+
+    def get(self, workflow_run_id: str) -> Optional[WorkflowRunData]:
+        """Get a workflow run"""
+
+    def store(self, run: WorkflowRunData) -> None:
+        """Create or update a workflow run"""
+
+    def list(
+        self,
+        workflow_id: Optional[str] = None,
+        status: Optional[WorkflowStatus] = None,
+    ) -> List[WorkflowRunData]:
+        """List workflow runs, optionally of one workflow or with one status"""
+
+
+def dump_node_tree(root: NodeState) -> Dict[str, Any]:
+    """Serialize a run's tree of nodes to a JSON-able dict"""
+    return root.tree.to_dict()
+
+
+def load_node_tree(data: Dict[str, Any]) -> NodeState:
+    """Load a tree of nodes serialized with `dump_node_tree`, and return its root"""
+    if "next_states" not in data:
+        return NodeTree.from_dict(data).node(0)
+    # runs stored before we kept nodes in a `NodeTree` nest their nodes
+    tree = NodeTree()
+    pending: List[Tuple[Optional[int], Dict[str, Any]]] = [(None, data)]
+    while pending:
+        parent, node_data = pending.pop()
+        info = NodeInfo.model_validate(node_data["info"])
+        index = tree.append(parent, info.task, info.step, info.status)
+        pending.extend((index, child) for child in reversed(node_data["next_states"]))
+    return tree.node(0)
+
+
+class InMemWorkflowRunStorage(WorkflowRunStorage):
+    """In-memory workflow run storage
+
+    Useful for tests. Runs are only visible within the process.
+    """
+
+    _runs: Dict[str, WorkflowRunData]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def get(self, workflow_run_id: str) -> Optional[WorkflowRunData]:
+        with self._lock:
+            run = self._runs.get(workflow_run_id)
+            return None if run is None else run.model_copy(deep=True)
+
+    def store(self, run: WorkflowRunData) -> None:
+        now = time.time()
+        with self._lock:
+            existing = self._runs.get(run.id)
+            run = run.model_copy(deep=True)
+            run.created_at = existing.created_at if existing else now
+            run.updated_at = now
+            self._runs[run.id] = run
+
+    def list(
+        self,
+        workflow_id: Optional[str] = None,
+        status: Optional[WorkflowStatus] = None,
+    ) -> List[WorkflowRunData]:
+        with self._lock:
+            return [
+                run.model_copy(deep=True)
+                for run in self._runs.values()
+                if (workflow_id is None or run.workflow_id == workflow_id)
+                and (status is None or run.status == status)
+            ]
+
+
+class OnDiskWorkflowRunStorage(WorkflowRunStorage):
+    """On-disk workflow run storage, backed by SQLite"""
+
+    _conn: sqlite3.Connection
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        with self._conn:
+            self._conn.executescript(storage_definitions.WORKFLOW_RUNS_SQLITE_TABLE)
+
+    def get(self, workflow_run_id: str) -> Optional[WorkflowRunData]:
+        with self._conn:
+            dbcursor = self._conn.execute(
+                f"SELECT {_RUN_COLUMNS} FROM workflow_runs WHERE id = :id",
+                {"id": workflow_run_id},
+            )
+            row = dbcursor.fetchone()
+        if not row:
+            return None
+        return _load_sqlite_row(row)
+
+    def store(self, run: WorkflowRunData) -> None:
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO workflow_runs (
+                    id,
+                    workflow_id,
+                    attempt_id,
+                    status,
+                    state,
+                    node_tree,
+                    created_at,
+                    updated_at
+                )
+                VALUES (
+                    :id,
+                    :workflow_id,
+                    :attempt_id,
+                    :status,
+                    :state,
+                    :node_tree,
+                    :now,
+                    :now
+                )
+                ON CONFLICT (id) DO UPDATE SET
+                    attempt_id = excluded.attempt_id,
+                    status = excluded.status,
+                    state = excluded.state,
+                    node_tree = excluded.node_tree,
+                    updated_at = excluded.updated_at
+                """,
+                {
+                    "id": run.id,
+                    "workflow_id": run.workflow_id,
+                    "attempt_id": run.attempt_id,
+                    "status": run.status.value,
+                    "state": json.dumps(run.state),
+                    "node_tree": json.dumps(run.node_tree),
+                    "now": now,
+                },
+            )
+
+    def list(
+        self,
+        workflow_id: Optional[str] = None,
+        status: Optional[WorkflowStatus] = None,
+    ) -> List[WorkflowRunData]:
+        params = _list_conditions(workflow_id, status)
+        where_clause = format_where_clause(params) if params else ""
+        with self._conn:
+            dbcursor = self._conn.execute(
+                f"""
+                SELECT {_RUN_COLUMNS} FROM workflow_runs
+                {where_clause}
+                ORDER BY created_at
+                """,
+                params,
+            )
+            return [_load_sqlite_row(row) for row in dbcursor]
+
+
+class PostgresWorkflowRunStorage(WorkflowRunStorage):
+    """Workflow run storage backed by a Postgres database"""
+
+    _pool: ConnectionPool
+
+    def __init__(self, pool: ConnectionPool, create_table: bool = True) -> None:
+        self._pool = pool
+        if create_table:
+            with self._pool.connection() as conn:
+                conn.execute(storage_definitions.WORKFLOW_RUNS_POSTGRES_TABLE)
+
+    def get(self, workflow_run_id: str) -> Optional[WorkflowRunData]:
+        with self._pool.connection() as conn:
+            cursor = conn.cursor(row_factory=dict_row)
+            row = cursor.execute(
+                f"SELECT {_RUN_COLUMNS} FROM public.workflow_runs WHERE id = %(id)s",
+                {"id": workflow_run_id},
+            ).fetchone()
+        if row is None:
+            return None
+        return WorkflowRunData.model_validate(row)
+
+    def store(self, run: WorkflowRunData) -> None:
+        with self._pool.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO public.workflow_runs (
+                    id,
+                    workflow_id,
+                    attempt_id,
+                    status,
+                    state,
+                    node_tree,
+                    created_at,
+                    updated_at
+                )
+                VALUES (
+                    %(id)s,
+                    %(workflow_id)s,
+                    %(attempt_id)s,
+                    %(status)s,
+                    %(state)s,
+                    %(node_tree)s,
+                    EXTRACT(EPOCH FROM clock_timestamp())::double precision,
+                    EXTRACT(EPOCH FROM clock_timestamp())::double precision
+                )
+                ON CONFLICT (id) DO UPDATE SET
+                    attempt_id = excluded.attempt_id,
+                    status = excluded.status,
+                    state = excluded.state,
+                    node_tree = excluded.node_tree,
+                    updated_at = excluded.updated_at
+                """,
+                {
+                    "id": run.id,
+                    "workflow_id": run.workflow_id,
+                    "attempt_id": run.attempt_id,
+                    "status": run.status.value,
+                    "state": Jsonb(run.state),
+                    "node_tree": Jsonb(run.node_tree),
+                },
+            )
+
+    def list(
+        self,
+        workflow_id: Optional[str] = None,
+        status: Optional[WorkflowStatus] = None,
+    ) -> List[WorkflowRunData]:
+        params = _list_conditions(workflow_id, status)
+        where_clause = ""
+        if params:
+            where_clause = "WHERE " + " AND ".join(
+                f"{key} = %({key})s" for key in params
+            )
+        with self._pool.connection() as conn:
+            cursor = conn.cursor(row_factory=dict_row)
+            rows = cursor.execute(
+                f"""
+                SELECT {_RUN_COLUMNS} FROM public.workflow_runs
+                {where_clause}
+                ORDER BY created_at
+                """,
+                params,
+            ).fetchall()
+        return [WorkflowRunData.model_validate(row) for row in rows]
+
+
+_RUN_COLUMNS = """
+    id,
+    workflow_id,
+    attempt_id,
+    status,
+    state,
+    node_tree,
+    created_at,
+    updated_at
+"""
+
+
+def _list_conditions(
+    workflow_id: Optional[str], status: Optional[WorkflowStatus]
+) -> Dict[str, Any]:
+    params: Dict[str, Any] = {}
+    if workflow_id:
+        params["workflow_id"] = workflow_id
+    if status:
+        params["status"] = status.value
+    return params
+
+
+def _load_sqlite_row(row: Any) -> WorkflowRunData:
+    return WorkflowRunData(
+        id=row[0],
+        workflow_id=row[1],
+        attempt_id=row[2],
+        status=WorkflowStatus(row[3]),
+        state=json.loads(row[4]),
+        node_tree=json.loads(row[5]),
+        created_at=row[6],
+        updated_at=row[7],
+    )
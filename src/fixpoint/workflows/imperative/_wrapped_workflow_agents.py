@@ -1,9 +1,30 @@
-"""Wrapped agents scoped to a workflow run"""
+"""Wrapped agents scoped to a workflow run
+
+We clone the agents every time a workflow calls a task or a step, so cloning
+must be cheap. Clones share the dict of inner agents until one of them adds an
+agent, and each clone wraps an agent for its workflow run the first time the
+agent is used.
+
+The containers never change the agents they are given. An agent without memory
+gets a shallow copy for the workflow run, with the run's memory. The copy shares
+the agent's clients, cache, and config, so many concurrent runs can use one set
+of agents.
+"""
 
 __all__ = ["WrappedWorkflowAgents", "AsyncWrappedWorkflowAgents"]
 
-from dataclasses import dataclass
-from typing import cast, Dict, Iterable, List, Optional, Tuple, TypeVar, Union
+import copy
+from typing import (
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from fixpoint.agents import BaseAgent, AsyncBaseAgent
 from fixpoint.memory import NoOpMemory, Memory
@@ -11,170 +32,91 @@ from .workflow import WorkflowRun
 from ._workflow_agent import WorkflowAgent, AsyncWorkflowAgent
 
 
-class WrappedWorkflowAgents:
-    """Wrapped agents scoped to a workflow run"""
-
-    _agents: Dict[str, WorkflowAgent]
-    _workflow_run: WorkflowRun
+A = TypeVar("A", BaseAgent, AsyncBaseAgent)
+W = TypeVar("W", WorkflowAgent, AsyncWorkflowAgent)
+Self = TypeVar("Self", bound="_LazyWrappedAgents")  # type: ignore[type-arg]
 
-    def __init__(
-        self,
-        agents: List[BaseAgent],
-        workflow_run: WorkflowRun,
-        *,
-        _workflow_agents_override_: Optional[Dict[str, WorkflowAgent]] = None,
-    ) -> None:
-        self._workflow_run = workflow_run
-        self._agents = cast(
-            Dict[str, WorkflowAgent],
-            _init_agents(
-                workflow_run, _SyncInitArgs(agents, _workflow_agents_override_)
-            ),
-        )
 
-    def __getitem__(self, key: str) -> BaseAgent:
-        return self._agents[key]
+class _LazyWrappedAgents(Generic[A, W]):
+    """Shared implementation of the wrapped agent containers"""
 
-    def __setitem__(self, key: str, agent: BaseAgent) -> None:
-        self._agents[key] = _wrap_sync_agent(self._workflow_run, agent)
-
-    def keys(self) -> Iterable[str]:
-        """Returns the agent ids in the workflow"""
-        return self._agents.keys()
-
-    def values(self) -> Iterable[BaseAgent]:
-        """Returns the agents in the workflow"""
-        return self._agents.values()
-
-    def items(self) -> Iterable[Tuple[str, BaseAgent]]:
-        """Returns the (agent ids, agents) in the workflow"""
-        return self._agents.items()
-
-    def clone(
-        self, new_workflow_run: Optional[WorkflowRun] = None
-    ) -> "WrappedWorkflowAgents":
-        """Clones the workflow context"""
-        workflow_run = self._workflow_run
-        if new_workflow_run:
-            workflow_run = new_workflow_run
-        new_agents = {
-            # pylint: disable=protected-access
-            k: WorkflowAgent(v._inner_agent, workflow_run)
-            for k, v in self._agents.items()
-        }
-
-        new_self = self.__class__(
-            agents=[],
-            workflow_run=workflow_run,
-            _workflow_agents_override_=new_agents,
-        )
-        if new_workflow_run:
-            # pylint: disable=protected-access
-            _update_agents(new_self._agents, workflow_run)
-        return new_self
-
-
-class AsyncWrappedWorkflowAgents:
-    """Wrapped async agents scoped to a workflow run"""
-
-    _agents: Dict[str, AsyncWorkflowAgent]
+    _wrap: Callable[[A, WorkflowRun], W]
+    # The inner agents, shared between clones. Copy it before changing it.
+    _inner_agents: Dict[str, A]
+    # The agents wrapped for this container's workflow run
+    _agents: Dict[str, W]
     _workflow_run: WorkflowRun
 
     def __init__(
         self,
-        agents: List[AsyncBaseAgent],
+        agents: List[A],
         workflow_run: WorkflowRun,
         *,
-        _workflow_agents_override_: Optional[Dict[str, AsyncWorkflowAgent]] = None,
+        _workflow_agents_override_: Optional[Dict[str, W]] = None,
     ) -> None:
         self._workflow_run = workflow_run
-        self._agents = cast(
-            Dict[str, AsyncWorkflowAgent],
-            _init_agents(
-                workflow_run, _AsyncInitArgs(agents, _workflow_agents_override_)
-            ),
-        )
-
-    def __getitem__(self, key: str) -> AsyncBaseAgent:
-        return self._agents[key]
-
-    def __setitem__(self, key: str, agent: AsyncBaseAgent) -> None:
-        self._agents[key] = _wrap_async_agent(self._workflow_run, agent)
+        if _workflow_agents_override_:
+            _check_unique_ids(list(_workflow_agents_override_.keys()))
+            self._agents = _workflow_agents_override_
+            self._inner_agents = {
+                # pylint: disable=protected-access
+                agent_id: agent._inner_agent  # type: ignore[misc]
+                for agent_id, agent in _workflow_agents_override_.items()
+            }
+        else:
+            _check_unique_ids([agent.id for agent in agents])
+            self._agents = {}
+            self._inner_agents = {
+                agent.id: _prepare_wrapped_agent(workflow_run, agent)
+                for agent in agents
+            }
+
+    def __getitem__(self, key: str) -> A:
+        agent = self._agents.get(key)
+        if agent is None:
+            agent = self._wrap(self._inner_agents[key], self._workflow_run)
+            self._agents[key] = agent
+        return agent  # type: ignore[return-value]
+
+    def __setitem__(self, key: str, agent: A) -> None:
+        agent = _prepare_wrapped_agent(self._workflow_run, agent)
+        self._inner_agents = {**self._inner_agents, key: agent}
+        self._agents[key] = self._wrap(agent, self._workflow_run)
 
     def keys(self) -> Iterable[str]:
         """Returns the agent ids in the workflow"""
-        return self._agents.keys()
+        return self._inner_agents.keys()
 
-    def values(self) -> Iterable[AsyncBaseAgent]:
+    def values(self) -> Iterable[A]:
         """Returns the agents in the workflow"""
-        return self._agents.values()
+        return [self[agent_id] for agent_id in self._inner_agents]
 
-    def items(self) -> Iterable[Tuple[str, AsyncBaseAgent]]:
+    def items(self) -> Iterable[Tuple[str, A]]:
         """Returns the (agent ids, agents) in the workflow"""
-        return self._agents.items()
-
-    def clone(
-        self, new_workflow_run: Optional[WorkflowRun] = None
-    ) -> "AsyncWrappedWorkflowAgents":
-        """Clones the workflow context"""
-        workflow_run = self._workflow_run
-        if new_workflow_run:
-            workflow_run = new_workflow_run
-        new_agents = {
-            # pylint: disable=protected-access
-            k: AsyncWorkflowAgent(v._inner_agent, workflow_run)
-            for k, v in self._agents.items()
-        }
-
-        new_self = self.__class__(
-            agents=[],
-            workflow_run=workflow_run,
-            _workflow_agents_override_=new_agents,
-        )
-        if new_workflow_run:
-            # pylint: disable=protected-access
-            _update_agents(new_self._agents, workflow_run)
-        return new_self
-
-
-GenAgent = TypeVar("GenAgent", bound=Union[BaseAgent, AsyncBaseAgent])
-GenWorkflowAgent = TypeVar(
-    "GenWorkflowAgent", bound=Union[WorkflowAgent, AsyncWorkflowAgent]
-)
+        return [(agent_id, self[agent_id]) for agent_id in self._inner_agents]
 
+    def clone(self: Self, new_workflow_run: Optional[WorkflowRun] = None) -> Self:
+        """Clones the wrapped agents, optionally for a new workflow run"""
+        # pylint: disable=protected-access
+        new_self = self.__class__.__new__(self.__class__)
+        new_self._inner_agents = self._inner_agents
+        new_self._agents = {}
+        new_self._workflow_run = new_workflow_run or self._workflow_run
+        return new_self
 
-@dataclass
-class _SyncInitArgs:
-    agents: List[BaseAgent]
-    workflow_agents_override: Optional[Dict[str, WorkflowAgent]]
 
+class WrappedWorkflowAgents(_LazyWrappedAgents[BaseAgent, WorkflowAgent]):
+    """Wrapped agents scoped to a workflow run"""
 
-@dataclass
-class _AsyncInitArgs:
-    agents: List[AsyncBaseAgent]
-    workflow_agents_override: Optional[Dict[str, AsyncWorkflowAgent]]
+    _wrap = WorkflowAgent
 
 
-def _init_agents(
-    workflow_run: WorkflowRun, init_args: Union[_SyncInitArgs, _AsyncInitArgs]
-) -> Union[Dict[str, WorkflowAgent], Dict[str, AsyncWorkflowAgent]]:
-    if init_args.workflow_agents_override:
-        _check_unique_ids(list(init_args.workflow_agents_override.keys()))
-        return init_args.workflow_agents_override
+class AsyncWrappedWorkflowAgents(
+    _LazyWrappedAgents[AsyncBaseAgent, AsyncWorkflowAgent]
+):
+    """Wrapped async agents scoped to a workflow run"""
 
-    _check_unique_ids([agent.id for agent in init_args.agents])
-    if isinstance(init_args, _SyncInitArgs):
-        new_sync_agents: Dict[str, WorkflowAgent] = {}
-        for agent in init_args.agents:
-            new_sync_agents[agent.id] = _wrap_sync_agent(workflow_run, agent)
-        return new_sync_agents
-    else:
-        new_async_agents: Dict[str, AsyncWorkflowAgent] = {}
-        for async_agent in init_args.agents:
-            new_async_agents[async_agent.id] = _wrap_async_agent(
-                workflow_run, async_agent
-            )
-        return new_async_agents
+    _wrap = AsyncWorkflowAgent
 
 
 def _check_unique_ids(agent_ids: List[str]) -> None:
@@ -182,32 +124,18 @@ def _check_unique_ids(agent_ids: List[str]) -> None:
         raise ValueError("Duplicate agent ids are not allowed")
 
 
-def _wrap_sync_agent(workflow_run: WorkflowRun, agent: BaseAgent) -> WorkflowAgent:
-    agent = _prepare_wrapped_agent(workflow_run, agent)
-    return WorkflowAgent(agent, workflow_run)
-
-
-def _wrap_async_agent(
-    workflow_run: WorkflowRun, agent: AsyncBaseAgent
-) -> AsyncWorkflowAgent:
-    agent = _prepare_wrapped_agent(workflow_run, agent)
-    return AsyncWorkflowAgent(agent, workflow_run)
+GenAgent = TypeVar("GenAgent", bound=Union[BaseAgent, AsyncBaseAgent])
 
 
 def _prepare_wrapped_agent(workflow_run: WorkflowRun, agent: GenAgent) -> GenAgent:
-    # We require agents in a workflow to have working memory
-    if isinstance(agent.memory, NoOpMemory):
-        if workflow_run.storage_config:
-            agent.memory = workflow_run.storage_config.memory_factory(agent.id)
-        else:
-            agent.memory = Memory()
-    return agent
-
-
-def _update_agents(
-    agents: Union[Dict[str, WorkflowAgent], Dict[str, AsyncWorkflowAgent]],
-    workflow_run: WorkflowRun,
-) -> None:
-    for agent in agents.values():
-        # pylint: disable=protected-access
-        agent._workflow_run = workflow_run
+    # We require agents in a workflow to have working memory. If the agent has
+    # none, we give the run its own view of the agent rather than setting memory
+    # on the caller's agent, which other runs might be using.
+    if not isinstance(agent.memory, NoOpMemory):
+        return agent
+    run_agent = copy.copy(agent)
+    if workflow_run.storage_config:
+        run_agent.memory = workflow_run.storage_config.memory_factory(agent.id)
+    else:
+        run_agent.memory = Memory()
+    return run_agent
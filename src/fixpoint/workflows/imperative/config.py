@@ -3,7 +3,7 @@
 Configuration for imperative workflows, such as setting up storage.
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import os
 from typing import Callable, List, Optional
 
@@ -14,6 +14,8 @@ from fixpoint.utils.storage import new_sqlite_conn
 from fixpoint._constants import DEFAULT_DISK_CACHE_SIZE_LIMIT_BYTES
 from ._doc_storage import DocStorage, SupabaseDocStorage, OnDiskDocStorage
 from ._form_storage import FormStorage, SupabaseFormStorage, OnDiskFormStorage
+from ._workflow_run_storage import WorkflowRunStorage, OnDiskWorkflowRunStorage
+from ._journal import RunJournal
 from .document import Document
 from .form import Form
 
@@ -23,12 +25,24 @@ DEF_CHAT_CACHE_TTL_S = 60 * 60 * 24 * 7
 
 @dataclass
 class StorageConfig:
-    """Storage configuration for imperative workflows and its agents, etc."""
+    """Storage configuration for imperative workflows and its agents, etc.
+
+    If there is a `workflow_run_storage`, workflow runs are stored there, so
+    that any process that shares the storage can load and retry them.
+    Otherwise, a workflow run is only known to the process that started it.
+
+    If there is a `run_journal`, each workflow run records what it does to an
+    append-only journal, which you can use to inspect the run at any point in
+    its history. A process that loads the run restores it from the journal's
+    latest snapshot, ahead of the workflow run storage.
+    """
 
     forms_storage: Optional[FormStorage]
     docs_storage: Optional[DocStorage]
     agent_cache: Optional[cache.SupportsChatCompletionCache]
     memory_factory: Callable[[str], memory.SupportsMemory]
+    workflow_run_storage: Optional[WorkflowRunStorage] = field(default=None)
+    run_journal: Optional[RunJournal] = field(default=None)
 
     @classmethod
     def with_defaults(
@@ -88,6 +102,7 @@ class StorageConfig:
         mem_conn = sqlite_conn
         doc_conn = sqlite_conn
         form_conn = sqlite_conn
+        run_conn = sqlite_conn
 
         # TODO(dbmikus) support on-disk memory storage
         # https://linear.app/fixpoint/issue/PRO-41/add-on-disk-memory-storage
@@ -108,6 +123,7 @@ class StorageConfig:
             docs_storage=OnDiskDocStorage(doc_conn),
             agent_cache=agent_cache,
             memory_factory=memory_factory,
+            workflow_run_storage=OnDiskWorkflowRunStorage(run_conn),
         )
 
     @classmethod
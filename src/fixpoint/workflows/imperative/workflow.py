@@ -1,6 +1,6 @@
 """Simple implementation of a workflow"""
 
-from typing import Any, Dict, List, Optional, Type, TypeVar, Union, cast
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar, Union, cast
 
 from pydantic import (
     BaseModel,
@@ -12,7 +12,13 @@ from pydantic import (
 )
 
 from fixpoint._utils.ids import make_resource_uuid
-from fixpoint.workflows.node_state import NodeState, CallHandle, SpawnGroup, NodeInfo
+from fixpoint.workflows.node_state import (
+    NodeState,
+    CallHandle,
+    SpawnGroup,
+    NodeInfo,
+    WorkflowStatus,
+)
 from fixpoint.workflows.human import HumanInTheLoop
 
 from .document import Document
@@ -20,29 +26,93 @@ from .form import Form
 from .config import StorageConfig, get_default_storage_config
 from ._doc_storage import DocStorage
 from ._form_storage import FormStorage
+from ._workflow_run_storage import WorkflowRunData, dump_node_tree, load_node_tree
+from ._run_registry import RunRegistryStats, WorkflowRunRegistry
+from ._journal import RunJournalRecorder, RunSnapshot
 
 T = TypeVar("T", bound=BaseModel)
 
+DEFAULT_MAX_CLOSED_RUNS = 1000
+
+_OPEN_STATUSES = frozenset([WorkflowStatus.RUNNING, WorkflowStatus.SUSPENDED])
+
 
 class Workflow(BaseModel):
     """A simple workflow implementation.
 
     From the Workflow, you can spawn Workflow Runs.
+
+    The workflow keeps its open runs and the `max_closed_runs` most recently
+    used closed runs in memory. If you load an evicted run, we reload it from
+    the workflow run storage.
+
+    Runs stay open until you save them with a closed status. If your runs are
+    durable and you don't always close them, you can also set `max_open_runs`
+    to evict the least recently used open runs. An evicted open run stays in
+    memory as long as something else in the process references it. If nothing
+    does and there is no workflow run storage or run journal to reload it from,
+    the run is lost.
     """
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
     id: str = Field(description="The unique identifier for the workflow.")
-    _memory: Dict[str, "WorkflowRun"] = PrivateAttr(default_factory=dict)
+    max_closed_runs: Optional[int] = Field(
+        description=(
+            "The max number of closed runs to keep in memory."
+            " If None, we keep every run."
+        ),
+        default=DEFAULT_MAX_CLOSED_RUNS,
+        exclude=True,
+    )
+    max_open_runs: Optional[int] = Field(
+        description=(
+            "The max number of open runs to keep in memory, besides the runs"
+            " that something else references. If None, we keep every open run."
+        ),
+        default=None,
+        exclude=True,
+    )
+    _memory: WorkflowRunRegistry["WorkflowRun"] = PrivateAttr()
 
-    def run(self, storage_config: Optional[StorageConfig] = None) -> "WorkflowRun":
-        """Create and run a Workflow Run"""
+    def model_post_init(self, _context: Any) -> None:
+        self._memory = WorkflowRunRegistry(
+            max_closed_runs=self.max_closed_runs, max_open_runs=self.max_open_runs
+        )
+
+    def run_registry_stats(self) -> RunRegistryStats:
+        """Get metrics about the runs this workflow holds in memory"""
+        return self._memory.stats()
+
+    def run(
+        self,
+        storage_config: Optional[StorageConfig] = None,
+        run_id: Optional[str] = None,
+    ) -> "WorkflowRun":
+        """Create and run a Workflow Run
+
+        If you pass in a `run_id`, the new workflow run uses that ID instead of
+        generating one. This is useful to resume a run that started in another
+        process.
+        """
         storage_config = storage_config or get_default_storage_config()
         new_workflow_run = WorkflowRun(
             workflow=self,
             storage_config=storage_config,
         )
-        self._memory[new_workflow_run.id] = new_workflow_run
+        if run_id is not None:
+            # pylint: disable=protected-access
+            new_workflow_run._id = run_id
+            # re-create the helpers that are scoped to the run ID
+            new_workflow_run.model_post_init(None)
+        if storage_config.run_journal is not None:
+            # pylint: disable=protected-access
+            new_workflow_run._journal = RunJournalRecorder(
+                storage_config.run_journal,
+                RunSnapshot(workflow_run_id=new_workflow_run.id),
+            )
+        self._memory.add(new_workflow_run.id, new_workflow_run)
+        new_workflow_run.save()
         return new_workflow_run
 
     def retry(
@@ -50,17 +120,34 @@ class Workflow(BaseModel):
     ) -> "WorkflowRun":
         """Retry a workflow run"""
         storage_config = storage_config or get_default_storage_config()
-        run = self.load_run(run_id)
+        run = self.load_run(run_id, storage_config=storage_config)
         if not run:
             raise ValueError(f'WorkflowRun "{run_id}" not found')
         run.generate_new_attempt()
+        run.save(status=WorkflowStatus.RUNNING)
         return run
 
-    def load_run(self, workflow_run_id: str) -> Union["WorkflowRun", None]:
-        """Load a workflow run from memory."""
-        # TODO(jakub): This should work with storage layers: postgres / supabase, in-memory
-        # and on-disk
-        return self._memory.get(workflow_run_id)
+    def load_run(
+        self, workflow_run_id: str, storage_config: Optional[StorageConfig] = None
+    ) -> Union["WorkflowRun", None]:
+        """Load a workflow run
+
+        We look for the workflow run in memory first. If this process does not
+        know about the run, we load it from the storage config's run journal or
+        its workflow run storage, if it has one.
+        """
+        run = self._memory.get(workflow_run_id)
+        if run is not None:
+            return run
+        storage_config = storage_config or get_default_storage_config()
+        run = _load_journaled_workflow_run(self, workflow_run_id, storage_config)
+        if run is None and storage_config.workflow_run_storage is not None:
+            data = storage_config.workflow_run_storage.get(workflow_run_id)
+            if data is not None and data.workflow_id == self.id:
+                run = _load_workflow_run(self, data, storage_config)
+        if run is not None:
+            self._memory.add(run.id, run, closed=run.status not in _OPEN_STATUSES)
+        return run
 
 
 def new_workflow_run_id() -> str:
@@ -73,7 +160,7 @@ def new_workflow_run_attempt_id() -> str:
     return make_resource_uuid("wfrunatmpt")
 
 
-class WorkflowRun(BaseModel):
+class WorkflowRun(BaseModel):  # pylint: disable=too-many-public-methods
     """A workflow run.
 
     The workflow run has a cache for objects, such as documents, forms, and
@@ -99,6 +186,7 @@ class WorkflowRun(BaseModel):
 
     _node_state: NodeState = PrivateAttr(default_factory=NodeState)
     _human_in_the_loop: HumanInTheLoop = PrivateAttr()
+    _journal: Optional[RunJournalRecorder] = PrivateAttr(default=None)
     state: dict[str, Any] = Field(
         description="State of the workflow run", default_factory=dict
     )
@@ -164,6 +252,11 @@ class WorkflowRun(BaseModel):
         """Get the human in the loop for the workflow run"""
         return self._human_in_the_loop
 
+    @property
+    def journal(self) -> Optional[RunJournalRecorder]:
+        """The recorder for the run's journal, if the storage has a run journal"""
+        return self._journal
+
     # pylint: disable=unused-argument
     def goto_task(self, task_id: str) -> None:
         """Transition to the given task.
@@ -171,7 +264,7 @@ class WorkflowRun(BaseModel):
         Tasks do not need to be declared ahead of time. When you go to a task,
         we infer its existence.
         """
-        self._node_state = self._node_state.add_task(task_id)
+        self._node_state = self._started(self._node_state.add_task(task_id))
 
     # pylint: disable=unused-argument
     def goto_step(self, step_id: str, task_id: Optional[str] = None) -> None:
@@ -180,55 +273,182 @@ class WorkflowRun(BaseModel):
         Steps do not need to be declared ahead of time. When you go to a step,
         we infer its existence.
         """
-        self._node_state = self._node_state.add_step(step_id, task_id)
+        self._node_state = self._started(self._node_state.add_step(step_id, task_id))
 
     def _update_node_state(self, new_state: NodeState) -> NodeState:
         self._node_state = new_state
         return self._node_state
 
+    def _started(self, node: NodeState) -> NodeState:
+        if self._journal is not None:
+            self._journal.node_started(node)
+        return node
+
+    def _on_node_close(self) -> Optional[Callable[[NodeState], None]]:
+        return None if self._journal is None else self._journal.node_closed
+
     def call_step(self, step_id: str) -> CallHandle:
         """Call a step"""
-        self._node_state = self._node_state.add_step(step_id)
-        return CallHandle(self._node_state, self._update_node_state)
+        self._node_state = self._started(self._node_state.add_step(step_id))
+        return CallHandle(
+            self._node_state, self._update_node_state, self._on_node_close()
+        )
 
     def call_task(self, task_id: str) -> CallHandle:
         """Call a task"""
-        self._node_state = self._node_state.add_task(task_id)
-        return CallHandle(self._node_state, self._update_node_state)
+        self._node_state = self._started(self._node_state.add_task(task_id))
+        return CallHandle(
+            self._node_state, self._update_node_state, self._on_node_close()
+        )
 
     def spawn_step(self, step_id: str) -> CallHandle:
         """Spawn a step"""
-        new_node = self._node_state.add_step(step_id)
-        return CallHandle(new_node)
+        new_node = self._started(self._node_state.add_step(step_id))
+        return CallHandle(new_node, on_close=self._on_node_close())
 
     def spawn_task(self, task_id: str) -> CallHandle:
         """Spawn a task"""
-        new_node = self._node_state.add_task(task_id)
-        return CallHandle(new_node)
+        new_node = self._started(self._node_state.add_task(task_id))
+        return CallHandle(new_node, on_close=self._on_node_close())
+
+    def spawn_group(  # pylint: disable=invalid-name
+        self, max_workers: Optional[int] = None
+    ) -> SpawnGroup:
+        """Handle for spawning a group of tasks
 
-    def spawn_group(self) -> SpawnGroup:  # pylint: disable=invalid-name
-        """Handle for spawning a group of tasks"""
-        return SpawnGroup(node_state=self._node_state)
+        The group runs submitted work on at most `max_workers` threads, or
+        started coroutines at most `max_workers` at a time.
+        """
+        return SpawnGroup(
+            node_state=self._node_state,
+            on_spawn=None if self._journal is None else self._journal.node_started,
+            on_close=self._on_node_close(),
+            max_workers=max_workers,
+        )
 
     def generate_new_attempt(self) -> None:
         """Generate and set a new attempt ID for the workflow run"""
         self._attempt_id = new_workflow_run_attempt_id()
 
+    @property
+    def status(self) -> WorkflowStatus:
+        """The status of the workflow run as a whole"""
+        return self._root_node().info.status or WorkflowStatus.RUNNING
+
+    def save(self, status: Optional[WorkflowStatus] = None) -> None:
+        """Store the workflow run in the workflow run storage, if there is one
+
+        If you pass in a `status`, we first set the status of the run. Once the
+        run is closed, the workflow may evict it from memory.
+        """
+        if status is not None:
+            self._root_node().status = status
+            # pylint: disable=protected-access
+            self.workflow._memory.mark(self.id, closed=status not in _OPEN_STATUSES)
+        if self._journal is not None:
+            self._journal.run_status(
+                self.workflow_id, self.attempt_id, self._root_node(), self.state
+            )
+        if self.storage_config is None:
+            return
+        run_storage = self.storage_config.workflow_run_storage
+        if run_storage is not None:
+            run_storage.store(self._to_data())
+
+    def _to_data(self) -> WorkflowRunData:
+        return WorkflowRunData(
+            id=self.id,
+            workflow_id=self.workflow_id,
+            attempt_id=self.attempt_id,
+            status=self.status,
+            state=self.state,
+            node_tree=dump_node_tree(self._root_node()),
+        )
+
+    def _root_node(self) -> NodeState:
+        return self._node_state.root()
+
     def clone(
         self, new_task: str | None = None, new_step: str | None = None
     ) -> "WorkflowRun":
-        """Clones the workflow run"""
-        # we cannot deep copy because some of the fields cannot be pickled,
-        # which is what the pydantic copy method uses
-        new_self = self.model_copy(deep=False)
-        # pylint: disable=protected-access
-        new_self._node_state = self._node_state.model_copy(deep=False)
-        new_self._node_state.info = self._node_state.info.model_copy(deep=True)
-        if new_task:
-            new_self._node_state.info.task = new_task
-        if new_step:
-            new_self._node_state.info.step = new_step
-        return new_self
+        """Clones the workflow run
+
+        The clone is a lightweight frame: it shares the run's documents, forms,
+        state, and node tree, and only has its own copy of the current node.
+        """
+        node_view = self._node_state.renamed(task=new_task, step=new_step)
+        return _frame(self, _private_updates_={"_node_state": node_view})
+
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def _frame(
+    model: M, *, _private_updates_: Optional[Dict[str, Any]] = None, **updates: Any
+) -> M:
+    """Make a shallow copy of a model, with some fields replaced
+
+    This skips pydantic's copying and validation, because we clone the workflow
+    run for every task and step call.
+    """
+    cls = model.__class__
+    new_model = cls.__new__(cls)
+    object.__setattr__(new_model, "__dict__", {**model.__dict__, **updates})
+    object.__setattr__(new_model, "__pydantic_extra__", model.__pydantic_extra__)
+    object.__setattr__(
+        new_model, "__pydantic_fields_set__", model.__pydantic_fields_set__
+    )
+    private = model.__pydantic_private__
+    if private is not None:
+        private = {**private, **(_private_updates_ or {})}
+    object.__setattr__(new_model, "__pydantic_private__", private)
+    return new_model
+
+
+def _load_journaled_workflow_run(
+    workflow: Workflow, workflow_run_id: str, storage_config: StorageConfig
+) -> Optional[WorkflowRun]:
+    """Load a workflow run from its latest journal snapshot"""
+    journal = storage_config.run_journal
+    if journal is None:
+        return None
+    snapshot = journal.load(workflow_run_id)
+    if snapshot is None or snapshot.workflow_id != workflow.id:
+        return None
+    nodes = snapshot.build_nodes()
+    run = WorkflowRun(
+        workflow=workflow, storage_config=storage_config, state=snapshot.state
+    )
+    # pylint: disable=protected-access
+    run._id = snapshot.workflow_run_id
+    run._attempt_id = snapshot.attempt_id
+    if nodes:
+        run._node_state = nodes[0]
+    run._journal = RunJournalRecorder(journal, snapshot, nodes)
+    # re-create the helpers that are scoped to the run ID
+    run.model_post_init(None)
+    if storage_config.docs_storage is None:
+        # in-memory documents only survive in the journal
+        for doc in snapshot.documents.values():
+            run._documents._memory[doc["id"]] = Document.model_validate(doc)
+    return run
+
+
+def _load_workflow_run(
+    workflow: Workflow, data: WorkflowRunData, storage_config: StorageConfig
+) -> WorkflowRun:
+    """Load a stored workflow run"""
+    run = WorkflowRun(
+        workflow=workflow, storage_config=storage_config, state=data.state
+    )
+    # pylint: disable=protected-access
+    run._id = data.id
+    run._attempt_id = data.attempt_id
+    if data.node_tree:
+        run._node_state = load_node_tree(data.node_tree)
+    # re-create the helpers that are scoped to the run ID
+    run.model_post_init(None)
+    return run
 
 
 class _Documents:
@@ -297,6 +517,8 @@ class _Documents:
             self._storage.create(document)
         else:
             self._memory[id] = document
+        if self.workflow_run.journal is not None:
+            self.workflow_run.journal.document_stored(document)
         return document
 
     def update(
@@ -326,6 +548,8 @@ class _Documents:
             self._storage.update(document)
         else:
             self._memory[document_id] = document
+        if self.workflow_run.journal is not None:
+            self.workflow_run.journal.document_stored(document)
 
         return document
 
@@ -422,6 +646,8 @@ class _Forms:
             self._storage.create(cast(Form[BaseModel], form))
         else:
             self._memory[form_id] = cast(Form[BaseModel], form)
+        if self.workflow_run.journal is not None:
+            self.workflow_run.journal.form_stored(form)
 
         return form
 
@@ -458,6 +684,8 @@ class _Forms:
             self._storage.update(form)
         else:
             self._memory[form_id] = form
+        if self.workflow_run.journal is not None:
+            self.workflow_run.journal.form_stored(form)
 
         return cast(Form[T], form)
 
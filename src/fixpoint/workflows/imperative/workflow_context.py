@@ -59,12 +59,15 @@ class WorkflowContext:
 
     def _setup_logger(self, workflow_run: WorkflowRun) -> logging.Logger:
         logger = logging.getLogger(f"fixpoint/workflows/runs/{workflow_run.id}")
-        # We need to add this stream handler, because otherwise I think the
-        # logger is using the handler from the default logger, which has a
-        # log-level of "warning". This means that we do not print "info" logs.
-        c_handler = logging.StreamHandler()
-        logger.addHandler(c_handler)
-        logger.setLevel(logging.INFO)
+        # Loggers are global, so if we already set up this run's logger (say,
+        # for an earlier attempt of the run), don't add another handler.
+        if not logger.handlers:
+            # We need to add this stream handler, because otherwise I think the
+            # logger is using the handler from the default logger, which has a
+            # log-level of "warning". This means that we do not print "info" logs.
+            c_handler = logging.StreamHandler()
+            logger.addHandler(c_handler)
+            logger.setLevel(logging.INFO)
         return logger
 
     @classmethod
@@ -93,16 +96,15 @@ class WorkflowContext:
     def clone(
         self, new_task: str | None = None, new_step: str | None = None
     ) -> "WorkflowContext":
-        """Clones the workflow context"""
-        # clone the workflow run
+        """Clones the workflow context
+
+        The clone shares everything with this context except for the workflow
+        run's current node, and its agents are scoped to the cloned run.
+        """
         new_workflow_run = self.workflow_run.clone(new_task=new_task, new_step=new_step)
-        # clone the agents
-        new_agents = self.agents.clone(new_workflow_run)
-
-        return self.__class__(
-            agents=[],
-            workflow_run=new_workflow_run,
-            cache=self.cache,
-            logger=self.logger,
-            _workflow_agents_override_=new_agents,
-        )
+        new_self = object.__new__(self.__class__)
+        new_self.__dict__.update(self.__dict__)
+        new_self.workflow_run = new_workflow_run
+        new_self.agents = self.agents.clone(new_workflow_run)
+        new_self.async_agents = self.async_agents.clone(new_workflow_run)
+        return new_self
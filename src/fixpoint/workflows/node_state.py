@@ -2,13 +2,36 @@
 Node state management for workflows.
 """
 
-__all__ = ["WorkflowStatus", "NodeInfo", "CallHandle", "NodeState", "SpawnGroup"]
+__all__ = [
+    "WorkflowStatus",
+    "NodeInfo",
+    "CallHandle",
+    "NodeState",
+    "NodeTree",
+    "SpawnGroup",
+]
 
+from array import array
+import asyncio
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
 import threading
 from enum import Enum
 from types import TracebackType
-from typing import List, Optional, Callable, Union
-from pydantic import BaseModel, Field, computed_field, PrivateAttr
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
+from pydantic import BaseModel, ConfigDict, Field, computed_field
 
 from fixpoint.workflows.constants import TASK_MAIN_ID, STEP_MAIN_ID
 
@@ -30,8 +53,13 @@ class NodeInfo(BaseModel):
     """
     Each task or step in a workflow run is a "node". This keeps track of which
     node the workflow run is in.
+
+    Node info is a frozen snapshot of the node, so setting a field raises an
+    error. To change a node's status, set `NodeState.status`.
     """
 
+    model_config = ConfigDict(frozen=True)
+
     task: str = Field(description="The task that the node is in", default=TASK_MAIN_ID)
     step: str = Field(description="The step that the node is in", default=STEP_MAIN_ID)
     status: Optional[WorkflowStatus] = Field(
@@ -45,70 +73,357 @@ class NodeInfo(BaseModel):
         return f"{self.task}/{self.step}"
 
 
+NodeCallback = Callable[["NodeState"], None]
+T = TypeVar("T")
+
+
 class CallHandle:
     """A handle used for transitioning back to the parent state"""
 
     _current_state: "NodeState"
     _update_node_state: Optional[Callable[["NodeState"], "NodeState"]]
+    _on_close: Optional[NodeCallback]
 
     def __init__(
         self,
         current_state: "NodeState",
         update_node_state: Optional[Callable[["NodeState"], "NodeState"]] = None,
+        on_close: Optional[NodeCallback] = None,
     ):
         self._current_state = current_state
         self._update_node_state = update_node_state
+        self._on_close = on_close
 
     def close(self, status: WorkflowStatus) -> "NodeState":
         """Close the node and return the parent state"""
         # Set status on current node and return parent state
-        self._current_state.info.status = status
+        self._current_state.status = status
         prev_state = self._current_state.prev_state
         if prev_state is None:
             raise RuntimeError("Cannot close node with no previous state")
+        if self._on_close is not None:
+            self._on_close(self._current_state)
         if self._update_node_state is not None:
             self._update_node_state(prev_state)
         return prev_state
 
 
-class NodeState(BaseModel):
-    """The state of a node in a workflow run"""
+# The position of each status is its code in a `NodeTree`. Only add statuses to
+# the end, because we persist the codes.
+_STATUSES: List[Optional[WorkflowStatus]] = [
+    None,
+    WorkflowStatus.RUNNING,
+    WorkflowStatus.SUSPENDED,
+    WorkflowStatus.FAILED,
+    WorkflowStatus.CANCELLED,
+    WorkflowStatus.COMPLETED,
+    WorkflowStatus.TERMINATED,
+    WorkflowStatus.TIMED_OUT,
+    WorkflowStatus.CONTINUED_AS_NEW,
+]
+_STATUS_CODES: Dict[Optional[WorkflowStatus], int] = {
+    status: code for code, status in enumerate(_STATUSES)
+}
 
-    prev_state: Optional["NodeState"] = Field(
-        description="The previous state", default=None
-    )
-    info: NodeInfo = Field(description="The head of the node state", default=NodeInfo())
-    next_states: List["NodeState"] = Field(description="The next states", default=[])
-    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
 
-    def _add_node(self, step: str, task: str) -> "NodeState":
-        next_state = NodeState(info=NodeInfo(step=step, task=task), prev_state=self)
-        self.next_states.append(next_state)
-        return next_state
+class NodeTree:
+    """A compact, append-only store of the nodes in a workflow run
+
+    A run with tens of thousands of tasks and steps would need tens of
+    thousands of node objects, so instead we keep the nodes in parallel arrays
+    of parent index, task ID, step ID, and status. Task and step IDs are
+    interned, because a run calls the same tasks and steps over and over. A
+    node is identified by its index, and the root node has index 0.
+    """
+
+    _lock: threading.Lock
+    # -1 for the root node
+    _parents: "array[int]"
+    # indexes into `_names`
+    _tasks: "array[int]"
+    _steps: "array[int]"
+    # indexes into `_STATUSES`
+    _statuses: bytearray
+    _names: List[str]
+    _name_ids: Dict[str, int]
+    # only nodes that have children are in here
+    _children: Dict[int, "array[int]"]
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._parents = array("i")
+        self._tasks = array("I")
+        self._steps = array("I")
+        self._statuses = bytearray()
+        self._names = []
+        self._name_ids = {}
+        self._children = {}
+
+    def __len__(self) -> int:
+        return len(self._parents)
+
+    def append(
+        self,
+        parent: Optional[int],
+        task: str,
+        step: str,
+        status: Optional[WorkflowStatus] = WorkflowStatus.RUNNING,
+    ) -> int:
+        """Add a node to the tree and return its index"""
+        with self._lock:
+            index = len(self._parents)
+            if parent is None:
+                self._parents.append(-1)
+            else:
+                if not 0 <= parent < index:
+                    raise IndexError(f"No parent node at index {parent}")
+                self._parents.append(parent)
+                children = self._children.get(parent)
+                if children is None:
+                    children = self._children[parent] = array("i")
+                children.append(index)
+            self._tasks.append(self._intern(task))
+            self._steps.append(self._intern(step))
+            self._statuses.append(_STATUS_CODES[status])
+            return index
+
+    def parent(self, index: int) -> Optional[int]:
+        """The index of the node's parent, or None for the root node"""
+        parent = self._parents[index]
+        return None if parent < 0 else parent
+
+    def children(self, index: int) -> List[int]:
+        """The indexes of the node's children, in the order they were added"""
+        children = self._children.get(index)
+        return [] if children is None else children.tolist()
+
+    def task(self, index: int) -> str:
+        """The task that the node is in"""
+        return self._names[self._tasks[index]]
+
+    def step(self, index: int) -> str:
+        """The step that the node is in"""
+        return self._names[self._steps[index]]
+
+    def status(self, index: int) -> Optional[WorkflowStatus]:
+        """The status of the node"""
+        return _STATUSES[self._statuses[index]]
+
+    def set_status(self, index: int, status: Optional[WorkflowStatus]) -> None:
+        """Set the status of the node"""
+        with self._lock:
+            self._statuses[index] = _STATUS_CODES[status]
+
+    def node(self, index: int = 0) -> "NodeState":
+        """Get a view of the node at `index`"""
+        if not 0 <= index < len(self._parents):
+            raise IndexError(f"No node at index {index}")
+        return NodeState(self, index)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the tree to a JSON-able dict"""
+        with self._lock:
+            return {
+                "names": list(self._names),
+                "parents": self._parents.tolist(),
+                "tasks": self._tasks.tolist(),
+                "steps": self._steps.tolist(),
+                "statuses": [
+                    None if status is None else status.value
+                    for status in map(_STATUSES.__getitem__, self._statuses)
+                ],
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "NodeTree":
+        """Load a tree serialized with `to_dict`"""
+        tree = cls()
+        names = data["names"]
+        for parent, task, step, status in zip(
+            data["parents"], data["tasks"], data["steps"], data["statuses"]
+        ):
+            tree.append(
+                None if parent < 0 else parent,
+                names[task],
+                names[step],
+                None if status is None else WorkflowStatus(status),
+            )
+        return tree
+
+    def _intern(self, name: str) -> int:
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        return name_id
+
+
+class NodeState:
+    """The state of a node in a workflow run
+
+    A node state is a lightweight view of one node in a `NodeTree`, so it is
+    cheap to create and the tree does not hold on to it. Two views of the same
+    node are equal. A view can show the node under a different task or step
+    name, which is how a cloned workflow run sees the task or step it runs.
+    """
+
+    __slots__ = ("tree", "index", "_task", "_step")
+
+    tree: NodeTree
+    index: int
+    _task: Optional[str]
+    _step: Optional[str]
+
+    def __init__(
+        self,
+        tree: Optional[NodeTree] = None,
+        index: int = 0,
+        *,
+        task: Optional[str] = None,
+        step: Optional[str] = None,
+    ) -> None:
+        if tree is None:
+            tree = NodeTree()
+            tree.append(None, TASK_MAIN_ID, STEP_MAIN_ID)
+        self.tree = tree
+        self.index = index
+        self._task = task
+        self._step = step
+
+    @property
+    def info(self) -> NodeInfo:
+        """The head of the node state
+
+        This is a frozen snapshot of the node. Nodes used to hold their info,
+        so `node.info.status = status` changed the node; now it raises, and
+        you set `node.status = status` instead.
+        """
+        return NodeInfo.model_construct(
+            task=self._task or self.tree.task(self.index),
+            step=self._step or self.tree.step(self.index),
+            status=self.tree.status(self.index),
+        )
+
+    @property
+    def status(self) -> Optional[WorkflowStatus]:
+        """The status of the node"""
+        return self.tree.status(self.index)
+
+    @status.setter
+    def status(self, status: Optional[WorkflowStatus]) -> None:
+        self.tree.set_status(self.index, status)
+
+    @property
+    def prev_state(self) -> Optional["NodeState"]:
+        """The previous state"""
+        parent = self.tree.parent(self.index)
+        return None if parent is None else NodeState(self.tree, parent)
+
+    @property
+    def next_states(self) -> List["NodeState"]:
+        """The next states"""
+        return [NodeState(self.tree, child) for child in self.tree.children(self.index)]
+
+    def root(self) -> "NodeState":
+        """The root node of the tree"""
+        return NodeState(self.tree, 0)
+
+    def renamed(
+        self, task: Optional[str] = None, step: Optional[str] = None
+    ) -> "NodeState":
+        """A view of the node that shows it under a different task or step"""
+        return NodeState(
+            self.tree, self.index, task=task or self._task, step=step or self._step
+        )
 
     def add_step(self, step: str, task: Union[str, None] = None) -> "NodeState":
         """Add a step to the node state"""
-        with self._lock:  # pylint: disable=not-context-manager
-            task = task or self.info.task
-            return self._add_node(step, task)
+        task = task or self._task or self.tree.task(self.index)
+        return NodeState(self.tree, self.tree.append(self.index, task, step))
 
     def add_task(self, task: str) -> "NodeState":
         """Add a task to the node state"""
-        with self._lock:  # pylint: disable=not-context-manager
-            return self._add_node(STEP_MAIN_ID, task)
+        return NodeState(self.tree, self.tree.append(self.index, task, STEP_MAIN_ID))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, NodeState):
+            return NotImplemented
+        return self.tree is other.tree and self.index == other.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self) -> str:
+        return f"NodeState(index={self.index}, info={self.info!r})"
 
 
 class SpawnGroup:
-    """Context manager for spawning nodes in a group"""
+    """Context manager for spawning nodes in a group
+
+    Besides recording nodes with `spawn_task` and `spawn_step`, a spawn group
+    can run work concurrently, each piece of work in its own spawned node:
+
+    - `submit_task` and `submit_step` run functions on a thread pool with at
+      most `max_workers` threads.
+    - `start_task` and `start_step` run coroutines on the event loop, at most
+      `max_workers` at a time. Use the group with `async with` for these, since
+      a plain `with` block can't wait for them.
+
+    ```
+    with workflow_run.spawn_group(max_workers=8) as group:
+        for field in fields:
+            group.submit_step(f"extract-{field}", extract_field, doc, field)
+    values = group.results()
+    ```
+
+    Each node is marked COMPLETED, FAILED, or CANCELLED when its work finishes.
+    The thread pool's threads update nodes and call the group's callbacks one
+    at a time. When the block exits, we wait for all of the work. If some of it
+    failed, or was cancelled without the block raising, we raise an
+    `ExceptionGroup` with the errors, or a `BaseExceptionGroup` if any of them
+    isn't an `Exception`. Like `asyncio.TaskGroup`, we re-raise a
+    `KeyboardInterrupt` or `SystemExit` from the work as is. If the block itself
+    raised, we cancel the work that has not finished first.
+    """
 
     _node_state: NodeState
     _spawned_nodes: List[NodeState]
+    _on_spawn: Optional[NodeCallback]
+    _on_close: Optional[NodeCallback]
+    _max_workers: Optional[int]
+    _executor: Optional[ThreadPoolExecutor]
+    _semaphore: Optional[asyncio.Semaphore]
+    # the work running in spawned nodes, and which nodes have work
+    _work: List[Union["Future[Any]", "asyncio.Future[Any]"]]
+    _work_nodes: Set[int]
+    # serializes node updates and callbacks from the thread pool's threads
+    _lock: threading.Lock
+    # whether the group was entered with `async with`, or None if not entered
+    _entered_async: Optional[bool]
 
-    def __init__(self, node_state: NodeState):
+    def __init__(
+        self,
+        node_state: NodeState,
+        on_spawn: Optional[NodeCallback] = None,
+        on_close: Optional[NodeCallback] = None,
+        max_workers: Optional[int] = None,
+    ):
+        if max_workers is not None and max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
         self._node_state = node_state
         self._spawned_nodes = []
+        self._on_spawn = on_spawn
+        self._on_close = on_close
+        self._max_workers = max_workers
+        self._executor = None
+        self._semaphore = None
+        self._work = []
+        self._work_nodes = set()
+        self._lock = threading.Lock()
+        self._entered_async = None
 
     def __enter__(self) -> "SpawnGroup":
+        self._entered_async = False
         return self
 
     def __exit__(
@@ -117,22 +432,185 @@ class SpawnGroup:
         exc_val: Union[BaseException, None],
         exc_tb: Union[TracebackType, None],
     ) -> None:
+        if any(isinstance(work, asyncio.Future) for work in self._work):
+            # we can't wait for coroutines here, so don't leave them running
+            self._cancel_work()
+            raise RuntimeError(
+                "Use `async with` for a spawn group that runs coroutines"
+            )
         if exc_val is not None:
-            for node in self._spawned_nodes:
-                node.info.status = WorkflowStatus.FAILED
-        else:
-            for node in self._spawned_nodes:
-                node.info.status = WorkflowStatus.COMPLETED
+            self._cancel_work()
+        futures.wait(cast(List["Future[Any]"], self._work))
+        if self._executor is not None:
+            # A future is done before its thread runs its done callbacks, so
+            # wait for the threads too, so that every node is closed.
+            self._executor.shutdown(wait=True)
+        self._finish(exc_val)
+
+    async def __aenter__(self) -> "SpawnGroup":
+        self._entered_async = True
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Union[type[BaseException], None],
+        exc_val: Union[BaseException, None],
+        exc_tb: Union[TracebackType, None],
+    ) -> None:
+        if exc_val is not None:
+            self._cancel_work()
+        await asyncio.gather(
+            *(
+                work if isinstance(work, asyncio.Future) else asyncio.wrap_future(work)
+                for work in self._work
+            ),
+            return_exceptions=True,
+        )
+        self._finish(exc_val)
 
     def spawn_task(self, task: str) -> CallHandle:
         """Spawn a task"""
         # Spawn a task, but don't change a node state
-        new_node = self._node_state.add_task(task)
-        self._spawned_nodes.append(new_node)
-        return CallHandle(new_node)
+        return CallHandle(self._spawn(self._node_state.add_task(task)))
 
     def spawn_step(self, step: str) -> CallHandle:
         """Spawn a step"""
-        new_node = self._node_state.add_step(step)
-        self._spawned_nodes.append(new_node)
-        return CallHandle(new_node)
+        return CallHandle(self._spawn(self._node_state.add_step(step)))
+
+    def submit_task(
+        self, task: str, fn: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> "Future[T]":
+        """Spawn a task and run `fn(*args, **kwargs)` in it on the thread pool"""
+        return self._submit(self._node_state.add_task(task), fn, args, kwargs)
+
+    def submit_step(
+        self, step: str, fn: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> "Future[T]":
+        """Spawn a step and run `fn(*args, **kwargs)` in it on the thread pool"""
+        return self._submit(self._node_state.add_step(step), fn, args, kwargs)
+
+    def start_task(
+        self, task: str, coro: Coroutine[Any, Any, T]
+    ) -> "asyncio.Future[T]":
+        """Spawn a task and run the coroutine in it on the event loop"""
+        return self._start(self._node_state.add_task(task), coro)
+
+    def start_step(
+        self, step: str, coro: Coroutine[Any, Any, T]
+    ) -> "asyncio.Future[T]":
+        """Spawn a step and run the coroutine in it on the event loop"""
+        return self._start(self._node_state.add_step(step), coro)
+
+    def results(self) -> List[Any]:
+        """The results of the submitted and started work, in order
+
+        Call this after the group exits. If any of the work failed, this raises
+        its exception.
+        """
+        return [work.result() for work in self._work]
+
+    def _spawn(self, node: NodeState) -> NodeState:
+        with self._lock:
+            self._spawned_nodes.append(node)
+            if self._on_spawn is not None:
+                self._on_spawn(node)
+        return node
+
+    def _submit(
+        self,
+        node: NodeState,
+        fn: Callable[..., T],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+    ) -> "Future[T]":
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers, thread_name_prefix="fixpoint-spawn"
+            )
+        self._spawn(node)
+        future = self._executor.submit(fn, *args, **kwargs)
+        self._track(node, future)
+        return future
+
+    def _start(
+        self, node: NodeState, coro: Coroutine[Any, Any, T]
+    ) -> "asyncio.Future[T]":
+        if self._entered_async is False:
+            coro.close()
+            raise RuntimeError(
+                "Use `async with` for a spawn group that runs coroutines"
+            )
+        if self._semaphore is None and self._max_workers is not None:
+            self._semaphore = asyncio.Semaphore(self._max_workers)
+        self._spawn(node)
+        task = asyncio.ensure_future(_bounded(self._semaphore, coro))
+        self._track(node, task)
+        return task
+
+    def _track(
+        self, node: NodeState, work: Union["Future[Any]", "asyncio.Future[Any]"]
+    ) -> None:
+        self._work.append(work)
+        self._work_nodes.add(node.index)
+
+        def close_node(done: Union["Future[Any]", "asyncio.Future[Any]"]) -> None:
+            if done.cancelled():
+                status = WorkflowStatus.CANCELLED
+            elif done.exception() is not None:
+                status = WorkflowStatus.FAILED
+            else:
+                status = WorkflowStatus.COMPLETED
+            with self._lock:
+                node.status = status
+                if self._on_close is not None:
+                    self._on_close(node)
+
+        work.add_done_callback(close_node)
+
+    def _cancel_work(self) -> None:
+        for work in self._work:
+            work.cancel()
+
+    def _finish(self, exc_val: Optional[BaseException]) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        with self._lock:
+            for node in self._spawned_nodes:
+                if node.index in self._work_nodes:
+                    continue
+                if exc_val is not None:
+                    node.status = WorkflowStatus.FAILED
+                else:
+                    node.status = WorkflowStatus.COMPLETED
+                if self._on_close is not None:
+                    self._on_close(node)
+        self._raise_work_errors(exc_val)
+
+    def _raise_work_errors(self, exc_val: Optional[BaseException]) -> None:
+        """Raise the failures of the group's work, if there were any"""
+        errors: List[BaseException] = []
+        for work in self._work:
+            if not work.cancelled():
+                if (error := work.exception()) is not None:
+                    errors.append(error)
+            elif exc_val is None:
+                # we only cancel work when the block raises, so something else
+                # cancelled it
+                errors.append(
+                    asyncio.CancelledError("Work in the spawn group was cancelled")
+                )
+        for error in errors:
+            if isinstance(error, (KeyboardInterrupt, SystemExit)):
+                raise error
+        if exc_val is None and errors:
+            # this is an ExceptionGroup if all of the errors are Exceptions
+            raise BaseExceptionGroup("Work in the spawn group failed", errors)
+
+
+async def _bounded(
+    semaphore: Optional[asyncio.Semaphore], coro: Coroutine[Any, Any, T]
+) -> T:
+    if semaphore is None:
+        return await coro
+    async with semaphore:
+        return await coro
@@ -12,22 +12,47 @@ RAG, and tools for parsing structured output from unstructured documents.
 """
 
 __all__ = [
+    "BatchProgress",
     "ExecutionError",
     "call_step",
+    "call_steps",
     "call_task",
+    "call_tasks",
+    "compact_call_cache",
     "DefinitionError",
+    "enqueue_workflow",
     "errors",
+    "invalidate_step",
+    "Job",
+    "JobQueue",
+    "JobStatus",
+    "JobResultError",
+    "NoAcceptedResultError",
+    "PostgresJobQueue",
+    "race",
     "RunConfig",
+    "SchedulerFullError",
+    "SchedulerStats",
+    "SQLiteJobQueue",
     "run_workflow",
+    "run_workflow_batch",
     "retry_workflow",
     "spawn_workflow",
     "respawn_workflow",
     "step",
+    "StepDag",
+    "StepExecutors",
+    "StepFuture",
+    "StepProcessContext",
     "task",
     "task_entrypoint",
     "workflow",
     "WorkflowContext",
+    "WorkflowScheduler",
+    "WorkflowWorker",
     "workflow_entrypoint",
+    "WorkflowEvent",
+    "WorkflowEventKind",
 ]
 
 from ._workflow import (
@@ -38,10 +63,31 @@ from ._workflow import (
     respawn_workflow,
     workflow_entrypoint,
 )
-from ._context import WorkflowContext
-from ._task import task, task_entrypoint, call_task
-from ._step import step, call_step
-from ._run_config import RunConfig
+from ._batch import BatchProgress, run_workflow_batch
+from ._context import StepProcessContext, WorkflowContext
+from ._dag import StepDag, StepFuture
+from ._events import WorkflowEvent, WorkflowEventKind
+from ._executor import StepExecutors
+from ._race import race
+from ._task import task, task_entrypoint, call_task, call_tasks
+from ._step import step, call_step, call_steps, invalidate_step
+from ._run_config import RunConfig, compact_call_cache
+from ._scheduler import SchedulerStats, WorkflowScheduler
+from ._jobqueue import (
+    enqueue_workflow,
+    Job,
+    JobQueue,
+    JobStatus,
+    PostgresJobQueue,
+    SQLiteJobQueue,
+    WorkflowWorker,
+)
 
-from .errors import ExecutionError, DefinitionError
+from .errors import (
+    ExecutionError,
+    DefinitionError,
+    JobResultError,
+    NoAcceptedResultError,
+    SchedulerFullError,
+)
 from . import errors
@@ -0,0 +1,68 @@
+"""Command-line tools for structured workflows
+
+Usage:
+
+    python -m fixpoint.workflows.structured compact-callcache STORAGE_PATH \\
+        --completed-run-ttl-hours 24
+"""
+
+import argparse
+from typing import List, Optional
+
+from ._run_config import compact_call_cache
+
+
+_SECONDS_PER_HOUR = 60 * 60
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the structured workflows command-line tools"""
+    parser = argparse.ArgumentParser(prog="python -m fixpoint.workflows.structured")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact = subparsers.add_parser(
+        "compact-callcache",
+        help="drop cached task and step results of runs that closed long ago",
+    )
+    compact.add_argument(
+        "storage_path", help="the storage path passed to RunConfig.with_disk"
+    )
+    compact.add_argument(
+        "--completed-run-ttl-hours",
+        type=float,
+        required=True,
+        help="drop results of runs that completed more than this many hours ago",
+    )
+    compact.add_argument(
+        "--failed-run-ttl-hours",
+        type=float,
+        default=None,
+        help="drop results of failed runs that closed more than this many hours ago",
+    )
+    compact.add_argument(
+        "--no-vacuum",
+        action="store_true",
+        help="don't shrink the cache database, which blocks writers while it runs",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "compact-callcache":
+        failed_run_ttl_s = None
+        if args.failed_run_ttl_hours is not None:
+            failed_run_ttl_s = args.failed_run_ttl_hours * _SECONDS_PER_HOUR
+        report = compact_call_cache(
+            args.storage_path,
+            completed_run_ttl_s=args.completed_run_ttl_hours * _SECONDS_PER_HOUR,
+            failed_run_ttl_s=failed_run_ttl_s,
+            vacuum=not args.no_vacuum,
+        )
+        print(
+            f"Removed {report.runs_removed} runs, {report.entries_removed} results,"
+            f" {report.entries_expired} expired results, and"
+            f" {report.blobs_removed} blobs"
+        )
+        print(f"Reclaimed {report.bytes_reclaimed} bytes")
+
+
+if __name__ == "__main__":
+    main()
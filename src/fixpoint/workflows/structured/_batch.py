@@ -0,0 +1,388 @@
+"""Structured workflows: running a workflow over a dataset of inputs
+
+`run_workflow_batch` runs one workflow run per input record. It reads the
+inputs lazily, so the dataset does not need to fit in memory, and runs at most
+`concurrency` workflow runs at a time. As runs finish, it appends their results
+to a JSONL file and checkpoints which records are done, so that if the batch is
+interrupted, running it again with the same checkpoint picks up where it
+stopped.
+"""
+
+__all__ = ["BatchProgress", "run_workflow_batch"]
+
+import asyncio
+from dataclasses import dataclass, replace
+import json
+import os
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Set,
+    Sized,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from fixpoint._utils.ids import make_resource_uuid
+from fixpoint.logging import logger as root_logger
+from ..node_state import WorkflowStatus
+from ._callcache import default_json_dumps
+from ._helpers import AgentsFactory, AsyncFunc, convert_json_args
+from ._run_config import RunConfig
+from ._workflow import respawn_workflow
+
+
+logger = root_logger.getChild("workflows.structured._batch")
+
+ProgressCallback = Callable[["BatchProgress"], None]
+
+
+@dataclass
+class BatchProgress:
+    """The progress of a batch of workflow runs"""
+
+    batch_id: str
+    # None if we don't know how many records there are
+    total: Optional[int] = None
+    completed: int = 0
+    failed: int = 0
+    # records that were done before the batch resumed
+    skipped: int = 0
+    in_flight: int = 0
+    elapsed_s: float = 0.0
+
+    @property
+    def done(self) -> int:
+        """The number of records this run of the batch finished"""
+        return self.completed + self.failed
+
+    @property
+    def throughput(self) -> float:
+        """Finished records per second"""
+        return self.done / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    @property
+    def eta_s(self) -> Optional[float]:
+        """The estimated seconds until the batch finishes, if we can tell"""
+        if self.total is None or self.throughput <= 0:
+            return None
+        remaining = self.total - self.skipped - self.done
+        return max(remaining, 0) / self.throughput
+
+
+async def run_workflow_batch(
+    workflow_entry: AsyncFunc[..., Any],
+    *,
+    inputs: Union[Iterable[Any], str],
+    run_config: RunConfig,
+    agents_factory: Optional[AgentsFactory] = None,
+    concurrency: int = 8,
+    output_path: Optional[str] = None,
+    checkpoint_path: Optional[str] = None,
+    retry_failed: bool = False,
+    on_progress: Optional[ProgressCallback] = None,
+    progress_interval_s: float = 10.0,
+) -> BatchProgress:
+    """Run a workflow once for each input record
+
+    `inputs` is either an iterable of records, or the path to a JSONL file with
+    one record per line. Each record is the single argument to the workflow
+    entrypoint after the `WorkflowContext`. Records from a JSONL file are
+    loaded into the type of that parameter, like `enqueue_workflow` does. Each
+    workflow run gets its own agents from `agents_factory`.
+
+    We run at most `concurrency` workflow runs at a time, and only read the
+    next record when a run finishes. If you pass in an `output_path`, we
+    append one JSON line per record as its run finishes, with the record's
+    index, run ID, status, and result or error.
+
+    If you pass in a `checkpoint_path`, we save which records are done there
+    as we go. Run the batch again with the same checkpoint to resume it: we
+    skip the records that are done, and records whose runs were interrupted
+    resume from their completed tasks and steps in the call cache. Records that
+    failed stay done, unless you set `retry_failed`.
+
+    We call `on_progress` every `progress_interval_s` seconds and when the
+    batch finishes, or log the progress if you don't pass in a callback.
+    Returns the final progress.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+    checkpoint = _Checkpoint.load(checkpoint_path, output_path, retry_failed)
+    records, total = _read_inputs(workflow_entry, inputs)
+    batch = _Batch(
+        workflow_entry,
+        run_config,
+        agents_factory,
+        checkpoint,
+        BatchProgress(batch_id=checkpoint.batch_id, total=total),
+        on_progress or _log_progress,
+    )
+    output = None
+    if output_path is not None:
+        # pylint: disable=consider-using-with
+        output = open(output_path, "a", encoding="utf-8")
+    try:
+        await batch.run(records, concurrency, output, progress_interval_s)
+    finally:
+        if output is not None:
+            output.close()
+        checkpoint.save()
+    return batch.report()
+
+
+class _Batch:
+    """The state of a batch while it runs"""
+
+    _workflow_entry: AsyncFunc[..., Any]
+    _run_config: RunConfig
+    _agents_factory: Optional[AgentsFactory]
+    _checkpoint: "_Checkpoint"
+    _progress: BatchProgress
+    _on_progress: ProgressCallback
+    _started_at: float
+
+    def __init__(
+        self,
+        workflow_entry: AsyncFunc[..., Any],
+        run_config: RunConfig,
+        agents_factory: Optional[AgentsFactory],
+        checkpoint: "_Checkpoint",
+        progress: BatchProgress,
+        on_progress: ProgressCallback,
+    ) -> None:
+        self._workflow_entry = workflow_entry
+        self._run_config = run_config
+        self._agents_factory = agents_factory
+        self._checkpoint = checkpoint
+        self._progress = progress
+        self._on_progress = on_progress
+        self._started_at = time.monotonic()
+
+    async def run(
+        self,
+        records: Iterator[Tuple[int, Any]],
+        concurrency: int,
+        output: Optional[TextIO],
+        progress_interval_s: float,
+    ) -> None:
+        """Run the records that are not done yet, `concurrency` at a time"""
+        slots = asyncio.Semaphore(concurrency)
+        running: Set["asyncio.Task[None]"] = set()
+        last_report = time.monotonic()
+
+        def maybe_report() -> None:
+            nonlocal last_report
+            if time.monotonic() - last_report >= progress_interval_s:
+                last_report = time.monotonic()
+                self.report()
+                self._checkpoint.save()
+
+        try:
+            for index, record in records:
+                if self._checkpoint.is_done(index):
+                    self._progress.skipped += 1
+                    continue
+                await slots.acquire()
+                self._progress.in_flight += 1
+                task = asyncio.create_task(self._run_record(index, record, output))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda _: slots.release())
+                maybe_report()
+            while running:
+                await asyncio.wait(set(running), timeout=progress_interval_s or None)
+                maybe_report()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    def report(self) -> BatchProgress:
+        """Report the progress so far, and return it"""
+        self._progress.elapsed_s = time.monotonic() - self._started_at
+        progress = replace(self._progress)
+        self._on_progress(progress)
+        return progress
+
+    async def _run_record(
+        self, index: int, record: Any, output: Optional[TextIO]
+    ) -> None:
+        run_id = f"wfrun-{self._checkpoint.batch_id}-{index}"
+        line: Dict[str, Any] = {"index": index, "run_id": run_id}
+        out_line: Optional[str] = None
+        try:
+            handle = respawn_workflow(
+                self._workflow_entry,
+                run_id,
+                run_config=self._run_config,
+                agents=self._agents_factory() if self._agents_factory else [],
+                args=[record],
+                start_if_unknown=True,
+            )
+            result = await handle.result()
+            if output is not None:
+                # A result we can't write out fails the record, so that it
+                # isn't counted as done without a line in the output.
+                out_line = default_json_dumps(
+                    {**line, "status": WorkflowStatus.COMPLETED.value, "result": result}
+                )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning(f"Batch record {index} failed: {type(e).__name__}: {e}")
+            self._progress.failed += 1
+            out_line = default_json_dumps(
+                {**line, "status": WorkflowStatus.FAILED.value, "error": str(e)}
+            )
+            self._checkpoint.mark(index, failed=True)
+        else:
+            self._progress.completed += 1
+            self._checkpoint.mark(index, failed=False)
+        finally:
+            self._progress.in_flight -= 1
+        if output is not None and out_line is not None:
+            output.write(out_line + "\n")
+            output.flush()
+
+
+def _read_inputs(
+    workflow_entry: AsyncFunc[..., Any], inputs: Union[Iterable[Any], str]
+) -> Tuple[Iterator[Tuple[int, Any]], Optional[int]]:
+    """Get the numbered input records, and how many there are if we can tell"""
+    if isinstance(inputs, str):
+        return enumerate(_read_jsonl(workflow_entry, inputs)), None
+    total = len(inputs) if isinstance(inputs, Sized) else None
+    return enumerate(inputs), total
+
+
+def _read_jsonl(workflow_entry: AsyncFunc[..., Any], path: str) -> Iterator[Any]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            [record], _ = convert_json_args(workflow_entry, [json.loads(line)], {})
+            yield record
+
+
+class _Checkpoint:
+    """Which records of a batch are done
+
+    Records finish out of order, so we keep the index below which every
+    record is done, plus the done records above it.
+    """
+
+    batch_id: str
+    _path: Optional[str]
+    _watermark: int
+    _done: Set[int]
+    _failed: Set[int]
+
+    def __init__(
+        self,
+        batch_id: str,
+        path: Optional[str],
+        watermark: int = 0,
+        done: Optional[Set[int]] = None,
+        failed: Optional[Set[int]] = None,
+    ) -> None:
+        self.batch_id = batch_id
+        self._path = path
+        self._watermark = watermark
+        self._done = done or set()
+        self._failed = failed or set()
+
+    @classmethod
+    def load(
+        cls, path: Optional[str], output_path: Optional[str], retry_failed: bool
+    ) -> "_Checkpoint":
+        """Load a checkpoint, or start a new one if there is none"""
+        if path is None or not os.path.exists(path):
+            return cls(make_resource_uuid("batch"), path)
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        checkpoint = cls(
+            data["batch_id"],
+            path,
+            watermark=data["watermark"],
+            done=set(data["done"]),
+            failed=set(data["failed"]),
+        )
+        if output_path is not None and os.path.exists(output_path):
+            # We write a record's output before we checkpoint it, so the
+            # output can have records that finished after the last checkpoint.
+            for index, failed in _read_output_indexes(output_path):
+                checkpoint.mark(index, failed)
+        if retry_failed:
+            checkpoint.unmark_failed()
+        return checkpoint
+
+    def is_done(self, index: int) -> bool:
+        """Whether the record is done"""
+        return index < self._watermark or index in self._done
+
+    def mark(self, index: int, failed: bool) -> None:
+        """Mark a record as done"""
+        if failed:
+            self._failed.add(index)
+        else:
+            self._failed.discard(index)
+        if self.is_done(index):
+            return
+        self._done.add(index)
+        while self._watermark in self._done:
+            self._done.remove(self._watermark)
+            self._watermark += 1
+
+    def unmark_failed(self) -> None:
+        """Mark failed records as not done, so that they run again"""
+        for index in self._failed:
+            if index < self._watermark:
+                self._done.update(range(index, self._watermark))
+                self._watermark = index
+            self._done.discard(index)
+        self._failed.clear()
+
+    def save(self) -> None:
+        """Atomically write the checkpoint, if it has a path"""
+        if self._path is None:
+            return
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "batch_id": self.batch_id,
+                    "watermark": self._watermark,
+                    "done": sorted(self._done),
+                    "failed": sorted(self._failed),
+                },
+                f,
+            )
+        os.replace(tmp_path, self._path)
+
+
+def _read_output_indexes(path: str) -> Iterator[Tuple[int, bool]]:
+    """The records in a batch output file, and whether each one failed"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line can be cut short if the batch was killed
+                continue
+            yield data["index"], data["status"] == WorkflowStatus.FAILED.value
+
+
+def _log_progress(progress: BatchProgress) -> None:
+    eta = "unknown" if progress.eta_s is None else f"{progress.eta_s:.0f}s"
+    logger.info(
+        f"Batch {progress.batch_id}: {progress.completed} completed,"
+        f" {progress.failed} failed, {progress.skipped} skipped,"
+        f" {progress.in_flight} in flight, {progress.throughput:.2f} runs/s,"
+        f" ETA {eta}"
+    )
@@ -2,15 +2,52 @@
 
 __all__ = [
     "serialize_args",
+    "default_json_dumps",
     "CallCache",
+    "RunAwareCallCache",
     "CallCacheKind",
     "CacheResult",
+    "CallCacheStats",
+    "global_memo_run_id",
     "StepInMemCallCache",
     "TaskInMemCallCache",
+    "StepBoundedInMemCallCache",
+    "TaskBoundedInMemCallCache",
     "StepDiskCallCache",
     "TaskDiskCallCache",
+    "ResultCodec",
+    "JSONCodec",
+    "PickleCodec",
+    "CompactionReport",
+    "compact_disk_call_cache",
+    "invalidate_results",
+    "has_run",
+    "prefetch_run",
+    "close_run",
+    "reopen_run",
 ]
 
-from ._shared import CallCache, CallCacheKind, CacheResult, serialize_args
-from ._in_mem import StepInMemCallCache, TaskInMemCallCache
+from ._shared import (
+    CallCache,
+    RunAwareCallCache,
+    CallCacheKind,
+    CacheResult,
+    default_json_dumps,
+    global_memo_run_id,
+    serialize_args,
+    invalidate_results,
+    has_run,
+    prefetch_run,
+    close_run,
+    reopen_run,
+)
+from ._in_mem import (
+    CallCacheStats,
+    StepInMemCallCache,
+    TaskInMemCallCache,
+    StepBoundedInMemCallCache,
+    TaskBoundedInMemCallCache,
+)
 from ._disk import StepDiskCallCache, TaskDiskCallCache
+from ._codec import ResultCodec, JSONCodec, PickleCodec
+from ._retention import CompactionReport, compact_disk_call_cache
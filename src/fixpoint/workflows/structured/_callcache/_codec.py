@@ -0,0 +1,174 @@
+"""Codecs for encoding task and step results in the on-disk call-caches"""
+
+__all__ = [
+    "ResultCodec",
+    "JSONCodec",
+    "PickleCodec",
+    "pickled_blob_names",
+]
+
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import tempfile
+from typing import Any, List, Optional, Protocol, Tuple, Type
+
+from ._shared import default_json_dumps
+from ._converter import value_to_type
+
+
+# 1 MiB
+DEFAULT_OUT_OF_BAND_MIN_BYTES = 1024 * 1024
+
+_PICKLE_FORMAT = "fixpoint.pickle.v1"
+
+
+class ResultCodec(Protocol):
+    """Encodes task and step results to store them in an on-disk call-cache"""
+
+    def encode(self, res: Any) -> Any:
+        """Encode a result into a value we can store in the cache
+
+        The encoded value must be a `str`, `bytes`, or a picklable value.
+        """
+
+    def decode(self, stored: Any, type_hint: Optional[Type[Any]] = None) -> Any:
+        """Decode a value stored in the cache back into a result"""
+
+
+class JSONCodec(ResultCodec):
+    """Encodes results as JSON
+
+    This is the default codec. Results must be JSON-serializable, or be
+    dataclasses or Pydantic models. Pass a `type_hint` when decoding to load
+    results back into dataclasses or Pydantic models.
+    """
+
+    def encode(self, res: Any) -> Any:
+        return default_json_dumps(res)
+
+    def decode(self, stored: Any, type_hint: Optional[Type[Any]] = None) -> Any:
+        deserialized = json.loads(stored)
+        if type_hint is None:
+            return deserialized
+        return value_to_type(hint=type_hint, value=deserialized)
+
+
+class PickleCodec(ResultCodec):
+    """Encodes results with pickle protocol 5
+
+    Use this codec for results that are not JSON-serializable, or that contain
+    large binary payloads, such as bytes or NumPy arrays.
+
+    If you give a `blob_dir`, buffers of at least `out_of_band_min_bytes` that
+    are pickled out-of-band (see `pickle.PickleBuffer`) are written to their
+    own content-addressed files in that directory instead of the cache. When
+    decoding, we memory-map those files read-only, so loading a large array
+    does not copy it into memory.
+
+    Only use this codec with a cache directory you trust, because unpickling
+    can run arbitrary code.
+    """
+
+    _blob_dir: Optional[str]
+    _out_of_band_min_bytes: int
+
+    def __init__(
+        self,
+        blob_dir: Optional[str] = None,
+        out_of_band_min_bytes: int = DEFAULT_OUT_OF_BAND_MIN_BYTES,
+    ) -> None:
+        self._blob_dir = blob_dir
+        self._out_of_band_min_bytes = out_of_band_min_bytes
+
+    @property
+    def blob_dir(self) -> Optional[str]:
+        """The directory where we write large out-of-band buffers"""
+        return self._blob_dir
+
+    def encode(self, res: Any) -> Any:
+        blob_names: List[str] = []
+
+        def buffer_callback(buf: pickle.PickleBuffer) -> bool:
+            if self._blob_dir is None:
+                return True
+            try:
+                raw = buf.raw()
+            except BufferError:
+                # non-contiguous buffers are pickled in-band
+                return True
+            with raw:
+                if raw.nbytes < self._out_of_band_min_bytes:
+                    # pickle the buffer in-band
+                    return True
+                blob_names.append(self._write_blob(raw))
+            return False
+
+        data = pickle.dumps(res, protocol=5, buffer_callback=buffer_callback)
+        return (_PICKLE_FORMAT, data, tuple(blob_names))
+
+    def decode(self, stored: Any, type_hint: Optional[Type[Any]] = None) -> Any:
+        fmt, data, blob_names = _unpack_stored(stored)
+        if fmt != _PICKLE_FORMAT:
+            raise ValueError(f"Unknown cached result format: {fmt}")
+        buffers = [self._map_blob(name) for name in blob_names]
+        return pickle.loads(data, buffers=buffers)
+
+    def _blob_path(self, name: str) -> str:
+        if self._blob_dir is None:
+            raise ValueError("PickleCodec has no blob directory")
+        return os.path.join(self._blob_dir, name[:2], name)
+
+    def _write_blob(self, raw: memoryview) -> str:
+        name = hashlib.sha256(raw).hexdigest()
+        path = self._blob_path(name)
+        try:
+            # If the blob exists, mark it as recently used, so that compaction
+            # does not delete it before we store the entry referencing it.
+            os.utime(path)
+            return name
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename it, so that concurrent writers and
+        # readers never see a partially written blob.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(raw)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return name
+
+    def _map_blob(self, name: str) -> memoryview:
+        with open(self._blob_path(name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # you cannot mmap an empty file
+                return memoryview(b"")
+            # the mapping stays valid after we close the file
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def pickled_blob_names(stored: Any) -> Tuple[str, ...]:
+    """The names of the blobs a value encoded by `PickleCodec` refers to
+
+    Returns an empty tuple for values not encoded by `PickleCodec`.
+    """
+    try:
+        fmt, _, blob_names = _unpack_stored(stored)
+    except ValueError:
+        return ()
+    if fmt != _PICKLE_FORMAT:
+        return ()
+    return blob_names
+
+
+def _unpack_stored(stored: Any) -> Tuple[str, bytes, Tuple[str, ...]]:
+    if not isinstance(stored, tuple) or len(stored) != 3:
+        raise ValueError("Cached result was not encoded with PickleCodec")
+    fmt, data, blob_names = stored
+    return fmt, data, blob_names
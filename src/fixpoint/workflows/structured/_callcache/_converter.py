@@ -28,11 +28,13 @@
 # Modifications:
 #
 # - dbmikus 2024-07-07: modifications to extract from original converter.py file
+# - add `compile_converter`, which builds and caches a conversion function per
+#   type hint instead of re-inspecting the hint on every conversion
 #
 # Original source:
 # https://github.com/temporalio/sdk-python/blob/38d9eefce2795f76fefc7fb5c487d85a5d1f51d9/temporalio/converter.py
 
-__all__ = ["value_to_type"]
+__all__ = ["compile_converter", "Converter", "value_to_type"]
 
 
 from abc import ABC, abstractmethod
@@ -40,22 +42,29 @@ import collections
 import dataclasses
 from enum import IntEnum
 import inspect
+import threading
 from typing import (
     Any,
+    Callable,
     Dict,
     get_type_hints,
+    List,
     Literal,
     NewType,
     Optional,
     Sequence,
+    Set,
     Tuple,
     Type,
     TypeVar,
     Union,
+    cast,
 )
 import sys
 import uuid
 
+from pydantic import BaseModel, TypeAdapter
+
 
 if sys.version_info >= (3, 10):
     from types import UnionType
@@ -95,7 +104,7 @@ class JSONTypeConverter(ABC):
         raise NotImplementedError
 
 
-# pylint: disable=too-many-branches,too-many-statements,too-many-locals
+# pylint: disable=too-many-branches,too-many-statements,too-many-locals,too-many-return-statements
 def value_to_type(
     hint: Type[Any],
     value: Any,
@@ -120,8 +129,8 @@ def value_to_type(
     Raises:
         TypeError: Unable to convert to the given hint.
     """
-    if custom_converters is None:
-        custom_converters = []
+    if not custom_converters:
+        return compile_converter(hint)(value)
 
     # Try custom converters
     for conv in custom_converters:
@@ -357,3 +366,372 @@ def _map_value_to_type(
     if per_key_types:
         ret_dict = hint(**ret_dict)
     return ret_dict
+
+
+Converter = Callable[[Any], Any]
+"""A function that converts a raw JSON loaded value to a specific type"""
+
+
+_converters_lock = threading.Lock()
+_converters: Dict[Any, Converter] = {}
+
+
+def compile_converter(hint: Any) -> Converter:
+    """Get a function that converts raw JSON loaded values to the type hint
+
+    This has the same behavior as `value_to_type` without custom converters,
+    but we inspect the type hint once, when building the conversion function,
+    instead of on every conversion. Conversion functions are cached per type
+    hint, so converting many values of the same type (for example, every item
+    of a `List[SomeDataclass]`) only pays for the type inspection once.
+
+    Pydantic models are converted with a Pydantic `TypeAdapter`.
+    """
+    return _compile_nested(hint, set())
+
+
+def _compile_nested(hint: Any, in_progress: Set[Any]) -> Converter:
+    try:
+        cached = _converters.get(hint)
+    except TypeError:
+        # unhashable type hints cannot be cached
+        return _compile(hint, in_progress)
+    if cached is not None:
+        return cached
+    if hint in in_progress:
+        # The type refers to itself, like a dataclass with a field of its own
+        # type. Resolve the converter once we first need it, by which point we
+        # will have finished compiling it.
+        return _LazyConverter(hint)
+
+    in_progress.add(hint)
+    try:
+        converter = _compile(hint, in_progress)
+    finally:
+        in_progress.discard(hint)
+    with _converters_lock:
+        converter = _converters.setdefault(hint, converter)
+    return converter
+
+
+class _LazyConverter:
+    _hint: Any
+    _converter: Optional[Converter]
+
+    def __init__(self, hint: Any) -> None:
+        self._hint = hint
+        self._converter = None
+
+    def __call__(self, value: Any) -> Any:
+        if self._converter is None:
+            self._converter = compile_converter(self._hint)
+        return self._converter(value)
+
+
+def _raise_unhandled(hint: Any) -> Converter:
+    def convert(_value: Any) -> Any:
+        raise TypeError(f"Unserializable type during conversion: {hint}")
+
+    return convert
+
+
+# pylint: disable=too-many-return-statements
+def _compile(hint: Any, in_progress: Set[Any]) -> Converter:
+    # Any or primitives
+    if hint is Any:
+        return _identity
+    elif hint is int or hint is float:
+        return _compile_number(hint)
+    elif hint is bool:
+        return _convert_bool
+    elif hint is str:
+        return _convert_str
+    elif hint is bytes:
+        return _convert_bytes
+    elif hint is type(None):
+        return _convert_none
+
+    # NewType
+    supertype = getattr(hint, "__supertype__", None)
+    if supertype:
+        return _compile_nested(supertype, in_progress)
+
+    origin = getattr(hint, "__origin__", hint)
+    type_args: Tuple[Any, ...] = getattr(hint, "__args__", ())
+
+    if origin is Literal:
+        return _compile_literal(type_args)
+
+    is_union = origin is Union
+    if sys.version_info >= (3, 10):
+        is_union = is_union or isinstance(origin, UnionType)
+    if is_union:
+        return _compile_union(hint, type_args, in_progress)
+
+    if inspect.isclass(origin) and issubclass(origin, collections.abc.Mapping):
+        return _compile_mapping(hint, origin, type_args, in_progress)
+
+    if dataclasses.is_dataclass(hint):
+        return _compile_dataclass(hint, in_progress)
+
+    if inspect.isclass(hint) and issubclass(hint, BaseModel):
+        return _compile_pydantic(hint)
+    parse_obj_attr = inspect.getattr_static(hint, "parse_obj", None)
+    if isinstance(parse_obj_attr, (classmethod, staticmethod)):
+        return _compile_parse_obj(hint)
+
+    if inspect.isclass(hint) and issubclass(hint, IntEnum):
+        return _compile_enum(hint, int, "an integer")
+    if sys.version_info >= (3, 11):
+        if inspect.isclass(hint) and issubclass(hint, StrEnum):
+            return _compile_enum(hint, str, "a string")
+
+    if inspect.isclass(hint) and issubclass(hint, uuid.UUID):
+        return cast(Converter, hint)
+
+    # Iterable. We intentionally put this last as it catches several others.
+    if inspect.isclass(origin) and issubclass(origin, collections.abc.Iterable):
+        return _compile_iterable(hint, origin, type_args, in_progress)
+
+    return _raise_unhandled(hint)
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+def _compile_number(hint: Type[Any]) -> Converter:
+    def convert(value: Any) -> Any:
+        if not isinstance(value, (int, float)):
+            raise TypeError(f"Expected value to be int|float, was {type(value)}")
+        return hint(value)
+
+    return convert
+
+
+def _convert_bool(value: Any) -> Any:
+    if not isinstance(value, bool):
+        raise TypeError(f"Expected value to be bool, was {type(value)}")
+    return bool(value)
+
+
+def _convert_str(value: Any) -> Any:
+    if not isinstance(value, str):
+        raise TypeError(f"Expected value to be str, was {type(value)}")
+    return str(value)
+
+
+def _convert_bytes(value: Any) -> Any:
+    if not isinstance(value, (str, bytes, list)):
+        raise TypeError(f"Expected value to be bytes, was {type(value)}")
+    return bytes(value)  # type: ignore
+
+
+def _convert_none(value: Any) -> Any:
+    if value is not None:
+        raise TypeError(f"Expected None, got value of type {type(value)}")
+    return value
+
+
+def _compile_literal(type_args: Tuple[Any, ...]) -> Converter:
+    def convert(value: Any) -> Any:
+        if value not in type_args:
+            raise TypeError(f"Value {value} not in literal values {type_args}")
+        return value
+
+    return convert
+
+
+def _compile_union(
+    hint: Any, type_args: Tuple[Any, ...], in_progress: Set[Any]
+) -> Converter:
+    arg_converters = [_compile_nested(arg, in_progress) for arg in type_args]
+
+    def convert(value: Any) -> Any:
+        # Try each one. Note, Optional is just a union w/ none.
+        for arg_converter in arg_converters:
+            try:
+                return arg_converter(value)
+            except Exception:  # pylint: disable=broad-exception-caught
+                pass
+        raise TypeError(f"Failed converting to {hint} from {value}")
+
+    return convert
+
+
+def _compile_mapping(
+    hint: Any, origin: Any, type_args: Tuple[Any, ...], in_progress: Set[Any]
+) -> Converter:
+    # If there are required or optional keys that means we are a TypedDict
+    # and therefore can extract per-key types
+    per_key_converters: Optional[Dict[str, Converter]] = None
+    if getattr(origin, "__required_keys__", None) or getattr(
+        origin, "__optional_keys__", None
+    ):
+        per_key_converters = {
+            key: _compile_nested(key_hint, in_progress)
+            for key, key_hint in get_type_hints(origin).items()
+        }
+
+    def _arg_converter(idx: int) -> Optional[Converter]:
+        if (
+            len(type_args) > idx
+            and type_args[idx] is not Any
+            and not isinstance(type_args[idx], TypeVar)
+        ):
+            return _compile_nested(type_args[idx], in_progress)
+        return None
+
+    key_converter = _arg_converter(0)
+    value_converter = _arg_converter(1)
+
+    def convert(map_value: Any) -> Any:
+        if not isinstance(map_value, collections.abc.Mapping):
+            raise TypeError(f"Expected {hint}, value was {type(map_value)}")
+        ret_dict = {}
+        for key, value in map_value.items():
+            if key_converter:
+                try:
+                    key = key_converter(key)
+                except Exception as err:
+                    raise TypeError(f"Failed converting key {key} on {hint}") from err
+            this_value_converter = value_converter
+            if per_key_converters:
+                this_value_converter = per_key_converters.get(key)
+            if this_value_converter:
+                try:
+                    value = this_value_converter(value)
+                except Exception as err:
+                    raise TypeError(
+                        f"Failed converting value for key {key} on {hint}"
+                    ) from err
+            ret_dict[key] = value
+        if per_key_converters:
+            return hint(**ret_dict)
+        return ret_dict
+
+    return convert
+
+
+def _compile_dataclass(hint: Any, in_progress: Set[Any]) -> Converter:
+    field_hints = get_type_hints(hint)
+    field_converters = [
+        (field.name, _compile_nested(field_hints[field.name], in_progress))
+        for field in dataclasses.fields(hint)
+    ]
+
+    def convert(value: Any) -> Any:
+        if not isinstance(value, dict):
+            raise TypeError(
+                f"Cannot convert to dataclass {hint}, value is {type(value)} not dict"
+            )
+        # We do not check whether field is required here. Rather, we let the
+        # attempted instantiation of the dataclass raise if a field is missing.
+        field_values = {}
+        for name, field_converter in field_converters:
+            if name in value:
+                try:
+                    field_values[name] = field_converter(value[name])
+                except Exception as err:
+                    raise TypeError(
+                        f"Failed converting field {name} on dataclass {hint}"
+                    ) from err
+        return hint(**field_values)
+
+    return convert
+
+
+def _compile_pydantic(hint: Type[BaseModel]) -> Converter:
+    adapter = TypeAdapter(hint)
+
+    def convert(value: Any) -> Any:
+        if not isinstance(value, dict):
+            raise TypeError(
+                f"Cannot convert to {hint}, value is {type(value)} not dict"
+            )
+        return adapter.validate_python(value)
+
+    return convert
+
+
+def _compile_parse_obj(hint: Any) -> Converter:
+    parse_obj = getattr(hint, "parse_obj")
+
+    def convert(value: Any) -> Any:
+        if not isinstance(value, dict):
+            raise TypeError(
+                f"Cannot convert to {hint}, value is {type(value)} not dict"
+            )
+        return parse_obj(value)
+
+    return convert
+
+
+def _compile_enum(hint: Any, value_type: Type[Any], type_desc: str) -> Converter:
+    def convert(value: Any) -> Any:
+        if not isinstance(value, value_type):
+            raise TypeError(
+                f"Cannot convert to enum {hint}, value not {type_desc}, "
+                f"value is {type(value)}"
+            )
+        return hint(value)
+
+    return convert
+
+
+def _compile_iterable(
+    hint: Any, origin: Any, type_args: Tuple[Any, ...], in_progress: Set[Any]
+) -> Converter:
+    if origin is tuple:
+        container: Optional[Callable[[List[Any]], Any]] = tuple
+    elif origin is set:
+        container = set
+    elif origin is collections.deque:
+        container = collections.deque
+    else:
+        container = None
+
+    # If there is no type arg, just return value as is
+    if not type_args or (
+        len(type_args) == 1
+        and (isinstance(type_args[0], TypeVar) or type_args[0] is Ellipsis)
+    ):
+        item_converter: Optional[Converter] = None
+        tuple_converters: List[Converter] = []
+    elif origin is not tuple:
+        item_converter = _compile_nested(type_args[0], in_progress)
+        tuple_converters = []
+    else:
+        # Tuples use the arg set, or the one before the ellipsis if that's set
+        item_converter = None
+        if type_args[-1] is Ellipsis:
+            item_converter = _compile_nested(type_args[-2], in_progress)
+            type_args = type_args[:-2]
+        tuple_converters = [_compile_nested(arg, in_progress) for arg in type_args]
+
+    def convert(value: Any) -> Any:
+        if not isinstance(value, collections.abc.Iterable):
+            raise TypeError(f"Expected {hint}, value was {type(value)}")
+        if item_converter is None and not tuple_converters:
+            ret_list = list(value)
+        else:
+            ret_list = []
+            for i, item in enumerate(value):
+                if i < len(tuple_converters):
+                    this_converter = tuple_converters[i]
+                elif item_converter is not None:
+                    this_converter = item_converter
+                else:
+                    raise TypeError(
+                        f"Type {hint} only expecting {len(tuple_converters)} values, "
+                        f"got at least {i + 1}"
+                    )
+                try:
+                    ret_list.append(this_converter(item))
+                except Exception as err:
+                    raise TypeError(f"Failed converting {hint} index {i}") from err
+        if container is not None:
+            return container(ret_list)
+        return ret_list
+
+    return convert
@@ -5,53 +5,98 @@ __all__ = [
     "TaskDiskCallCache",
 ]
 
+import itertools
 import json
+import sqlite3
 import tempfile
-from typing import Any, Optional, Type
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar
 
 import diskcache
 
 from fixpoint._constants import (
     DEFAULT_DISK_CACHE_SIZE_LIMIT_BYTES as DEFAULT_SIZE_LIMIT_BYTES,
 )
+from fixpoint.workflows.node_state import WorkflowStatus
 from ._shared import (
-    CallCache,
+    RunAwareCallCache,
     CallCacheKind,
     CacheResult,
     serialize_step_cache_key,
     serialize_task_cache_key,
     default_json_dumps,
+    is_shared_run_id,
+    run_meta_key,
+    RUN_META_KEY_PREFIX,
     T,
     logger,
 )
-from ._converter import value_to_type
+from ._codec import JSONCodec, ResultCodec
 
 
-class StepDiskCallCache(CallCache):
-    """An on-disk call-cache for steps"""
+_D = TypeVar("_D", bound="_DiskCallCache")
+_MISSING = object()
+# how many results to evict on each store while over the size limit, and how
+# many of the oldest entries to look at to find them
+_CULL_COUNT = 10
+_CULL_SCAN_LIMIT = 1000
+# The diskcache versions whose database schema `_query` knows. We pin diskcache
+# to these in our package dependencies.
+_KNOWN_DISKCACHE_VERSION_PREFIX = "5.6."
 
-    cache_kind = CallCacheKind.STEP
+
+class _DiskCallCache(RunAwareCallCache):
+    """Shared implementation of the on-disk task and step call-caches
+
+    Each cached result is tagged with its workflow run, and the cache keeps an
+    index on tags, so that we can find all of a run's results without scanning
+    the whole cache, while storing a result stays a single write. Because the
+    tag lives on the entry itself, a result that expires or is evicted drops out
+    of its run's index too. When a run closes, we record its status and closing
+    time, so that `compact_disk_call_cache` can later drop the results of runs
+    that closed long ago.
+
+    Results are encoded with the cache's `codec`, which defaults to JSON.
+
+    With `pin_open_runs`, we evict results to stay under the cache's size limit
+    ourselves instead of leaving it to diskcache, and we skip the results of
+    workflow runs that are still open. Turn off diskcache's own eviction by
+    creating the cache with `cull_limit=0`.
+    """
+
+    cache_kind: CallCacheKind
     _ttl_s: Optional[float]
     _cache: diskcache.Cache
+    _codec: ResultCodec
+    _pin_open_runs: bool
 
     def __init__(
         self,
         cache: diskcache.Cache,
         ttl_s: Optional[float] = None,
+        codec: Optional[ResultCodec] = None,
+        *,
+        pin_open_runs: bool = False,
     ) -> None:
         self._cache = cache
         self._ttl_s = ttl_s
+        self._codec = codec or JSONCodec()
+        self._pin_open_runs = pin_open_runs
+        if not cache.tag_index:
+            cache.create_tag_index()
 
     @classmethod
     def from_tmpdir(
-        cls,
+        cls: Type[_D],
         ttl_s: Optional[float] = None,
         size_limit_bytes: int = DEFAULT_SIZE_LIMIT_BYTES,
-    ) -> "StepDiskCallCache":
+        codec: Optional[ResultCodec] = None,
+    ) -> _D:
         """Create a new cache from inside a temporary directory"""
         cache_dir = tempfile.mkdtemp()
         cache = diskcache.Cache(directory=cache_dir, size_limit=size_limit_bytes)
-        return cls(cache, ttl_s)
+        return cls(cache, ttl_s, codec)
 
     def check_cache(
         self,
@@ -69,54 +114,272 @@ class StepDiskCallCache(CallCache):
         If you provide a `type_hint`, we will load the cached result into that
         type. We can load in Pydantic models and dataclasses.
         """
-
-        key = serialize_step_cache_key(
-            run_id=run_id, step_id=kind_id, args=serialized_args
-        )
+        kind = self.cache_kind.value
+        key = self._serialize_key(run_id, kind_id, serialized_args)
         if key in self._cache:
-            logger.debug(f"Cache hit for step {kind_id} with key {key}")
+            logger.debug(f"Cache hit for {kind} {kind_id} with key {key}")
             return CacheResult[T](
-                found=True, result=_deserialize_val(self._cache[key], type_hint)
+                found=True, result=self._codec.decode(self._cache[key], type_hint)
             )
-        logger.debug(f"Cache miss for step {kind_id} with key {key}")
+        logger.debug(f"Cache miss for {kind} {kind_id} with key {key}")
         return CacheResult[T](found=False, result=None)
 
     def store_result(
         self, run_id: str, kind_id: str, serialized_args: str, res: Any
     ) -> None:
         """Stores the results of a task or step into the call cache."""
-        key = serialize_step_cache_key(
+        key = self._serialize_key(run_id, kind_id, serialized_args)
+        res_serialized = self._codec.encode(res)
+        self._cache.set(
+            key, res_serialized, expire=self._ttl_s, tag=self._run_tag(run_id)
+        )
+        if self._pin_open_runs:
+            self._cull()
+        logger.debug(
+            f"Stored result for {self.cache_kind.value} {kind_id} with key {key}"
+        )
+
+    def invalidate(
+        self,
+        run_id: str,
+        kind_id: Optional[str] = None,
+        serialized_args: Optional[str] = None,
+    ) -> None:
+        removed = self._invalidate(run_id, kind_id, serialized_args)
+        logger.debug(
+            f"Invalidated {self.cache_kind.value} results for run {run_id}"
+            f" ({removed} removed)"
+        )
+
+    def drop_run(self, run_id: str) -> int:
+        """Delete all of a run's cached results
+
+        Returns the number of results deleted.
+        """
+        return self._invalidate(run_id)
+
+    def _invalidate(
+        self,
+        run_id: str,
+        kind_id: Optional[str] = None,
+        serialized_args: Optional[str] = None,
+    ) -> int:
+        if kind_id is not None and serialized_args is not None:
+            key = self._serialize_key(run_id, kind_id, serialized_args)
+            return 1 if self._cache.delete(key) else 0
+        if kind_id is None and serialized_args is None:
+            removed: int = self._cache.evict(self._run_tag(run_id))
+            return removed
+        removed = 0
+        with self._cache.transact():
+            for key, entry_kind_id, entry_args in self._run_entries(run_id):
+                if (kind_id is None or entry_kind_id == kind_id) and (
+                    serialized_args is None or entry_args == serialized_args
+                ):
+                    removed += 1 if self._cache.delete(key) else 0
+        return removed
+
+    def has_run(self, run_id: str) -> bool:
+        """Whether the cache has any results of a run, or a record of it closing"""
+        return run_meta_key(run_id) in self._cache or bool(self._run_entries(run_id))
+
+    def prefetch_run(self, run_id: str) -> RunAwareCallCache:
+        """Load all cached results of a run into memory
+
+        We load the results lazily, the first time the returned call cache is
+        checked for one of the run's results, so that a run waiting in a queue
+        doesn't hold its results in memory. We then look up the run's results
+        by their tag and read them within a single transaction, instead of
+        doing one lookup per task or step when the workflow run is replayed.
+        """
+        return _PrefetchedDiskCallCache(self, run_id)
+
+    def load_run(self, run_id: str) -> Dict[Tuple[str, str], Any]:
+        """Read all of a run's encoded results, keyed by kind ID and args"""
+        entries: Dict[Tuple[str, str], Any] = {}
+        with self._cache.transact():
+            for key, kind_id, serialized_args in self._run_entries(run_id):
+                value = self._cache.get(key, _MISSING)
+                # the entry might have expired or been evicted
+                if value is not _MISSING:
+                    entries[(kind_id, serialized_args)] = value
+        logger.debug(
+            f"Prefetched {len(entries)} {self.cache_kind.value} results for run {run_id}"
+        )
+        return entries
+
+    def close_run(self, run_id: str, status: WorkflowStatus) -> None:
+        """Record that a run closed, so that we can later drop its results"""
+        self._cache.set(
+            run_meta_key(run_id), {"status": status.value, "closed_at": time.time()}
+        )
+
+    def reopen_run(self, run_id: str) -> None:
+        """Forget that a run closed, so that compaction keeps its results"""
+        self._cache.delete(run_meta_key(run_id))
+
+    def decode(self, stored: Any, type_hint: Optional[Type[Any]] = None) -> Any:
+        """Decode a stored result with the cache's codec"""
+        return self._codec.decode(stored, type_hint)
+
+    def _serialize_key(self, run_id: str, kind_id: str, serialized_args: str) -> str:
+        if self.cache_kind == CallCacheKind.TASK:
+            return serialize_task_cache_key(
+                run_id=run_id, task_id=kind_id, args=serialized_args
+            )
+        return serialize_step_cache_key(
             run_id=run_id, step_id=kind_id, args=serialized_args
         )
-        res_serialized = default_json_dumps(res)
-        self._cache.set(key, res_serialized, expire=self._ttl_s)
-        logger.debug(f"Stored result for step {kind_id} with key {key}")
 
+    def _cull(self) -> None:
+        """Evict the least recently stored results that no open run needs
+
+        Like diskcache's own eviction, we evict a few results on each store
+        while the cache is over its size limit.
+        """
+        if _used_bytes(self._cache) <= self._cache.size_limit:
+            return
+        pinned: Dict[str, bool] = {}
+        culled = 0
+        for key, run_id in self._oldest_results():
+            if run_id not in pinned:
+                pinned[run_id] = self._is_open_run(run_id)
+            if pinned[run_id]:
+                continue
+            self._cache.delete(key)
+            culled += 1
+            if culled == _CULL_COUNT:
+                break
+        if culled == 0:
+            logger.debug("Call cache is over its size limit, but every run is open")
+
+    def _is_open_run(self, run_id: str) -> bool:
+        if is_shared_run_id(run_id):
+            return False
+        return run_meta_key(run_id) not in self._cache
+
+    def _run_tag(self, run_id: str) -> str:
+        return default_json_dumps({"run_tag": self.cache_kind.value, "run_id": run_id})
+
+    def _oldest_results(self) -> List[Tuple[str, str]]:
+        """The keys of the least recently stored results, with their run IDs"""
+        rows = _query(
+            self._cache,
+            "SELECT key, tag FROM Cache ORDER BY store_time LIMIT ?",
+            (_CULL_SCAN_LIMIT,),
+        )
+        if rows is not None:
+            # Untagged entries, such as the records of closed runs, are not
+            # results.
+            return [(key, json.loads(tag)["run_id"]) for key, tag in rows if tag]
+        # Without the tag index, we can only walk the keys in key order.
+        results: List[Tuple[str, str]] = []
+        for key in itertools.islice(self._cache.iterkeys(), _CULL_SCAN_LIMIT):
+            parsed = _parse_result_key(key)
+            if parsed is not None:
+                results.append((key, parsed["run_id"]))
+        return results
+
+    def _run_entries(self, run_id: str) -> List[Tuple[str, str, str]]:
+        """The keys of a run's cached results, with their kind IDs and args"""
+        kind_field = "task_id" if self.cache_kind == CallCacheKind.TASK else "step_id"
+        rows = _query(
+            self._cache, "SELECT key FROM Cache WHERE tag = ?", (self._run_tag(run_id),)
+        )
+        if rows is None:
+            # Fall back to scanning every key in the cache.
+            keys = list(self._cache.iterkeys())
+        else:
+            keys = [key for (key,) in rows]
+        entries: List[Tuple[str, str, str]] = []
+        for key in keys:
+            parsed = _parse_result_key(key)
+            if (
+                parsed is not None
+                and parsed["run_id"] == run_id
+                and kind_field in parsed
+            ):
+                entries.append((key, parsed[kind_field], parsed["args"]))
+        return entries
+
+
+def _query(
+    cache: diskcache.Cache, sql: str, params: Tuple[Any, ...] = ()
+) -> Optional[List[Tuple[Any, ...]]]:
+    """Run a raw SQL query against the cache's database
 
-class TaskDiskCallCache(CallCache):
+    diskcache can evict entries by tag, but has no public way to list them or
+    to find the oldest ones, so we query its database directly. That relies on
+    diskcache's private schema, so we only do it for the diskcache versions we
+    know, and return None otherwise or if the query fails. Callers then fall
+    back to diskcache's public API.
+    """
+    if not diskcache.__version__.startswith(_KNOWN_DISKCACHE_VERSION_PREFIX):
+        return None
+    try:
+        # pylint: disable=protected-access
+        rows: List[Tuple[Any, ...]] = cache._sql(sql, params).fetchall()
+    except (AttributeError, sqlite3.Error) as e:
+        logger.warning(f"Could not query the call cache's database: {e}")
+        return None
+    return rows
+
+
+def _parse_result_key(key: Any) -> Optional[Dict[str, Any]]:
+    """Parse the key of a cached result, or return None for other keys"""
+    if not isinstance(key, str) or key.startswith(RUN_META_KEY_PREFIX):
+        return None
+    try:
+        parsed = json.loads(key)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(parsed, dict) or "run_id" not in parsed:
+        return None
+    return parsed
+
+
+def _used_bytes(cache: diskcache.Cache) -> int:
+    """The size of the cache, not counting free pages in its database"""
+    volume: int = cache.volume()
+    free_pages = _query(cache, "PRAGMA freelist_count")
+    page_size = _query(cache, "PRAGMA page_size")
+    if free_pages is None or page_size is None:
+        return volume
+    free_bytes: int = free_pages[0][0] * page_size[0][0]
+    return volume - free_bytes
+
+
+class StepDiskCallCache(_DiskCallCache):
+    """An on-disk call-cache for steps"""
+
+    cache_kind = CallCacheKind.STEP
+
+
+class TaskDiskCallCache(_DiskCallCache):
     """An on-disk call-cache for tasks"""
 
     cache_kind = CallCacheKind.TASK
-    _cache: diskcache.Cache
 
-    def __init__(
-        self,
-        cache: diskcache.Cache,
-        ttl_s: Optional[float] = None,
-    ) -> None:
-        self._cache = cache
-        self._ttl_s = ttl_s
 
-    @classmethod
-    def from_tmpdir(
-        cls,
-        ttl_s: Optional[float] = None,
-        size_limit_bytes: int = DEFAULT_SIZE_LIMIT_BYTES,
-    ) -> "TaskDiskCallCache":
-        """Create a new cache from inside a temporary directory"""
-        cache_dir = tempfile.mkdtemp()
-        cache = diskcache.Cache(directory=cache_dir, size_limit=size_limit_bytes)
-        return cls(cache, ttl_s)
+class _PrefetchedDiskCallCache(RunAwareCallCache):
+    """An in-memory overlay over an on-disk call-cache, for a single run
+
+    The run's results are loaded on the first lookup of one of them.
+    """
+
+    cache_kind: CallCacheKind
+    _inner: _DiskCallCache
+    _run_id: str
+    _lock: threading.Lock
+    # (kind_id, serialized_args) -> encoded result, once loaded
+    _entries: Optional[Dict[Tuple[str, str], Any]]
+
+    def __init__(self, inner: _DiskCallCache, run_id: str) -> None:
+        self.cache_kind = inner.cache_kind
+        self._inner = inner
+        self._run_id = run_id
+        self._lock = threading.Lock()
+        self._entries = None
 
     def check_cache(
         self,
@@ -125,33 +388,61 @@ class TaskDiskCallCache(CallCache):
         serialized_args: str,
         type_hint: Optional[Type[Any]] = None,
     ) -> CacheResult[T]:
-        key = serialize_task_cache_key(
-            run_id=run_id, task_id=kind_id, args=serialized_args
-        )
-        if key in self._cache:
-            logger.debug(f"Cache hit for task {kind_id} with key {key}")
-            return CacheResult[T](
-                found=True, result=_deserialize_val(self._cache[key], type_hint)
-            )
-        logger.debug(f"Cache miss for task {kind_id} with key {key}")
-        return CacheResult[T](found=False, result=None)
+        if run_id == self._run_id:
+            stored = self._loaded().get((kind_id, serialized_args), _MISSING)
+            if stored is not _MISSING:
+                logger.debug(
+                    f"Prefetched cache hit for {self.cache_kind.value} {kind_id}"
+                )
+                return CacheResult[T](
+                    found=True, result=self._inner.decode(stored, type_hint)
+                )
+        return self._inner.check_cache(run_id, kind_id, serialized_args, type_hint)
 
     def store_result(
         self, run_id: str, kind_id: str, serialized_args: str, res: Any
     ) -> None:
-        key = serialize_task_cache_key(
-            run_id=run_id, task_id=kind_id, args=serialized_args
-        )
-        res_serialized = default_json_dumps(res)
-        self._cache.set(key, res_serialized, expire=self._ttl_s)
-        logger.debug(f"Stored result for task {kind_id} with key {key}")
-
-
-def _deserialize_val(
-    value_str: str,
-    type_hint: Optional[Type[Any]] = None,
-) -> Any:
-    deserialized = json.loads(value_str)
-    if type_hint is None:
-        return deserialized
-    return value_to_type(hint=type_hint, value=deserialized)
+        self._inner.store_result(run_id, kind_id, serialized_args, res)
+        if run_id == self._run_id:
+            with self._lock:
+                # Drop any result we prefetched for the call, so that later
+                # lookups read the new result from the underlying cache.
+                if self._entries is not None:
+                    self._entries.pop((kind_id, serialized_args), None)
+
+    def invalidate(
+        self,
+        run_id: str,
+        kind_id: Optional[str] = None,
+        serialized_args: Optional[str] = None,
+    ) -> None:
+        if run_id == self._run_id:
+            with self._lock:
+                entries = self._entries or {}
+                for key in list(entries):
+                    if (kind_id is None or key[0] == kind_id) and (
+                        serialized_args is None or key[1] == serialized_args
+                    ):
+                        del entries[key]
+        self._inner.invalidate(run_id, kind_id, serialized_args)
+
+    def has_run(self, run_id: str) -> bool:
+        return self._inner.has_run(run_id)
+
+    def prefetch_run(self, run_id: str) -> RunAwareCallCache:
+        return self._inner.prefetch_run(run_id)
+
+    def close_run(self, run_id: str, status: WorkflowStatus) -> None:
+        if run_id == self._run_id:
+            with self._lock:
+                self._entries = {}
+        self._inner.close_run(run_id, status)
+
+    def reopen_run(self, run_id: str) -> None:
+        self._inner.reopen_run(run_id)
+
+    def _loaded(self) -> Dict[Tuple[str, str], Any]:
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._inner.load_run(self._run_id)
+            return self._entries
@@ -1,24 +1,42 @@
 """In-memory call-cache"""
 
-__all__ = ["StepInMemCallCache", "TaskInMemCallCache"]
+__all__ = [
+    "CallCacheStats",
+    "StepInMemCallCache",
+    "TaskInMemCallCache",
+    "StepBoundedInMemCallCache",
+    "TaskBoundedInMemCallCache",
+]
 
-from typing import Any, Dict, Optional, Type
+from collections import OrderedDict
+import dataclasses
+import heapq
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
 
+from fixpoint.workflows.node_state import WorkflowStatus
 from ._shared import (
-    CallCache,
+    RunAwareCallCache,
     CallCacheKind,
     CacheResult,
-    serialize_step_cache_key,
-    serialize_task_cache_key,
+    default_json_dumps,
+    logger,
     T,
 )
 
 
-class StepInMemCallCache(CallCache):
-    """An in-memory call-cache for steps"""
+class _InMemCallCache(RunAwareCallCache):
+    """Shared implementation of the in-memory task and step call-caches
 
-    cache_kind = CallCacheKind.STEP
-    _cache: Dict[str, Any]
+    Results are grouped by workflow run, so that we can invalidate all results
+    of a run without scanning every cached result.
+    """
+
+    cache_kind: CallCacheKind
+    # run_id -> (kind_id, serialized_args) -> result
+    _cache: Dict[str, Dict[Tuple[str, str], Any]]
 
     def __init__(self) -> None:
         self._cache = {}
@@ -30,30 +48,149 @@ class StepInMemCallCache(CallCache):
         serialized_args: str,
         type_hint: Optional[Type[Any]] = None,
     ) -> CacheResult[T]:
-        key = serialize_step_cache_key(
-            run_id=run_id, step_id=kind_id, args=serialized_args
-        )
-        if key not in self._cache:
+        run_cache = self._cache.get(run_id)
+        key = (kind_id, serialized_args)
+        if run_cache is None or key not in run_cache:
             return CacheResult[T](found=False, result=None)
-        return CacheResult[T](found=True, result=self._cache[key])
+        return CacheResult[T](found=True, result=run_cache[key])
 
     def store_result(
         self, run_id: str, kind_id: str, serialized_args: str, res: Any
     ) -> None:
-        key = serialize_step_cache_key(
-            run_id=run_id, step_id=kind_id, args=serialized_args
-        )
-        self._cache[key] = res
+        self._cache.setdefault(run_id, {})[(kind_id, serialized_args)] = res
+
+    def invalidate(
+        self,
+        run_id: str,
+        kind_id: Optional[str] = None,
+        serialized_args: Optional[str] = None,
+    ) -> None:
+        if kind_id is None:
+            self._cache.pop(run_id, None)
+            return
+        run_cache = self._cache.get(run_id)
+        if run_cache is None:
+            return
+        if serialized_args is not None:
+            run_cache.pop((kind_id, serialized_args), None)
+        else:
+            for key in [k for k in run_cache if k[0] == kind_id]:
+                del run_cache[key]
+        if not run_cache:
+            del self._cache[run_id]
+
+    def has_run(self, run_id: str) -> bool:
+        return run_id in self._cache
 
+    def prefetch_run(self, run_id: str) -> RunAwareCallCache:
+        # results are already in memory
+        return self
+
+    def close_run(self, run_id: str, status: WorkflowStatus) -> None:
+        pass
+
+    def reopen_run(self, run_id: str) -> None:
+        pass
+
+
+class StepInMemCallCache(_InMemCallCache):
+    """An in-memory call-cache for steps"""
+
+    cache_kind = CallCacheKind.STEP
 
-class TaskInMemCallCache(CallCache):
+
+class TaskInMemCallCache(_InMemCallCache):
     """An in-memory call-cache for tasks"""
 
     cache_kind = CallCacheKind.TASK
-    _cache: Dict[str, Any]
+
+
+@dataclasses.dataclass
+class CallCacheStats:
+    """Statistics about a bounded in-memory call-cache"""
+
+    hits: int = 0
+    misses: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+    runs: int = 0
+    evicted_runs: int = 0
+    evicted_entries: int = 0
+    expired_entries: int = 0
+
+
+_EntryKey = Tuple[str, str]
+
+
+class _RunEntries:
+    """The cached results of one workflow run"""
+
+    # (kind_id, serialized_args) -> (result, size in bytes, expiration time)
+    entries: Dict[_EntryKey, Tuple[Any, int, Optional[float]]]
+    size_bytes: int
+    closed_status: Optional[WorkflowStatus]
+    closed_at: Optional[float]
 
     def __init__(self) -> None:
-        self._cache = {}
+        self.entries = {}
+        self.size_bytes = 0
+        self.closed_status = None
+        self.closed_at = None
+
+
+class _BoundedInMemCallCache(RunAwareCallCache):
+    """Shared implementation of the bounded in-memory call-caches
+
+    Results are grouped by workflow run, and runs are evicted as a whole, least
+    recently used first. Closed runs are evicted before open runs. The results
+    of a completed run are dropped `completed_run_ttl_s` seconds after the run
+    completes. The results of a failed run are kept, because you might retry
+    the run, until the run is evicted to stay within the cache's budget.
+    """
+
+    cache_kind: CallCacheKind
+    _max_entries: Optional[int]
+    _max_bytes: Optional[int]
+    _ttl_s: Optional[float]
+    _completed_run_ttl_s: float
+    _sizeof: Callable[[Any], int]
+    _timer: Callable[[], float]
+    _lock: threading.Lock
+    # least recently used runs come first
+    _runs: "OrderedDict[str, _RunEntries]"
+    # heap of (completion time, run_id) for completed runs
+    _completed_runs: List[Tuple[float, str]]
+    _stats: CallCacheStats
+
+    def __init__(
+        self,
+        *,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl_s: Optional[float] = None,
+        completed_run_ttl_s: float = 0.0,
+        sizeof: Optional[Callable[[Any], int]] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        max_entries: the max number of results to keep in the cache
+        max_bytes: the max total size of results to keep in the cache
+        ttl_s: the time-to-live in seconds of each result
+        completed_run_ttl_s: how long to keep the results of a completed run
+        sizeof: estimates the size in bytes of a result. By default, we use the
+            length of its JSON serialization.
+        timer: the clock used for expiration
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl_s = ttl_s
+        self._completed_run_ttl_s = completed_run_ttl_s
+        self._sizeof = sizeof or _default_sizeof
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._runs = OrderedDict()
+        self._completed_runs = []
+        self._stats = CallCacheStats()
 
     def check_cache(
         self,
@@ -62,17 +199,180 @@ class TaskInMemCallCache(CallCache):
         serialized_args: str,
         type_hint: Optional[Type[Any]] = None,
     ) -> CacheResult[T]:
-        key = serialize_task_cache_key(
-            run_id=run_id, task_id=kind_id, args=serialized_args
-        )
-        if key not in self._cache:
-            return CacheResult[T](found=False, result=None)
-        return CacheResult[T](found=True, result=self._cache[key])
+        key = (kind_id, serialized_args)
+        with self._lock:
+            now = self._timer()
+            self._drop_completed_runs(now)
+            run = self._runs.get(run_id)
+            item = run.entries.get(key) if run is not None else None
+            if run is None or item is None:
+                self._stats.misses += 1
+                return CacheResult[T](found=False, result=None)
+            res, _, expires_at = item
+            if expires_at is not None and expires_at <= now:
+                self._remove_entry(run_id, run, key)
+                self._stats.expired_entries += 1
+                self._stats.misses += 1
+                return CacheResult[T](found=False, result=None)
+            self._runs.move_to_end(run_id)
+            self._stats.hits += 1
+            return CacheResult[T](found=True, result=res)
 
     def store_result(
         self, run_id: str, kind_id: str, serialized_args: str, res: Any
     ) -> None:
-        key = serialize_task_cache_key(
-            run_id=run_id, task_id=kind_id, args=serialized_args
-        )
-        self._cache[key] = res
+        key = (kind_id, serialized_args)
+        size = self._sizeof(res) if self._max_bytes is not None else 0
+        if self._max_bytes is not None and size > self._max_bytes:
+            logger.debug(
+                f"Not caching {self.cache_kind.value} {kind_id} result of"
+                f" {size} bytes, which is larger than the cache"
+            )
+            return
+        with self._lock:
+            now = self._timer()
+            self._drop_completed_runs(now)
+            run = self._runs.get(run_id)
+            if run is None:
+                run = _RunEntries()
+                self._runs[run_id] = run
+            # storing results re-opens a closed run, for example when retrying
+            run.closed_status = None
+            run.closed_at = None
+            old = run.entries.pop(key, None)
+            if old is not None:
+                # replace the entry in place, so we don't drop its run when it
+                # is the run's only entry
+                run.size_bytes -= old[1]
+                self._stats.entries -= 1
+                self._stats.size_bytes -= old[1]
+            expires_at = now + self._ttl_s if self._ttl_s is not None else None
+            run.entries[key] = (res, size, expires_at)
+            run.size_bytes += size
+            self._stats.entries += 1
+            self._stats.size_bytes += size
+            self._runs.move_to_end(run_id)
+            self._evict(run_id)
+
+    def invalidate(
+        self,
+        run_id: str,
+        kind_id: Optional[str] = None,
+        serialized_args: Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                return
+            if kind_id is None:
+                self._remove_run(run_id)
+                return
+            for key in list(run.entries):
+                if key[0] == kind_id and (
+                    serialized_args is None or key[1] == serialized_args
+                ):
+                    self._remove_entry(run_id, run, key)
+
+    def has_run(self, run_id: str) -> bool:
+        with self._lock:
+            return run_id in self._runs
+
+    def prefetch_run(self, run_id: str) -> RunAwareCallCache:
+        # results are already in memory
+        return self
+
+    def close_run(self, run_id: str, status: WorkflowStatus) -> None:
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                return
+            now = self._timer()
+            run.closed_status = status
+            run.closed_at = now
+            if status == WorkflowStatus.COMPLETED:
+                heapq.heappush(self._completed_runs, (now, run_id))
+                self._drop_completed_runs(now)
+
+    def reopen_run(self, run_id: str) -> None:
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None:
+                # the run's entry in the heap of completed runs is now stale
+                run.closed_status = None
+
+    def stats(self) -> CallCacheStats:
+        """Get statistics about the cache"""
+        with self._lock:
+            return dataclasses.replace(self._stats, runs=len(self._runs))
+
+    def _drop_completed_runs(self, now: float) -> None:
+        while self._completed_runs:
+            completed_at, run_id = self._completed_runs[0]
+            if completed_at + self._completed_run_ttl_s > now:
+                break
+            heapq.heappop(self._completed_runs)
+            run = self._runs.get(run_id)
+            # The run might have been re-opened or evicted since it completed.
+            if (
+                run is not None
+                and run.closed_status == WorkflowStatus.COMPLETED
+                and run.closed_at == completed_at
+            ):
+                self._remove_run(run_id)
+
+    def _is_over_budget(self) -> bool:
+        return (
+            self._max_entries is not None and self._stats.entries > self._max_entries
+        ) or (self._max_bytes is not None and self._stats.size_bytes > self._max_bytes)
+
+    def _evict(self, current_run_id: str) -> None:
+        if not self._is_over_budget():
+            return
+        # Evict whole runs, least recently used first, preferring closed runs.
+        # We never evict the run we are currently storing results for this way.
+        closed = [rid for rid, r in self._runs.items() if r.closed_status is not None]
+        opened = [rid for rid, r in self._runs.items() if r.closed_status is None]
+        for run_id in closed + opened:
+            if not self._is_over_budget():
+                return
+            if run_id != current_run_id:
+                self._stats.evicted_entries += len(self._runs[run_id].entries)
+                self._stats.evicted_runs += 1
+                self._remove_run(run_id)
+        # If the current run alone is over budget, evict its oldest results.
+        run = self._runs.get(current_run_id)
+        while run is not None and run.entries and self._is_over_budget():
+            self._remove_entry(current_run_id, run, next(iter(run.entries)))
+            self._stats.evicted_entries += 1
+
+    def _remove_entry(self, run_id: str, run: _RunEntries, key: _EntryKey) -> None:
+        _, size, _ = run.entries.pop(key)
+        run.size_bytes -= size
+        self._stats.entries -= 1
+        self._stats.size_bytes -= size
+        if not run.entries:
+            del self._runs[run_id]
+
+    def _remove_run(self, run_id: str) -> None:
+        run = self._runs.pop(run_id)
+        self._stats.entries -= len(run.entries)
+        self._stats.size_bytes -= run.size_bytes
+
+
+class StepBoundedInMemCallCache(_BoundedInMemCallCache):
+    """A bounded in-memory call-cache for steps"""
+
+    cache_kind = CallCacheKind.STEP
+
+
+class TaskBoundedInMemCallCache(_BoundedInMemCallCache):
+    """A bounded in-memory call-cache for tasks"""
+
+    cache_kind = CallCacheKind.TASK
+
+
+def _default_sizeof(res: Any) -> int:
+    try:
+        return len(default_json_dumps(res))
+    except (TypeError, ValueError):
+        return sys.getsizeof(res)
@@ -0,0 +1,141 @@
+"""Run-aware retention for the on-disk call-caches"""
+
+__all__ = ["CompactionReport", "compact_disk_call_cache"]
+
+from dataclasses import dataclass
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import diskcache
+
+from fixpoint.workflows.node_state import WorkflowStatus
+from ._shared import RUN_META_KEY_PREFIX, logger, run_meta_key
+from ._disk import StepDiskCallCache, TaskDiskCallCache
+from ._codec import pickled_blob_names
+
+
+# Don't delete blobs written within this window, because the cache entry that
+# refers to them might not be stored yet.
+_BLOB_GRACE_PERIOD_S = 60 * 60
+
+
+@dataclass
+class CompactionReport:
+    """What compacting a call cache removed"""
+
+    runs_removed: int = 0
+    entries_removed: int = 0
+    entries_expired: int = 0
+    blobs_removed: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        """The number of bytes of disk space reclaimed"""
+        return max(self.bytes_before - self.bytes_after, 0)
+
+
+def compact_disk_call_cache(
+    cache: diskcache.Cache,
+    *,
+    completed_run_ttl_s: float,
+    failed_run_ttl_s: Optional[float] = None,
+    blob_dir: Optional[str] = None,
+    vacuum: bool = True,
+    now: Optional[float] = None,
+) -> CompactionReport:
+    """Drop the cached results of runs that closed long ago
+
+    Drops the step and task results of runs that completed more than
+    `completed_run_ttl_s` seconds ago. Runs that closed without completing,
+    for example because they failed, are kept so that you can retry them,
+    unless you set `failed_run_ttl_s`. Results of open runs are never dropped,
+    except when they expire.
+
+    If you give the `blob_dir` of a `PickleCodec`, we also delete blobs that
+    no cache entry refers to anymore. If `vacuum` is true, we also shrink the
+    cache's database file, which blocks writers to the cache while it runs.
+    """
+    if now is None:
+        now = time.time()
+    report = CompactionReport(bytes_before=_volume(cache, blob_dir))
+    report.entries_expired = cache.expire(now)
+
+    caches = [StepDiskCallCache(cache), TaskDiskCallCache(cache)]
+    for run_id in _closed_run_ids(cache):
+        meta_key = run_meta_key(run_id)
+        with cache.transact():
+            # Check again inside the transaction, because the run might have
+            # been re-opened to retry it.
+            meta: Optional[Dict[str, Any]] = cache.get(meta_key)
+            if meta is None:
+                continue
+            ttl_s = (
+                completed_run_ttl_s
+                if meta["status"] == WorkflowStatus.COMPLETED.value
+                else failed_run_ttl_s
+            )
+            if ttl_s is None or meta["closed_at"] + ttl_s > now:
+                continue
+            for run_cache in caches:
+                report.entries_removed += run_cache.drop_run(run_id)
+            cache.delete(meta_key)
+            report.runs_removed += 1
+
+    if blob_dir is not None:
+        report.blobs_removed = _remove_unreferenced_blobs(cache, blob_dir, now)
+    if vacuum:
+        cache.check(fix=True)
+
+    report.bytes_after = _volume(cache, blob_dir)
+    logger.info(
+        f"Compacted call cache: removed {report.runs_removed} runs and"
+        f" {report.entries_removed} results, reclaimed {report.bytes_reclaimed} bytes"
+    )
+    return report
+
+
+def _closed_run_ids(cache: diskcache.Cache) -> List[str]:
+    run_ids: List[str] = []
+    for key in cache.iterkeys():
+        if isinstance(key, str) and key.startswith(RUN_META_KEY_PREFIX):
+            run_ids.append(json.loads(key)["run_meta"])
+    return run_ids
+
+
+def _remove_unreferenced_blobs(
+    cache: diskcache.Cache, blob_dir: str, now: float
+) -> int:
+    referenced: Set[str] = set()
+    for key in cache.iterkeys():
+        referenced.update(pickled_blob_names(cache.get(key)))
+    removed = 0
+    for dirpath, _, filenames in os.walk(blob_dir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if name in referenced:
+                continue
+            try:
+                if os.path.getmtime(path) + _BLOB_GRACE_PERIOD_S > now:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+    return removed
+
+
+def _volume(cache: diskcache.Cache, blob_dir: Optional[str]) -> int:
+    size: int = cache.volume()
+    if blob_dir is None:
+        return size
+    for dirpath, _, filenames in os.walk(blob_dir):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+            except FileNotFoundError:
+                continue
+    return size
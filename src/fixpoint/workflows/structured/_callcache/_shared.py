@@ -3,13 +3,21 @@
 __all__ = [
     "CacheResult",
     "CallCache",
+    "RunAwareCallCache",
     "CallCacheKind",
+    "default_json_dumps",
+    "global_memo_run_id",
     "JSONEncoder",
     "logger",
     "serialize_args",
     "serialize_step_cache_key",
     "serialize_task_cache_key",
     "T",
+    "invalidate_results",
+    "has_run",
+    "prefetch_run",
+    "close_run",
+    "reopen_run",
 ]
 
 import dataclasses
@@ -21,6 +29,7 @@ from typing import Any, Generic, Optional, Protocol, Type, TypeVar
 from pydantic import BaseModel
 
 from fixpoint.logging import logger as root_logger
+from fixpoint.workflows.node_state import WorkflowStatus
 
 
 T = TypeVar("T")
@@ -69,6 +78,109 @@ class CallCache(Protocol):
         """Store the result of a task or step call"""
 
 
+class RunAwareCallCache(CallCache, Protocol):
+    """Protocol for a call cache that also manages whole workflow runs
+
+    These methods are optional for call caches. We call them through
+    `invalidate_results`, `has_run`, `prefetch_run`, `close_run`, and
+    `reopen_run`, which do nothing for call caches that only implement
+    `CallCache`.
+    """
+
+    def invalidate(
+        self,
+        run_id: str,
+        kind_id: Optional[str] = None,
+        serialized_args: Optional[str] = None,
+    ) -> None:
+        """Invalidate cached results for a run
+
+        If `kind_id` is given, only invalidate results for that task or step.
+        If `serialized_args` is also given, only invalidate the result of the
+        call with those arguments.
+        """
+
+    def has_run(self, run_id: str) -> bool:
+        """Whether the call cache has any results or records for a workflow run"""
+
+    def prefetch_run(self, run_id: str) -> "RunAwareCallCache":
+        """Load all cached results of a run into memory
+
+        Returns a call cache that serves the run's results from memory, and
+        that falls back to this call cache for everything else. This is useful
+        when replaying a workflow run, which checks the cache for every task
+        and step that already ran.
+        """
+
+    def close_run(self, run_id: str, status: WorkflowStatus) -> None:
+        """Tell the call cache that a workflow run finished
+
+        Call caches can use this to release the results of completed runs.
+        """
+
+    def reopen_run(self, run_id: str) -> None:
+        """Tell the call cache that a closed workflow run is running again
+
+        We call this when a retried run starts, so that the call cache keeps
+        the run's results while it runs.
+        """
+
+
+def invalidate_results(
+    cache: CallCache,
+    run_id: str,
+    kind_id: Optional[str] = None,
+    serialized_args: Optional[str] = None,
+) -> None:
+    """Invalidate cached results for a run, if the call cache supports it"""
+    invalidate = getattr(cache, "invalidate", None)
+    if invalidate is None:
+        logger.warning(
+            f"{type(cache).__name__} can't invalidate results, so we keep them"
+        )
+        return
+    invalidate(run_id, kind_id, serialized_args)
+
+
+def has_run(cache: CallCache, run_id: str) -> bool:
+    """Whether the call cache knows about a workflow run
+
+    Call caches that can't tell never know about a run.
+    """
+    has = getattr(cache, "has_run", None)
+    if has is None:
+        return False
+    found: bool = has(run_id)
+    return found
+
+
+def prefetch_run(cache: CallCache, run_id: str) -> CallCache:
+    """Load a run's cached results into memory, if the call cache supports it
+
+    Returns the call cache itself if it doesn't.
+    """
+    prefetch = getattr(cache, "prefetch_run", None)
+    if prefetch is None:
+        return cache
+    prefetched: CallCache = prefetch(run_id)
+    return prefetched
+
+
+def close_run(cache: CallCache, run_id: str, status: WorkflowStatus) -> None:
+    """Tell the call cache that a workflow run finished, if it cares"""
+    close = getattr(cache, "close_run", None)
+    if close is not None:
+        close(run_id, status)
+
+
+def reopen_run(cache: CallCache, run_id: str) -> None:
+    """Tell the call cache that a closed workflow run is running again, if it
+    cares"""
+    reopen = getattr(cache, "reopen_run", None)
+    if reopen is not None:
+        reopen(run_id)
+
+
 class JSONEncoder(json.JSONEncoder):
     """Encoder to serialize objects to JSON"""
 
@@ -95,6 +207,33 @@ def serialize_task_cache_key(*, run_id: str, task_id: str, args: str) -> str:
     return default_json_dumps({"run_id": run_id, "task_id": task_id, "args": args})
 
 
+def global_memo_run_id(kind_id: str, version: str) -> str:
+    """The run ID under which globally memoized results are stored
+
+    Globally memoized tasks and steps share their results across workflow runs,
+    so instead of the workflow run ID we key them on the task or step ID and
+    the version of its code.
+    """
+    return f"__memo__/{kind_id}/{version}"
+
+
+def run_meta_key(run_id: str) -> str:
+    """The cache key under which we record that a workflow run closed"""
+    return default_json_dumps({"run_meta": run_id})
+
+
+RUN_META_KEY_PREFIX = '{"run_meta":'
+
+
+def is_shared_run_id(run_id: str) -> bool:
+    """Whether results under this run ID are shared between workflow runs
+
+    Results that outlive a single workflow run, such as globally memoized
+    results, are stored under run IDs that start with "__".
+    """
+    return run_id.startswith("__")
+
+
 def default_json_dumps(obj: Any) -> str:
     """Default serialization of an object to JSON"""
     return json.dumps(obj, sort_keys=True, separators=(",", ":"), cls=JSONEncoder)
@@ -1,7 +1,8 @@
 """The workflow context for structured workflows"""
 
+import hashlib
 import logging
-from typing import List, Optional
+from typing import Any, List, Optional, Type
 
 from fixpoint.agents import AsyncBaseAgent
 from fixpoint.cache import SupportsChatCompletionCache
@@ -9,6 +10,8 @@ from fixpoint.cache import SupportsChatCompletionCache
 from ..imperative import WorkflowContext as ImperativeWorkflowContext, WorkflowRun
 from ..imperative._wrapped_workflow_agents import AsyncWrappedWorkflowAgents
 from ._run_config import RunConfig
+from ._events import WorkflowEvent, WorkflowEventKind, WorkflowEventStream
+from ._callcache import invalidate_results
 
 
 class WorkflowContext:
@@ -28,10 +31,19 @@ class WorkflowContext:
     - A logger that is scoped to the lifetime of the `WorkflowRun`.
     - The `run_config`, that defines settings for the worflow run. You rarely
       need to access this.
+
+    Call `emit(...)` to stream a partial result to whoever is reading the
+    run's events, and `checkpoint(...)` and `recall(...)` to save progress
+    partway through a long step.
     """
 
     run_config: RunConfig
     _imp_ctx: ImperativeWorkflowContext
+    # shared by the context and all of its clones
+    _events: WorkflowEventStream
+    # the serialized arguments of the task or step call this context is in
+    _call_args: Optional[str]
+    _checkpointed: bool
 
     def __init__(
         self,
@@ -55,6 +67,9 @@ class WorkflowContext:
             _async_workflow_agents_override_=_workflow_agents_override_,
         )
         self.run_config = run_config
+        self._events = WorkflowEventStream()
+        self._call_args = None
+        self._checkpointed = False
 
     @property
     def agents(self) -> AsyncWrappedWorkflowAgents:
@@ -76,24 +91,155 @@ class WorkflowContext:
         """The workflow run context's logger"""
         return self._imp_ctx.logger
 
+    async def emit(self, value: Any) -> None:
+        """Emit a partial result to the reader of the run's events
+
+        You read the events with `handle.events()`. If the reader has fallen
+        behind, this waits for it to catch up. If nothing is reading events,
+        this does nothing.
+        """
+        if not self._events.active:
+            return
+        node_info = self.workflow_run.node_info
+        await self._events.publish(
+            WorkflowEvent(
+                kind=WorkflowEventKind.EMITTED,
+                workflow_run_id=self.workflow_run.id,
+                task=node_info.task,
+                step=node_info.step,
+                value=value,
+            )
+        )
+
+    def checkpoint(self, key: str, value: Any) -> None:
+        """Save a value partway through a step
+
+        If the step fails and the workflow run is retried, `recall(key)` in the
+        retried step returns the value, so a long loop can pick up where it
+        stopped. Checkpoints are scoped to the current task or step call,
+        including its arguments, and are stored in the run config's step call
+        cache. Once the step finishes, its result is cached instead, so we
+        drop its checkpoints.
+
+        ```
+        start = ctx.recall("next_chunk", default=0)
+        for i in range(start, len(chunks)):
+            results.append(await summarize(ctx, chunks[i]))
+            ctx.checkpoint("results", results)
+            ctx.checkpoint("next_chunk", i + 1)
+        ```
+        """
+        self.run_config.call_cache.steps.store_result(
+            run_id=self.workflow_run.id,
+            kind_id=self._checkpoint_kind_id(),
+            serialized_args=key,
+            res=value,
+        )
+        self._checkpointed = True
+
+    def recall(
+        self, key: str, default: Any = None, type_hint: Optional[Type[Any]] = None
+    ) -> Any:
+        """Get a value saved with `checkpoint(key, ...)` in this task or step call
+
+        Returns `default` if there is no such checkpoint. Pass in a `type_hint`
+        to load the value into that type, if the call cache stores values as
+        JSON.
+        """
+        res = self.run_config.call_cache.steps.check_cache(
+            run_id=self.workflow_run.id,
+            kind_id=self._checkpoint_kind_id(),
+            serialized_args=key,
+            type_hint=type_hint,
+        )
+        return res.result if res.found else default
+
+    def _checkpoint_kind_id(self) -> str:
+        node_info = self.workflow_run.node_info
+        digest = hashlib.sha256((self._call_args or "").encode()).hexdigest()[:16]
+        return f"__checkpoint__/{node_info.task}/{node_info.step}/{digest}"
+
+    def _for_call(self, serialized_args: str) -> "WorkflowContext":
+        """A copy of this context for a task or step call with these arguments"""
+        new_self = object.__new__(self.__class__)
+        new_self.__dict__.update(self.__dict__)
+        # pylint: disable=protected-access
+        new_self._call_args = serialized_args
+        new_self._checkpointed = False
+        return new_self
+
+    def _clear_checkpoints(self) -> None:
+        if self._checkpointed:
+            invalidate_results(
+                self.run_config.call_cache.steps,
+                run_id=self.workflow_run.id,
+                kind_id=self._checkpoint_kind_id(),
+            )
+            self._checkpointed = False
+
     def clone(
         self, new_task: str | None = None, new_step: str | None = None
     ) -> "WorkflowContext":
-        """Clones the workflow context"""
-
-        # We need to override this metod from the child class because we have
-        # different init parameters.
+        """Clones the workflow context
+
+        The clone is a lightweight frame that shares everything with this
+        context except for the workflow run's current node.
+        """
+        new_self = object.__new__(self.__class__)
+        new_self.__dict__.update(self.__dict__)
+        # pylint: disable=protected-access
+        new_self._imp_ctx = self._imp_ctx.clone(new_task=new_task, new_step=new_step)
+        new_self._checkpointed = False
+        return new_self
+
+
+class StepProcessContext:
+    """The context a step gets when it runs in a worker process
+
+    The workflow run, its agents, and its storage can't leave the process that
+    runs the workflow, so a step defined with `executor="process"` gets this
+    picklable stand-in for the `WorkflowContext`. It identifies the workflow
+    run, task, and step, and has a logger.
+    """
 
-        # clone the workflow run
-        new_workflow_run = self.workflow_run.clone(new_task=new_task, new_step=new_step)
-        # clone the agents
-        new_agents = self.agents.clone(new_workflow_run)
+    workflow_id: str
+    workflow_run_id: str
+    run_attempt_id: str
+    task_id: Optional[str]
+    step_id: Optional[str]
+    _logger_name: str
 
-        return self.__class__(
-            agents=[],
-            workflow_run=new_workflow_run,
-            cache=self.cache,
-            logger=self.logger,
-            run_config=self.run_config,
-            _workflow_agents_override_=new_agents,
+    def __init__(
+        self,
+        *,
+        workflow_id: str,
+        workflow_run_id: str,
+        run_attempt_id: str,
+        task_id: Optional[str],
+        step_id: Optional[str],
+        logger_name: str,
+    ) -> None:
+        self.workflow_id = workflow_id
+        self.workflow_run_id = workflow_run_id
+        self.run_attempt_id = run_attempt_id
+        self.task_id = task_id
+        self.step_id = step_id
+        self._logger_name = logger_name
+
+    @classmethod
+    def from_context(cls, ctx: WorkflowContext) -> "StepProcessContext":
+        """Snapshot the picklable parts of a workflow context"""
+        wrun = ctx.workflow_run
+        return cls(
+            workflow_id=wrun.workflow_id,
+            workflow_run_id=wrun.id,
+            run_attempt_id=wrun.attempt_id,
+            task_id=wrun.node_info.task,
+            step_id=wrun.node_info.step,
+            logger_name=ctx.logger.name,
         )
+
+    @property
+    def logger(self) -> logging.Logger:
+        """The workflow run's logger"""
+        return logging.getLogger(self._logger_name)
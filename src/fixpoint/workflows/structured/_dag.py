@@ -0,0 +1,221 @@
+"""Structured workflows: running steps as a dependency graph
+
+A `StepDag` runs a set of step calls in the order their dependencies require,
+running independent steps concurrently. A step call depends on another one if
+it takes that call's `StepFuture` as an argument, if it is added with
+`after=[...]`, or if its step was defined with `@structured.step(after=[...])`.
+Each step call is a normal `call_step`, so it is call-cached and becomes its own
+step node in the workflow run.
+
+```
+dag = structured.StepDag(ctx, max_concurrency=4)
+text = dag.add(extract, args=[document])
+summary = dag.add(summarize, args=[text])
+tags = dag.add(tag, args=[text])
+await dag.run()
+return summary.result(), tags.result()
+```
+"""
+
+__all__ = ["StepDag", "StepFuture"]
+
+import asyncio
+from collections import deque
+from typing import Any, Dict, Generic, List, Optional, Sequence
+
+from ._context import WorkflowContext
+from .errors import DefinitionError
+from ._helpers import AsyncFunc, Params, Ret
+from ._step import call_step, get_step_fixp
+
+
+class StepFuture(Generic[Ret]):
+    """A step call in a `StepDag`, and its result once it has run
+
+    Pass it as an argument to another step call in the same DAG to use its
+    result there.
+    """
+
+    step_id: str
+    fn: AsyncFunc[..., Ret]
+    args: List[Any]
+    kwargs: Dict[str, Any]
+    after: List["StepFuture[Any]"]
+    _done: bool
+    _result: Optional[Ret]
+
+    def __init__(
+        self,
+        step_id: str,
+        fn: AsyncFunc[..., Ret],
+        args: List[Any],
+        kwargs: Dict[str, Any],
+        after: List["StepFuture[Any]"],
+    ) -> None:
+        self.step_id = step_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.after = after
+        self._done = False
+        self._result = None
+
+    def done(self) -> bool:
+        """Whether the step call has finished"""
+        return self._done
+
+    def result(self) -> Ret:
+        """The result of the step call
+
+        Raises a `RuntimeError` if the step call has not finished.
+        """
+        if not self._done:
+            raise RuntimeError(f"Step {self.step_id} has not finished running")
+        return self._result  # type: ignore[return-value]
+
+    def set_result(self, result: Ret) -> None:
+        """Record the result of the finished step call"""
+        self._result = result
+        self._done = True
+
+    def dependencies(self) -> List["StepFuture[Any]"]:
+        """The step calls whose results this step call takes as arguments, or
+        that it must run after"""
+        deps = list(self.after)
+        for arg in [*self.args, *self.kwargs.values()]:
+            if isinstance(arg, StepFuture) and arg not in deps:
+                deps.append(arg)
+        return deps
+
+
+class StepDag:
+    """A graph of step calls, which runs each call once its dependencies finish
+
+    Step calls that don't depend on each other run concurrently, at most
+    `max_concurrency` at a time, or all at once if it is `None`. If a step call
+    fails, we cancel the step calls that are still running and raise an
+    `ExceptionGroup`, like `call_steps` does.
+    """
+
+    _ctx: WorkflowContext
+    _max_concurrency: Optional[int]
+    _nodes: List[StepFuture[Any]]
+
+    def __init__(
+        self, ctx: WorkflowContext, *, max_concurrency: Optional[int] = None
+    ) -> None:
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(
+                f"max_concurrency must be at least 1, got {max_concurrency}"
+            )
+        self._ctx = ctx
+        self._max_concurrency = max_concurrency
+        self._nodes = []
+
+    def add(
+        self,
+        fn: AsyncFunc[Params, Ret],
+        args: Optional[List[Any]] = None,
+        kwargs: Optional[Dict[str, Any]] = None,
+        *,
+        after: Optional[Sequence[StepFuture[Any]]] = None,
+    ) -> StepFuture[Ret]:
+        """Add a step call to the graph
+
+        Any `StepFuture` in `args` or `kwargs` is replaced by its result when
+        the step runs. The step call also waits for the calls in `after`, and
+        for every call in the graph to the steps its definition runs after.
+        """
+        step_fixp = get_step_fixp(fn)
+        if not step_fixp:
+            raise DefinitionError(f"Step {fn.__name__} is not a valid step definition")
+        node = StepFuture[Ret](
+            step_fixp.id, fn, list(args or []), dict(kwargs or {}), list(after or [])
+        )
+        for dep in node.dependencies():
+            if dep not in self._nodes:
+                raise DefinitionError(
+                    f"Step {node.step_id} depends on a step call that is not in this DAG"
+                )
+        self._nodes.append(node)
+        return node
+
+    async def run(self) -> None:
+        """Run the step calls that have not run yet"""
+        deps = self._dependencies()
+        order = _topological_order(self._nodes, deps)
+        finished = {id(node): asyncio.Event() for node in self._nodes}
+        for node in self._nodes:
+            if node.done():
+                finished[id(node)].set()
+        sem = asyncio.Semaphore(self._max_concurrency or len(self._nodes) or 1)
+
+        async def run_node(node: StepFuture[Any]) -> None:
+            for dep in deps[id(node)]:
+                await finished[id(dep)].wait()
+            async with sem:
+                result = await call_step(
+                    self._ctx,
+                    node.fn,
+                    args=[_resolve(arg) for arg in node.args],
+                    kwargs={k: _resolve(v) for k, v in node.kwargs.items()},
+                )
+            node.set_result(result)
+            finished[id(node)].set()
+
+        async with asyncio.TaskGroup() as tg:
+            for node in order:
+                if not node.done():
+                    tg.create_task(run_node(node))
+
+    def _dependencies(self) -> Dict[int, List[StepFuture[Any]]]:
+        """Each step call's dependencies, including the steps it runs after by
+        definition"""
+        by_step_id: Dict[str, List[StepFuture[Any]]] = {}
+        for node in self._nodes:
+            by_step_id.setdefault(node.step_id, []).append(node)
+        deps: Dict[int, List[StepFuture[Any]]] = {}
+        for node in self._nodes:
+            node_deps = node.dependencies()
+            step_fixp = get_step_fixp(node.fn)
+            for step_id in step_fixp.after if step_fixp else []:
+                if step_id not in by_step_id:
+                    raise DefinitionError(
+                        f"Step {node.step_id} runs after step {step_id},"
+                        " but the DAG has no call to it"
+                    )
+                node_deps.extend(d for d in by_step_id[step_id] if d not in node_deps)
+            deps[id(node)] = node_deps
+        return deps
+
+
+def _topological_order(
+    nodes: List[StepFuture[Any]], deps: Dict[int, List[StepFuture[Any]]]
+) -> List[StepFuture[Any]]:
+    """Order the step calls so each one comes after its dependencies
+
+    Step calls that are ready at the same time keep the order they were added
+    in. Raises a `DefinitionError` if the dependencies have a cycle.
+    """
+    waiting_on = {id(node): len(deps[id(node)]) for node in nodes}
+    dependents: Dict[int, List[StepFuture[Any]]] = {id(node): [] for node in nodes}
+    for node in nodes:
+        for dep in deps[id(node)]:
+            dependents[id(dep)].append(node)
+    ready = deque(node for node in nodes if waiting_on[id(node)] == 0)
+    order: List[StepFuture[Any]] = []
+    while ready:
+        node = ready.popleft()
+        order.append(node)
+        for dependent in dependents[id(node)]:
+            waiting_on[id(dependent)] -= 1
+            if waiting_on[id(dependent)] == 0:
+                ready.append(dependent)
+    if len(order) < len(nodes):
+        cycle = sorted({node.step_id for node in nodes if waiting_on[id(node)] > 0})
+        raise DefinitionError(f"Steps {', '.join(cycle)} depend on each other")
+    return order
+
+
+def _resolve(arg: Any) -> Any:
+    return arg.result() if isinstance(arg, StepFuture) else arg
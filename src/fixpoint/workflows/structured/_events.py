@@ -0,0 +1,233 @@
+"""Structured workflows: streaming events from a running workflow
+
+A workflow run publishes events as it goes: when its status changes, when a
+task or step finishes, and when the workflow emits a partial result with
+`ctx.emit(...)`. You read them with `handle.events()`. Events sit in a bounded
+buffer, and when it is full the workflow waits for you to read, so a slow
+reader slows the workflow down instead of buffering without limit. If nothing
+is reading events, the workflow publishes nothing.
+"""
+
+__all__ = [
+    "EventSubscription",
+    "WorkflowEvent",
+    "WorkflowEventKind",
+    "WorkflowEventStream",
+]
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Deque, Optional
+
+from ..constants import STEP_MAIN_ID, TASK_MAIN_ID
+from ..imperative import WorkflowRun
+from ..node_state import WorkflowStatus
+
+
+DEFAULT_MAX_BUFFERED_EVENTS = 100
+
+
+class WorkflowEventKind(Enum):
+    """The kinds of events a workflow run publishes"""
+
+    RUN_STATUS = "run_status"
+    TASK_CLOSED = "task_closed"
+    STEP_CLOSED = "step_closed"
+    EMITTED = "emitted"
+
+
+@dataclass(frozen=True)
+class WorkflowEvent:
+    """An event from a running workflow
+
+    `task` and `step` are the node the event happened in. For a closed task or
+    step, `status` is how it closed and `value` is its result. For an emitted
+    event, `value` is the emitted value. For a status change, `status` is the
+    run's new status.
+    """
+
+    kind: WorkflowEventKind
+    workflow_run_id: str
+    task: str
+    step: str
+    status: Optional[WorkflowStatus] = None
+    value: Any = None
+
+
+class EventSubscription:
+    """A reader's bounded buffer of a workflow run's events
+
+    Iterate over it with `async for` to read events until the run finishes.
+    """
+
+    _stream: "WorkflowEventStream"
+    loop: asyncio.AbstractEventLoop
+    max_buffered: int
+    buffer: Deque[WorkflowEvent]
+    changed: asyncio.Condition
+    closed: bool
+
+    def __init__(
+        self,
+        stream: "WorkflowEventStream",
+        loop: asyncio.AbstractEventLoop,
+        max_buffered: int,
+    ) -> None:
+        self._stream = stream
+        self.loop = loop
+        self.max_buffered = max_buffered
+        self.buffer = deque()
+        self.changed = asyncio.Condition()
+        self.closed = False
+
+    def __aiter__(self) -> "EventSubscription":
+        return self
+
+    async def __anext__(self) -> WorkflowEvent:
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.closed or bool(self.buffer))
+            if not self.buffer:
+                raise StopAsyncIteration
+            event = self.buffer.popleft()
+            self.changed.notify_all()
+            return event
+
+    async def aclose(self) -> None:
+        """Stop reading events
+
+        If the workflow is waiting for us to read, it goes on, and it stops
+        publishing events.
+        """
+        self._stream.unsubscribe(self)
+        await self.close()
+
+    async def put(self, event: WorkflowEvent, wait: bool) -> None:
+        """Buffer an event, and if `wait`, wait until there is room for it"""
+        async with self.changed:
+            if wait:
+                await self.changed.wait_for(
+                    lambda: self.closed or len(self.buffer) < self.max_buffered
+                )
+            if not self.closed:
+                self.buffer.append(event)
+                self.changed.notify_all()
+
+    async def close(self) -> None:
+        """Stop buffering events. The reader still gets the buffered events."""
+        async with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+
+class WorkflowEventStream:
+    """Where a workflow run publishes its events
+
+    A workflow run and all of its workflow contexts share one stream. The
+    stream has at most one reader at a time.
+    """
+
+    _subscription: Optional[EventSubscription]
+    _finished: bool
+
+    def __init__(self) -> None:
+        self._subscription = None
+        self._finished = False
+
+    @property
+    def active(self) -> bool:
+        """Whether something is reading the events"""
+        return self._subscription is not None
+
+    def subscribe(
+        self, max_buffered: int = DEFAULT_MAX_BUFFERED_EVENTS
+    ) -> EventSubscription:
+        """Start reading the run's events
+
+        Call this from the event loop the workflow runs on. We buffer at most
+        `max_buffered` events that you have not read yet.
+        """
+        if max_buffered < 1:
+            raise ValueError(f"max_buffered must be at least 1, got {max_buffered}")
+        if self._subscription is not None:
+            raise RuntimeError("Only one reader at a time can read workflow events")
+        sub = EventSubscription(self, asyncio.get_running_loop(), max_buffered)
+        if self._finished:
+            sub.closed = True
+        else:
+            self._subscription = sub
+        return sub
+
+    def unsubscribe(self, sub: EventSubscription) -> None:
+        """Stop publishing events to a reader"""
+        if self._subscription is sub:
+            self._subscription = None
+
+    async def publish(self, event: WorkflowEvent) -> None:
+        """Publish an event, waiting if the reader's buffer is full"""
+        await self._put(event, wait=True)
+
+    async def publish_status(
+        self, workflow_run_id: str, status: WorkflowStatus, final: bool = False
+    ) -> None:
+        """Publish a change to the run's status
+
+        If the status is `final`, the run is finished and we stop the stream.
+        We don't wait for the reader then, so that a finished run doesn't hang
+        on a reader that stopped reading.
+        """
+        if final:
+            self._finished = True
+        event = WorkflowEvent(
+            kind=WorkflowEventKind.RUN_STATUS,
+            workflow_run_id=workflow_run_id,
+            task=TASK_MAIN_ID,
+            step=STEP_MAIN_ID,
+            status=status,
+        )
+        await self._put(event, wait=not final)
+        sub = self._subscription
+        if final and sub is not None:
+            self._subscription = None
+            await _on_loop(sub, sub.close())
+
+    async def _put(self, event: WorkflowEvent, wait: bool) -> None:
+        sub = self._subscription
+        if sub is None:
+            return
+        await _on_loop(sub, sub.put(event, wait))
+
+
+async def _on_loop(sub: EventSubscription, coro: Any) -> None:
+    """Run a coroutine on the reader's event loop
+
+    Steps that run on a worker thread have their own event loop.
+    """
+    if asyncio.get_running_loop() is sub.loop:
+        await coro
+    else:
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, sub.loop))
+
+
+async def publish_node_closed(
+    events: WorkflowEventStream,
+    kind: WorkflowEventKind,
+    workflow_run: WorkflowRun,
+    status: WorkflowStatus,
+    value: Any = None,
+) -> None:
+    """Publish that a task or step closed, if anything is reading events"""
+    if not events.active:
+        return
+    node_info = workflow_run.node_info
+    await events.publish(
+        WorkflowEvent(
+            kind=kind,
+            workflow_run_id=workflow_run.id,
+            task=node_info.task,
+            step=node_info.step,
+            status=status,
+            value=value,
+        )
+    )
@@ -0,0 +1,84 @@
+"""Structured workflows: running steps off of the event loop
+
+Steps normally run on the workflow's event loop, so a step that blocks or does
+a lot of CPU work stalls every other workflow run in the process. A step
+defined with `executor="thread"` or `executor="process"` runs in a worker thread
+or a worker process instead, in its own event loop.
+"""
+
+__all__ = ["ExecutorKind", "StepExecutors"]
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import threading
+from typing import Literal, Optional
+
+
+ExecutorKind = Literal["thread", "process"]
+
+
+class StepExecutors:
+    """The worker thread and process pools that steps are offloaded to
+
+    The pools are created the first time a step needs them. Worker processes are
+    started with the "spawn" start method, so they don't inherit the parent's
+    threads, locks, or open connections.
+    """
+
+    _max_threads: Optional[int]
+    _max_processes: Optional[int]
+    _lock: threading.Lock
+    _thread_pool: Optional[ThreadPoolExecutor]
+    _process_pool: Optional[ProcessPoolExecutor]
+
+    def __init__(
+        self,
+        max_threads: Optional[int] = None,
+        max_processes: Optional[int] = None,
+    ) -> None:
+        self._max_threads = max_threads
+        self._max_processes = max_processes
+        self._lock = threading.Lock()
+        self._thread_pool = None
+        self._process_pool = None
+
+    def thread_pool(self) -> ThreadPoolExecutor:
+        """Get the thread pool, creating it if needed"""
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(
+                    max_workers=self._max_threads,
+                    thread_name_prefix="fixpoint-step",
+                )
+            return self._thread_pool
+
+    def process_pool(self) -> ProcessPoolExecutor:
+        """Get the process pool, creating it if needed"""
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self._max_processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._process_pool
+
+    def get(self, kind: ExecutorKind) -> Executor:
+        """Get the pool for an executor kind"""
+        if kind == "thread":
+            return self.thread_pool()
+        if kind == "process":
+            return self.process_pool()
+        raise ValueError(f'Unknown executor "{kind}"')
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Shut down the pools
+
+        If a step needs a pool again afterwards, we create a new one.
+        """
+        with self._lock:
+            thread_pool, self._thread_pool = self._thread_pool, None
+            process_pool, self._process_pool = self._process_pool, None
+        if thread_pool is not None:
+            thread_pool.shutdown(wait=wait)
+        if process_pool is not None:
+            process_pool.shutdown(wait=wait)
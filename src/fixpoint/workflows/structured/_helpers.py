@@ -1,14 +1,43 @@
 """Internal helpers for the structured workflow system"""
 
 import asyncio
+import contextvars
+import functools
 from functools import wraps
+import hashlib
 import inspect
-from typing import Any, Awaitable, Callable, Coroutine, ParamSpec, Tuple, TypeVar, cast
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Optional,
+    ParamSpec,
+    Sequence,
+    Tuple,
+    TypeVar,
+    cast,
+    get_type_hints,
+)
 
-from ._context import WorkflowContext
+import fixpoint
+from fixpoint.logging import logger
+
+from .. import tracing
+from ..node_state import WorkflowStatus
+from ._context import StepProcessContext, WorkflowContext
+from ._executor import ExecutorKind
 from .errors import DefinitionError, InternalError
 from ._errors import InternalExecutionError
-from ._callcache import CallCacheKind, CacheResult, serialize_args
+from ._callcache import (
+    CallCache,
+    CallCacheKind,
+    CacheResult,
+    serialize_args,
+)
+from ._callcache._converter import compile_converter
 
 
 Params = ParamSpec("Params")
@@ -16,6 +45,14 @@ Ret = TypeVar("Ret")
 Ret_co = TypeVar("Ret_co", covariant=True)
 AwaitableRet = TypeVar("AwaitableRet", bound=Awaitable[Any])
 AsyncFunc = Callable[Params, Coroutine[Any, Any, Ret]]
+AgentsFactory = Callable[[], List[fixpoint.agents.AsyncBaseAgent]]
+
+# While this is set, task and step results are added to it as pending stores
+# instead of going to the call cache right away. Structured races use it so
+# that losing branches don't cache their results.
+_deferred_stores: contextvars.ContextVar[Optional[List[Callable[[], None]]]] = (
+    contextvars.ContextVar("fixpoint_deferred_stores", default=None)
+)
 
 
 def validate_func_has_context_arg(func: Callable[..., Any]) -> None:
@@ -24,6 +61,16 @@ def validate_func_has_context_arg(func: Callable[..., Any]) -> None:
     If the function is a method, we expect the first argument to be "self" and
     the next argument to be a a WorkflowContext.
     """
+    context_arg_position(func)
+
+
+def context_arg_position(func: Callable[..., Any]) -> int:
+    """Get the position of a function's WorkflowContext argument
+
+    The position is 1 if the function is a method, whose first argument is
+    "self", and 0 otherwise. Raises a DefinitionError if the function does not
+    have room for a WorkflowContext argument.
+    """
     sig = inspect.signature(func)
     if len(sig.parameters) < 1:
         raise DefinitionError(
@@ -35,53 +82,83 @@ def validate_func_has_context_arg(func: Callable[..., Any]) -> None:
             raise DefinitionError(
                 "In class method: first non-self parameter must be of type WorkflowContext"
             )
+        return 1
+    return 0
 
 
 def decorate_with_cache(
-    kind: CallCacheKind, kind_id: str
+    kind: CallCacheKind, kind_id: str, memo_run_id: Optional[str] = None
 ) -> Callable[[AsyncFunc[Params, Ret]], AsyncFunc[Params, Ret]]:
     """Decorate a task or a step for call durability.
 
     Decorate a step or a task for call durability, so that we store the results
     of calling a task or a step. If the workflow fails and we recall the task or
     step, we can check if we already computed its results.
+
+    Results are keyed on the workflow run. If you pass in a `memo_run_id`, we
+    key results on that instead, so they are shared across workflow runs.
+
+    Decorate a function once, when it is defined, rather than on every call:
+    we inspect the function's signature when decorating it.
     """
+    if kind == CallCacheKind.TASK:
+        get_callcache = _get_task_callcache
+    elif kind == CallCacheKind.STEP:
+        get_callcache = _get_step_callcache
+    else:
+        raise InternalError(f"Unknown call cache kind: {kind}")
 
     def decorator(func: AsyncFunc[Params, Ret]) -> AsyncFunc[Params, Ret]:
-        validate_func_has_context_arg(func)
+        expected_ctx_pos = context_arg_position(func)
 
         @wraps(func)
         async def wrapper(*args: Any, **kwargs: Any) -> Ret:
-            ctx, ctx_pos = _pull_ctx_arg(*args)
-            wrun_id = ctx.workflow_run.id
-            if kind == CallCacheKind.TASK:
-                callcache = ctx.run_config.call_cache.tasks
-            elif kind == CallCacheKind.STEP:
-                callcache = ctx.run_config.call_cache.steps
-            else:
-                raise InternalError(f"Unknown call cache kind: {kind}")
-
-            remaining_args = args[ctx_pos + 1 :]
-            serialized = serialize_args(*remaining_args, **kwargs)
+            ctx_pos = expected_ctx_pos
+            if len(args) <= ctx_pos or not isinstance(args[ctx_pos], WorkflowContext):
+                _, ctx_pos = _pull_ctx_arg(*args)
+            ctx: WorkflowContext = args[ctx_pos]
+            wrun_id = memo_run_id or ctx.workflow_run.id
+            callcache = get_callcache(ctx)
+
+            serialized = serialize_args(*args[ctx_pos + 1 :], **kwargs)
             cache_check: CacheResult[Ret] = callcache.check_cache(
                 run_id=wrun_id, kind_id=kind_id, serialized_args=serialized
             )
-            match cache_check:
-                case CacheResult(found=True, result=cache_res):
-                    # we can cast this, because while `cache_res` is of type
-                    # Optional[Ret], if `found is True`, then `cache_res` is
-                    # actually of type `Ret`.
-                    #
-                    # We can't just do an `is None` check, because technically
-                    # the result could be of type `None`.
-                    return cast(Ret, cache_res)
-
-            async with asyncio.TaskGroup() as tg:
-                res_task = tg.create_task(func(*args, **kwargs))
-            res = res_task.result()
-            callcache.store_result(
-                run_id=wrun_id, kind_id=kind_id, serialized_args=serialized, res=res
-            )
+            _set_cache_status(kind, kind_id, cache_check.found)
+            if cache_check.found:
+                # we can cast this, because while `cache_check.result` is of
+                # type Optional[Ret], if `found is True`, then it is actually of
+                # type `Ret`.
+                #
+                # We can't just do an `is None` check, because technically
+                # the result could be of type `None`.
+                return cast(Ret, cache_check.result)
+
+            # give the call its own context, so its checkpoints are scoped to
+            # its arguments
+            # pylint: disable=protected-access
+            call_ctx = ctx._for_call(serialized)
+            args = (*args[:ctx_pos], call_ctx, *args[ctx_pos + 1 :])
+            res = await func(*args, **kwargs)
+
+            def store() -> None:
+                callcache.store_result(
+                    run_id=wrun_id, kind_id=kind_id, serialized_args=serialized, res=res
+                )
+                call_ctx._clear_checkpoints()
+                journal = ctx.workflow_run.journal
+                if journal is None:
+                    return
+                try:
+                    journal.cache_write(kind.value, kind_id, serialized)
+                # the call already succeeded and its result is cached, so a
+                # journal we can't write to must not fail it
+                except Exception:  # pylint: disable=broad-exception-caught
+                    logger.exception(
+                        "Failed to journal the result of %s %s", kind.value, kind_id
+                    )
+
+            store_or_defer(store)
             return res
 
         return wrapper
@@ -89,6 +166,158 @@ def decorate_with_cache(
     return decorator
 
 
+def store_or_defer(store: Callable[[], None]) -> None:
+    """Store a call result now, or later if stores are deferred"""
+    deferred = _deferred_stores.get()
+    if deferred is None:
+        store()
+    else:
+        deferred.append(store)
+
+
+def defer_stores(deferred: List[Callable[[], None]]) -> None:
+    """Defer the call-cache stores in the current context to `deferred`"""
+    _deferred_stores.set(deferred)
+
+
+def closed_status(exc: BaseException) -> WorkflowStatus:
+    """The status of a task or step node that raised this exception"""
+    if isinstance(exc, asyncio.CancelledError):
+        return WorkflowStatus.CANCELLED
+    return WorkflowStatus.FAILED
+
+
+def _set_cache_status(kind: CallCacheKind, kind_id: str, hit: bool) -> None:
+    """Record on the current task or step span if its result was call-cached"""
+    span = tracing.current_span()
+    # The task or step function can be called outside of a `call_task` or
+    # `call_step`, in which case the current span belongs to its caller.
+    if span is not None and span.name == f"{kind.value} {kind_id}":
+        span.set_attribute("callcache.hit", hit)
+
+
+def _get_task_callcache(ctx: WorkflowContext) -> CallCache:
+    return ctx.run_config.call_cache.tasks
+
+
+def _get_step_callcache(ctx: WorkflowContext) -> CallCache:
+    return ctx.run_config.call_cache.steps
+
+
+def offload_to_executor(
+    step_fn: Callable[..., Any], kind: ExecutorKind
+) -> AsyncFunc[..., Any]:
+    """Make a function that runs a step's body on a worker thread or process
+
+    `step_fn` is the decorated step function, and we find its undecorated body
+    through `__wrapped__`. For the process executor, `step_fn` must be
+    importable by its module and name, so that we can send it to the worker
+    process, and the step gets a `StepProcessContext` instead of the
+    `WorkflowContext`.
+    """
+
+    async def offloaded(*args: Any, **kwargs: Any) -> Any:
+        ctx, ctx_pos = _pull_ctx_arg(*args)
+        call_args = list(args)
+        if kind == "process":
+            call_args[ctx_pos] = StepProcessContext.from_context(ctx)
+        pool = ctx.run_config.executors.get(kind)
+        return await asyncio.get_running_loop().run_in_executor(
+            pool, functools.partial(_run_step_body, step_fn, call_args, kwargs)
+        )
+
+    return offloaded
+
+
+def _run_step_body(
+    step_fn: Callable[..., Any], args: Sequence[Any], kwargs: Dict[str, Any]
+) -> Any:
+    """Run a step's undecorated body in its own event loop"""
+    body = inspect.unwrap(step_fn)
+    return asyncio.run(body(*args, **kwargs))
+
+
+async def gather_bounded(
+    calls: Sequence[Callable[[], Coroutine[Any, Any, Ret]]],
+    max_concurrency: Optional[int] = None,
+) -> List[Ret]:
+    """Run many calls concurrently, at most `max_concurrency` at a time
+
+    Returns the results in the same order as the calls. We start calls in
+    order, and we don't start a call until a slot is free, so the call's task or
+    step node is only added to the workflow run when it starts. If any call
+    fails, we cancel the remaining calls and raise their exceptions together in
+    an `ExceptionGroup`, like `asyncio.TaskGroup` does.
+    """
+    if max_concurrency is not None and max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+    sem = asyncio.Semaphore(max_concurrency or len(calls) or 1)
+
+    async def run_call(call: Callable[[], Coroutine[Any, Any, Ret]]) -> Ret:
+        async with sem:
+            return await call()
+
+    async with asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(run_call(call)) for call in calls]
+    return [task.result() for task in tasks]
+
+
+def fan_out_call_args(
+    args: Sequence[Sequence[Any]],
+    kwargs: Optional[Sequence[Dict[str, Any]]],
+) -> List[Tuple[List[Any], Dict[str, Any]]]:
+    """Pair up the per-call positional and keyword arguments of a fan-out"""
+    if kwargs is None:
+        return [(list(call_args), {}) for call_args in args]
+    if len(kwargs) != len(args):
+        raise ValueError(
+            f"Got {len(args)} args but {len(kwargs)} kwargs; they must match"
+        )
+    return [
+        (list(call_args), dict(call_kwargs))
+        for call_args, call_kwargs in zip(args, kwargs)
+    ]
+
+
+def convert_json_args(
+    workflow_entry: AsyncFunc[..., Any],
+    args: Sequence[Any],
+    kwargs: Dict[str, Any],
+) -> Tuple[List[Any], Dict[str, Any]]:
+    """Load JSON arguments into the types of the entrypoint's parameters"""
+    hints = get_type_hints(workflow_entry)
+    # skip the `self` and `ctx` parameters
+    params = list(inspect.signature(workflow_entry).parameters.values())[2:]
+    converted_args = []
+    for i, arg in enumerate(args):
+        hint = hints.get(params[i].name) if i < len(params) else None
+        converted_args.append(arg if hint is None else compile_converter(hint)(arg))
+    converted_kwargs = {}
+    for name, arg in kwargs.items():
+        hint = hints.get(name)
+        converted_kwargs[name] = arg if hint is None else compile_converter(hint)(arg)
+    return converted_args, converted_kwargs
+
+
+def code_version(func: Callable[..., Any]) -> str:
+    """A digest identifying the version of a function's code
+
+    We hash the function's source code. If the source is not available (for
+    example, the function was defined in an interactive session), we fall back
+    to hashing its compiled bytecode and constants.
+    """
+    try:
+        code = inspect.getsource(func).encode("utf-8")
+    except (OSError, TypeError) as err:
+        func_code = getattr(func, "__code__", None)
+        if func_code is None:
+            raise DefinitionError(
+                f"Cannot determine the code version of {func}. Pass in a version."
+            ) from err
+        code = func_code.co_code + repr(func_code.co_consts).encode("utf-8")
+    return hashlib.sha256(code).hexdigest()[:16]
+
+
 def _pull_ctx_arg(*args: Any) -> Tuple[WorkflowContext, int]:
     """Return the WorkflowContext from function params, along with its position.
 
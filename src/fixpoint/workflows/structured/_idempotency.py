@@ -0,0 +1,137 @@
+"""Structured workflows: deduplicating identical workflow runs
+
+An idempotent workflow run is keyed on its workflow ID, a digest of its
+arguments, and an optional version. Spawning the same workflow with the same
+arguments while a run is in flight attaches to that run, and spawning it after
+the run completed returns the run's stored result, so the work is not done
+twice.
+
+We only know about the runs in flight in this process, so two processes that
+spawn the same run at the same time both run the workflow.
+"""
+
+__all__ = ["IdempotencyKey", "SharedRun"]
+
+import asyncio
+from dataclasses import dataclass
+import hashlib
+from typing import (
+    Any,
+    Coroutine,
+    Dict,
+    Generic,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Type,
+)
+
+from ._callcache import CacheResult, serialize_args
+from ._helpers import Ret
+from ._run_config import RunConfig
+from ._workflow_run_handle import WorkflowRunHandleImpl
+
+
+@dataclass(frozen=True)
+class IdempotencyKey:
+    """Identifies the idempotent runs of a workflow with some arguments"""
+
+    workflow_id: str
+    version: str
+    serialized_args: str
+    # the run ID that every run with this key gets
+    run_id: str
+
+    @classmethod
+    def of(
+        cls,
+        workflow_id: str,
+        version: Optional[str],
+        args: Optional[Sequence[Any]],
+        kwargs: Optional[Dict[str, Any]],
+    ) -> "IdempotencyKey":
+        """Make the key for running a workflow with these arguments"""
+        serialized = serialize_args(*(args or []), **(kwargs or {}))
+        version = version or ""
+        digest = hashlib.sha256(
+            "\0".join([workflow_id, version, serialized]).encode()
+        ).hexdigest()
+        return cls(workflow_id, version, serialized, f"wfrun-idem-{digest[:32]}")
+
+    @property
+    def _cache_run_id(self) -> str:
+        # we store the results of idempotent runs apart from any run's task
+        # and step results
+        return f"__idempotent__/{self.workflow_id}/{self.version}"
+
+    def stored_result(
+        self, run_config: RunConfig, type_hint: Optional[Type[Any]] = None
+    ) -> CacheResult[Any]:
+        """The result of a completed run with this key, if there is one"""
+        return run_config.call_cache.tasks.check_cache(
+            run_id=self._cache_run_id,
+            kind_id=self.workflow_id,
+            serialized_args=self.serialized_args,
+            type_hint=type_hint,
+        )
+
+    def store_result(self, run_config: RunConfig, result: Any) -> None:
+        """Store the result of a completed run with this key"""
+        run_config.call_cache.tasks.store_result(
+            run_id=self._cache_run_id,
+            kind_id=self.workflow_id,
+            serialized_args=self.serialized_args,
+            res=result,
+        )
+
+
+class SharedRun(Generic[Ret]):
+    """A workflow run that several handles wait on
+
+    The run starts when the first handle waits for it. Cancelling one waiting
+    handle does not cancel the run for the others.
+
+    The shared run adds itself to `in_flight`, keyed on its run ID, and removes
+    itself when the run finishes. `in_flight` should hold its values weakly:
+    the handles keep the shared run alive until the run starts, and the run's
+    task keeps it alive after that. So if every handle is dropped before the
+    run starts, the shared run leaves `in_flight` with them.
+    """
+
+    _handle: WorkflowRunHandleImpl[Ret]
+    _coro: Coroutine[Any, Any, Ret]
+    _task: "Optional[asyncio.Task[Ret]]"
+    _in_flight: MutableMapping[str, "SharedRun[Any]"]
+
+    def __init__(
+        self,
+        handle: WorkflowRunHandleImpl[Ret],
+        coro: Coroutine[Any, Any, Ret],
+        in_flight: MutableMapping[str, "SharedRun[Any]"],
+    ) -> None:
+        self._handle = handle
+        self._coro = coro
+        self._task = None
+        self._in_flight = in_flight
+        in_flight[handle.workflow_run_id()] = self
+
+    def __del__(self) -> None:
+        if self._task is None:
+            # no handle ever waited, so the run never started
+            self._coro.close()
+
+    def attach(self) -> WorkflowRunHandleImpl[Ret]:
+        """A new handle that waits on the run"""
+        return self._handle.attach(self.join())
+
+    async def join(self) -> Ret:
+        """Start the run if it has not started, and wait for its result"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._coro)
+            self._task.add_done_callback(self._forget)
+        return await asyncio.shield(self._task)
+
+    def _forget(self, _task: "asyncio.Task[Ret]") -> None:
+        run_id = self._handle.workflow_run_id()
+        if self._in_flight.get(run_id) is self:
+            del self._in_flight[run_id]
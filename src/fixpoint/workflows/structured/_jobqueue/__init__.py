@@ -0,0 +1,22 @@
+"""Durable job queues for running structured workflows on many workers
+
+Instead of running a workflow in the process that spawns it, you can enqueue
+the workflow run as a job, and have one or more `WorkflowWorker`s claim and run
+it. Workers lease the jobs they run, so that if a worker crashes, another
+worker retries the run.
+"""
+
+__all__ = [
+    "enqueue_workflow",
+    "Job",
+    "JobQueue",
+    "JobStatus",
+    "PostgresJobQueue",
+    "SQLiteJobQueue",
+    "WorkflowWorker",
+]
+
+from ._shared import Job, JobQueue, JobStatus
+from ._sqlite import SQLiteJobQueue
+from ._postgres import PostgresJobQueue
+from ._worker import enqueue_workflow, WorkflowWorker
@@ -0,0 +1,282 @@
+"""A workflow job queue backed by Postgres"""
+
+__all__ = ["PostgresJobQueue"]
+
+import json
+from typing import Any, Dict, Optional, Sequence
+
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import ConnectionPool
+
+from fixpoint._storage import definitions as storage_definitions
+from .._callcache import default_json_dumps
+from ._shared import Job, JobQueue, JobStatus, encode_job_result
+
+
+# We take all timestamps from the database's clock, so that leases work even
+# if the workers' clocks disagree.
+_NOW = "EXTRACT(EPOCH FROM clock_timestamp())::double precision"
+
+_JOB_COLUMNS = """
+    id,
+    workflow_id,
+    run_id,
+    args,
+    kwargs,
+    priority,
+    status,
+    attempts,
+    max_attempts,
+    lease_owner,
+    lease_expires_at,
+    result,
+    error,
+    created_at,
+    updated_at
+"""
+
+
+class PostgresJobQueue(JobQueue):
+    """A workflow job queue backed by a Postgres database
+
+    Workers on any number of hosts can share the queue. Workers claim jobs with
+    `SELECT ... FOR UPDATE SKIP LOCKED`, so they never claim the same job and
+    never wait on each other's claims.
+    """
+
+    _pool: ConnectionPool
+
+    def __init__(self, pool: ConnectionPool, create_table: bool = True) -> None:
+        self._pool = pool
+        if create_table:
+            with self._pool.connection() as conn:
+                conn.execute(storage_definitions.WORKFLOW_JOBS_POSTGRES_TABLE)
+
+    def enqueue(self, job: Job) -> Job:
+        params = _job_to_row(job)
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                f"""
+                INSERT INTO public.workflow_jobs ({_JOB_COLUMNS})
+                VALUES (
+                    %(id)s,
+                    %(workflow_id)s,
+                    %(run_id)s,
+                    %(args)s,
+                    %(kwargs)s,
+                    %(priority)s,
+                    %(status)s,
+                    %(attempts)s,
+                    %(max_attempts)s,
+                    %(lease_owner)s,
+                    %(lease_expires_at)s,
+                    %(result)s,
+                    %(error)s,
+                    {_NOW},
+                    {_NOW}
+                )
+                RETURNING created_at
+                """,
+                params,
+            ).fetchone()
+        if row is not None:
+            job.created_at = job.updated_at = row[0]
+        return job
+
+    def claim(
+        self, worker_id: str, workflow_ids: Sequence[str], lease_s: float
+    ) -> Optional[Job]:
+        if not workflow_ids:
+            return None
+        with self._pool.connection() as conn, conn.transaction():
+            conn.execute(
+                f"""
+                UPDATE public.workflow_jobs SET
+                    status = %(failed)s,
+                    error = COALESCE(error, 'worker lease expired'),
+                    lease_owner = NULL,
+                    lease_expires_at = NULL,
+                    updated_at = {_NOW}
+                WHERE id IN (
+                    SELECT id FROM public.workflow_jobs
+                    WHERE
+                        status = %(running)s
+                        AND lease_expires_at < {_NOW}
+                        AND attempts >= max_attempts
+                    FOR UPDATE SKIP LOCKED
+                )
+                """,
+                {
+                    "failed": JobStatus.FAILED.value,
+                    "running": JobStatus.RUNNING.value,
+                },
+            )
+            cursor = conn.cursor(row_factory=dict_row)
+            row = cursor.execute(
+                f"""
+                UPDATE public.workflow_jobs SET
+                    status = %(running)s,
+                    attempts = attempts + 1,
+                    lease_owner = %(worker_id)s,
+                    lease_expires_at = {_NOW} + %(lease_s)s,
+                    updated_at = {_NOW}
+                WHERE id = (
+                    SELECT id FROM public.workflow_jobs
+                    WHERE
+                        workflow_id = ANY(%(workflow_ids)s)
+                        AND (
+                            status = %(queued)s
+                            OR (
+                                status = %(running)s
+                                AND lease_expires_at < {_NOW}
+                            )
+                        )
+                    ORDER BY priority DESC, created_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {_JOB_COLUMNS}
+                """,
+                {
+                    "queued": JobStatus.QUEUED.value,
+                    "running": JobStatus.RUNNING.value,
+                    "worker_id": worker_id,
+                    "lease_s": lease_s,
+                    "workflow_ids": list(workflow_ids),
+                },
+            ).fetchone()
+        if row is None:
+            return None
+        return _row_to_job(row)
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_s: float) -> bool:
+        return self._update_leased(
+            job_id,
+            worker_id,
+            f"lease_expires_at = {_NOW} + %(lease_s)s",
+            {"lease_s": lease_s},
+        )
+
+    def complete(self, job_id: str, worker_id: str, result: Any) -> bool:
+        return self._update_leased(
+            job_id,
+            worker_id,
+            """
+            status = %(new_status)s,
+            result = %(result)s::jsonb,
+            error = NULL,
+            lease_owner = NULL,
+            lease_expires_at = NULL
+            """,
+            {
+                "new_status": JobStatus.COMPLETED.value,
+                "result": encode_job_result(result),
+            },
+        )
+
+    def fail(
+        self, job_id: str, worker_id: str, error: str, *, retry: bool = True
+    ) -> bool:
+        return self._update_leased(
+            job_id,
+            worker_id,
+            """
+            status = CASE
+                WHEN %(retry)s AND attempts < max_attempts THEN %(queued)s
+                ELSE %(failed)s
+            END,
+            error = %(error)s,
+            lease_owner = NULL,
+            lease_expires_at = NULL
+            """,
+            {
+                "queued": JobStatus.QUEUED.value,
+                "failed": JobStatus.FAILED.value,
+                "error": error,
+                "retry": retry,
+            },
+        )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._pool.connection() as conn:
+            cursor = conn.cursor(row_factory=dict_row)
+            row = cursor.execute(
+                f"SELECT {_JOB_COLUMNS} FROM public.workflow_jobs WHERE id = %(id)s",
+                {"id": job_id},
+            ).fetchone()
+        if row is None:
+            return None
+        return _row_to_job(row)
+
+    def _update_leased(
+        self, job_id: str, worker_id: str, set_clause: str, params: Dict[str, Any]
+    ) -> bool:
+        with self._pool.connection() as conn:
+            cursor = conn.execute(
+                f"""
+                UPDATE public.workflow_jobs SET
+                    {set_clause},
+                    updated_at = {_NOW}
+                WHERE
+                    id = %(id)s
+                    AND lease_owner = %(worker_id)s
+                    AND status = %(status)s
+                """,
+                {
+                    **params,
+                    "id": job_id,
+                    "worker_id": worker_id,
+                    "status": JobStatus.RUNNING.value,
+                },
+            )
+            return cursor.rowcount == 1
+
+
+def _job_to_row(job: Job) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "workflow_id": job.workflow_id,
+        "run_id": job.run_id,
+        "args": _jsonb(job.args),
+        "kwargs": _jsonb(job.kwargs),
+        "priority": job.priority,
+        "status": job.status.value,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "lease_owner": job.lease_owner,
+        "lease_expires_at": job.lease_expires_at,
+        "result": None if job.result is None else _jsonb(job.result),
+        "error": job.error,
+    }
+
+
+def _row_to_job(row: Dict[str, Any]) -> Job:
+    return Job(
+        id=row["id"],
+        workflow_id=row["workflow_id"],
+        run_id=row["run_id"],
+        args=_load_json(row["args"]),
+        kwargs=_load_json(row["kwargs"]),
+        priority=row["priority"],
+        status=JobStatus(row["status"]),
+        attempts=row["attempts"],
+        max_attempts=row["max_attempts"],
+        lease_owner=row["lease_owner"],
+        lease_expires_at=row["lease_expires_at"],
+        result=_load_json(row["result"]),
+        error=row["error"],
+        created_at=row["created_at"],
+        updated_at=row["updated_at"],
+    )
+
+
+def _jsonb(value: Any) -> Jsonb:
+    return Jsonb(value, dumps=default_json_dumps)
+
+
+def _load_json(value: Any) -> Any:
+    # psycopg already decodes jsonb columns
+    if isinstance(value, (str, bytes)):
+        return json.loads(value)
+    return value
@@ -0,0 +1,123 @@
+"""Shared definitions for durable workflow job queues"""
+
+__all__ = ["Job", "JobQueue", "JobStatus", "encode_job_result", "new_job_id"]
+
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, List, Optional, Protocol, Sequence
+
+from fixpoint._utils.ids import make_resource_uuid
+from fixpoint.logging import logger as root_logger
+from ..errors import JobResultError
+from .._callcache import default_json_dumps
+
+
+class JobStatus(Enum):
+    """The status of a workflow job"""
+
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+
+
+@dataclass
+class Job:
+    """A queued request to run a workflow
+
+    A job runs the workflow with the ID `workflow_id` under the workflow run ID
+    `run_id`. If a worker crashes while running the job, another worker retries
+    the same workflow run, which picks up the already completed tasks and steps
+    from the call cache.
+    """
+
+    id: str
+    workflow_id: str
+    run_id: str
+    args: List[Any] = field(default_factory=list)
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    priority: int = 0
+    status: JobStatus = JobStatus.QUEUED
+    attempts: int = 0
+    max_attempts: int = 3
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+
+class JobQueue(Protocol):
+    """A durable queue of workflow jobs, shared by many workers
+
+    Workers claim jobs with a lease. While a worker runs a job, it must renew
+    its lease with `heartbeat(...)`. If the lease expires, for example because
+    the worker crashed, other workers can claim the job again.
+
+    All methods are blocking, so call them from a thread if you are in an
+    async event loop.
+    """
+
+    def enqueue(self, job: Job) -> Job:
+        """Add a job to the queue"""
+
+    def claim(
+        self, worker_id: str, workflow_ids: Sequence[str], lease_s: float
+    ) -> Optional[Job]:
+        """Claim the next job to run, or return None if there are no jobs
+
+        Only claims jobs for the given workflow IDs. Claims queued jobs and
+        running jobs whose lease expired, highest priority first, then oldest
+        first.
+        """
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_s: float) -> bool:
+        """Renew a worker's lease on a job
+
+        Returns False if the worker no longer holds the lease, in which case it
+        should stop running the job.
+        """
+
+    def complete(self, job_id: str, worker_id: str, result: Any) -> bool:
+        """Mark a job as completed with its result
+
+        Returns False if the worker no longer holds the lease. Raises a
+        `JobResultError`, without changing the job, if the result can't be
+        stored.
+        """
+
+    def fail(
+        self, job_id: str, worker_id: str, error: str, *, retry: bool = True
+    ) -> bool:
+        """Record that a job attempt failed
+
+        If `retry` is true and the job has attempts left, it is queued again.
+        Otherwise it is marked as failed. Returns False if the worker no longer
+        holds the lease.
+        """
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Get a job by ID"""
+
+
+def encode_job_result(result: Any) -> str:
+    """Encode the result of a job as JSON
+
+    Raises a `JobResultError` if the result can't be encoded.
+    """
+    try:
+        return default_json_dumps(result)
+    except (TypeError, ValueError) as e:
+        raise JobResultError(
+            f"Can't store the workflow result of type {type(result).__name__}"
+            f" as JSON: {e}"
+        ) from e
+
+
+def new_job_id() -> str:
+    """Create a new workflow job ID"""
+    return make_resource_uuid("wjob")
+
+
+logger = root_logger.getChild("workflows.structured._jobqueue")
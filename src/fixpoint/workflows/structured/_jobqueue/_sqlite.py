@@ -0,0 +1,303 @@
+"""A workflow job queue backed by SQLite"""
+
+__all__ = ["SQLiteJobQueue"]
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from fixpoint._storage import definitions as storage_definitions
+from .._callcache import default_json_dumps
+from ._shared import Job, JobQueue, JobStatus, encode_job_result
+
+
+_JOB_COLUMNS = """
+    id,
+    workflow_id,
+    run_id,
+    args,
+    kwargs,
+    priority,
+    status,
+    attempts,
+    max_attempts,
+    lease_owner,
+    lease_expires_at,
+    result,
+    error,
+    created_at,
+    updated_at
+"""
+
+
+class SQLiteJobQueue(JobQueue):
+    """A workflow job queue backed by an SQLite database
+
+    Many worker processes on the same host can share the queue by opening the
+    same database file. Claiming a job takes a write lock on the database, so
+    that two workers never claim the same job. To run workers on many hosts,
+    use a `PostgresJobQueue`.
+    """
+
+    _conn: sqlite3.Connection
+    _lock: threading.Lock
+    _timer: Callable[[], float]
+
+    def __init__(self, dbpath: str, timer: Callable[[], float] = time.time) -> None:
+        # We manage transactions ourselves, so that claiming a job can take
+        # the database's write lock before it reads which jobs are available.
+        self._conn = sqlite3.connect(
+            dbpath, isolation_level=None, check_same_thread=False, timeout=30.0
+        )
+        self._lock = threading.Lock()
+        self._timer = timer
+        self._conn.executescript(storage_definitions.WORKFLOW_JOBS_SQLITE_TABLE)
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self._conn.close()
+
+    def enqueue(self, job: Job) -> Job:
+        now = self._timer()
+        job.created_at = job.updated_at = now
+        with self._lock:
+            self._conn.execute(
+                f"""
+                INSERT INTO workflow_jobs ({_JOB_COLUMNS})
+                VALUES (
+                    :id,
+                    :workflow_id,
+                    :run_id,
+                    :args,
+                    :kwargs,
+                    :priority,
+                    :status,
+                    :attempts,
+                    :max_attempts,
+                    :lease_owner,
+                    :lease_expires_at,
+                    :result,
+                    :error,
+                    :created_at,
+                    :updated_at
+                )
+                """,
+                _job_to_row(job),
+            )
+        return job
+
+    def claim(
+        self, worker_id: str, workflow_ids: Sequence[str], lease_s: float
+    ) -> Optional[Job]:
+        if not workflow_ids:
+            return None
+        workflow_params = ", ".join("?" for _ in workflow_ids)
+        with self._lock, self._transaction():
+            now = self._timer()
+            _fail_exhausted_leases(self._conn, now)
+            row = self._conn.execute(
+                f"""
+                SELECT id FROM workflow_jobs
+                WHERE
+                    workflow_id IN ({workflow_params})
+                    AND (
+                        status = ?
+                        OR (status = ? AND lease_expires_at < ?)
+                    )
+                ORDER BY priority DESC, created_at
+                LIMIT 1
+                """,
+                [
+                    *workflow_ids,
+                    JobStatus.QUEUED.value,
+                    JobStatus.RUNNING.value,
+                    now,
+                ],
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                """
+                UPDATE workflow_jobs SET
+                    status = :status,
+                    attempts = attempts + 1,
+                    lease_owner = :worker_id,
+                    lease_expires_at = :lease_expires_at,
+                    updated_at = :now
+                WHERE id = :id
+                """,
+                {
+                    "id": row[0],
+                    "status": JobStatus.RUNNING.value,
+                    "worker_id": worker_id,
+                    "lease_expires_at": now + lease_s,
+                    "now": now,
+                },
+            )
+            return self._get(row[0])
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_s: float) -> bool:
+        now = self._timer()
+        return self._update_leased(
+            job_id,
+            worker_id,
+            "lease_expires_at = :lease_expires_at",
+            {"lease_expires_at": now + lease_s},
+        )
+
+    def complete(self, job_id: str, worker_id: str, result: Any) -> bool:
+        return self._update_leased(
+            job_id,
+            worker_id,
+            """
+            status = :new_status,
+            result = :result,
+            error = NULL,
+            lease_owner = NULL,
+            lease_expires_at = NULL
+            """,
+            {
+                "new_status": JobStatus.COMPLETED.value,
+                "result": encode_job_result(result),
+            },
+        )
+
+    def fail(
+        self, job_id: str, worker_id: str, error: str, *, retry: bool = True
+    ) -> bool:
+        return self._update_leased(
+            job_id,
+            worker_id,
+            """
+            status = CASE
+                WHEN :retry AND attempts < max_attempts THEN :queued
+                ELSE :failed
+            END,
+            error = :error,
+            lease_owner = NULL,
+            lease_expires_at = NULL
+            """,
+            {
+                "queued": JobStatus.QUEUED.value,
+                "failed": JobStatus.FAILED.value,
+                "error": error,
+                "retry": retry,
+            },
+        )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._get(job_id)
+
+    def _get(self, job_id: str) -> Optional[Job]:
+        row = self._conn.execute(
+            f"SELECT {_JOB_COLUMNS} FROM workflow_jobs WHERE id = ?", [job_id]
+        ).fetchone()
+        if row is None:
+            return None
+        return _row_to_job(row)
+
+    def _update_leased(
+        self, job_id: str, worker_id: str, set_clause: str, params: Dict[str, Any]
+    ) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                f"""
+                UPDATE workflow_jobs SET
+                    {set_clause},
+                    updated_at = :now
+                WHERE id = :id AND lease_owner = :worker_id AND status = :status
+                """,
+                {
+                    **params,
+                    "id": job_id,
+                    "worker_id": worker_id,
+                    "status": JobStatus.RUNNING.value,
+                    "now": self._timer(),
+                },
+            )
+            return cursor.rowcount == 1
+
+    def _transaction(self) -> "_ImmediateTransaction":
+        return _ImmediateTransaction(self._conn)
+
+
+class _ImmediateTransaction:
+    """A transaction that takes the database's write lock when it begins"""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+
+    def __enter__(self) -> None:
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc_type is None:
+            self._conn.execute("COMMIT")
+        else:
+            self._conn.execute("ROLLBACK")
+
+
+def _fail_exhausted_leases(conn: sqlite3.Connection, now: float) -> None:
+    """Fail running jobs whose lease expired and that have no attempts left"""
+    conn.execute(
+        """
+        UPDATE workflow_jobs SET
+            status = :failed,
+            error = COALESCE(error, 'worker lease expired'),
+            lease_owner = NULL,
+            lease_expires_at = NULL,
+            updated_at = :now
+        WHERE
+            status = :running
+            AND lease_expires_at < :now
+            AND attempts >= max_attempts
+        """,
+        {
+            "failed": JobStatus.FAILED.value,
+            "running": JobStatus.RUNNING.value,
+            "now": now,
+        },
+    )
+
+
+def _job_to_row(job: Job) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "workflow_id": job.workflow_id,
+        "run_id": job.run_id,
+        "args": default_json_dumps(job.args),
+        "kwargs": default_json_dumps(job.kwargs),
+        "priority": job.priority,
+        "status": job.status.value,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "lease_owner": job.lease_owner,
+        "lease_expires_at": job.lease_expires_at,
+        "result": None if job.result is None else default_json_dumps(job.result),
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+def _row_to_job(row: Sequence[Any]) -> Job:
+    return Job(
+        id=row[0],
+        workflow_id=row[1],
+        run_id=row[2],
+        args=json.loads(row[3]),
+        kwargs=json.loads(row[4]),
+        priority=row[5],
+        status=JobStatus(row[6]),
+        attempts=row[7],
+        max_attempts=row[8],
+        lease_owner=row[9],
+        lease_expires_at=row[10],
+        result=None if row[11] is None else json.loads(row[11]),
+        error=row[12],
+        created_at=row[13],
+        updated_at=row[14],
+    )
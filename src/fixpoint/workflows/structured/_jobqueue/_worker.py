@@ -0,0 +1,275 @@
+"""Workers that run workflow jobs from a durable job queue"""
+
+__all__ = ["enqueue_workflow", "WorkflowWorker"]
+
+import asyncio
+import socket
+import os
+from typing import Any, Dict, Optional, Sequence, Set
+
+from fixpoint._utils.ids import make_resource_uuid
+from ..errors import DefinitionError, JobResultError
+from .._helpers import AgentsFactory, AsyncFunc, convert_json_args
+from .._run_config import RunConfig
+from .._workflow import (
+    get_workflow_definition_meta_fixp,
+    get_workflow_entrypoint_fixp,
+    respawn_workflow,
+)
+from ...imperative.workflow import new_workflow_run_id
+from ._shared import Job, JobQueue, new_job_id, logger
+
+
+def enqueue_workflow(
+    queue: JobQueue,
+    workflow_entry: AsyncFunc[..., Any],
+    *,
+    args: Optional[Sequence[Any]] = None,
+    kwargs: Optional[Dict[str, Any]] = None,
+    priority: int = 0,
+    max_attempts: int = 3,
+    run_id: Optional[str] = None,
+) -> Job:
+    """Queue a workflow run for a `WorkflowWorker` to run
+
+    The `args` and `kwargs` must be JSON-serializable, or be dataclasses or
+    Pydantic models. Workers load them back into the types of the workflow
+    entrypoint's parameters.
+
+    If a worker crashes or fails while running the workflow, another worker
+    retries the run, up to `max_attempts` times in total.
+    """
+    if max_attempts < 1:
+        raise ValueError("max_attempts must be at least 1")
+    job = Job(
+        id=new_job_id(),
+        workflow_id=_workflow_id_of(workflow_entry),
+        run_id=run_id or new_workflow_run_id(),
+        args=list(args or []),
+        kwargs=dict(kwargs or {}),
+        priority=priority,
+        max_attempts=max_attempts,
+    )
+    return queue.enqueue(job)
+
+
+class WorkflowWorker:
+    """Runs workflow jobs that it claims from a durable job queue
+
+    Run many workers, in many processes or on many hosts, against the same
+    queue to scale out. Each worker runs at most `max_concurrency` jobs at a
+    time, and only runs jobs of the workflows you give it.
+
+    A worker holds a lease on each job it runs, and renews the lease every
+    `heartbeat_interval_s` seconds. If a worker crashes, its lease expires
+    after `lease_s` seconds and another worker retries the workflow run. For
+    the retry to skip the tasks and steps that already finished, use a call
+    cache that all workers share, such as `RunConfig.with_disk(...)` on a disk
+    that all workers can reach.
+
+    ```
+    queue = structured.SQLiteJobQueue("jobs.db")
+    structured.enqueue_workflow(queue, MyWorkflow.main, args=[{"name": "foo"}])
+
+    worker = structured.WorkflowWorker(
+        queue,
+        [MyWorkflow.main],
+        run_config=run_config,
+        agents_factory=lambda: [new_agent()],
+    )
+    await worker.run()
+    ```
+    """
+
+    _queue: JobQueue
+    _workflows: Dict[str, AsyncFunc[..., Any]]
+    _run_config: RunConfig
+    _agents_factory: AgentsFactory
+    _worker_id: str
+    _lease_s: float
+    _heartbeat_interval_s: float
+    _poll_interval_s: float
+    _max_concurrency: int
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        workflows: Sequence[AsyncFunc[..., Any]],
+        *,
+        run_config: RunConfig,
+        agents_factory: Optional[AgentsFactory] = None,
+        worker_id: Optional[str] = None,
+        lease_s: float = 60.0,
+        heartbeat_interval_s: Optional[float] = None,
+        poll_interval_s: float = 1.0,
+        max_concurrency: int = 1,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        if lease_s <= 0:
+            raise ValueError("lease_s must be positive")
+        self._queue = queue
+        self._workflows = {_workflow_id_of(entry): entry for entry in workflows}
+        self._run_config = run_config
+        self._agents_factory = agents_factory or list
+        self._worker_id = worker_id or _default_worker_id()
+        self._lease_s = lease_s
+        self._heartbeat_interval_s = (
+            heartbeat_interval_s if heartbeat_interval_s is not None else lease_s / 3
+        )
+        self._poll_interval_s = poll_interval_s
+        self._max_concurrency = max_concurrency
+
+    @property
+    def worker_id(self) -> str:
+        """The ID the worker claims jobs under"""
+        return self._worker_id
+
+    async def run_once(self) -> Optional[Job]:
+        """Claim and run one job
+
+        Returns the claimed job, or None if there were no jobs to run.
+        """
+        job = await self._claim()
+        if job is None:
+            return None
+        await self._run_job(job)
+        return job
+
+    async def run(self, stop: Optional[asyncio.Event] = None) -> None:
+        """Run jobs until the `stop` event is set
+
+        When stopping, the worker waits for the jobs it is running to finish.
+        """
+        stop = stop or asyncio.Event()
+        slots = asyncio.Semaphore(self._max_concurrency)
+        running: Set["asyncio.Task[None]"] = set()
+        try:
+            while not stop.is_set():
+                await slots.acquire()
+                job = await self._claim()
+                if job is None:
+                    slots.release()
+                    await _wait_for(stop, self._poll_interval_s)
+                    continue
+                task = asyncio.create_task(self._run_job(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    async def _claim(self) -> Optional[Job]:
+        return await asyncio.to_thread(
+            self._queue.claim,
+            self._worker_id,
+            list(self._workflows.keys()),
+            self._lease_s,
+        )
+
+    async def _run_job(self, job: Job) -> None:
+        logger.info(
+            f"Worker {self._worker_id} running job {job.id}"
+            f" (attempt {job.attempts} of {job.max_attempts})"
+        )
+        lease_lost = asyncio.Event()
+        run_task = asyncio.ensure_future(self._run_workflow(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job, run_task, lease_lost))
+        try:
+            result = await run_task
+        except asyncio.CancelledError:
+            if not lease_lost.is_set():
+                # The worker is shutting down. Once the lease expires, another
+                # worker picks up the job.
+                raise
+            logger.warning(f"Worker {self._worker_id} lost its lease on {job.id}")
+            return
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.exception(f"Job {job.id} failed")
+            await asyncio.to_thread(
+                self._queue.fail, job.id, self._worker_id, f"{type(e).__name__}: {e}"
+            )
+        else:
+            await self._complete(job, result)
+        finally:
+            heartbeat.cancel()
+
+    async def _complete(self, job: Job, result: Any) -> None:
+        try:
+            await asyncio.to_thread(
+                self._queue.complete, job.id, self._worker_id, result
+            )
+        except JobResultError as e:
+            # Retrying would return the same result from the call cache, so we
+            # fail the job right away.
+            logger.error(f"Job {job.id} failed: {e}")
+            await asyncio.to_thread(
+                self._queue.fail,
+                job.id,
+                self._worker_id,
+                f"{type(e).__name__}: {e}",
+                retry=False,
+            )
+
+    async def _run_workflow(self, job: Job) -> Any:
+        entry = self._workflows[job.workflow_id]
+        args, kwargs = convert_json_args(entry, job.args, job.kwargs)
+        # Respawning the run under its own run ID means that a retry picks up
+        # the results of tasks and steps from earlier attempts.
+        handle = respawn_workflow(
+            entry,
+            job.run_id,
+            run_config=self._run_config,
+            agents=self._agents_factory(),
+            args=args,
+            kwargs=kwargs,
+            start_if_unknown=True,
+        )
+        return await handle.result()
+
+    async def _heartbeat(
+        self,
+        job: Job,
+        run_task: "asyncio.Future[Any]",
+        lease_lost: asyncio.Event,
+    ) -> None:
+        while True:
+            await asyncio.sleep(self._heartbeat_interval_s)
+            try:
+                renewed = await asyncio.to_thread(
+                    self._queue.heartbeat, job.id, self._worker_id, self._lease_s
+                )
+            except Exception:  # pylint: disable=broad-exception-caught
+                # keep running, and try again at the next heartbeat
+                logger.exception(f"Failed to renew the lease on job {job.id}")
+                continue
+            if not renewed:
+                lease_lost.set()
+                run_task.cancel()
+                return
+
+
+def _workflow_id_of(workflow_entry: AsyncFunc[..., Any]) -> str:
+    entryfixp = get_workflow_entrypoint_fixp(workflow_entry)
+    if not entryfixp or not entryfixp.workflow_cls:
+        raise DefinitionError(
+            f'Workflow "{workflow_entry.__name__}" is not a valid workflow entrypoint'
+        )
+    fixpmeta = get_workflow_definition_meta_fixp(entryfixp.workflow_cls)
+    if not fixpmeta:
+        raise DefinitionError(
+            f'Workflow "{entryfixp.workflow_cls.__name__}" is not a valid workflow definition'
+        )
+    return fixpmeta.workflow.id
+
+
+async def _wait_for(event: asyncio.Event, timeout_s: float) -> None:
+    try:
+        await asyncio.wait_for(event.wait(), timeout_s)
+    except asyncio.TimeoutError:
+        pass
+
+
+def _default_worker_id() -> str:
+    return f"{socket.gethostname()}/{os.getpid()}/{make_resource_uuid('wkr')}"
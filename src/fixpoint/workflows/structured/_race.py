@@ -0,0 +1,95 @@
+"""Structured workflows: racing alternative branches
+
+`race` runs alternative ways of computing the same thing concurrently, such as
+the same extraction with two prompts or two models, and returns the first
+result that is good enough. The other branches are cancelled, so their task and
+step nodes are marked `CANCELLED`, and nothing a losing branch computed goes
+into the call cache. If the workflow run is retried, the winner's cached
+results let it win again right away.
+"""
+
+__all__ = ["race"]
+
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from ._context import WorkflowContext
+from .errors import NoAcceptedResultError
+from ._helpers import Ret, defer_stores, store_or_defer
+
+
+async def race(
+    ctx: WorkflowContext,
+    branches: Sequence[Awaitable[Ret]],
+    *,
+    accept: Optional[Callable[[Ret], bool]] = None,
+) -> Ret:
+    """Run branches concurrently and return the first accepted result
+
+    Each branch is an awaitable, usually a `call_step(...)` or `call_task(...)`
+    call that you have not awaited yet. A result is accepted if `accept`
+    returns True for it, or if there is no `accept`. Branches that fail don't
+    win. Once a branch wins, we cancel the branches that are still running.
+
+    The task and step results of every branch are held back from the call
+    cache until the race is decided, and only the winner's are stored. If no
+    branch gives an accepted result, we raise a `NoAcceptedResultError`.
+
+    ```
+    fields = await structured.race(
+        ctx,
+        [
+            structured.call_step(ctx, extract_fields, args=[doc, "gpt-4o-mini"]),
+            structured.call_step(ctx, extract_fields, args=[doc, "gpt-4o"]),
+        ],
+        accept=lambda fields: fields.complete,
+    )
+    ```
+    """
+    if not branches:
+        raise ValueError("A race needs at least one branch")
+
+    async def run_branch(
+        branch: Awaitable[Ret], deferred: List[Callable[[], None]]
+    ) -> Ret:
+        # each branch runs in its own copy of the context, so this only
+        # defers the stores of this branch
+        defer_stores(deferred)
+        return await branch
+
+    deferred_by_task: Dict["asyncio.Task[Ret]", List[Callable[[], None]]] = {}
+    for branch in branches:
+        deferred: List[Callable[[], None]] = []
+        deferred_by_task[asyncio.create_task(run_branch(branch, deferred))] = deferred
+    pending = set(deferred_by_task)
+    errors: List[BaseException] = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            # if several branches finished at once, prefer the earlier ones
+            for task in [t for t in deferred_by_task if t in done]:
+                if task.cancelled():
+                    errors.append(asyncio.CancelledError())
+                    continue
+                exc = task.exception()
+                if exc is not None:
+                    errors.append(exc)
+                    continue
+                result = task.result()
+                if accept is None or accept(result):
+                    for store in deferred_by_task[task]:
+                        # in a nested race, this defers to the outer race
+                        store_or_defer(store)
+                    return result
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    ctx.logger.warning("No branch of the race gave an accepted result")
+    raise NoAcceptedResultError(
+        f"None of the {len(branches)} branches gave an accepted result", errors
+    )
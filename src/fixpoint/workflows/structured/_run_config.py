@@ -1,11 +1,16 @@
 """Configuration for running workflows."""
 
-from dataclasses import dataclass
+__all__ = ["CallCacheConfig", "RunConfig", "compact_call_cache"]
+
+from dataclasses import dataclass, field
 import os
+from typing import Any, Dict, Literal, Optional
 
 import diskcache
 
 from fixpoint._constants import DEFAULT_DISK_CACHE_SIZE_LIMIT_BYTES
+from ..node_state import WorkflowStatus
+from ..tracing import Tracer
 from ..imperative import StorageConfig
 from ..imperative.config import (
     DEF_CHAT_CACHE_MAX_SIZE,
@@ -15,9 +20,31 @@ from ._callcache import (
     CallCache,
     StepInMemCallCache,
     TaskInMemCallCache,
+    StepBoundedInMemCallCache,
+    TaskBoundedInMemCallCache,
     StepDiskCallCache,
     TaskDiskCallCache,
+    JSONCodec,
+    PickleCodec,
+    ResultCodec,
+    CompactionReport,
+    compact_disk_call_cache,
+    has_run,
+    prefetch_run,
+    close_run,
+    reopen_run,
 )
+from ._executor import StepExecutors
+
+
+def _callcache_dir(storage_path: str) -> str:
+    return os.path.join(storage_path, "callcache")
+
+
+def _callcache_blob_dir(storage_path: str) -> str:
+    # This must not be inside the diskcache directory, because diskcache
+    # deletes files that it does not know about when it checks the cache.
+    return os.path.join(storage_path, "callcache-blobs")
 
 
 @dataclass
@@ -27,16 +54,45 @@ class CallCacheConfig:
     steps: CallCache
     tasks: CallCache
 
+    def has_run(self, run_id: str) -> bool:
+        """Whether the call caches know about a run"""
+        return has_run(self.steps, run_id) or has_run(self.tasks, run_id)
+
+    def prefetch_run(self, run_id: str) -> "CallCacheConfig":
+        """Load all of a run's cached step and task results into memory"""
+        return CallCacheConfig(
+            steps=prefetch_run(self.steps, run_id),
+            tasks=prefetch_run(self.tasks, run_id),
+        )
+
+    def close_run(self, run_id: str, status: WorkflowStatus) -> None:
+        """Tell the call caches that a run finished with the given status"""
+        close_run(self.steps, run_id, status)
+        close_run(self.tasks, run_id, status)
+
+    def reopen_run(self, run_id: str) -> None:
+        """Tell the call caches that a closed run is running again"""
+        reopen_run(self.steps, run_id)
+        reopen_run(self.tasks, run_id)
+
 
 @dataclass
 class RunConfig:
     """Configuration for running workflows.
 
     Configuration for running workflows, such as the storage backends to use.
+
+    Steps defined with an `executor` run on the thread and process pools in
+    `executors`. Share a `RunConfig` across workflow runs to share the pools.
+
+    If you set a `tracer`, we record a span for each workflow run, task call,
+    step call, and agent completion.
     """
 
     storage: StorageConfig
     call_cache: CallCacheConfig
+    executors: StepExecutors = field(default_factory=StepExecutors)
+    tracer: Optional[Tracer] = None
 
     @classmethod
     def with_defaults(
@@ -75,20 +131,54 @@ class RunConfig:
         agent_cache_size_limit_bytes: int = DEFAULT_DISK_CACHE_SIZE_LIMIT_BYTES,
         callcache_ttl_s: int,
         callcache_size_limit_bytes: int = DEFAULT_DISK_CACHE_SIZE_LIMIT_BYTES,
+        callcache_codec: Literal["json", "pickle"] = "json",
+        callcache_pin_open_runs: bool = False,
     ) -> "RunConfig":
-        """Configure run for disk storage"""
+        """Configure run for disk storage
+
+        By default, task and step results are stored as JSON. With
+        `callcache_codec="pickle"`, results are pickled instead, and large
+        binary buffers in them are stored in their own files and memory-mapped
+        when loaded. Only use pickle with a storage path you trust.
+
+        By default, when the call cache grows past its size limit, it evicts
+        the least recently stored results, even if they belong to a workflow
+        run that is still running. With `callcache_pin_open_runs=True`, it
+        skips the results of open runs when it evicts, and still evicts other
+        results to stay under its size limit. Open runs can take the cache
+        over its limit. Run `compact_call_cache` periodically to drop the
+        results of runs that closed long ago.
+        """
         storage_config = StorageConfig.with_disk(
             storage_path=storage_path,
             agent_cache_ttl_s=agent_cache_ttl_s,
             agent_cache_size_limit_bytes=agent_cache_size_limit_bytes,
         )
-        callcache_dir = os.path.join(storage_path, "callcache")
         call_cache = diskcache.Cache(
-            directory=callcache_dir, size_limit=callcache_size_limit_bytes
+            directory=_callcache_dir(storage_path),
+            size_limit=callcache_size_limit_bytes,
+            eviction_policy="least-recently-stored",
+            # with pinning, the call caches evict results themselves
+            cull_limit=0 if callcache_pin_open_runs else 10,
         )
+        codec: ResultCodec
+        if callcache_codec == "pickle":
+            codec = PickleCodec(blob_dir=_callcache_blob_dir(storage_path))
+        else:
+            codec = JSONCodec()
         call_cache_config = CallCacheConfig(
-            steps=StepDiskCallCache(cache=call_cache, ttl_s=callcache_ttl_s),
-            tasks=TaskDiskCallCache(cache=call_cache, ttl_s=callcache_ttl_s),
+            steps=StepDiskCallCache(
+                cache=call_cache,
+                ttl_s=callcache_ttl_s,
+                codec=codec,
+                pin_open_runs=callcache_pin_open_runs,
+            ),
+            tasks=TaskDiskCallCache(
+                cache=call_cache,
+                ttl_s=callcache_ttl_s,
+                codec=codec,
+                pin_open_runs=callcache_pin_open_runs,
+            ),
         )
         return cls(storage_config, call_cache_config)
 
@@ -97,11 +187,63 @@ class RunConfig:
         cls,
         chat_cache_maxsize: int = DEF_CHAT_CACHE_MAX_SIZE,
         chat_cache_ttl_s: int = DEF_CHAT_CACHE_TTL_S,
+        *,
+        callcache_max_entries: Optional[int] = None,
+        callcache_max_bytes: Optional[int] = None,
+        callcache_ttl_s: Optional[float] = None,
+        callcache_completed_run_ttl_s: float = 0.0,
     ) -> "RunConfig":
-        """Configure run for in-memory storage"""
+        """Configure run for in-memory storage
+
+        If you set any of the `callcache_*` limits, the task and step call
+        caches are bounded, and evict the results of completed and least
+        recently used workflow runs.
+        """
         storage = StorageConfig.with_in_memory(chat_cache_maxsize, chat_cache_ttl_s)
-        call_cache = CallCacheConfig(
-            steps=StepInMemCallCache(),
-            tasks=TaskInMemCallCache(),
-        )
+        if (
+            callcache_max_entries is None
+            and callcache_max_bytes is None
+            and callcache_ttl_s is None
+        ):
+            call_cache = CallCacheConfig(
+                steps=StepInMemCallCache(),
+                tasks=TaskInMemCallCache(),
+            )
+        else:
+            bounds: Dict[str, Any] = {
+                "max_entries": callcache_max_entries,
+                "max_bytes": callcache_max_bytes,
+                "ttl_s": callcache_ttl_s,
+                "completed_run_ttl_s": callcache_completed_run_ttl_s,
+            }
+            call_cache = CallCacheConfig(
+                steps=StepBoundedInMemCallCache(**bounds),
+                tasks=TaskBoundedInMemCallCache(**bounds),
+            )
         return cls(storage, call_cache)
+
+
+def compact_call_cache(
+    storage_path: str,
+    *,
+    completed_run_ttl_s: float,
+    failed_run_ttl_s: Optional[float] = None,
+    vacuum: bool = True,
+) -> CompactionReport:
+    """Drop cached task and step results of workflow runs that closed long ago
+
+    Compacts the disk call cache of a `RunConfig.with_disk(...)` storage path.
+    Drops the results of runs that completed more than `completed_run_ttl_s`
+    seconds ago. Failed runs are kept so that you can retry them, unless you
+    set `failed_run_ttl_s`. Results of open runs are never dropped.
+
+    Returns a report of what was removed, including the bytes reclaimed.
+    """
+    with diskcache.Cache(directory=_callcache_dir(storage_path)) as cache:
+        return compact_disk_call_cache(
+            cache,
+            completed_run_ttl_s=completed_run_ttl_s,
+            failed_run_ttl_s=failed_run_ttl_s,
+            blob_dir=_callcache_blob_dir(storage_path),
+            vacuum=vacuum,
+        )
@@ -0,0 +1,266 @@
+"""Structured workflows: an in-process scheduler for workflow runs
+
+The scheduler limits how many workflow runs execute at once in a process, both
+overall and per workflow. Runs waiting for a free slot sit in a bounded queue,
+and higher-priority runs leave the queue first.
+"""
+
+__all__ = ["SchedulerStats", "WorkflowScheduler"]
+
+import asyncio
+from dataclasses import dataclass, replace
+import heapq
+import itertools
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Literal, Optional, TypeVar
+
+from .errors import SchedulerFullError
+
+
+T = TypeVar("T")
+
+OnFullPolicy = Literal["wait", "reject"]
+
+
+@dataclass
+class SchedulerStats:
+    """Metrics about a workflow scheduler"""
+
+    queued: int = 0
+    running: int = 0
+    max_queued: int = 0
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    rejected: int = 0
+    total_queue_wait_s: float = 0.0
+    total_run_s: float = 0.0
+    max_run_s: float = 0.0
+
+    @property
+    def avg_run_s(self) -> float:
+        """The average duration of finished runs"""
+        finished = self.completed + self.failed
+        return self.total_run_s / finished if finished else 0.0
+
+
+class _QueuedRun:
+    """A workflow run waiting in the scheduler's queue"""
+
+    sort_key: tuple[int, int]
+    workflow_id: str
+    ready: "asyncio.Future[None]"
+    queued_at: float
+
+    def __init__(
+        self,
+        priority: int,
+        seq: int,
+        workflow_id: str,
+        ready: "asyncio.Future[None]",
+        queued_at: float,
+    ) -> None:
+        # higher priorities first, then first-in first-out
+        self.sort_key = (-priority, seq)
+        self.workflow_id = workflow_id
+        self.ready = ready
+        self.queued_at = queued_at
+
+    def __lt__(self, other: "_QueuedRun") -> bool:
+        return self.sort_key < other.sort_key
+
+
+class WorkflowScheduler:
+    """Schedules workflow runs with concurrency limits, priorities, and backpressure
+
+    At most `max_concurrency` runs execute at once, and at most the per-workflow
+    limit for runs of the same workflow. The per-workflow limit is looked up in
+    `workflow_limits` by workflow ID, falling back to `default_workflow_limit`.
+    Other runs wait in a queue, and runs with a higher `priority` leave the
+    queue first.
+
+    The queue holds at most `max_queued` runs. When it is full, the scheduler
+    either waits for room in the queue (`on_full="wait"`) or raises a
+    `SchedulerFullError` (`on_full="reject"`).
+
+    Use a scheduler from a single event loop. Pass it to
+    `structured.spawn_workflow(...)` or `structured.run_workflow(...)`:
+
+    ```
+    scheduler = structured.WorkflowScheduler(max_concurrency=20, max_queued=1000)
+    result = await structured.run_workflow(
+        MyWorkflow.main,
+        run_config=run_config,
+        agents=[],
+        scheduler=scheduler,
+        priority=10,
+    )
+    ```
+    """
+
+    _max_concurrency: int
+    _max_queued: Optional[int]
+    _workflow_limits: Dict[str, int]
+    _default_workflow_limit: Optional[int]
+    _on_full: OnFullPolicy
+    _timer: Callable[[], float]
+    _queue: List[_QueuedRun]
+    _running: Dict[str, int]
+    _num_running: int
+    # callers waiting for room in a full queue
+    _queue_space_waiters: List["asyncio.Future[None]"]
+    _seq: "itertools.count[int]"
+    _stats: SchedulerStats
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        *,
+        max_queued: Optional[int] = None,
+        workflow_limits: Optional[Dict[str, int]] = None,
+        default_workflow_limit: Optional[int] = None,
+        on_full: OnFullPolicy = "wait",
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        if on_full not in ("wait", "reject"):
+            raise ValueError(f'Invalid on_full policy "{on_full}"')
+        self._max_concurrency = max_concurrency
+        self._max_queued = max_queued
+        self._workflow_limits = dict(workflow_limits or {})
+        self._default_workflow_limit = default_workflow_limit
+        self._on_full = on_full
+        self._timer = timer
+        self._queue = []
+        self._running = {}
+        self._num_running = 0
+        self._queue_space_waiters = []
+        self._seq = itertools.count()
+        self._stats = SchedulerStats()
+
+    def stats(self) -> SchedulerStats:
+        """Get metrics about the scheduler"""
+        return replace(self._stats, queued=len(self._queue), running=self._num_running)
+
+    async def run(
+        self,
+        workflow_id: str,
+        coro: Coroutine[Any, Any, T],
+        priority: int = 0,
+    ) -> T:
+        """Run a workflow run's coroutine once the scheduler admits it"""
+        try:
+            await self._acquire(workflow_id, priority)
+        except BaseException:
+            # the coroutine never started, so don't warn that it was never
+            # awaited
+            coro.close()
+            raise
+
+        started_at = self._timer()
+        try:
+            res = await coro
+        except BaseException:
+            self._stats.failed += 1
+            raise
+        else:
+            self._stats.completed += 1
+            return res
+        finally:
+            duration = self._timer() - started_at
+            self._stats.total_run_s += duration
+            self._stats.max_run_s = max(self._stats.max_run_s, duration)
+            self._release(workflow_id)
+
+    async def _acquire(self, workflow_id: str, priority: int) -> None:
+        self._stats.submitted += 1
+        if not self._queue and self._has_slot(workflow_id):
+            self._start(workflow_id)
+            return
+
+        while self._max_queued is not None and len(self._queue) >= self._max_queued:
+            if self._on_full == "reject":
+                self._stats.rejected += 1
+                raise SchedulerFullError(
+                    f"Workflow scheduler queue is full ({self._max_queued} runs)"
+                )
+            space = asyncio.get_running_loop().create_future()
+            self._queue_space_waiters.append(space)
+            try:
+                await space
+            except asyncio.CancelledError:
+                if space in self._queue_space_waiters:
+                    self._queue_space_waiters.remove(space)
+                elif not space.cancelled():
+                    # we were woken up but are not going to use the space
+                    self._wake_queue_space_waiter()
+                raise
+
+        queued = _QueuedRun(
+            priority,
+            next(self._seq),
+            workflow_id,
+            asyncio.get_running_loop().create_future(),
+            self._timer(),
+        )
+        heapq.heappush(self._queue, queued)
+        self._stats.max_queued = max(self._stats.max_queued, len(self._queue))
+        self._dispatch()
+        try:
+            await queued.ready
+        except asyncio.CancelledError:
+            if queued.ready.done() and not queued.ready.cancelled():
+                # we were admitted right as we were cancelled
+                self._release(workflow_id)
+            else:
+                self._remove_queued(queued)
+            raise
+
+    def _has_slot(self, workflow_id: str) -> bool:
+        if self._num_running >= self._max_concurrency:
+            return False
+        limit = self._workflow_limits.get(workflow_id, self._default_workflow_limit)
+        return limit is None or self._running.get(workflow_id, 0) < limit
+
+    def _start(self, workflow_id: str) -> None:
+        self._num_running += 1
+        self._running[workflow_id] = self._running.get(workflow_id, 0) + 1
+
+    def _release(self, workflow_id: str) -> None:
+        self._num_running -= 1
+        self._running[workflow_id] -= 1
+        if self._running[workflow_id] == 0:
+            del self._running[workflow_id]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit queued runs, in priority order, while there are free slots
+
+        A run whose workflow is at its limit does not block lower-priority runs
+        of other workflows.
+        """
+        blocked: List[_QueuedRun] = []
+        while self._queue and self._num_running < self._max_concurrency:
+            queued = heapq.heappop(self._queue)
+            if not self._has_slot(queued.workflow_id):
+                blocked.append(queued)
+                continue
+            self._start(queued.workflow_id)
+            self._stats.total_queue_wait_s += self._timer() - queued.queued_at
+            queued.ready.set_result(None)
+            self._wake_queue_space_waiter()
+        for queued in blocked:
+            heapq.heappush(self._queue, queued)
+
+    def _remove_queued(self, queued: _QueuedRun) -> None:
+        self._queue.remove(queued)
+        heapq.heapify(self._queue)
+        self._wake_queue_space_waiter()
+
+    def _wake_queue_space_waiter(self) -> None:
+        while self._queue_space_waiters:
+            space = self._queue_space_waiters.pop(0)
+            if not space.done():
+                space.set_result(None)
+                return
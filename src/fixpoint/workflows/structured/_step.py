@@ -13,32 +13,77 @@ past or current steps and tasks.
 """
 
 from functools import wraps
-from typing import Any, Callable, Dict, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+)
 
-from fixpoint.workflows import WorkflowStatus
+from fixpoint.workflows import WorkflowStatus, tracing
 from ._context import WorkflowContext
 from .errors import DefinitionError
-from ._callcache import CallCacheKind
+from ._callcache import (
+    CallCacheKind,
+    serialize_args,
+    global_memo_run_id,
+    invalidate_results,
+)
 from ._helpers import (
     validate_func_has_context_arg,
+    closed_status,
     decorate_with_cache,
+    code_version,
+    offload_to_executor,
+    fan_out_call_args,
+    gather_bounded,
     AsyncFunc,
     Params,
     Ret,
 )
+from ._run_config import RunConfig
+from ._events import WorkflowEventKind, publish_node_closed
+from ._executor import ExecutorKind
+
+
+MemoizeMode = Literal["run", "global"]
 
 
 class StepFixp:
     """The internal Fixpoint attribute for a step function"""
 
     id: str
+    memoize: MemoizeMode
+    memo_run_id: Optional[str]
+    executor: Optional[ExecutorKind]
+    after: List[str]
 
-    def __init__(self, id: str):  # pylint: disable=redefined-builtin
+    def __init__(
+        self,
+        id: str,  # pylint: disable=redefined-builtin
+        memoize: MemoizeMode = "run",
+        memo_run_id: Optional[str] = None,
+        executor: Optional[ExecutorKind] = None,
+        after: Optional[Sequence[str]] = None,
+    ):
         self.id = id
+        self.memoize = memoize
+        self.memo_run_id = memo_run_id
+        self.executor = executor
+        self.after = list(after or [])
 
 
 def step(
     id: str,  # pylint: disable=redefined-builtin
+    *,
+    memoize: MemoizeMode = "run",
+    version: Optional[str] = None,
+    executor: Optional[ExecutorKind] = None,
+    after: Optional[Sequence[str]] = None,
 ) -> Callable[[AsyncFunc[Params, Ret]], AsyncFunc[Params, Ret]]:
     """Decorate a function to mark it as a step definition
 
@@ -52,19 +97,66 @@ def step(
     def my_step(ctx: WorkflowContext, args: Dict[str, Any]) -> None:
         ...
     ```
+
+    By default, step results are cached per workflow run. If you set
+    `memoize="global"`, results are shared across workflow runs: calling the
+    step with the same arguments in another run reuses the cached result. The
+    cached results are keyed on a version of the step's code, which is a hash
+    of its source code unless you pass in your own `version` string. Changing
+    the version invalidates the memoized results, and you can also invalidate
+    them explicitly with `structured.invalidate_step(...)`.
+
+    Steps run on the workflow's event loop, so a step that blocks or does a lot
+    of CPU work holds up every other workflow run in the process. Set
+    `executor="thread"` to run the step in a worker thread, or
+    `executor="process"` to run it in a worker process. The step then runs in
+    its own event loop, and its result is still call-cached as usual. In a
+    worker process, the step gets a `StepProcessContext` instead of the
+    `WorkflowContext`, its arguments and result must be picklable, and the step
+    must be defined at the top level of a module. The pools are managed by the
+    `RunConfig`'s `executors`.
+
+    `after` lists the IDs of steps that must finish before this one. It only
+    matters when the step runs in a `StepDag`, where the step waits for every
+    call to those steps in the DAG.
     """
+    if memoize not in ("run", "global"):
+        raise DefinitionError(f'Invalid memoize mode "{memoize}" for step {id}')
+    if executor not in (None, "thread", "process"):
+        raise DefinitionError(f'Invalid executor "{executor}" for step {id}')
+    if version is not None and memoize != "global":
+        raise DefinitionError(
+            f'Step {id} has a version, but only steps with memoize="global" use one'
+        )
+    if after is not None and id in after:
+        raise DefinitionError(f"Step {id} cannot run after itself")
 
     def decorator(func: AsyncFunc[Params, Ret]) -> AsyncFunc[Params, Ret]:
-        # pylint: disable=protected-access
-        func.__fixp = StepFixp(id)  # type: ignore[attr-defined]
-
         validate_func_has_context_arg(func)
 
+        memo_run_id = None
+        if memoize == "global":
+            memo_run_id = global_memo_run_id(id, version or code_version(func))
+
+        # pylint: disable=protected-access
+        func.__fixp = StepFixp(  # type: ignore[attr-defined]
+            id,
+            memoize=memoize,
+            memo_run_id=memo_run_id,
+            executor=executor,
+            after=after,
+        )
+
         @wraps(func)
         async def wrapper(*args: Any, **kwargs: Any) -> Ret:
-            wrapped_func = decorate_with_cache(CallCacheKind.STEP, id)(func)
-            result = await wrapped_func(*args, **kwargs)
-            return result
+            return await cached_func(*args, **kwargs)
+
+        # Build the call path once, so that calling the step does not need to
+        # inspect or decorate the step function again.
+        body: AsyncFunc[..., Ret] = func
+        if executor is not None:
+            body = offload_to_executor(wrapper, executor)
+        cached_func = decorate_with_cache(CallCacheKind.STEP, id, memo_run_id)(body)
 
         return wrapper
 
@@ -122,10 +214,109 @@ async def call_step(
     step_handle = ctx.workflow_run.spawn_step(step_fixp.id)
     new_ctx = ctx.clone(new_step=step_fixp.id)
     try:
-        ret = await fn(new_ctx, *args, **kwargs)  # type: ignore[arg-type]
-    except:
-        step_handle.close(WorkflowStatus.FAILED)
+        with tracing.span(f"step {step_fixp.id}", new_ctx.workflow_run):
+            ret = await fn(new_ctx, *args, **kwargs)  # type: ignore[arg-type]
+    except BaseException as e:
+        status = closed_status(e)
+        step_handle.close(status)
+        await publish_node_closed(
+            ctx._events,  # pylint: disable=protected-access
+            WorkflowEventKind.STEP_CLOSED,
+            new_ctx.workflow_run,
+            status,
+        )
         raise
     else:
         step_handle.close(WorkflowStatus.COMPLETED)
+    await publish_node_closed(
+        ctx._events,  # pylint: disable=protected-access
+        WorkflowEventKind.STEP_CLOSED,
+        new_ctx.workflow_run,
+        WorkflowStatus.COMPLETED,
+        ret,
+    )
     return ret
+
+
+async def call_steps(
+    ctx: WorkflowContext,
+    fn: AsyncFunc[Params, Ret],
+    args: Sequence[Sequence[Any]],
+    *,
+    kwargs: Optional[Sequence[Dict[str, Any]]] = None,
+    max_concurrency: Optional[int] = None,
+) -> List[Ret]:
+    """Execute a step many times concurrently, once per set of arguments
+
+    `args` is a list with the positional arguments of each call, and `kwargs`
+    is an optional list, of the same length, with the keyword arguments of each
+    call. We run at most `max_concurrency` calls at a time, or all at once if it
+    is `None`, and return the results in the same order as the arguments.
+
+    Each call is a normal `call_step`, so each one is its own step node in the
+    workflow run, and its result is cached per set of arguments. If any call
+    fails, we cancel the calls that are still running and raise an
+    `ExceptionGroup`.
+
+    ```
+    results = await structured.call_steps(
+        ctx,
+        summarize_document,
+        args=[[doc] for doc in documents],
+        max_concurrency=8,
+    )
+    ```
+    """
+    if not get_step_fixp(fn):
+        raise DefinitionError(f"Step {fn.__name__} is not a valid step definition")
+
+    def make_call(
+        call_args: List[Any], call_kwargs: Dict[str, Any]
+    ) -> Callable[[], Coroutine[Any, Any, Ret]]:
+        return lambda: call_step(ctx, fn, args=call_args, kwargs=call_kwargs)
+
+    return await gather_bounded(
+        [make_call(a, kw) for a, kw in fan_out_call_args(args, kwargs)],
+        max_concurrency,
+    )
+
+
+def invalidate_step(
+    run_config: RunConfig,
+    fn: AsyncFunc[Params, Ret],
+    *,
+    run_id: Optional[str] = None,
+    args: Optional[List[Any]] = None,
+    kwargs: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Invalidate the call-cached results of a step.
+
+    For a step defined with `memoize="global"`, this invalidates the results
+    memoized across workflow runs for the current version of the step. For any
+    other step, you must pass in the `run_id` of the workflow run whose cached
+    results you want to invalidate.
+
+    If you pass in `args` or `kwargs`, we only invalidate the result of calling
+    the step with those arguments. Otherwise, we invalidate all of the step's
+    cached results. To target a call that had no extra arguments, pass in
+    `args=[]`.
+    """
+    step_fixp = get_step_fixp(fn)
+    if not step_fixp:
+        raise DefinitionError(f"Step {fn.__name__} is not a valid step definition")
+
+    cache_run_id = step_fixp.memo_run_id or run_id
+    if cache_run_id is None:
+        raise ValueError(
+            f"Step {step_fixp.id} is not globally memoized, so you must pass a run_id"
+        )
+
+    serialized_args = None
+    if args is not None or kwargs is not None:
+        serialized_args = serialize_args(*(args or []), **(kwargs or {}))
+    invalidate_results(
+        run_config.call_cache.steps,
+        run_id=cache_run_id,
+        kind_id=step_fixp.id,
+        serialized_args=serialized_args,
+    )
@@ -10,26 +10,32 @@ from functools import wraps
 from typing import (
     Any,
     Callable,
+    Coroutine,
     Dict,
     List,
     Optional,
+    Sequence,
     Type,
     TypeVar,
     cast,
 )
 
 from ..constants import STEP_MAIN_ID
-from .. import WorkflowStatus, imperative
+from .. import WorkflowStatus, imperative, tracing
 from ..imperative import WorkflowRun
 from ._context import WorkflowContext
 from .errors import DefinitionError, InternalError
 from ._callcache import CallCacheKind
+from ._events import WorkflowEventKind, publish_node_closed
 from ._helpers import (
     validate_func_has_context_arg,
     AsyncFunc,
     Params,
     Ret,
+    closed_status,
     decorate_with_cache,
+    fan_out_call_args,
+    gather_bounded,
 )
 
 
@@ -181,29 +187,36 @@ def task_entrypoint() -> Callable[[AsyncFunc[Params, Ret]], AsyncFunc[Params, Re
 
         validate_func_has_context_arg(func)
 
+        # We only know the task ID once the task class is defined, so we build
+        # the call path on the first call and reuse it afterwards.
+        cached_func: Optional[AsyncFunc[Params, Ret]] = None
+
         @wraps(func)
         async def wrapper(*args: Params.args, **kwargs: Params.kwargs) -> Ret:
-            taskentry_fixp = get_task_entrypoint_fixp_from_fn(func)
-            if taskentry_fixp is None:
-                raise InternalError("task entry __fixp is not defined")
-            if taskentry_fixp.task_cls is None:
-                raise InternalError("task entry __fixp.task_cls is not defined")
-            task_meta_fixp = get_task_definition_meta_fixp(taskentry_fixp.task_cls)
-            if task_meta_fixp is None:
-                raise InternalError("task definition __fixp_meta is not defined")
-            task_id = task_meta_fixp.task_id
-
-            wrapped_func: AsyncFunc[Params, Ret] = decorate_with_cache(
-                CallCacheKind.TASK, task_id
-            )(func)
-            result = await wrapped_func(*args, **kwargs)
-            return result
+            nonlocal cached_func
+            if cached_func is None:
+                cached_func = decorate_with_cache(
+                    CallCacheKind.TASK, _resolve_task_id(func)
+                )(func)
+            return await cached_func(*args, **kwargs)
 
         return wrapper
 
     return decorator
 
 
+def _resolve_task_id(entry_func: Callable[..., Any]) -> str:
+    taskentry_fixp = get_task_entrypoint_fixp_from_fn(entry_func)
+    if taskentry_fixp is None:
+        raise InternalError("task entry __fixp is not defined")
+    if taskentry_fixp.task_cls is None:
+        raise InternalError("task entry __fixp.task_cls is not defined")
+    task_meta_fixp = get_task_definition_meta_fixp(taskentry_fixp.task_cls)
+    if task_meta_fixp is None:
+        raise InternalError("task definition __fixp_meta is not defined")
+    return task_meta_fixp.task_id
+
+
 def get_task_entrypoint_from_defn(defn: Type[C]) -> Optional[Callable[..., Any]]:
     """Get the entrypoint function from a task class definition"""
     for attr in defn.__dict__.values():
@@ -301,10 +314,63 @@ async def call_task(
     # The Params type gets confused because we are injecting an additional
     # WorkflowContext. Ignore that error.
     try:
-        res = await task_entry(task_instance, new_ctx, *args, **kwargs)  # type: ignore[arg-type]
-    except:
-        task_handle.close(WorkflowStatus.FAILED)
+        with tracing.span(f"task {fixpmeta.task_id}", new_ctx.workflow_run):
+            res = await task_entry(
+                task_instance, new_ctx, *args, **kwargs  # type: ignore[arg-type]
+            )
+    except BaseException as e:
+        status = closed_status(e)
+        task_handle.close(status)
+        await publish_node_closed(
+            ctx._events,  # pylint: disable=protected-access
+            WorkflowEventKind.TASK_CLOSED,
+            new_ctx.workflow_run,
+            status,
+        )
         raise
     else:
         task_handle.close(WorkflowStatus.COMPLETED)
+    await publish_node_closed(
+        ctx._events,  # pylint: disable=protected-access
+        WorkflowEventKind.TASK_CLOSED,
+        new_ctx.workflow_run,
+        WorkflowStatus.COMPLETED,
+        res,
+    )
     return res
+
+
+async def call_tasks(
+    ctx: WorkflowContext,
+    task_entry: AsyncFunc[Params, Ret],
+    args: Sequence[Sequence[Any]],
+    *,
+    kwargs: Optional[Sequence[Dict[str, Any]]] = None,
+    max_concurrency: Optional[int] = None,
+) -> List[Ret]:
+    """Execute a task many times concurrently, once per set of arguments
+
+    `args` is a list with the positional arguments of each call, and `kwargs`
+    is an optional list, of the same length, with the keyword arguments of each
+    call. We run at most `max_concurrency` calls at a time, or all at once if it
+    is `None`, and return the results in the same order as the arguments.
+
+    Each call is a normal `call_task`, so each one is its own task node in the
+    workflow run, and its result is cached per set of arguments. If any call
+    fails, we cancel the calls that are still running and raise an
+    `ExceptionGroup`.
+    """
+    if not get_task_entrypoint_fixp_from_fn(task_entry):
+        raise DefinitionError(
+            f'Task "{task_entry.__name__}" is not a valid task entrypoint'
+        )
+
+    def make_call(
+        call_args: List[Any], call_kwargs: Dict[str, Any]
+    ) -> Callable[[], Coroutine[Any, Any, Ret]]:
+        return lambda: call_task(ctx, task_entry, args=call_args, kwargs=call_kwargs)
+
+    return await gather_bounded(
+        [make_call(a, kw) for a, kw in fan_out_call_args(args, kwargs)],
+        max_concurrency,
+    )
@@ -17,27 +17,43 @@ __all__ = [
     "retry_workflow",
 ]
 
+import asyncio
+import dataclasses
 from dataclasses import dataclass
 from functools import wraps
+import inspect
 from typing import (
     Any,
     Callable,
+    Coroutine,
     Dict,
     List,
     Optional,
     Sequence,
+    Tuple,
     Type,
     TypeVar,
     cast,
+    get_type_hints,
 )
+import weakref
 
 import fixpoint
 from .. import imperative
+from ..node_state import WorkflowStatus
+from ..tracing import Tracer
 from .errors import DefinitionError, ExecutionError, InternalError
 from ._context import WorkflowContext
+from ._events import WorkflowEventStream
 from ._helpers import validate_func_has_context_arg, AsyncFunc, Params, Ret, Ret_co
-from ._run_config import RunConfig
-from ._workflow_run_handle import WorkflowRunHandle, WorkflowRunHandleImpl
+from ._idempotency import IdempotencyKey, SharedRun
+from ._run_config import CallCacheConfig, RunConfig
+from ._scheduler import WorkflowScheduler
+from ._workflow_run_handle import (
+    CompletedWorkflowRunHandle,
+    WorkflowRunHandle,
+    WorkflowRunHandleImpl,
+)
 
 
 T = TypeVar("T")
@@ -106,10 +122,13 @@ class WorkflowMetaFixp:
     """Internal fixpoint attribute for a workflow class definition."""
 
     workflow: imperative.Workflow
+    # in-flight idempotent runs, by run ID
+    idempotent_runs: "weakref.WeakValueDictionary[str, SharedRun[Any]]"
 
     def __init__(self, workflow_id: str) -> None:
         print("DBM creating Workflow definition again")
         self.workflow = imperative.Workflow(id=workflow_id)
+        self.idempotent_runs = weakref.WeakValueDictionary()
 
 
 @dataclass
@@ -136,22 +155,41 @@ class WorkflowInstanceFixp:
         run_config: RunConfig,
         agents: List[fixpoint.agents.AsyncBaseAgent],
         retry_for_run_id: Optional[str] = None,
+        start_if_unknown: bool = False,
     ) -> WorkflowContext:
         """Internal function to "run" a workflow.
 
         Create a workflow object instance and context. It doesn't actually call
         the workflow entrypoint, but it initializes the Fixpoint workflow
         instance attribute with a workflow run and a workflow context.
+
+        Retrying a run that neither the workflow run storage nor the call cache
+        knows about raises a ValueError, unless `start_if_unknown` is set.
         """
         if self.run_fixp:
             raise ValueError("workflow instance was already run")
-        if retry_for_run_id:
+        if (
+            retry_for_run_id
+            and not workflow.load_run(
+                retry_for_run_id, storage_config=run_config.storage
+            )
+            and (start_if_unknown or run_config.call_cache.has_run(retry_for_run_id))
+        ):
+            # The run started somewhere we can't load it from, for example in
+            # another worker process without workflow run storage. Resume it
+            # under the same ID, so that it picks up its results from the call
+            # cache.
+            run = workflow.run(
+                storage_config=run_config.storage, run_id=retry_for_run_id
+            )
+        elif retry_for_run_id:
             run = workflow.retry(retry_for_run_id, storage_config=run_config.storage)
         else:
             run = workflow.run(storage_config=run_config.storage)
 
         cache = run_config.storage.agent_cache
-        # The WorkflowContext initializer will set fresh memory for each agent
+        # The WorkflowContext initializer gives each agent without memory a
+        # view with fresh memory for this run
         wfctx = WorkflowContext(
             run_config=run_config, agents=agents, workflow_run=run, cache=cache
         )
@@ -279,6 +317,10 @@ def spawn_workflow(
     agents: List[fixpoint.agents.AsyncBaseAgent],
     args: Optional[Sequence[Any]] = None,
     kwargs: Optional[Dict[str, Any]] = None,
+    scheduler: Optional[WorkflowScheduler] = None,
+    priority: int = 0,
+    idempotent: bool = False,
+    idempotency_version: Optional[str] = None,
 ) -> WorkflowRunHandle[Ret_co]:
     """Runs a structured workflow.
 
@@ -287,11 +329,11 @@ def spawn_workflow(
 
     The `agents` list is a list of agents that will be available to the
     workflow. The agent will be wired up to interact with the workflow run,
-    having memory of all past workflow run inferences. Note that every agent you
-    pass in here will its memory overridden for the particular workflow run, so
-    don't use agents that you want to use outside of or across workflow runs.
-    The agents will be available to the workflow via the `WorkflowContext`
-    argument.
+    having memory of all past workflow run inferences. An agent without memory
+    is not changed: the run gets a view of it with memory for that run, which
+    shares the agent's clients, cache, and config. So you can pass the same
+    agents to many workflow runs, including concurrent ones. The agents will be
+    available to the workflow via the `WorkflowContext` argument.
 
     A more complete example:
 
@@ -313,7 +355,33 @@ def spawn_workflow(
 
     If you pass in a `ctx_factory`, it will be used instead of the `ctx_factory`
     defined on the workflow class.
+
+    If you pass in a `WorkflowScheduler`, the workflow run waits in the
+    scheduler's queue until the scheduler admits it, which happens in order of
+    `priority`, highest first. The run is queued when you await its result.
+
+    If you set `idempotent`, runs are keyed on the workflow ID, a digest of the
+    arguments, and the optional `idempotency_version`. If a run with the same
+    key is in flight in this process, you get a handle attached to it. If a
+    run with the same key completed, you get a handle with its result, which
+    is stored in the run config's call cache. Either way the workflow does not
+    run again. A run that failed is retried under the same run ID, skipping
+    the tasks and steps that finished. Change the version to run the workflow
+    again for arguments it already completed. We only deduplicate in-flight
+    runs within one process, so two processes that spawn the same run at the
+    same time both run the workflow.
     """
+    if idempotent:
+        return _spawn_idempotent_workflow(
+            workflow_entry,
+            idempotency_version,
+            run_config=run_config,
+            agents=agents,
+            args=args,
+            kwargs=kwargs,
+            scheduler=scheduler,
+            priority=priority,
+        )
     return _spawn_workflow_common(
         workflow_entry,
         run_id=None,
@@ -321,6 +389,8 @@ def spawn_workflow(
         agents=agents,
         args=args,
         kwargs=kwargs,
+        scheduler=scheduler,
+        priority=priority,
     )
 
 
@@ -332,8 +402,23 @@ def respawn_workflow(
     agents: List[fixpoint.agents.AsyncBaseAgent],
     args: Optional[Sequence[Any]] = None,
     kwargs: Optional[Dict[str, Any]] = None,
+    scheduler: Optional[WorkflowScheduler] = None,
+    priority: int = 0,
+    start_if_unknown: bool = False,
 ) -> WorkflowRunHandle[Ret_co]:
-    """Retries running a structured workflow."""
+    """Retries running a structured workflow.
+
+    Before replaying the workflow run, we load all of its cached task and step
+    results into memory at once, so that replaying already completed tasks and
+    steps does not need a storage lookup each.
+
+    The run does not need to have started in this process. If the run config's
+    storage has workflow run storage, we load the run from there. Otherwise, if
+    the call cache has results of the run, we resume it under the given
+    `run_id`, so that it picks up those results. If we don't know about the run
+    at all, we raise a ValueError, unless you set `start_if_unknown`, in which
+    case we start a new run under the given `run_id`.
+    """
     return _spawn_workflow_common(
         workflow_entry,
         run_id=run_id,
@@ -341,18 +426,76 @@ def respawn_workflow(
         agents=agents,
         args=args,
         kwargs=kwargs,
+        scheduler=scheduler,
+        priority=priority,
+        start_if_unknown=start_if_unknown,
     )
 
 
-def _spawn_workflow_common(
+def _spawn_idempotent_workflow(
     workflow_entry: AsyncFunc[Params, Ret_co],
+    version: Optional[str],
     *,
-    run_id: Optional[str],
     run_config: RunConfig,
     agents: List[fixpoint.agents.AsyncBaseAgent],
     args: Optional[Sequence[Any]] = None,
     kwargs: Optional[Dict[str, Any]] = None,
+    scheduler: Optional[WorkflowScheduler] = None,
+    priority: int = 0,
 ) -> WorkflowRunHandle[Ret_co]:
+    """Spawn a workflow run, or attach to the same run in flight in this process
+
+    Deduplicating in-flight runs only works within one process. Across
+    processes, we only share the results of runs that completed.
+    """
+    _, fixpmeta = _workflow_defn_of(workflow_entry)
+    wf = fixpmeta.workflow
+    key = IdempotencyKey.of(wf.id, version, args, kwargs)
+    stored = key.stored_result(run_config, get_type_hints(workflow_entry).get("return"))
+    if stored.found:
+        return CompletedWorkflowRunHandle[Ret_co](
+            wf.id,
+            key.run_id,
+            cast(Ret_co, stored.result),
+            lambda: wf.load_run(key.run_id, storage_config=run_config.storage),
+        )
+
+    shared = fixpmeta.idempotent_runs.get(key.run_id)
+    if shared is None:
+        handle = _spawn_workflow_common(
+            workflow_entry,
+            run_id=key.run_id,
+            run_config=run_config,
+            agents=agents,
+            args=args,
+            kwargs=kwargs,
+            scheduler=scheduler,
+            priority=priority,
+            start_if_unknown=True,
+        )
+        shared = SharedRun(
+            handle,
+            _finish_idempotent_run(handle, key, run_config),
+            fixpmeta.idempotent_runs,
+        )
+    return shared.attach()
+
+
+async def _finish_idempotent_run(
+    handle: WorkflowRunHandleImpl[Ret_co],
+    key: IdempotencyKey,
+    run_config: RunConfig,
+) -> Ret_co:
+    """Store the result of an idempotent run when it completes"""
+    ret = await handle.result()
+    key.store_result(run_config, ret)
+    return ret
+
+
+def _workflow_defn_of(
+    workflow_entry: Callable[..., Any]
+) -> Tuple[Type[Any], WorkflowMetaFixp]:
+    """The workflow class of an entrypoint, and its Fixpoint attribute"""
     entryfixp = get_workflow_entrypoint_fixp(workflow_entry)
     if not entryfixp:
         raise DefinitionError(
@@ -369,13 +512,40 @@ def _spawn_workflow_common(
         raise DefinitionError(
             f'Workflow "{workflow_defn.__name__}" is not a valid workflow definition'
         )
+    return workflow_defn, fixpmeta
+
+
+def _spawn_workflow_common(
+    workflow_entry: AsyncFunc[Params, Ret_co],
+    *,
+    run_id: Optional[str],
+    run_config: RunConfig,
+    agents: List[fixpoint.agents.AsyncBaseAgent],
+    args: Optional[Sequence[Any]] = None,
+    kwargs: Optional[Dict[str, Any]] = None,
+    scheduler: Optional[WorkflowScheduler] = None,
+    priority: int = 0,
+    start_if_unknown: bool = False,
+) -> WorkflowRunHandleImpl[Ret_co]:
+    workflow_defn, fixpmeta = _workflow_defn_of(workflow_entry)
+    if run_id:
+        run_config = dataclasses.replace(
+            run_config, call_cache=run_config.call_cache.prefetch_run(run_id)
+        )
+
     workflow_instance = workflow_defn()
     fixp = get_workflow_instance_fixp(workflow_instance)
     if not fixp:
         raise DefinitionError(
             f'Workflow "{workflow_defn.__name__}" is not a valid workflow instance'
         )
-    fixp.run(fixpmeta.workflow, run_config, agents, retry_for_run_id=run_id)
+    fixp.run(
+        fixpmeta.workflow,
+        run_config,
+        agents,
+        retry_for_run_id=run_id,
+        start_if_unknown=start_if_unknown,
+    )
 
     if not fixp.run_fixp:
         # this is an internal error, not a user error
@@ -383,11 +553,105 @@ def _spawn_workflow_common(
 
     args = args or []
     kwargs = kwargs or {}
-    ctx = fixp.run_fixp.ctx
+    run_fixp = fixp.run_fixp
     # The Params type gets confused because we are injecting an additional
     # WorkflowContext. Ignore that error.
-    res = workflow_entry(workflow_instance, ctx, *args, **kwargs)  # type: ignore[arg-type]
-    return WorkflowRunHandleImpl[Ret_co](fixp.run_fixp.workflow_run, res)
+    res = workflow_entry(
+        workflow_instance, run_fixp.ctx, *args, **kwargs  # type: ignore[arg-type]
+    )
+    # pylint: disable=protected-access
+    res = _close_run_when_done(
+        res,
+        run_fixp.workflow_run,
+        run_config.call_cache,
+        run_fixp.ctx._events,
+        retrying=bool(run_id),
+        tracer=run_config.tracer,
+        scheduler=scheduler,
+        priority=priority,
+    )
+    return WorkflowRunHandleImpl[Ret_co](
+        run_fixp.workflow_run, res, run_fixp.ctx._events
+    )
+
+
+async def _close_run_when_done(
+    res: Coroutine[Any, Any, Ret_co],
+    workflow_run: imperative.WorkflowRun,
+    call_cache: CallCacheConfig,
+    events: WorkflowEventStream,
+    *,
+    retrying: bool = False,
+    tracer: Optional[Tracer] = None,
+    scheduler: Optional[WorkflowScheduler] = None,
+    priority: int = 0,
+) -> Ret_co:
+    """Record when a workflow run starts and finishes, and how
+
+    When a retried run starts, we tell the call caches that it is open again.
+    If there is a scheduler, the run waits for the scheduler to admit it. When
+    the run finishes, we store its final status, tell the call caches about it,
+    and publish it to the reader of the run's events. We do that even if the
+    scheduler rejected the run, or the run was cancelled while it was queued.
+    """
+    if retrying:
+        call_cache.reopen_run(workflow_run.id)
+    started = _publish_start(res, workflow_run.id, events)
+    traced = started if tracer is None else _trace_run(started, workflow_run, tracer)
+    status = WorkflowStatus.FAILED
+    try:
+        if scheduler is None:
+            ret = await traced
+        else:
+            ret = await scheduler.run(workflow_run.workflow_id, traced, priority)
+        status = WorkflowStatus.COMPLETED
+        return ret
+    except asyncio.CancelledError:
+        status = WorkflowStatus.CANCELLED
+        raise
+    finally:
+        # don't warn that the run's coroutines were never awaited if the
+        # scheduler never admitted the run
+        for coro in (res, started, traced):
+            if (
+                inspect.iscoroutine(coro)
+                and inspect.getcoroutinestate(coro) == inspect.CORO_CREATED
+            ):
+                coro.close()
+        workflow_run.save(status=status)
+        call_cache.close_run(workflow_run.id, status)
+        await events.publish_status(workflow_run.id, status, final=True)
+
+
+async def _publish_start(
+    res: Coroutine[Any, Any, Ret_co], workflow_run_id: str, events: WorkflowEventStream
+) -> Ret_co:
+    """Publish that a workflow run is running, and run it"""
+    await events.publish_status(workflow_run_id, WorkflowStatus.RUNNING)
+    return await res
+
+
+async def _trace_run(
+    res: Coroutine[Any, Any, Ret_co],
+    workflow_run: imperative.WorkflowRun,
+    tracer: Tracer,
+) -> Ret_co:
+    """Trace a workflow run, and the tasks, steps, and agent calls in it"""
+    with tracer.activate(), tracer.span(
+        f"workflow {workflow_run.workflow_id}",
+        workflow_run,
+        **{"workflow.attempt_id": workflow_run.attempt_id},
+    ) as span:
+        status = WorkflowStatus.FAILED
+        try:
+            ret = await res
+            status = WorkflowStatus.COMPLETED
+            return ret
+        except asyncio.CancelledError:
+            status = WorkflowStatus.CANCELLED
+            raise
+        finally:
+            span.set_attribute("workflow.status", status.value)
 
 
 async def run_workflow(
@@ -397,6 +661,10 @@ async def run_workflow(
     agents: List[fixpoint.agents.AsyncBaseAgent],
     args: Optional[Sequence[Any]] = None,
     kwargs: Optional[Dict[str, Any]] = None,
+    scheduler: Optional[WorkflowScheduler] = None,
+    priority: int = 0,
+    idempotent: bool = False,
+    idempotency_version: Optional[str] = None,
 ) -> Ret_co:
     """Runs a structured workflow, returning its result.
 
@@ -404,7 +672,15 @@ async def run_workflow(
     shortcut for `spawn_workflow(...).result()`.
     """
     wrun_handle = spawn_workflow(
-        workflow_entry, run_config=run_config, agents=agents, args=args, kwargs=kwargs
+        workflow_entry,
+        run_config=run_config,
+        agents=agents,
+        args=args,
+        kwargs=kwargs,
+        scheduler=scheduler,
+        priority=priority,
+        idempotent=idempotent,
+        idempotency_version=idempotency_version,
     )
     return await wrun_handle.result()
 
@@ -417,6 +693,8 @@ async def retry_workflow(
     agents: List[fixpoint.agents.AsyncBaseAgent],
     args: Optional[Sequence[Any]] = None,
     kwargs: Optional[Dict[str, Any]] = None,
+    scheduler: Optional[WorkflowScheduler] = None,
+    priority: int = 0,
 ) -> Ret_co:
     """Retries running a structured workflow.
 
@@ -432,5 +710,7 @@ async def retry_workflow(
         agents=agents,
         args=args,
         kwargs=kwargs,
+        scheduler=scheduler,
+        priority=priority,
     )
     return await wrun_handle.result()
@@ -4,9 +4,26 @@ A handle on a WorkflowRun, which is used to check the status of a workflow run,
 access its result, etc.
 """
 
-from typing import Any, Coroutine, Optional, Protocol, cast
+import asyncio
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Coroutine,
+    Optional,
+    Protocol,
+    cast,
+)
 
 from .. import imperative
+from ..constants import STEP_MAIN_ID, TASK_MAIN_ID
+from ..node_state import WorkflowStatus
+from ._events import (
+    DEFAULT_MAX_BUFFERED_EVENTS,
+    WorkflowEvent,
+    WorkflowEventKind,
+    WorkflowEventStream,
+)
 from ._helpers import Ret_co
 
 Coro = Coroutine[Any, Any, Ret_co]
@@ -18,6 +35,24 @@ class WorkflowRunHandle(Protocol[Ret_co]):
     async def result(self) -> Ret_co:
         """The result of running a workflow"""
 
+    def events(
+        self, max_buffered: int = DEFAULT_MAX_BUFFERED_EVENTS
+    ) -> AsyncGenerator[WorkflowEvent, None]:
+        """Stream the workflow run's events as they happen
+
+        ```
+        async for event in handle.events():
+            ...
+        result = await handle.result()
+        ```
+
+        We yield the run's status changes, each task and step as it closes,
+        and each value the workflow emits with `ctx.emit(...)`, until the run
+        finishes. If the run has not started yet, this starts it. We buffer at
+        most `max_buffered` events, and if you read them slower than the
+        workflow publishes them, the workflow waits for you.
+        """
+
     def workflow_id(self) -> str:
         """The ID of the workflow"""
 
@@ -53,15 +88,25 @@ class WorkflowRunHandleImpl(WorkflowRunHandle[Ret_co]):
 
     _workflow_run: imperative.WorkflowRun
     _result: Coroutine[Any, Any, Ret_co]
+    _events: WorkflowEventStream
+    _started: bool
+    # set if reading the events started the run in the background
+    _run_task: "Optional[asyncio.Task[Ret_co]]"
     _awaited_result: Optional[Ret_co]
     _was_awaited: bool
     _is_open: bool
 
     def __init__(
-        self, workflow_run: imperative.WorkflowRun, result: Coroutine[Any, Any, Ret_co]
+        self,
+        workflow_run: imperative.WorkflowRun,
+        result: Coroutine[Any, Any, Ret_co],
+        events: Optional[WorkflowEventStream] = None,
     ) -> None:
         self._workflow_run = workflow_run
         self._result = result
+        self._events = events or WorkflowEventStream()
+        self._started = False
+        self._run_task = None
         self._awaited_result = None
         self._was_awaited = False
         self._is_open = True
@@ -70,12 +115,36 @@ class WorkflowRunHandleImpl(WorkflowRunHandle[Ret_co]):
         if self._was_awaited:
             return cast(Ret_co, self._awaited_result)
         try:
-            self._awaited_result = await self._result
+            if self._run_task is not None:
+                self._awaited_result = await self._run_task
+            else:
+                self._started = True
+                self._awaited_result = await self._result
         finally:
             self._was_awaited = True
             self._is_open = False
         return self._awaited_result
 
+    async def events(  # pylint: disable=invalid-overridden-method
+        self, max_buffered: int = DEFAULT_MAX_BUFFERED_EVENTS
+    ) -> AsyncGenerator[WorkflowEvent, None]:
+        subscription = self._events.subscribe(max_buffered)
+        try:
+            if not self._started:
+                self._started = True
+                self._run_task = asyncio.ensure_future(self._result)
+            async for event in subscription:
+                yield event
+        finally:
+            await subscription.aclose()
+
+    def attach(
+        self, result: Coroutine[Any, Any, Ret_co]
+    ) -> "WorkflowRunHandleImpl[Ret_co]":
+        """A new handle on the same workflow run that gets its result from
+        `result`"""
+        return WorkflowRunHandleImpl[Ret_co](self._workflow_run, result, self._events)
+
     def workflow_id(self) -> str:
         return self._workflow_run.workflow_id
 
@@ -92,3 +161,58 @@ class WorkflowRunHandleImpl(WorkflowRunHandle[Ret_co]):
 
     def is_closed(self) -> bool:
         return not self.is_open()
+
+
+class CompletedWorkflowRunHandle(WorkflowRunHandle[Ret_co]):
+    """Handle to a workflow run that already completed, with its stored result
+
+    Spawning an idempotent workflow with the same arguments as a completed run
+    gives you this handle instead of running the workflow again.
+    """
+
+    _workflow_id: str
+    _workflow_run_id: str
+    _result: Ret_co
+    _load_run: Callable[[], Optional[imperative.WorkflowRun]]
+
+    def __init__(
+        self,
+        workflow_id: str,
+        workflow_run_id: str,
+        result: Ret_co,
+        load_run: Callable[[], Optional[imperative.WorkflowRun]],
+    ) -> None:
+        self._workflow_id = workflow_id
+        self._workflow_run_id = workflow_run_id
+        self._result = result
+        self._load_run = load_run
+
+    async def result(self) -> Ret_co:
+        return self._result
+
+    async def events(  # pylint: disable=invalid-overridden-method
+        self, max_buffered: int = DEFAULT_MAX_BUFFERED_EVENTS
+    ) -> AsyncGenerator[WorkflowEvent, None]:
+        yield WorkflowEvent(
+            kind=WorkflowEventKind.RUN_STATUS,
+            workflow_run_id=self._workflow_run_id,
+            task=TASK_MAIN_ID,
+            step=STEP_MAIN_ID,
+            status=WorkflowStatus.COMPLETED,
+        )
+
+    def workflow_id(self) -> str:
+        return self._workflow_id
+
+    def workflow_run_id(self) -> str:
+        return self._workflow_run_id
+
+    def finalized_workflow_run(self) -> Optional[imperative.WorkflowRun]:
+        """The completed workflow run, if we can load it from storage"""
+        return self._load_run()
+
+    def is_open(self) -> bool:
+        return False
+
+    def is_closed(self) -> bool:
+        return True
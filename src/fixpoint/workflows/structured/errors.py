@@ -5,8 +5,13 @@ __all__ = [
     "DefinitionError",
     "ExecutionError",
     "InternalError",
+    "JobResultError",
+    "NoAcceptedResultError",
+    "SchedulerFullError",
 ]
 
+from typing import List
+
 from fixpoint.errors import FixpointException
 
 
@@ -47,3 +52,33 @@ class ExecutionError(StructuredException):
 
 class InternalError(StructuredException):
     """An internal error (non-user) in the structured workflows library"""
+
+
+class JobResultError(StructuredException):
+    """Raised when a job queue can't store the result of a workflow job
+
+    Job queues store results as JSON. A worker that gets this error fails the
+    job without retrying it, because every retry would return the same result.
+    """
+
+
+class SchedulerFullError(StructuredException):
+    """Raised when a workflow scheduler's queue is full
+
+    A `WorkflowScheduler` configured with `on_full="reject"` raises this instead
+    of queueing another workflow run.
+    """
+
+
+class NoAcceptedResultError(StructuredException):
+    """Raised when no branch of a `structured.race` gave an accepted result
+
+    `errors` has the exceptions of the branches that failed. The other branches
+    finished with results that were not accepted.
+    """
+
+    errors: List[BaseException]
+
+    def __init__(self, msg: str, errors: List[BaseException]) -> None:
+        super().__init__(msg)
+        self.errors = errors
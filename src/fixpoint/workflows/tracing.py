@@ -0,0 +1,371 @@
+"""Tracing workflow execution
+
+A `Tracer` records a span for each workflow run, task call, step call, and
+agent completion, so you can see where a workflow spends its time. Each span
+has its duration, the IDs of its workflow run, task, and step, and extra
+attributes such as whether a task or step result came from the call cache, or
+how many tokens an agent completion used.
+
+We track the current span with context variables, so spans nest correctly
+across concurrent tasks and steps. Spans are kept in memory and can be exported
+to a file, either as OTLP JSON, which OpenTelemetry tools can import, or as a
+Chrome trace, which you can open in Perfetto or `chrome://tracing`. You don't
+need a running trace collector.
+
+```
+tracer = Tracer()
+run_config = structured.RunConfig.with_in_memory()
+run_config.tracer = tracer
+await structured.run_workflow(MyWorkflow.main, run_config=run_config, agents=[])
+tracer.export_chrome_trace("trace.json")
+```
+"""
+
+__all__ = [
+    "Span",
+    "SpanStatus",
+    "Tracer",
+    "current_span",
+    "current_tracer",
+    "span",
+]
+
+from collections import deque
+import contextvars
+from dataclasses import dataclass, field
+from enum import Enum
+import json
+import os
+import threading
+import time
+from types import TracebackType
+from typing import Any, Deque, Dict, List, Optional, Type, Union
+
+from fixpoint._protocols.workflow_run import WorkflowRunData
+
+
+DEFAULT_MAX_SPANS = 100_000
+
+AttributeValue = Union[str, int, float, bool]
+
+
+class SpanStatus(Enum):
+    """How the work in a span ended"""
+
+    UNSET = "UNSET"
+    OK = "OK"
+    ERROR = "ERROR"
+
+
+@dataclass
+class Span:
+    """A timed unit of work, such as a step call"""
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    # nanoseconds since the epoch
+    start_ns: int = 0
+    end_ns: Optional[int] = None
+    attributes: Dict[str, AttributeValue] = field(default_factory=dict)
+    status: SpanStatus = SpanStatus.UNSET
+    status_message: Optional[str] = None
+
+    @property
+    def duration_ns(self) -> Optional[int]:
+        """How long the span took, or None if it has not ended"""
+        if self.end_ns is None:
+            return None
+        return self.end_ns - self.start_ns
+
+    def set_attribute(self, key: str, value: Optional[AttributeValue]) -> None:
+        """Set an attribute on the span. We skip attributes that are None."""
+        if value is not None:
+            self.attributes[key] = value
+
+
+_current_tracer: contextvars.ContextVar[Optional["Tracer"]] = contextvars.ContextVar(
+    "fixpoint_tracer", default=None
+)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "fixpoint_span", default=None
+)
+
+
+def current_tracer() -> Optional["Tracer"]:
+    """The tracer that is active in the current context, if any"""
+    return _current_tracer.get()
+
+
+def current_span() -> Optional[Span]:
+    """The span that is open in the current context, if any"""
+    return _current_span.get()
+
+
+class Tracer:
+    """Records spans in memory and exports them to trace files
+
+    We keep at most `max_spans` spans, dropping the oldest ones first.
+    """
+
+    _lock: threading.Lock
+    _spans: Deque[Span]
+    _dropped_spans: int
+
+    def __init__(self, max_spans: Optional[int] = DEFAULT_MAX_SPANS) -> None:
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+        self._dropped_spans = 0
+
+    def activate(self) -> "_ActiveTracer":
+        """Make this the tracer for the current context
+
+        Use it as a context manager. Spans opened with `span(...)` inside of it
+        are recorded by this tracer.
+        """
+        return _ActiveTracer(self)
+
+    def span(
+        self,
+        name: str,
+        workflow_run: Optional[WorkflowRunData] = None,
+        **attributes: Optional[AttributeValue],
+    ) -> "_OpenSpan":
+        """Open a span, as a child of the current span
+
+        Use it as a context manager. If you pass in a `workflow_run`, the span
+        gets the IDs of the run and of the task and step it is in.
+        """
+        parent = _current_span.get()
+        new_span = Span(
+            name=name,
+            trace_id=os.urandom(16).hex() if parent is None else parent.trace_id,
+            span_id=os.urandom(8).hex(),
+            parent_id=None if parent is None else parent.span_id,
+        )
+        if workflow_run is not None:
+            _set_run_attributes(new_span, workflow_run)
+        for key, value in attributes.items():
+            new_span.set_attribute(key, value)
+        return _OpenSpan(self, new_span)
+
+    def spans(self) -> List[Span]:
+        """The spans that have ended, in the order they ended"""
+        with self._lock:
+            return list(self._spans)
+
+    @property
+    def dropped_spans(self) -> int:
+        """The number of spans we dropped to stay under `max_spans`"""
+        return self._dropped_spans
+
+    def clear(self) -> None:
+        """Drop all recorded spans"""
+        with self._lock:
+            self._spans.clear()
+            self._dropped_spans = 0
+
+    def to_otlp_json(self, service_name: str = "fixpoint") -> Dict[str, Any]:
+        """The recorded spans, in the OTLP JSON format"""
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes({"service.name": service_name})
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [_otlp_span(s) for s in self.spans()],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """The recorded spans, in the Chrome trace event format
+
+        Each span is a pair of nestable async events, grouped by trace, because
+        concurrent steps in a workflow run overlap without nesting.
+        """
+        pid = os.getpid()
+        events: List[Dict[str, Any]] = []
+        for s in self.spans():
+            if s.end_ns is None:
+                continue
+            base = {"name": s.name, "cat": "fixpoint", "pid": pid, "id": s.trace_id}
+            events.append(
+                {
+                    **base,
+                    "ph": "b",
+                    "ts": s.start_ns / 1000,
+                    "args": {**s.attributes, "status": s.status.value},
+                }
+            )
+            events.append({**base, "ph": "e", "ts": s.end_ns / 1000})
+        events.sort(key=lambda event: event["ts"])
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_otlp_json(self, path: str, service_name: str = "fixpoint") -> None:
+        """Write the recorded spans to a file, in the OTLP JSON format"""
+        _write_json(path, self.to_otlp_json(service_name))
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Write the recorded spans to a file, in the Chrome trace event format"""
+        _write_json(path, self.to_chrome_trace())
+
+    def _record(self, ended: Span) -> None:
+        with self._lock:
+            if len(self._spans) == self._spans.maxlen:
+                self._dropped_spans += 1
+            self._spans.append(ended)
+
+
+class _ActiveTracer:
+    _tracer: Tracer
+    _token: Optional[contextvars.Token[Optional[Tracer]]]
+
+    def __init__(self, tracer: Tracer) -> None:
+        self._tracer = tracer
+        self._token = None
+
+    def __enter__(self) -> Tracer:
+        self._token = _current_tracer.set(self._tracer)
+        return self._tracer
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        if self._token is not None:
+            _current_tracer.reset(self._token)
+
+
+class _OpenSpan:
+    _tracer: Tracer
+    _span: Span
+    _start: int
+    _token: Optional[contextvars.Token[Optional[Span]]]
+
+    def __init__(self, tracer: Tracer, new_span: Span) -> None:
+        self._tracer = tracer
+        self._span = new_span
+        self._start = 0
+        self._token = None
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self._span)
+        self._span.start_ns = time.time_ns()
+        # measure the duration with a monotonic clock
+        self._start = time.perf_counter_ns()
+        return self._span
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        ended = self._span
+        ended.end_ns = ended.start_ns + time.perf_counter_ns() - self._start
+        if exc_val is not None:
+            ended.status = SpanStatus.ERROR
+            ended.status_message = f"{type(exc_val).__name__}: {exc_val}"
+        elif ended.status == SpanStatus.UNSET:
+            ended.status = SpanStatus.OK
+        if self._token is not None:
+            _current_span.reset(self._token)
+        self._tracer._record(ended)  # pylint: disable=protected-access
+
+
+class _NoOpSpan:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        return None
+
+
+_NOOP_SPAN = _NoOpSpan()
+
+
+def span(
+    name: str,
+    workflow_run: Optional[WorkflowRunData] = None,
+    **attributes: Optional[AttributeValue],
+) -> Union[_OpenSpan, _NoOpSpan]:
+    """Open a span with the current tracer
+
+    Use it as a context manager, which gives you the `Span`, or None if there
+    is no active tracer. Without an active tracer this does nothing, so it is
+    cheap to call on hot paths.
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return _NOOP_SPAN
+    return tracer.span(name, workflow_run, **attributes)
+
+
+def _set_run_attributes(new_span: Span, workflow_run: WorkflowRunData) -> None:
+    new_span.set_attribute("workflow.id", workflow_run.workflow_id)
+    new_span.set_attribute("workflow.run_id", workflow_run.id)
+    # A WorkflowRun knows which task and step it is in, but other
+    # WorkflowRunData might not
+    node_info = getattr(workflow_run, "node_info", None)
+    if node_info is not None:
+        new_span.set_attribute("workflow.task", node_info.task)
+        new_span.set_attribute("workflow.step", node_info.step)
+
+
+def _otlp_span(s: Span) -> Dict[str, Any]:
+    otlp: Dict[str, Any] = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        # SPAN_KIND_INTERNAL
+        "kind": 1,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns if s.end_ns is not None else s.start_ns),
+        "attributes": _otlp_attributes(s.attributes),
+        "status": {"code": _OTLP_STATUS_CODES[s.status]},
+    }
+    if s.parent_id is not None:
+        otlp["parentSpanId"] = s.parent_id
+    if s.status_message is not None:
+        otlp["status"]["message"] = s.status_message
+    return otlp
+
+
+_OTLP_STATUS_CODES = {SpanStatus.UNSET: 0, SpanStatus.OK: 1, SpanStatus.ERROR: 2}
+
+
+def _otlp_attributes(attributes: Dict[str, AttributeValue]) -> List[Dict[str, Any]]:
+    return [
+        {"key": key, "value": _otlp_value(value)} for key, value in attributes.items()
+    ]
+
+
+def _otlp_value(value: AttributeValue) -> Dict[str, Any]:
+    # bool is a subclass of int, so check it first
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP JSON encodes 64-bit integers as strings
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
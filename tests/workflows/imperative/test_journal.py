@@ -0,0 +1,276 @@
+import hashlib
+import pathlib
+import sqlite3
+import threading
+from typing import Iterator, List, Optional
+
+from pydantic import BaseModel
+import pytest
+
+from fixpoint.agents import BaseAgent
+from fixpoint.agents.mock import MockAgent, new_mock_completion
+from fixpoint.workflows import WorkflowStatus, imperative, structured
+from fixpoint.workflows.imperative import (
+    InMemRunJournal,
+    JournalEvent,
+    JournalEventKind,
+    OnDiskRunJournal,
+    RunJournal,
+    StorageConfig,
+)
+from fixpoint.workflows.imperative.workflow_context import WorkflowContext
+
+
+class Answer(BaseModel):
+    answer: Optional[str] = None
+
+
+@pytest.fixture(params=["in_mem", "on_disk"])
+def journal(request: pytest.FixtureRequest) -> Iterator[RunJournal]:
+    if request.param == "in_mem":
+        yield InMemRunJournal(snapshot_every=3)
+    else:
+        with sqlite3.connect(":memory:") as conn:
+            yield OnDiskRunJournal(conn, snapshot_every=3)
+
+
+def new_storage_config(journal: RunJournal) -> StorageConfig:
+    storage_config = StorageConfig.with_in_memory()
+    storage_config.run_journal = journal
+    return storage_config
+
+
+def test_journal_records_and_replays_run(journal: RunJournal) -> None:
+    workflow = imperative.Workflow(id="journaled")
+    run = workflow.run(storage_config=new_storage_config(journal))
+    step = run.spawn_step("my-step")
+    run.docs.store(id="doc", contents="draft")
+    step.close(WorkflowStatus.COMPLETED)
+    run.docs.update(document_id="doc", contents="final")
+    run.forms.store(schema=Answer, form_id="form")
+    run.state["done"] = True
+    run.save(status=WorkflowStatus.COMPLETED)
+
+    events = journal.events(run.id)
+    assert [event.kind for event in events] == [
+        JournalEventKind.RUN_STATUS,
+        JournalEventKind.NODE_STARTED,
+        JournalEventKind.DOCUMENT_STORED,
+        JournalEventKind.NODE_CLOSED,
+        JournalEventKind.DOCUMENT_STORED,
+        JournalEventKind.FORM_STORED,
+        JournalEventKind.RUN_STATUS,
+    ]
+    assert [event.seq for event in events] == list(range(1, 8))
+
+    snapshot = journal.load(run.id)
+    assert snapshot is not None
+    assert snapshot.seq == 7
+    assert snapshot.workflow_id == "journaled"
+    assert snapshot.status == WorkflowStatus.COMPLETED
+    assert snapshot.state == {"done": True}
+    assert snapshot.documents["doc"]["contents"] == "final"
+    assert snapshot.forms["form"]["contents"] == {"answer": None}
+    root, child = snapshot.build_nodes()
+    assert child.prev_state == root
+    assert child.info.step == "my-step"
+    assert child.info.status == WorkflowStatus.COMPLETED
+
+    # time travel to just after the document was first stored
+    earlier = journal.load(run.id, at_seq=3)
+    assert earlier is not None
+    assert earlier.seq == 3
+    assert earlier.status == WorkflowStatus.RUNNING
+    assert earlier.documents["doc"]["contents"] == "draft"
+    assert earlier.nodes[1]["status"] == WorkflowStatus.RUNNING.value
+    assert not earlier.forms
+
+    assert journal.load("unknown-run") is None
+
+
+def test_load_run_from_journal(journal: RunJournal) -> None:
+    storage_config = new_storage_config(journal)
+    run = imperative.Workflow(id="journaled").run(storage_config=storage_config)
+    run.spawn_task("my-task").close(WorkflowStatus.FAILED)
+    run.docs.store(id="doc", contents="contents")
+    run.save(status=WorkflowStatus.FAILED)
+
+    other_workflow = imperative.Workflow(id="journaled")
+    loaded = other_workflow.load_run(run.id, storage_config=storage_config)
+    assert loaded is not None
+    assert loaded.attempt_id == run.attempt_id
+    assert loaded.status == WorkflowStatus.FAILED
+    # pylint: disable=protected-access
+    [child] = loaded._node_state.next_states
+    assert child.info.task == "my-task"
+    assert child.info.status == WorkflowStatus.FAILED
+    doc = loaded.docs.get("doc")
+    assert doc is not None
+    assert doc.contents == "contents"
+
+    # the loaded run keeps appending to the same journal
+    retried = other_workflow.retry(run.id, storage_config=storage_config)
+    retried.spawn_step("after-retry")
+    events = journal.events(run.id)
+    assert [event.seq for event in events] == list(range(1, len(events) + 1))
+    snapshot = journal.load(run.id)
+    assert snapshot is not None
+    assert snapshot.attempt_id == retried.attempt_id
+    assert [node["step"] for node in snapshot.nodes][-1] == "after-retry"
+    assert snapshot.nodes[-1]["parent"] == 0
+
+    assert (
+        imperative.Workflow(id="other").load_run(run.id, storage_config=storage_config)
+        is None
+    )
+
+
+def test_journal_records_agent_calls() -> None:
+    journal = InMemRunJournal()
+    run = imperative.Workflow(id="journaled").run(
+        storage_config=new_storage_config(journal)
+    )
+    agents: List[BaseAgent] = [
+        MockAgent(completion_fn=new_mock_completion, agent_id="agent")
+    ]
+    ctx = WorkflowContext(agents=agents, workflow_run=run)
+    ctx.agents["agent"].create_completion(
+        messages=[{"role": "user", "content": "hi"}], model="gpt-4o"
+    )
+    [event] = [
+        event
+        for event in journal.events(run.id)
+        if event.kind == JournalEventKind.AGENT_CALL
+    ]
+    assert event.data == {"agent_id": "agent", "model": "gpt-4o"}
+
+
+@structured.step(id="double")
+async def double(_ctx: structured.WorkflowContext, x: int) -> int:
+    return x * 2
+
+
+@structured.workflow(id="journaled-structured")
+class JournaledWorkflow:
+    @structured.workflow_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, x: int) -> int:
+        return await structured.call_step(ctx, double, args=[x])
+
+
+@pytest.mark.asyncio
+async def test_journal_records_call_cache_writes() -> None:
+    journal = InMemRunJournal()
+    run_config = structured.RunConfig.with_in_memory()
+    run_config.storage.run_journal = journal
+    handle = structured.spawn_workflow(
+        JournaledWorkflow.main, run_config=run_config, agents=[], args=[21]
+    )
+    assert await handle.result() == 42
+
+    snapshot = journal.load(handle.workflow_run_id())
+    assert snapshot is not None
+    assert snapshot.status == WorkflowStatus.COMPLETED
+    # the journal refers to the cached result instead of copying it
+    digest = hashlib.sha256(b'{"args":[21],"kwargs":{}}').hexdigest()
+    [write] = [
+        event
+        for event in journal.events(handle.workflow_run_id())
+        if event.kind == JournalEventKind.CACHE_WRITE
+    ]
+    assert write.data == {"cache": "step", "kind_id": "double", "args_digest": digest}
+    assert snapshot.cache["step/double"] == {digest: write.seq}
+    assert [(node["step"], node["status"]) for node in snapshot.nodes[1:]] == [
+        ("double", WorkflowStatus.COMPLETED.value)
+    ]
+
+
+@structured.step(id="to-bytes")
+async def to_bytes(_ctx: structured.WorkflowContext, x: int) -> bytes:
+    return str(x).encode()
+
+
+@structured.workflow(id="journaled-bytes")
+class JournaledBytesWorkflow:
+    @structured.workflow_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, x: int) -> bytes:
+        return await structured.call_step(ctx, to_bytes, args=[x])
+
+
+class BrokenJournal(InMemRunJournal):
+    def append(self, event: JournalEvent) -> None:
+        if event.kind == JournalEventKind.CACHE_WRITE:
+            raise OSError("disk full")
+        super().append(event)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("broken", [False, True])
+async def test_journaling_never_fails_a_step(
+    tmp_path: pathlib.Path, broken: bool
+) -> None:
+    run_config = structured.RunConfig.with_disk(
+        storage_path=tmp_path.as_posix(),
+        agent_cache_ttl_s=60,
+        callcache_ttl_s=60,
+        callcache_codec="pickle",
+    )
+    journal = BrokenJournal() if broken else InMemRunJournal()
+    run_config.storage.run_journal = journal
+    handle = structured.spawn_workflow(
+        JournaledBytesWorkflow.main, run_config=run_config, agents=[], args=[7]
+    )
+    # a result the journal can't encode as JSON, or a journal that fails to
+    # write, still leaves the step completed
+    assert await handle.result() == b"7"
+    snapshot = journal.load(handle.workflow_run_id())
+    assert snapshot is not None
+    assert snapshot.status == WorkflowStatus.COMPLETED
+    assert [node["status"] for node in snapshot.nodes[1:]] == [
+        WorkflowStatus.COMPLETED.value
+    ]
+    assert bool(snapshot.cache) is not broken
+
+
+def test_on_disk_journal_batches_writes_and_keeps_latest_snapshot(
+    tmp_path: pathlib.Path,
+) -> None:
+    db_path = (tmp_path / "journal.db").as_posix()
+    with sqlite3.connect(db_path, check_same_thread=False) as conn:
+        journal = OnDiskRunJournal(conn, snapshot_every=4, flush_every=100)
+        run = imperative.Workflow(id="journaled").run(
+            storage_config=new_storage_config(journal)
+        )
+
+        def spawn_steps(thread: int) -> None:
+            for i in range(5):
+                run.spawn_step(f"step-{thread}-{i}")
+
+        threads = [threading.Thread(target=spawn_steps, args=[t]) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with sqlite3.connect(db_path) as reader:
+
+            def stored(table: str) -> List[int]:
+                return [
+                    row[0]
+                    for row in reader.execute(f"SELECT seq FROM {table} ORDER BY seq")
+                ]
+
+            # the run's first status was flushed, and a snapshot flushes the
+            # events before it
+            assert stored("workflow_run_events") == list(range(1, 21))
+            assert stored("workflow_run_snapshots") == [20]
+
+            run.save(status=WorkflowStatus.COMPLETED)
+            assert stored("workflow_run_events") == list(range(1, 23))
+
+        snapshot = journal.load(run.id)
+        assert snapshot is not None
+        assert snapshot.status == WorkflowStatus.COMPLETED
+        assert len(snapshot.nodes) == 21
+        earlier = journal.load(run.id, at_seq=10)
+        assert earlier is not None
+        assert len(earlier.nodes) == 10
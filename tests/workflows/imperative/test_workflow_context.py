@@ -3,6 +3,7 @@ from typing import List
 from fixpoint.cache import ChatCompletionTLRUCache
 from fixpoint.agents import BaseAgent
 from fixpoint.agents.mock import MockAgent, new_mock_completion
+from fixpoint.memory import Memory, NoOpMemory
 from fixpoint.workflows import imperative
 from fixpoint.workflows.imperative._wrapped_workflow_agents import WrappedWorkflowAgents
 from fixpoint.workflows.imperative.workflow_context import WorkflowContext
@@ -80,12 +81,13 @@ class TestWorkflowContext:
 
         new_wfctx = wfctx.clone()
 
-        # agents should be cloned
+        # agents should be cloned, sharing the run's views of the agents
         assert [
             agent._inner_agent
             for agent in new_wfctx.agents.values()
             if isinstance(agent, WorkflowAgent)
-        ] == agents
+        ] == list(wfctx.agents._inner_agents.values())
+        assert [agent.id for agent in new_wfctx.agents.values()] == ["agent1", "agent2"]
         assert new_wfctx.agents is not wfctx.agents
 
         # workflow_run should be cloned
@@ -95,3 +97,86 @@ class TestWorkflowContext:
         # cache and logger are preserved
         assert new_wfctx.cache is cache
         assert new_wfctx.logger is wfctx.logger
+
+
+class TestCopyOnWriteClone:
+    def test_agents_are_wrapped_lazily(self) -> None:
+        agents: List[BaseAgent] = [
+            MockAgent(completion_fn=new_mock_completion, agent_id=f"agent{i}")
+            for i in range(3)
+        ]
+        workflow_run = imperative.Workflow(id="test_workflow").run()
+        wfctx = WorkflowContext(agents=agents, workflow_run=workflow_run)
+
+        new_wfctx = wfctx.clone(new_step="my-step")
+        # clones share the inner agents, and don't wrap them until they are used
+        assert new_wfctx.agents._inner_agents is wfctx.agents._inner_agents
+        assert not new_wfctx.agents._agents
+        agent = new_wfctx.agents["agent1"]
+        assert isinstance(agent, WorkflowAgent)
+        assert agent._workflow_run is new_wfctx.workflow_run
+        assert list(new_wfctx.agents._agents) == ["agent1"]
+
+        # adding an agent to a clone does not change the original
+        new_wfctx.agents["extra"] = MockAgent(
+            completion_fn=new_mock_completion, agent_id="extra"
+        )
+        assert "extra" in new_wfctx.agents.keys()
+        assert "extra" not in wfctx.agents.keys()
+
+    def test_runs_get_their_own_agent_memory(self) -> None:
+        cache = ChatCompletionTLRUCache(maxsize=10, ttl_s=60)
+        shared = MockAgent(
+            completion_fn=new_mock_completion, agent_id="shared", cache=cache
+        )
+        workflow = imperative.Workflow(id="test_workflow")
+        wfctx1 = WorkflowContext(agents=[shared], workflow_run=workflow.run())
+        wfctx2 = WorkflowContext(agents=[shared], workflow_run=workflow.run())
+
+        wfctx1.agents["shared"].create_completion(messages=[])
+        # the caller's agent is left alone
+        assert isinstance(shared.memory, NoOpMemory)
+        # each run has its own memory, and shares the rest of the agent
+        run_agent1 = wfctx1.agents._inner_agents["shared"]
+        run_agent2 = wfctx2.agents._inner_agents["shared"]
+        assert run_agent1.memory is not run_agent2.memory
+        assert len(list(run_agent1.memory.memories())) == 1
+        assert not list(run_agent2.memory.memories())
+        assert run_agent1._cache is cache  # type: ignore[attr-defined]
+        # clones in a run share the run's memory
+        assert wfctx1.clone(new_step="s").agents["shared"].memory is run_agent1.memory
+
+        # agents that come with memory keep it
+        memory = Memory()
+        with_memory = MockAgent(
+            completion_fn=new_mock_completion, agent_id="with_memory", memory=memory
+        )
+        wfctx3 = WorkflowContext(agents=[with_memory], workflow_run=workflow.run())
+        assert wfctx3.agents._inner_agents["with_memory"] is with_memory
+
+    def test_clone_only_copies_current_node(self) -> None:
+        workflow_run = imperative.Workflow(id="test_workflow").run()
+        wfctx = WorkflowContext(agents=[], workflow_run=workflow_run)
+        new_wfctx = wfctx.clone(new_task="my-task", new_step="my-step")
+
+        assert new_wfctx.workflow_run.node_info.id == "my-task/my-step"
+        assert wfctx.workflow_run.node_info.id != "my-task/my-step"
+        assert new_wfctx.workflow_run.docs is wfctx.workflow_run.docs
+        assert new_wfctx.workflow_run.state is wfctx.workflow_run.state
+
+        # nodes added through the clone are part of the same node tree
+        new_wfctx.workflow_run.spawn_step("child")
+        assert [
+            node.info.step for node in wfctx.workflow_run._node_state.next_states
+        ] == ["child"]
+
+    def test_logger_handlers_are_not_duplicated(self) -> None:
+        workflow = imperative.Workflow(id="test_workflow")
+        workflow_run = workflow.run()
+        wfctx = WorkflowContext(agents=[], workflow_run=workflow_run)
+        num_handlers = len(wfctx.logger.handlers)
+        retried = WorkflowContext(
+            agents=[], workflow_run=workflow.retry(workflow_run.id)
+        )
+        assert retried.logger is wfctx.logger
+        assert len(retried.logger.handlers) == num_handlers
@@ -0,0 +1,228 @@
+import gc
+import os
+import pathlib
+import sqlite3
+
+import pytest
+
+from fixpoint.workflows import WorkflowStatus, imperative, structured
+from fixpoint.workflows.imperative import (
+    InMemWorkflowRunStorage,
+    OnDiskWorkflowRunStorage,
+    PostgresWorkflowRunStorage,
+    StorageConfig,
+    WorkflowRunData,
+    WorkflowRunStorage,
+)
+from fixpoint.workflows.structured._workflow import get_workflow_definition_meta_fixp
+
+
+def check_storage_roundtrip(storage: WorkflowRunStorage, workflow_id: str) -> None:
+    run = WorkflowRunData(
+        id=f"run-{os.urandom(4).hex()}",
+        workflow_id=workflow_id,
+        attempt_id="attempt-1",
+        status=WorkflowStatus.RUNNING,
+        state={"counter": 1},
+        node_tree={"info": {"task": "main", "step": "main"}, "next_states": []},
+    )
+    storage.store(run)
+    other = run.model_copy(update={"id": f"run-{os.urandom(4).hex()}"})
+    storage.store(other)
+
+    loaded = storage.get(run.id)
+    assert loaded is not None
+    assert loaded.state == {"counter": 1}
+    assert loaded.status == WorkflowStatus.RUNNING
+    assert loaded.created_at > 0
+
+    run.attempt_id = "attempt-2"
+    run.status = WorkflowStatus.COMPLETED
+    storage.store(run)
+    loaded = storage.get(run.id)
+    assert loaded is not None
+    assert loaded.attempt_id == "attempt-2"
+    assert loaded.status == WorkflowStatus.COMPLETED
+
+    assert storage.get("does-not-exist") is None
+    assert [r.id for r in storage.list(workflow_id=workflow_id)] == [run.id, other.id]
+    assert [
+        r.id
+        for r in storage.list(workflow_id=workflow_id, status=WorkflowStatus.RUNNING)
+    ] == [other.id]
+
+
+def test_in_mem_storage() -> None:
+    check_storage_roundtrip(InMemWorkflowRunStorage(), "workflow")
+
+
+def test_on_disk_storage() -> None:
+    with sqlite3.connect(":memory:") as conn:
+        check_storage_roundtrip(OnDiskWorkflowRunStorage(conn), "workflow")
+
+
+@pytest.mark.skipif(
+    not os.environ.get("POSTGRES_URL"),
+    reason="Disabled until we have a Postgres test database",
+)
+def test_postgres_storage() -> None:
+    # pylint: disable=import-outside-toplevel
+    from psycopg_pool import ConnectionPool
+
+    with ConnectionPool(os.environ["POSTGRES_URL"]) as pool:
+        check_storage_roundtrip(
+            PostgresWorkflowRunStorage(pool), f"workflow-{os.urandom(4).hex()}"
+        )
+
+
+def test_load_run_from_storage() -> None:
+    storage_config = StorageConfig.with_in_memory()
+    storage_config.workflow_run_storage = InMemWorkflowRunStorage()
+
+    workflow = imperative.Workflow(id="my-workflow")
+    run = workflow.run(storage_config=storage_config)
+    run.state["progress"] = "halfway"
+    step = run.spawn_step("my-step")
+    step.close(WorkflowStatus.COMPLETED)
+    run.save(status=WorkflowStatus.FAILED)
+
+    # another process, with its own copy of the workflow
+    other_workflow = imperative.Workflow(id="my-workflow")
+    loaded = other_workflow.load_run(run.id, storage_config=storage_config)
+    assert loaded is not None
+    assert loaded.id == run.id
+    assert loaded.attempt_id == run.attempt_id
+    assert loaded.status == WorkflowStatus.FAILED
+    assert loaded.state == {"progress": "halfway"}
+    # pylint: disable=protected-access
+    [child] = loaded._node_state.next_states
+    assert child.info.step == "my-step"
+    assert child.info.status == WorkflowStatus.COMPLETED
+    assert child.prev_state == loaded._node_state
+
+    retried = other_workflow.retry(run.id, storage_config=storage_config)
+    assert retried.attempt_id != run.attempt_id
+    assert retried.status == WorkflowStatus.RUNNING
+
+    assert (
+        imperative.Workflow(id="other-workflow").load_run(
+            run.id, storage_config=storage_config
+        )
+        is None
+    )
+
+
+@pytest.mark.asyncio
+async def test_retry_structured_run_in_another_process(tmp_path: pathlib.Path) -> None:
+    calls = {"num": 0}
+
+    @structured.workflow(id="retry-anywhere")
+    class Workflow:
+        @structured.workflow_entrypoint()
+        async def main(self, ctx: structured.WorkflowContext) -> str:
+            calls["num"] += 1
+            if calls["num"] == 1:
+                raise RuntimeError("first attempt fails")
+            return ctx.workflow_run.id
+
+    def new_run_config() -> structured.RunConfig:
+        return structured.RunConfig.with_disk(
+            storage_path=tmp_path.as_posix(),
+            agent_cache_ttl_s=60,
+            callcache_ttl_s=60,
+        )
+
+    run_config = new_run_config()
+    with pytest.raises(structured.ExecutionError) as exc_info:
+        await structured.run_workflow(Workflow.main, run_config=run_config, agents=[])
+    run_id = exc_info.value.workflow_run_id
+    run_storage = run_config.storage.workflow_run_storage
+    assert run_storage is not None
+    stored = run_storage.get(run_id)
+    assert stored is not None
+    assert stored.status == WorkflowStatus.FAILED
+
+    # Forget the run, as if we were a different process
+    meta = get_workflow_definition_meta_fixp(Workflow)
+    assert meta is not None
+    meta.workflow._memory.clear()  # pylint: disable=protected-access
+
+    other_config = new_run_config()
+    res = await structured.retry_workflow(
+        Workflow.main, run_id=run_id, run_config=other_config, agents=[]
+    )
+    assert res == run_id
+    other_storage = other_config.storage.workflow_run_storage
+    assert other_storage is not None
+    stored_after = other_storage.get(run_id)
+    assert stored_after is not None
+    assert stored_after.status == WorkflowStatus.COMPLETED
+    assert stored_after.attempt_id != stored.attempt_id
+
+
+def test_closed_runs_are_evicted_and_reloaded() -> None:
+    storage_config = StorageConfig.with_in_memory()
+    storage_config.workflow_run_storage = InMemWorkflowRunStorage()
+    workflow = imperative.Workflow(id="bounded-workflow", max_closed_runs=2)
+
+    runs = [workflow.run(storage_config=storage_config) for _ in range(4)]
+    run_ids = [run.id for run in runs]
+    stats = workflow.run_registry_stats()
+    assert (stats.open_runs, stats.closed_runs, stats.evicted_runs) == (4, 0, 0)
+
+    for run in runs:
+        run.save(status=WorkflowStatus.COMPLETED)
+    stats = workflow.run_registry_stats()
+    assert (stats.open_runs, stats.closed_runs, stats.evicted_runs) == (0, 2, 2)
+    assert stats.size == 2
+
+    # an evicted run that is still referenced comes back as the same object
+    assert workflow.load_run(run_ids[0], storage_config=storage_config) is runs[0]
+
+    # an evicted run that nothing references is reloaded from storage
+    del runs, run
+    gc.collect()
+    reloaded = workflow.load_run(run_ids[1], storage_config=storage_config)
+    assert reloaded is not None
+    assert reloaded.id == run_ids[1]
+    assert reloaded.status == WorkflowStatus.COMPLETED
+    assert reloaded.storage_config is storage_config
+
+    # retrying a run reopens it
+    retried = workflow.retry(run_ids[2], storage_config=storage_config)
+    stats = workflow.run_registry_stats()
+    assert (stats.open_runs, stats.closed_runs) == (1, 1)
+    assert workflow.load_run(run_ids[2]) is retried
+
+
+def test_open_runs_are_evicted_once_unreferenced() -> None:
+    storage_config = StorageConfig.with_in_memory()
+    storage_config.workflow_run_storage = InMemWorkflowRunStorage()
+    # by default, open runs are never evicted
+    default_workflow = imperative.Workflow(id="unbounded-open-workflow")
+    for _ in range(20):
+        default_workflow.run(storage_config=storage_config)
+    gc.collect()
+    stats = default_workflow.run_registry_stats()
+    assert (stats.open_runs, stats.evicted_runs) == (20, 0)
+
+    workflow = imperative.Workflow(id="bounded-open-workflow", max_open_runs=2)
+    # callers of Workflow.run() often never close their runs
+    runs = [workflow.run(storage_config=storage_config) for _ in range(4)]
+    run_ids = [run.id for run in runs]
+    stats = workflow.run_registry_stats()
+    assert (stats.open_runs, stats.closed_runs, stats.evicted_runs) == (2, 0, 2)
+
+    # an evicted open run that is still referenced is the same object
+    assert workflow.load_run(run_ids[0]) is runs[0]
+    assert workflow.run_registry_stats().open_runs == 2
+
+    # an evicted open run that nothing references is dropped from memory, and
+    # reloaded from storage
+    del runs
+    gc.collect()
+    assert workflow.run_registry_stats().size == 2
+    reloaded = workflow.load_run(run_ids[1], storage_config=storage_config)
+    assert reloaded is not None
+    assert reloaded.id == run_ids[1]
+    assert reloaded.status == WorkflowStatus.RUNNING
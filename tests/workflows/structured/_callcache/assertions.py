@@ -1,5 +1,6 @@
 from fixpoint.workflows.structured._callcache import (
     CallCache,
+    RunAwareCallCache,
     serialize_args,
     CacheResult,
 )
@@ -47,3 +48,44 @@ def assert_cache_works(cache: CallCache) -> None:
         run_id="run-1", kind_id="my-kind-2", serialized_args=serialized_new
     )
     assert not res_diff_kind.found
+
+
+def assert_invalidate_works(cache: RunAwareCallCache) -> None:
+    args0 = serialize_args(0)
+    args1 = serialize_args(1)
+    for run_id in ["run-1", "run-2"]:
+        for kind_id in ["kind-1", "kind-2"]:
+            for args in [args0, args1]:
+                cache.store_result(
+                    run_id=run_id, kind_id=kind_id, serialized_args=args, res=args
+                )
+
+    def is_cached(run_id: str, kind_id: str, args: str) -> bool:
+        return cache.check_cache(
+            run_id=run_id, kind_id=kind_id, serialized_args=args
+        ).found
+
+    # invalidate a single call
+    cache.invalidate(run_id="run-1", kind_id="kind-1", serialized_args=args0)
+    assert not is_cached("run-1", "kind-1", args0)
+    assert is_cached("run-1", "kind-1", args1)
+    assert is_cached("run-1", "kind-2", args0)
+
+    # invalidate all calls of a task or step
+    cache.invalidate(run_id="run-1", kind_id="kind-1")
+    assert not is_cached("run-1", "kind-1", args1)
+    assert is_cached("run-1", "kind-2", args0)
+    assert is_cached("run-1", "kind-2", args1)
+
+    # invalidate a whole run
+    cache.invalidate(run_id="run-1")
+    assert not is_cached("run-1", "kind-2", args0)
+    assert not is_cached("run-1", "kind-2", args1)
+
+    # other runs are untouched
+    for kind_id in ["kind-1", "kind-2"]:
+        for args in [args0, args1]:
+            assert is_cached("run-2", kind_id, args)
+
+    # invalidating a run without cached results is a no-op
+    cache.invalidate(run_id="run-3")
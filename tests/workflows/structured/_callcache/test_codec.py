@@ -0,0 +1,94 @@
+import os
+import pathlib
+import pickle
+from dataclasses import dataclass
+from typing import Any, Tuple
+
+import pytest
+
+from fixpoint.workflows.structured._callcache import (
+    CacheResult,
+    JSONCodec,
+    PickleCodec,
+    StepDiskCallCache,
+)
+
+
+@dataclass
+class DC:
+    val: int
+
+
+class ZeroCopyByteArray(bytearray):
+    """A bytearray that pickles its contents out-of-band"""
+
+    def __reduce_ex__(self, protocol: Any) -> Tuple[Any, ...]:
+        return (type(self)._reconstruct, (pickle.PickleBuffer(self),))
+
+    @classmethod
+    def _reconstruct(cls, obj: Any) -> Any:
+        if isinstance(obj, cls):
+            return obj
+        # Don't copy buffers that were pickled out-of-band, which might be
+        # backed by a memory-mapped file
+        return memoryview(obj)
+
+
+def test_json_codec() -> None:
+    codec = JSONCodec()
+    stored = codec.encode({"a": [1, 2]})
+    assert isinstance(stored, str)
+    assert codec.decode(stored) == {"a": [1, 2]}
+    assert codec.decode(codec.encode(DC(val=1)), DC) == DC(val=1)
+
+
+def test_pickle_codec_inline() -> None:
+    codec = PickleCodec()
+    res = {"bytes": b"\x00\x01", "set": {1, 2}, "dc": DC(val=1)}
+    assert codec.decode(codec.encode(res)) == res
+    big = ZeroCopyByteArray(b"x" * 1024)
+    assert bytes(codec.decode(codec.encode(big))) == bytes(big)
+
+
+def test_pickle_codec_out_of_band(tmp_path: pathlib.Path) -> None:
+    blob_dir = tmp_path / "blobs"
+    codec = PickleCodec(blob_dir=blob_dir.as_posix(), out_of_band_min_bytes=100)
+    small = ZeroCopyByteArray(b"s" * 10)
+    big = ZeroCopyByteArray(b"b" * 1000)
+
+    stored = codec.encode({"small": small, "big": big, "again": big})
+    _, data, blob_names = stored
+    # only the big buffer is written out, and identical buffers share a blob
+    assert len(data) < 1000
+    assert len(set(blob_names)) == 1
+    blob_files = [p for p in blob_dir.rglob("*") if p.is_file()]
+    assert len(blob_files) == 1
+    assert os.path.getsize(blob_files[0]) == 1000
+
+    decoded = codec.decode(stored)
+    assert bytes(decoded["small"]) == bytes(small)
+    assert bytes(decoded["big"]) == bytes(big)
+    # the big buffer is read through a read-only memory map
+    assert isinstance(decoded["big"], memoryview)
+    assert decoded["big"].readonly
+
+
+def test_pickle_codec_rejects_json() -> None:
+    with pytest.raises(ValueError):
+        PickleCodec().decode(JSONCodec().encode([1, 2]))
+
+
+def test_disk_cache_with_pickle_codec(tmp_path: pathlib.Path) -> None:
+    codec = PickleCodec(blob_dir=tmp_path.as_posix(), out_of_band_min_bytes=100)
+    cache = StepDiskCallCache.from_tmpdir(codec=codec)
+    res = (DC(val=1), ZeroCopyByteArray(b"b" * 1000))
+    cache.store_result(run_id="run", kind_id="kind", serialized_args="s0", res=res)
+
+    for c in [cache, cache.prefetch_run("run")]:
+        cached: CacheResult[Tuple[DC, Any]] = c.check_cache(
+            run_id="run", kind_id="kind", serialized_args="s0"
+        )
+        assert cached.found
+        assert cached.result is not None
+        assert cached.result[0] == DC(val=1)
+        assert bytes(cached.result[1]) == b"b" * 1000
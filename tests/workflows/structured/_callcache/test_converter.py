@@ -1,8 +1,15 @@
+from dataclasses import dataclass
+from enum import IntEnum
 import json
-from typing import get_type_hints
+from typing import Dict, List, Literal, Optional, Set, Tuple, get_type_hints
+
+import pytest
 
 from fixpoint.workflows.structured._callcache._shared import default_json_dumps
-from fixpoint.workflows.structured._callcache._converter import value_to_type
+from fixpoint.workflows.structured._callcache._converter import (
+    compile_converter,
+    value_to_type,
+)
 
 from .fixtures import PBM, PBMInner, DC, DCInner
 
@@ -41,3 +48,67 @@ def test_dataclass_converter() -> None:
 
     assert isinstance(deserialized_res, DC)
     assert deserialized_res == computed_res
+
+
+@dataclass
+class TreeNode:
+    value: int
+    children: List["TreeNode"]
+    parent_value: Optional[int] = None
+
+
+class Color(IntEnum):
+    RED = 1
+    BLUE = 2
+
+
+def test_compiled_converter_is_cached() -> None:
+    assert compile_converter(List[DC]) is compile_converter(List[DC])
+
+
+def test_compiled_converter_list_of_dataclasses() -> None:
+    values = [
+        DC(xyz=DCInner(key200={"a": i}, key100=i), abc={"b": i}, middle=[str(i)])
+        for i in range(10)
+    ]
+    raw = json.loads(default_json_dumps(values))
+    assert compile_converter(List[DC])(raw) == values
+
+
+def test_compiled_converter_recursive_dataclass() -> None:
+    tree = TreeNode(
+        value=1,
+        children=[
+            TreeNode(value=2, children=[], parent_value=1),
+            TreeNode(
+                value=3,
+                children=[TreeNode(value=4, children=[], parent_value=3)],
+                parent_value=1,
+            ),
+        ],
+    )
+    raw = json.loads(default_json_dumps(tree))
+    assert compile_converter(TreeNode)(raw) == tree
+
+
+def test_compiled_converter_containers() -> None:
+    assert compile_converter(Tuple[int, str])([1, "a"]) == (1, "a")
+    assert compile_converter(Tuple[int, ...])([1, 2, 3]) == (1, 2, 3)
+    assert compile_converter(Set[int])([1, 2]) == {1, 2}
+    assert compile_converter(Dict[str, Color])({"a": 1}) == {"a": Color.RED}
+    assert compile_converter(Optional[PBMInner])(None) is None
+    assert compile_converter(Optional[PBMInner])(
+        {"key200": {"a": 1}, "key100": 2}
+    ) == PBMInner(key200={"a": 1}, key100=2)
+    assert compile_converter(Literal["a", "b"])("a") == "a"
+
+
+def test_compiled_converter_errors() -> None:
+    with pytest.raises(TypeError):
+        compile_converter(Tuple[int, str])([1, "a", "b"])
+    with pytest.raises(TypeError):
+        compile_converter(List[int])([1, "a"])
+    with pytest.raises(TypeError):
+        compile_converter(DC)([1, 2])
+    with pytest.raises(TypeError):
+        compile_converter(Literal["a", "b"])("c")
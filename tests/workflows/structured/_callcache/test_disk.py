@@ -1,16 +1,21 @@
 from dataclasses import dataclass
 from typing import Type
+import tempfile
+
+import diskcache
 import pytest
 
 from pydantic import BaseModel
 
+from fixpoint.workflows.node_state import WorkflowStatus
 from fixpoint.workflows.structured._callcache import CacheResult
+from fixpoint.workflows.structured._callcache import _disk
 from fixpoint.workflows.structured._callcache._disk import (
     StepDiskCallCache,
     TaskDiskCallCache,
 )
 
-from .assertions import assert_cache_works
+from .assertions import assert_cache_works, assert_invalidate_works
 
 
 @dataclass
@@ -30,6 +35,13 @@ class TestDiskCallCache:
         cache = cache_cls.from_tmpdir()
         assert_cache_works(cache)
 
+    @pytest.mark.parametrize("cache_cls", [StepDiskCallCache, TaskDiskCallCache])
+    def test_invalidate(
+        self, cache_cls: Type[StepDiskCallCache | TaskDiskCallCache]
+    ) -> None:
+        cache = cache_cls.from_tmpdir()
+        assert_invalidate_works(cache)
+
     @pytest.mark.parametrize("cache_cls", [StepDiskCallCache, TaskDiskCallCache])
     def test_pydantic(
         self, cache_cls: Type[StepDiskCallCache | TaskDiskCallCache]
@@ -57,3 +69,128 @@ class TestDiskCallCache:
         )
         assert cached.found
         assert cached.result == res
+
+    @pytest.mark.parametrize("cache_cls", [StepDiskCallCache, TaskDiskCallCache])
+    def test_prefetch_run(
+        self, cache_cls: Type[StepDiskCallCache | TaskDiskCallCache]
+    ) -> None:
+        dcache = diskcache.Cache(directory=tempfile.mkdtemp())
+        cache = cache_cls(dcache)
+        for i in range(10):
+            cache.store_result(
+                run_id="run-1", kind_id=f"kind-{i}", serialized_args="s0", res=i
+            )
+        cache.store_result(
+            run_id="run-2", kind_id="kind-0", serialized_args="s0", res=100
+        )
+
+        prefetched = cache.prefetch_run("run-1")
+        # The run's results are loaded on the first lookup of one of them
+        cache.store_result(
+            run_id="run-1", kind_id="kind-late", serialized_args="s0", res=11
+        )
+        assert prefetched.check_cache(
+            run_id="run-1", kind_id="kind-late", serialized_args="s0"
+        ).found
+        # The prefetched results are served from memory, so they survive the
+        # underlying storage going away.
+        dcache.clear()
+        for i in range(10):
+            res: CacheResult[int] = prefetched.check_cache(
+                run_id="run-1", kind_id=f"kind-{i}", serialized_args="s0"
+            )
+            assert res.found
+            assert res.result == i
+        # Other runs fall through to the underlying cache
+        assert not prefetched.check_cache(
+            run_id="run-2", kind_id="kind-0", serialized_args="s0"
+        ).found
+
+        # New results are written through to the underlying cache
+        prefetched.store_result(
+            run_id="run-1", kind_id="kind-new", serialized_args="s0", res=5
+        )
+        assert cache.check_cache(
+            run_id="run-1", kind_id="kind-new", serialized_args="s0"
+        ).found
+        # and replace what we prefetched for the same call
+        prefetched.store_result(
+            run_id="run-1", kind_id="kind-1", serialized_args="s0", res=50
+        )
+        assert (
+            prefetched.check_cache(
+                run_id="run-1", kind_id="kind-1", serialized_args="s0"
+            ).result
+            == 50
+        )
+
+        # Invalidations apply to the prefetched results too
+        prefetched.invalidate(run_id="run-1", kind_id="kind-0")
+        assert not prefetched.check_cache(
+            run_id="run-1", kind_id="kind-0", serialized_args="s0"
+        ).found
+
+    @pytest.mark.parametrize("cache_cls", [StepDiskCallCache, TaskDiskCallCache])
+    def test_prefetch_run_with_type_hint(
+        self, cache_cls: Type[StepDiskCallCache | TaskDiskCallCache]
+    ) -> None:
+        cache = cache_cls.from_tmpdir()
+        cache.store_result(
+            run_id="run", kind_id="kind", serialized_args="s0", res=RetDataClass(val=1)
+        )
+        prefetched = cache.prefetch_run("run")
+        cached: CacheResult[RetDataClass] = prefetched.check_cache(
+            run_id="run", kind_id="kind", serialized_args="s0", type_hint=RetDataClass
+        )
+        assert cached.found
+        assert cached.result == RetDataClass(val=1)
+
+    @pytest.mark.parametrize("cache_cls", [StepDiskCallCache, TaskDiskCallCache])
+    def test_run_index_lives_on_entries(
+        self, cache_cls: Type[StepDiskCallCache | TaskDiskCallCache]
+    ) -> None:
+        dcache = diskcache.Cache(directory=tempfile.mkdtemp())
+        cache = cache_cls(dcache)
+        for i in range(5):
+            cache.store_result(
+                run_id="run", kind_id=f"kind-{i % 2}", serialized_args=f"s{i}", res=i
+            )
+        # storing a result doesn't write a separate index entry
+        assert len(dcache) == 5
+
+        cache.invalidate(run_id="run", kind_id="kind-0")
+        assert len(dcache) == 2
+        assert cache.check_cache(
+            run_id="run", kind_id="kind-1", serialized_args="s1"
+        ).found
+        assert cache.drop_run("run") == 2
+        assert len(dcache) == 0
+
+    @pytest.mark.parametrize("cache_cls", [StepDiskCallCache, TaskDiskCallCache])
+    def test_without_raw_queries(
+        self,
+        cache_cls: Type[StepDiskCallCache | TaskDiskCallCache],
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        # On diskcache versions we don't know, we stick to its public API
+        monkeypatch.setattr(_disk, "_KNOWN_DISKCACHE_VERSION_PREFIX", "0.0.")
+        dcache = diskcache.Cache(directory=tempfile.mkdtemp())
+        cache = cache_cls(dcache)
+        for i in range(4):
+            cache.store_result(
+                run_id="run", kind_id=f"kind-{i % 2}", serialized_args=f"s{i}", res=i
+            )
+        cache.store_result(
+            run_id="other", kind_id="kind-0", serialized_args="s0", res=100
+        )
+        cache.close_run("other", WorkflowStatus.COMPLETED)
+
+        assert set(cache.load_run("run")) == {
+            ("kind-0", "s0"),
+            ("kind-1", "s1"),
+            ("kind-0", "s2"),
+            ("kind-1", "s3"),
+        }
+        cache.invalidate(run_id="run", kind_id="kind-0")
+        assert set(cache.load_run("run")) == {("kind-1", "s1"), ("kind-1", "s3")}
+        assert set(cache.load_run("other")) == {("kind-0", "s0")}
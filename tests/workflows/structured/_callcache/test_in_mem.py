@@ -1,12 +1,16 @@
-from typing import Type
+from typing import List, Type
 import pytest
 
+from fixpoint.workflows.node_state import WorkflowStatus
+from fixpoint.workflows.structured._callcache import CacheResult
 from fixpoint.workflows.structured._callcache._in_mem import (
     StepInMemCallCache,
     TaskInMemCallCache,
+    StepBoundedInMemCallCache,
+    TaskBoundedInMemCallCache,
 )
 
-from .assertions import assert_cache_works
+from .assertions import assert_cache_works, assert_invalidate_works
 
 
 class TestInMemCallCache:
@@ -16,3 +20,143 @@ class TestInMemCallCache:
     ) -> None:
         cache = cache_cls()
         assert_cache_works(cache)
+
+    @pytest.mark.parametrize("cache_cls", [StepInMemCallCache, TaskInMemCallCache])
+    def test_invalidate(
+        self, cache_cls: Type[StepInMemCallCache | TaskInMemCallCache]
+    ) -> None:
+        cache = cache_cls()
+        assert_invalidate_works(cache)
+
+
+class FakeTimer:
+    now: float
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+BoundedCacheCls = Type[StepBoundedInMemCallCache | TaskBoundedInMemCallCache]
+_bounded_classes: List[BoundedCacheCls] = [
+    StepBoundedInMemCallCache,
+    TaskBoundedInMemCallCache,
+]
+
+
+class TestBoundedInMemCallCache:
+    @pytest.mark.parametrize("cache_cls", _bounded_classes)
+    def test_basic(self, cache_cls: BoundedCacheCls) -> None:
+        assert_cache_works(cache_cls(max_entries=100))
+        assert_invalidate_works(cache_cls(max_entries=100))
+
+    @pytest.mark.parametrize("cache_cls", _bounded_classes)
+    def test_evicts_least_recently_used_runs(self, cache_cls: BoundedCacheCls) -> None:
+        cache = cache_cls(max_entries=4)
+        for run_id in ["run-1", "run-2"]:
+            cache.store_result(run_id, "step", "a", 1)
+            cache.store_result(run_id, "step", "b", 2)
+        # touch run-1 so that run-2 is the least recently used
+        assert cache.check_cache("run-1", "step", "a").found
+        cache.store_result("run-3", "step", "a", 3)
+
+        assert cache.check_cache("run-1", "step", "b").found
+        assert not cache.check_cache("run-2", "step", "a").found
+        assert cache.check_cache("run-3", "step", "a").found
+        stats = cache.stats()
+        assert stats.entries == 3
+        assert stats.runs == 2
+        assert stats.evicted_runs == 1
+        assert stats.evicted_entries == 2
+
+    @pytest.mark.parametrize("cache_cls", _bounded_classes)
+    def test_evicts_closed_runs_first(self, cache_cls: BoundedCacheCls) -> None:
+        cache = cache_cls(max_entries=2)
+        cache.store_result("run-1", "step", "a", 1)
+        cache.store_result("run-2", "step", "a", 2)
+        cache.close_run("run-2", WorkflowStatus.FAILED)
+        cache.store_result("run-3", "step", "a", 3)
+
+        assert cache.check_cache("run-1", "step", "a").found
+        assert not cache.check_cache("run-2", "step", "a").found
+        assert cache.check_cache("run-3", "step", "a").found
+
+    @pytest.mark.parametrize("cache_cls", _bounded_classes)
+    def test_byte_budget(self, cache_cls: BoundedCacheCls) -> None:
+        cache = cache_cls(max_bytes=10, sizeof=len)
+        cache.store_result("run-1", "step", "a", "x" * 6)
+        cache.store_result("run-1", "step", "b", "x" * 3)
+        assert cache.stats().size_bytes == 9
+        # a single run over budget evicts its own oldest results
+        cache.store_result("run-1", "step", "c", "x" * 4)
+        assert not cache.check_cache("run-1", "step", "a").found
+        assert cache.check_cache("run-1", "step", "b").found
+        assert cache.check_cache("run-1", "step", "c").found
+        assert cache.stats().size_bytes == 7
+        # results larger than the whole cache are not stored
+        cache.store_result("run-1", "step", "d", "x" * 11)
+        assert not cache.check_cache("run-1", "step", "d").found
+        assert cache.stats().size_bytes == 7
+
+    @pytest.mark.parametrize("cache_cls", _bounded_classes)
+    def test_overwrite_entry(self, cache_cls: BoundedCacheCls) -> None:
+        cache = cache_cls(max_entries=10, max_bytes=100, sizeof=len)
+        # the entry is its run's only one
+        cache.store_result("run-1", "step", "a", "x" * 5)
+        cache.store_result("run-1", "step", "a", "y" * 3)
+        res: CacheResult[str] = cache.check_cache("run-1", "step", "a")
+        assert res.found
+        assert res.result == "yyy"
+        stats = cache.stats()
+        assert (stats.entries, stats.size_bytes, stats.runs) == (1, 3, 1)
+
+        cache.store_result("run-1", "step", "b", "z" * 4)
+        cache.store_result("run-1", "step", "b", "z" * 2)
+        stats = cache.stats()
+        assert (stats.entries, stats.size_bytes, stats.runs) == (2, 5, 1)
+
+    @pytest.mark.parametrize("cache_cls", _bounded_classes)
+    def test_entry_ttl(self, cache_cls: BoundedCacheCls) -> None:
+        timer = FakeTimer()
+        cache = cache_cls(ttl_s=10, timer=timer)
+        cache.store_result("run-1", "step", "a", 1)
+        timer.now = 9
+        assert cache.check_cache("run-1", "step", "a").found
+        timer.now = 10
+        assert not cache.check_cache("run-1", "step", "a").found
+        stats = cache.stats()
+        assert stats.expired_entries == 1
+        assert stats.entries == 0
+        assert stats.hits == 1
+        assert stats.misses == 1
+
+    @pytest.mark.parametrize("cache_cls", _bounded_classes)
+    def test_drops_completed_runs(self, cache_cls: BoundedCacheCls) -> None:
+        timer = FakeTimer()
+        cache = cache_cls(completed_run_ttl_s=60, timer=timer)
+        cache.store_result("run-1", "step", "a", 1)
+        cache.store_result("run-2", "step", "a", 2)
+        cache.close_run("run-1", WorkflowStatus.COMPLETED)
+        cache.close_run("run-2", WorkflowStatus.FAILED)
+
+        timer.now = 59
+        assert cache.check_cache("run-1", "step", "a").found
+        timer.now = 60
+        assert not cache.check_cache("run-1", "step", "a").found
+        # failed runs are kept so that they can be retried
+        assert cache.check_cache("run-2", "step", "a").found
+        assert cache.stats().runs == 1
+
+    @pytest.mark.parametrize("cache_cls", _bounded_classes)
+    def test_retrying_reopens_run(self, cache_cls: BoundedCacheCls) -> None:
+        timer = FakeTimer()
+        cache = cache_cls(completed_run_ttl_s=60, timer=timer)
+        cache.store_result("run-1", "step", "a", 1)
+        cache.close_run("run-1", WorkflowStatus.COMPLETED)
+        timer.now = 30
+        cache.store_result("run-1", "step", "b", 2)
+        timer.now = 100
+        assert cache.check_cache("run-1", "step", "a").found
+        assert cache.check_cache("run-1", "step", "b").found
@@ -0,0 +1,155 @@
+import pathlib
+import pickle
+import time
+from typing import Any, Tuple
+
+import diskcache
+
+from fixpoint.workflows import structured
+from fixpoint.workflows.node_state import WorkflowStatus
+from fixpoint.workflows.structured._callcache import (
+    PickleCodec,
+    StepDiskCallCache,
+    TaskDiskCallCache,
+    compact_disk_call_cache,
+)
+from fixpoint.workflows.structured._callcache._shared import run_meta_key
+from fixpoint.workflows.structured.__main__ import main as cli_main
+
+
+HOUR = 60 * 60
+
+
+class ZeroCopyByteArray(bytearray):
+    def __reduce_ex__(self, protocol: Any) -> Tuple[Any, ...]:
+        return (type(self), (pickle.PickleBuffer(self),))
+
+
+def _store_run(
+    step_cache: StepDiskCallCache, task_cache: TaskDiskCallCache, run_id: str
+) -> None:
+    step_cache.store_result(run_id=run_id, kind_id="step", serialized_args="a", res=1)
+    step_cache.store_result(run_id=run_id, kind_id="step", serialized_args="b", res=2)
+    task_cache.store_result(run_id=run_id, kind_id="task", serialized_args="a", res=3)
+
+
+def _is_cached(step_cache: StepDiskCallCache, run_id: str) -> bool:
+    return step_cache.check_cache(
+        run_id=run_id, kind_id="step", serialized_args="a"
+    ).found
+
+
+def test_compact_drops_old_completed_runs(tmp_path: pathlib.Path) -> None:
+    cache = diskcache.Cache(directory=tmp_path.as_posix())
+    step_cache, task_cache = StepDiskCallCache(cache), TaskDiskCallCache(cache)
+    for run_id in ["completed", "failed", "open", "retried"]:
+        _store_run(step_cache, task_cache, run_id)
+    for run_id, status in [
+        ("completed", WorkflowStatus.COMPLETED),
+        ("failed", WorkflowStatus.FAILED),
+        ("retried", WorkflowStatus.FAILED),
+    ]:
+        step_cache.close_run(run_id, status)
+        task_cache.close_run(run_id, status)
+    # prefetching a run to retry it doesn't re-open it, but starting it does
+    step_cache.prefetch_run("retried")
+    assert run_meta_key("retried") in cache
+    step_cache.reopen_run("retried")
+
+    # nothing is old enough to compact yet
+    report = compact_disk_call_cache(cache, completed_run_ttl_s=HOUR, vacuum=False)
+    assert report.runs_removed == 0
+
+    report = compact_disk_call_cache(
+        cache, completed_run_ttl_s=HOUR, now=time.time() + 2 * HOUR
+    )
+    assert report.runs_removed == 1
+    assert report.entries_removed == 3
+    assert not _is_cached(step_cache, "completed")
+    assert _is_cached(step_cache, "failed")
+    assert _is_cached(step_cache, "open")
+    assert _is_cached(step_cache, "retried")
+
+    report = compact_disk_call_cache(
+        cache,
+        completed_run_ttl_s=HOUR,
+        failed_run_ttl_s=HOUR,
+        now=time.time() + 2 * HOUR,
+    )
+    assert report.runs_removed == 1
+    assert not _is_cached(step_cache, "failed")
+    assert _is_cached(step_cache, "open")
+    assert _is_cached(step_cache, "retried")
+
+
+def test_compact_removes_unreferenced_blobs(tmp_path: pathlib.Path) -> None:
+    blob_dir = tmp_path / "blobs"
+    codec = PickleCodec(blob_dir=blob_dir.as_posix(), out_of_band_min_bytes=100)
+    cache = diskcache.Cache(directory=(tmp_path / "cache").as_posix())
+    step_cache = StepDiskCallCache(cache, codec=codec)
+    for run_id, payload in [("run-1", b"1"), ("run-2", b"2")]:
+        step_cache.store_result(
+            run_id=run_id,
+            kind_id="step",
+            serialized_args="a",
+            res=ZeroCopyByteArray(payload * 100_000),
+        )
+    step_cache.close_run("run-1", WorkflowStatus.COMPLETED)
+
+    report = compact_disk_call_cache(
+        cache,
+        completed_run_ttl_s=HOUR,
+        blob_dir=blob_dir.as_posix(),
+        now=time.time() + 2 * HOUR,
+    )
+    assert report.runs_removed == 1
+    assert report.blobs_removed == 1
+    assert report.bytes_reclaimed >= 100_000
+    assert len([p for p in blob_dir.rglob("*") if p.is_file()]) == 1
+    assert _is_cached(step_cache, "run-2")
+
+
+def test_compact_call_cache_cli(tmp_path: pathlib.Path, capsys: Any) -> None:
+    run_config = structured.RunConfig.with_disk(
+        storage_path=tmp_path.as_posix(),
+        agent_cache_ttl_s=HOUR,
+        callcache_ttl_s=HOUR,
+        callcache_pin_open_runs=True,
+    )
+    run_config.call_cache.steps.store_result("run", "step", "a", 1)
+    run_config.call_cache.close_run("run", WorkflowStatus.COMPLETED)
+
+    cli_main(
+        ["compact-callcache", tmp_path.as_posix(), "--completed-run-ttl-hours", "1"]
+    )
+    assert "Removed 0 runs" in capsys.readouterr().out
+
+    report = structured.compact_call_cache(tmp_path.as_posix(), completed_run_ttl_s=0)
+    assert report.runs_removed == 1
+
+
+def test_pinning_keeps_open_runs_and_evicts_the_rest(tmp_path: pathlib.Path) -> None:
+    run_config = structured.RunConfig.with_disk(
+        storage_path=tmp_path.as_posix(),
+        agent_cache_ttl_s=HOUR,
+        callcache_ttl_s=HOUR,
+        callcache_size_limit_bytes=500_000,
+        callcache_pin_open_runs=True,
+    )
+    steps = run_config.call_cache.steps
+    payload = "x" * 10_000
+    for i in range(20):
+        steps.store_result("open", "step", str(i), payload)
+    for run in range(10):
+        for i in range(20):
+            steps.store_result(f"closed-{run}", "step", str(i), payload)
+            steps.store_result(f"__memo__/step/v{run}", "step", str(i), payload)
+        run_config.call_cache.close_run(f"closed-{run}", WorkflowStatus.COMPLETED)
+
+    # the open run's results are all kept
+    for i in range(20):
+        assert steps.check_cache("open", "step", str(i)).found
+    # and everything else is evicted to stay near the size limit
+    with diskcache.Cache(directory=(tmp_path / "callcache").as_posix()) as cache:
+        assert len(cache) < 100
+        assert cache.volume() < 1_000_000
@@ -1,4 +1,13 @@
+from typing import Any, Dict, Optional, Tuple, Type
+
+from fixpoint.workflows.node_state import WorkflowStatus
 from fixpoint.workflows.structured._callcache._shared import (
+    CacheResult,
+    CallCacheKind,
+    close_run,
+    invalidate_results,
+    prefetch_run,
+    reopen_run,
     serialize_args,
 )
 
@@ -49,3 +58,40 @@ class TestSerializeArgs:
             serialize_args(1, {"b": 200, "a": 100}, x=50, a=4, d={"xyz": 90, "abc": 10})
             == '{"args":[1,{"a":100,"b":200}],"kwargs":{"a":4,"d":{"abc":10,"xyz":90},"x":50}}'
         )
+
+
+class _MinimalCallCache:
+    """A call cache that only implements the required methods"""
+
+    cache_kind = CallCacheKind.STEP
+
+    def __init__(self) -> None:
+        self.results: Dict[Tuple[str, str, str], Any] = {}
+
+    def check_cache(
+        self,
+        run_id: str,
+        kind_id: str,
+        serialized_args: str,
+        type_hint: Optional[Type[Any]] = None,
+    ) -> CacheResult[Any]:
+        key = (run_id, kind_id, serialized_args)
+        if key in self.results:
+            return CacheResult[Any](found=True, result=self.results[key])
+        return CacheResult[Any](found=False, result=None)
+
+    def store_result(
+        self, run_id: str, kind_id: str, serialized_args: str, res: Any
+    ) -> None:
+        self.results[(run_id, kind_id, serialized_args)] = res
+
+
+def test_run_methods_are_optional() -> None:
+    cache = _MinimalCallCache()
+    cache.store_result(run_id="run", kind_id="kind", serialized_args="s0", res=1)
+
+    assert prefetch_run(cache, "run") is cache
+    close_run(cache, "run", WorkflowStatus.COMPLETED)
+    reopen_run(cache, "run")
+    invalidate_results(cache, "run")
+    assert cache.check_cache(run_id="run", kind_id="kind", serialized_args="s0").found
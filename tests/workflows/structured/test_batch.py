@@ -0,0 +1,174 @@
+import asyncio
+import json
+import pathlib
+from typing import Any, Dict, List
+
+from pydantic import BaseModel
+import pytest
+
+from fixpoint.workflows import structured
+from fixpoint.workflows.structured import BatchProgress
+
+
+class Record(BaseModel):
+    n: int
+
+
+_calls: Dict[int, int] = {}
+_in_flight = 0
+_max_in_flight = 0
+_unblocked = asyncio.Event()
+
+
+@structured.step(id="square")
+async def square(_ctx: structured.WorkflowContext, n: int) -> int:
+    global _in_flight, _max_in_flight  # pylint: disable=global-statement
+    _calls[n] = _calls.get(n, 0) + 1
+    _in_flight += 1
+    _max_in_flight = max(_max_in_flight, _in_flight)
+    try:
+        if n >= 4:
+            await _unblocked.wait()
+        if n == 7:
+            raise ValueError("seven")
+        return n * n
+    finally:
+        _in_flight -= 1
+
+
+@structured.workflow(id="batched")
+class BatchedWorkflow:
+    @structured.workflow_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, record: Record) -> int:
+        return await structured.call_step(ctx, square, args=[record.n])
+
+
+def _read_output(path: pathlib.Path) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.asyncio
+async def test_batch_resumes_after_interruption(tmp_path: pathlib.Path) -> None:
+    inputs_path = tmp_path / "inputs.jsonl"
+    with open(inputs_path, "w", encoding="utf-8") as f:
+        for n in range(10):
+            f.write(json.dumps({"n": n}) + "\n")
+    output_path = tmp_path / "output.jsonl"
+    checkpoint_path = tmp_path / "checkpoint.json"
+    run_config = structured.RunConfig.with_in_memory()
+    reports: List[BatchProgress] = []
+
+    def run_batch() -> "asyncio.Task[BatchProgress]":
+        return asyncio.create_task(
+            structured.run_workflow_batch(
+                BatchedWorkflow.main,
+                inputs=str(inputs_path),
+                run_config=run_config,
+                concurrency=2,
+                output_path=str(output_path),
+                checkpoint_path=str(checkpoint_path),
+                on_progress=reports.append,
+                progress_interval_s=0,
+            )
+        )
+
+    # records from 4 on block, so the first batch finishes records 0-3 and
+    # then hangs until we interrupt it
+    batch = run_batch()
+    while len(_read_output(output_path) if output_path.exists() else []) < 4:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    batch.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await batch
+    assert sorted(line["index"] for line in _read_output(output_path)) == [0, 1, 2, 3]
+
+    _unblocked.set()
+    progress = await run_batch()
+    assert progress.skipped == 4
+    assert progress.completed == 5
+    assert progress.failed == 1
+    assert progress.in_flight == 0
+    assert reports[-1] == progress
+
+    lines = {line["index"]: line for line in _read_output(output_path)}
+    assert len(_read_output(output_path)) == 10
+    assert lines[3]["result"] == 9
+    assert lines[9]["status"] == "COMPLETED"
+    assert lines[7]["status"] == "FAILED"
+    assert lines[7]["error"] == "seven"
+    assert len({line["run_id"] for line in lines.values()}) == 10
+    # records we finished are not run again on resume
+    assert all(_calls[n] == 1 for n in range(4))
+    assert _max_in_flight <= 2
+
+
+@pytest.mark.asyncio
+async def test_batch_progress_and_retry_failed(tmp_path: pathlib.Path) -> None:
+    checkpoint_path = tmp_path / "checkpoint.json"
+    run_config = structured.RunConfig.with_in_memory()
+    _unblocked.set()
+    records = [Record(n=n) for n in (1, 7, 2)]
+
+    progress = await structured.run_workflow_batch(
+        BatchedWorkflow.main,
+        inputs=records,
+        run_config=run_config,
+        checkpoint_path=str(checkpoint_path),
+        on_progress=lambda _: None,
+    )
+    assert (progress.total, progress.completed, progress.failed) == (3, 2, 1)
+    assert progress.throughput > 0
+    assert progress.eta_s == 0
+
+    # without retry_failed, the failed record stays done
+    progress = await structured.run_workflow_batch(
+        BatchedWorkflow.main,
+        inputs=records,
+        run_config=run_config,
+        checkpoint_path=str(checkpoint_path),
+        on_progress=lambda _: None,
+    )
+    assert (progress.skipped, progress.completed, progress.failed) == (3, 0, 0)
+
+    progress = await structured.run_workflow_batch(
+        BatchedWorkflow.main,
+        inputs=records,
+        run_config=run_config,
+        checkpoint_path=str(checkpoint_path),
+        retry_failed=True,
+        on_progress=lambda _: None,
+    )
+    assert (progress.skipped, progress.completed, progress.failed) == (2, 0, 1)
+    assert progress.batch_id.startswith("batch-")
+
+
+@structured.workflow(id="batched-unserializable")
+class UnserializableWorkflow:
+    @structured.workflow_entrypoint()
+    async def main(self, _ctx: structured.WorkflowContext, record: Record) -> Any:
+        if record.n == 2:
+            return {record.n}
+        return record.n
+
+
+@pytest.mark.asyncio
+async def test_batch_unserializable_result(tmp_path: pathlib.Path) -> None:
+    output_path = tmp_path / "output.jsonl"
+    progress = await structured.run_workflow_batch(
+        UnserializableWorkflow.main,
+        inputs=[Record(n=n) for n in range(3)],
+        run_config=structured.RunConfig.with_in_memory(),
+        output_path=str(output_path),
+        on_progress=lambda _: None,
+    )
+    assert (progress.completed, progress.failed) == (2, 1)
+
+    lines = {line["index"]: line for line in _read_output(output_path)}
+    assert [lines[n]["status"] for n in range(3)] == [
+        "COMPLETED",
+        "COMPLETED",
+        "FAILED",
+    ]
+    assert "not JSON serializable" in lines[2]["error"]
@@ -0,0 +1,136 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from fixpoint.workflows import WorkflowStatus, structured
+from fixpoint.workflows.structured import WorkflowEvent, WorkflowEventKind
+
+
+@structured.step(id="draft")
+async def draft(ctx: structured.WorkflowContext, topic: str) -> str:
+    await ctx.emit(f"drafting {topic}")
+    return f"draft about {topic}"
+
+
+@structured.task(id="write")
+class Write:
+    @structured.task_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, topic: str) -> str:
+        text = await structured.call_step(ctx, draft, args=[topic])
+        return text.upper()
+
+
+@structured.workflow(id="streaming")
+class StreamingWorkflow:
+    @structured.workflow_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, topic: str) -> str:
+        return await structured.call_task(ctx, Write.main, args=[topic])
+
+
+@pytest.mark.asyncio
+async def test_stream_events() -> None:
+    handle = structured.spawn_workflow(
+        StreamingWorkflow.main,
+        run_config=structured.RunConfig.with_in_memory(),
+        agents=[],
+        args=["cats"],
+    )
+    events = [event async for event in handle.events()]
+    assert await handle.result() == "DRAFT ABOUT CATS"
+
+    run_id = handle.workflow_run_id()
+    assert all(event.workflow_run_id == run_id for event in events)
+    assert [
+        (event.kind, event.task, event.step, event.status, event.value)
+        for event in events
+    ] == [
+        (
+            WorkflowEventKind.RUN_STATUS,
+            "__main__",
+            "__main__",
+            WorkflowStatus.RUNNING,
+            None,
+        ),
+        (WorkflowEventKind.EMITTED, "write", "draft", None, "drafting cats"),
+        (
+            WorkflowEventKind.STEP_CLOSED,
+            "write",
+            "draft",
+            WorkflowStatus.COMPLETED,
+            "draft about cats",
+        ),
+        (
+            WorkflowEventKind.TASK_CLOSED,
+            "write",
+            "__main__",
+            WorkflowStatus.COMPLETED,
+            "DRAFT ABOUT CATS",
+        ),
+        (
+            WorkflowEventKind.RUN_STATUS,
+            "__main__",
+            "__main__",
+            WorkflowStatus.COMPLETED,
+            None,
+        ),
+    ]
+
+    # the run is over, so there is nothing more to read
+    assert [event async for event in handle.events()] == []
+
+
+@structured.workflow(id="chatty")
+class ChattyWorkflow:
+    @structured.workflow_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, progress: List[int]) -> int:
+        for i in range(10):
+            await ctx.emit(i)
+            progress.append(i)
+        raise ValueError("done talking")
+
+
+@pytest.mark.asyncio
+async def test_slow_reader_applies_backpressure() -> None:
+    progress: List[int] = []
+    handle = structured.spawn_workflow(
+        ChattyWorkflow.main,
+        run_config=structured.RunConfig.with_in_memory(),
+        agents=[],
+        args=[progress],
+    )
+    read: List[WorkflowEvent] = []
+    async for event in handle.events(max_buffered=2):
+        read.append(event)
+        await asyncio.sleep(0.001)
+        emitted = sum(1 for e in read if e.kind == WorkflowEventKind.EMITTED)
+        # the workflow can't get more than the buffer size ahead of us
+        assert len(progress) <= emitted + 2
+
+    assert [e.value for e in read if e.kind == WorkflowEventKind.EMITTED] == list(
+        range(10)
+    )
+    assert read[-1].status == WorkflowStatus.FAILED
+    with pytest.raises(structured.ExecutionError):
+        await handle.result()
+
+
+@pytest.mark.asyncio
+async def test_reader_can_stop_early() -> None:
+    progress: List[int] = []
+    handle = structured.spawn_workflow(
+        ChattyWorkflow.main,
+        run_config=structured.RunConfig.with_in_memory(),
+        agents=[],
+        args=[progress],
+    )
+    events = handle.events(max_buffered=1)
+    async for event in events:
+        assert event.kind == WorkflowEventKind.RUN_STATUS
+        break
+    await events.aclose()
+
+    # the workflow runs to the end without a reader
+    with pytest.raises(structured.ExecutionError):
+        await handle.result()
+    assert progress == list(range(10))
@@ -0,0 +1,316 @@
+import asyncio
+from dataclasses import dataclass
+import os
+import pathlib
+from typing import List
+
+import pytest
+
+from fixpoint.workflows import structured
+from fixpoint.workflows.structured import Job, JobStatus
+
+
+class FakeTimer:
+    now: float
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def new_job(workflow_id: str = "wf", priority: int = 0, max_attempts: int = 2) -> Job:
+    return Job(
+        id=f"job-{os.urandom(4).hex()}",
+        workflow_id=workflow_id,
+        run_id=f"run-{os.urandom(4).hex()}",
+        args=[{"a": 1}],
+        priority=priority,
+        max_attempts=max_attempts,
+    )
+
+
+class TestSQLiteJobQueue:
+    def test_claim_order(self, tmp_path: pathlib.Path) -> None:
+        timer = FakeTimer()
+        queue = structured.SQLiteJobQueue(str(tmp_path / "jobs.db"), timer=timer)
+        low = queue.enqueue(new_job())
+        timer.now += 1
+        high = queue.enqueue(new_job(priority=5))
+        timer.now += 1
+        other = queue.enqueue(new_job(workflow_id="other"))
+
+        claimed = queue.claim("w1", ["wf"], lease_s=10)
+        assert claimed is not None
+        assert claimed.id == high.id
+        assert claimed.status == JobStatus.RUNNING
+        assert claimed.attempts == 1
+        assert claimed.lease_owner == "w1"
+        assert claimed.args == [{"a": 1}]
+
+        claimed = queue.claim("w2", ["wf"], lease_s=10)
+        assert claimed is not None
+        assert claimed.id == low.id
+        assert queue.claim("w2", ["wf"], lease_s=10) is None
+        assert queue.claim("w2", [], lease_s=10) is None
+
+        claimed = queue.claim("w2", ["wf", "other"], lease_s=10)
+        assert claimed is not None
+        assert claimed.id == other.id
+
+    def test_lease_expiry(self, tmp_path: pathlib.Path) -> None:
+        timer = FakeTimer()
+        queue = structured.SQLiteJobQueue(str(tmp_path / "jobs.db"), timer=timer)
+        job = queue.enqueue(new_job(max_attempts=2))
+        assert queue.claim("w1", ["wf"], lease_s=10) is not None
+
+        timer.now += 5
+        assert queue.heartbeat(job.id, "w1", lease_s=10)
+        timer.now += 8
+        # the heartbeat extended the lease
+        assert queue.claim("w2", ["wf"], lease_s=10) is None
+
+        timer.now += 10
+        claimed = queue.claim("w2", ["wf"], lease_s=10)
+        assert claimed is not None
+        assert claimed.lease_owner == "w2"
+        assert claimed.attempts == 2
+        # the first worker lost its lease
+        assert not queue.heartbeat(job.id, "w1", lease_s=10)
+        assert not queue.complete(job.id, "w1", "result")
+
+        # the job has no attempts left, so an expired lease fails it
+        timer.now += 20
+        assert queue.claim("w3", ["wf"], lease_s=10) is None
+        failed = queue.get(job.id)
+        assert failed is not None
+        assert failed.status == JobStatus.FAILED
+        assert failed.error == "worker lease expired"
+
+    def test_complete_and_fail(self, tmp_path: pathlib.Path) -> None:
+        queue = structured.SQLiteJobQueue(str(tmp_path / "jobs.db"))
+        job = queue.enqueue(new_job(max_attempts=2))
+
+        assert queue.claim("w1", ["wf"], lease_s=10) is not None
+        assert queue.fail(job.id, "w1", "boom")
+        retried = queue.get(job.id)
+        assert retried is not None
+        assert retried.status == JobStatus.QUEUED
+        assert retried.error == "boom"
+
+        assert queue.claim("w1", ["wf"], lease_s=10) is not None
+        assert queue.fail(job.id, "w1", "boom again")
+        failed = queue.get(job.id)
+        assert failed is not None
+        assert failed.status == JobStatus.FAILED
+        assert queue.claim("w1", ["wf"], lease_s=10) is None
+
+        other = queue.enqueue(new_job())
+        assert queue.claim("w1", ["wf"], lease_s=10) is not None
+        assert queue.complete(other.id, "w1", {"answer": 42})
+        completed = queue.get(other.id)
+        assert completed is not None
+        assert completed.status == JobStatus.COMPLETED
+        assert completed.result == {"answer": 42}
+        assert completed.lease_owner is None
+
+
+@dataclass
+class Greeting:
+    name: str
+    punctuation: str
+
+
+step_calls: List[str] = []
+
+
+@structured.workflow(id="job-queue-workflow")
+class GreetingWorkflow:
+    @structured.workflow_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, greeting: Greeting) -> str:
+        hello = await structured.call_step(ctx, say_hello, args=[greeting.name])
+        return await structured.call_step(
+            ctx, punctuate, args=[hello, greeting.punctuation]
+        )
+
+
+@structured.step(id="say-hello")
+async def say_hello(_ctx: structured.WorkflowContext, name: str) -> str:
+    step_calls.append("say-hello")
+    return f"Hello, {name}"
+
+
+@structured.step(id="punctuate")
+async def punctuate(
+    _ctx: structured.WorkflowContext, text: str, punctuation: str
+) -> str:
+    step_calls.append("punctuate")
+    if step_calls.count("punctuate") == 1:
+        raise RuntimeError("flaky step")
+    return text + punctuation
+
+
+@pytest.mark.asyncio
+async def test_worker_retries_from_call_cache(tmp_path: pathlib.Path) -> None:
+    step_calls.clear()
+    queue = structured.SQLiteJobQueue(str(tmp_path / "jobs.db"))
+    job = structured.enqueue_workflow(
+        queue,
+        GreetingWorkflow.main,
+        args=[Greeting(name="Fixpoint", punctuation="!")],
+        max_attempts=2,
+    )
+    assert job.workflow_id == "job-queue-workflow"
+
+    run_config = structured.RunConfig.with_disk(
+        storage_path=tmp_path.as_posix(),
+        agent_cache_ttl_s=60,
+        callcache_ttl_s=60,
+    )
+    # Each worker stands in for a separate process.
+    first = structured.WorkflowWorker(
+        queue, [GreetingWorkflow.main], run_config=run_config
+    )
+    assert await first.run_once() is not None
+    failed = queue.get(job.id)
+    assert failed is not None
+    assert failed.status == JobStatus.QUEUED
+    assert failed.error is not None and "ExecutionError" in failed.error
+
+    second = structured.WorkflowWorker(
+        queue, [GreetingWorkflow.main], run_config=run_config
+    )
+    assert await second.run_once() is not None
+    completed = queue.get(job.id)
+    assert completed is not None
+    assert completed.status == JobStatus.COMPLETED
+    assert completed.result == "Hello, Fixpoint!"
+    # the retry got the first step's result from the call cache
+    assert step_calls == ["say-hello", "punctuate", "punctuate"]
+
+    assert await second.run_once() is None
+
+
+@pytest.mark.asyncio
+async def test_worker_run_until_stopped(tmp_path: pathlib.Path) -> None:
+    step_calls.clear()
+    step_calls.append("punctuate")  # don't fail the step
+    queue = structured.SQLiteJobQueue(str(tmp_path / "jobs.db"))
+    jobs = [
+        structured.enqueue_workflow(
+            queue,
+            GreetingWorkflow.main,
+            args=[Greeting(name=f"worker {i}", punctuation=".")],
+        )
+        for i in range(4)
+    ]
+    worker = structured.WorkflowWorker(
+        queue,
+        [GreetingWorkflow.main],
+        run_config=structured.RunConfig.with_in_memory(),
+        poll_interval_s=0.01,
+        max_concurrency=2,
+    )
+    stop = asyncio.Event()
+    worker_task = asyncio.create_task(worker.run(stop))
+
+    async def all_done() -> None:
+        while True:
+            statuses = [queue.get(job.id).status for job in jobs]  # type: ignore[union-attr]
+            if all(status == JobStatus.COMPLETED for status in statuses):
+                return
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(all_done(), timeout=10)
+    stop.set()
+    await asyncio.wait_for(worker_task, timeout=10)
+    results = [queue.get(job.id).result for job in jobs]  # type: ignore[union-attr]
+    assert results == [f"Hello, worker {i}." for i in range(4)]
+
+
+@pytest.mark.asyncio
+async def test_worker_cancels_run_on_lost_lease(tmp_path: pathlib.Path) -> None:
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    @structured.workflow(id="job-queue-slow-workflow")
+    class SlowWorkflow:
+        @structured.workflow_entrypoint()
+        async def main(self, _ctx: structured.WorkflowContext) -> None:
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+    queue = structured.SQLiteJobQueue(str(tmp_path / "jobs.db"))
+    job = structured.enqueue_workflow(queue, SlowWorkflow.main)
+    worker = structured.WorkflowWorker(
+        queue,
+        [SlowWorkflow.main],
+        run_config=structured.RunConfig.with_in_memory(),
+        worker_id="w1",
+        heartbeat_interval_s=0.01,
+    )
+    run = asyncio.create_task(worker.run_once())
+    await asyncio.wait_for(started.wait(), timeout=10)
+    # another worker steals the job
+    queue.fail(job.id, "w1", "stolen")
+    await asyncio.wait_for(run, timeout=10)
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_worker_fails_job_with_unstorable_result(tmp_path: pathlib.Path) -> None:
+    runs: List[str] = []
+
+    @structured.workflow(id="job-queue-bytes-workflow")
+    class BytesWorkflow:
+        @structured.workflow_entrypoint()
+        async def main(self, _ctx: structured.WorkflowContext) -> bytes:
+            runs.append("run")
+            return b"not json"
+
+    queue = structured.SQLiteJobQueue(str(tmp_path / "jobs.db"))
+    job = structured.enqueue_workflow(queue, BytesWorkflow.main, max_attempts=3)
+    with pytest.raises(structured.JobResultError):
+        queue.complete(job.id, "w1", b"not json")
+
+    worker = structured.WorkflowWorker(
+        queue, [BytesWorkflow.main], run_config=structured.RunConfig.with_in_memory()
+    )
+    assert await worker.run_once() is not None
+    failed = queue.get(job.id)
+    assert failed is not None
+    # the job fails on its first attempt instead of being retried
+    assert failed.status == JobStatus.FAILED
+    assert failed.attempts == 1
+    assert failed.error is not None and "JobResultError" in failed.error
+    assert await worker.run_once() is None
+    assert runs == ["run"]
+
+
+@pytest.mark.skipif(
+    not os.environ.get("POSTGRES_URL"),
+    reason="Disabled until we have a Postgres test database",
+)
+def test_postgres_job_queue() -> None:
+    # pylint: disable=import-outside-toplevel
+    from psycopg_pool import ConnectionPool
+
+    with ConnectionPool(os.environ["POSTGRES_URL"]) as pool:
+        queue = structured.PostgresJobQueue(pool)
+        job = queue.enqueue(new_job(workflow_id=f"wf-{os.urandom(4).hex()}"))
+        claimed = queue.claim("w1", [job.workflow_id], lease_s=10)
+        assert claimed is not None
+        assert claimed.id == job.id
+        assert queue.claim("w2", [job.workflow_id], lease_s=10) is None
+        assert queue.heartbeat(job.id, "w1", lease_s=10)
+        assert not queue.heartbeat(job.id, "w2", lease_s=10)
+        assert queue.complete(job.id, "w1", ["done"])
+        completed = queue.get(job.id)
+        assert completed is not None
+        assert completed.status == JobStatus.COMPLETED
+        assert completed.result == ["done"]
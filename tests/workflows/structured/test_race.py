@@ -0,0 +1,117 @@
+import asyncio
+from typing import Dict
+
+import pytest
+
+from fixpoint.workflows import WorkflowStatus, imperative, structured
+from fixpoint.workflows.structured._callcache import serialize_args
+from fixpoint.workflows.structured._run_config import RunConfig
+
+
+_calls: Dict[str, int] = {}
+
+
+@structured.step(id="extract")
+async def extract(_ctx: structured.WorkflowContext, strategy: str, delay: float) -> str:
+    _calls[strategy] = _calls.get(strategy, 0) + 1
+    await asyncio.sleep(delay)
+    if strategy == "broken":
+        raise ValueError("extraction failed")
+    return f"fields from {strategy}"
+
+
+@structured.task(id="extract-twice")
+class ExtractTwice:
+    @structured.task_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, strategy: str) -> str:
+        return await structured.call_step(ctx, extract, args=[strategy, 0.01])
+
+
+def new_workflow_context() -> structured.WorkflowContext:
+    return structured.WorkflowContext(
+        run_config=RunConfig.with_in_memory(),
+        agents=[],
+        workflow_run=imperative.Workflow(id="racing").run(),
+    )
+
+
+def is_cached(ctx: structured.WorkflowContext, strategy: str, delay: float) -> bool:
+    return ctx.run_config.call_cache.steps.check_cache(
+        run_id=ctx.workflow_run.id,
+        kind_id="extract",
+        serialized_args=serialize_args(strategy, delay),
+    ).found
+
+
+@pytest.mark.asyncio
+async def test_race() -> None:
+    _calls.clear()
+    ctx = new_workflow_context()
+
+    async def run_race() -> str:
+        return await structured.race(
+            ctx,
+            [
+                structured.call_step(ctx, extract, args=["cheap", 0.0]),
+                structured.call_step(ctx, extract, args=["broken", 0.0]),
+                structured.call_step(ctx, extract, args=["good", 0.02]),
+                structured.call_step(ctx, extract, args=["slow", 10.0]),
+            ],
+            accept=lambda fields: "cheap" not in fields,
+        )
+
+    assert await run_race() == "fields from good"
+    # pylint: disable=protected-access
+    statuses = [c.info.status for c in ctx.workflow_run._node_state.next_states]
+    assert statuses == [
+        WorkflowStatus.COMPLETED,
+        WorkflowStatus.FAILED,
+        WorkflowStatus.COMPLETED,
+        WorkflowStatus.CANCELLED,
+    ]
+    # only the winner's result is cached
+    assert is_cached(ctx, "good", 0.02)
+    assert not is_cached(ctx, "cheap", 0.0)
+    assert not is_cached(ctx, "slow", 10.0)
+
+    # when we run the race again, the winner's cached result wins right away
+    assert await run_race() == "fields from good"
+    assert _calls == {"cheap": 2, "broken": 2, "good": 1, "slow": 2}
+
+
+@pytest.mark.asyncio
+async def test_race_defers_nested_results() -> None:
+    _calls.clear()
+    ctx = new_workflow_context()
+    res = await structured.race(
+        ctx,
+        [
+            structured.call_task(ctx, ExtractTwice.main, args=["first"]),
+            structured.call_task(ctx, ExtractTwice.main, args=["second"]),
+        ],
+        accept=lambda fields: "second" in fields,
+    )
+    assert res == "fields from second"
+    assert is_cached(ctx, "second", 0.01)
+    # the losing task's step finished, but its result is not cached
+    assert not is_cached(ctx, "first", 0.01)
+
+
+@pytest.mark.asyncio
+async def test_race_without_accepted_result() -> None:
+    ctx = new_workflow_context()
+    with pytest.raises(structured.NoAcceptedResultError) as exc_info:
+        await structured.race(
+            ctx,
+            [
+                structured.call_step(ctx, extract, args=["broken", 0.0]),
+                structured.call_step(ctx, extract, args=["cheap", 0.0]),
+            ],
+            accept=lambda fields: "cheap" not in fields,
+        )
+    [error] = exc_info.value.errors
+    assert isinstance(error, ValueError)
+    assert not is_cached(ctx, "cheap", 0.0)
+
+    with pytest.raises(ValueError):
+        await structured.race(ctx, [])
@@ -0,0 +1,207 @@
+import asyncio
+import gc
+from typing import AsyncIterator, Dict, List
+
+import pytest
+
+from fixpoint.workflows import WorkflowStatus, structured
+from fixpoint.workflows.structured import WorkflowEvent, WorkflowEventKind
+from fixpoint.workflows.structured._workflow_run_handle import WorkflowRunHandle
+
+
+class Tracker:
+    running: Dict[str, int]
+    max_running: Dict[str, int]
+    max_total: int
+    order: List[str]
+
+    def __init__(self) -> None:
+        self.running = {}
+        self.max_running = {}
+        self.max_total = 0
+        self.order = []
+
+    async def run(self, workflow_id: str, name: str, gate: asyncio.Event) -> str:
+        self.order.append(name)
+        self.running[workflow_id] = self.running.get(workflow_id, 0) + 1
+        self.max_running[workflow_id] = max(
+            self.max_running.get(workflow_id, 0), self.running[workflow_id]
+        )
+        self.max_total = max(self.max_total, sum(self.running.values()))
+        await gate.wait()
+        self.running[workflow_id] -= 1
+        return name
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limits() -> None:
+    scheduler = structured.WorkflowScheduler(
+        max_concurrency=3, workflow_limits={"a": 1}
+    )
+    tracker = Tracker()
+    gate = asyncio.Event()
+    tasks = [
+        asyncio.create_task(scheduler.run(wid, tracker.run(wid, f"{wid}{i}", gate)))
+        for i in range(4)
+        for wid in ["a", "b"]
+    ]
+    await asyncio.sleep(0)
+    stats = scheduler.stats()
+    assert stats.running == 3
+    assert stats.queued == 5
+    gate.set()
+    assert sorted(await asyncio.gather(*tasks)) == sorted(tracker.order)
+    assert tracker.max_total == 3
+    assert tracker.max_running["a"] == 1
+
+    stats = scheduler.stats()
+    assert stats.completed == 8
+    assert stats.running == 0
+    assert stats.queued == 0
+    assert stats.max_queued == 5
+
+
+@pytest.mark.asyncio
+async def test_priority() -> None:
+    scheduler = structured.WorkflowScheduler(max_concurrency=1)
+    tracker = Tracker()
+    gate = asyncio.Event()
+    first = asyncio.create_task(scheduler.run("w", tracker.run("w", "first", gate)))
+    await asyncio.sleep(0)
+    tasks = [
+        asyncio.create_task(
+            scheduler.run("w", tracker.run("w", name, gate), priority=priority)
+        )
+        for name, priority in [("low", 0), ("high", 10), ("mid", 5), ("low2", 0)]
+    ]
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(first, *tasks)
+    assert tracker.order == ["first", "high", "mid", "low", "low2"]
+
+
+@pytest.mark.asyncio
+async def test_reject_when_full() -> None:
+    scheduler = structured.WorkflowScheduler(
+        max_concurrency=1, max_queued=1, on_full="reject"
+    )
+    tracker = Tracker()
+    gate = asyncio.Event()
+    running = asyncio.create_task(scheduler.run("w", tracker.run("w", "1", gate)))
+    queued = asyncio.create_task(scheduler.run("w", tracker.run("w", "2", gate)))
+    await asyncio.sleep(0)
+    with pytest.raises(structured.SchedulerFullError):
+        await scheduler.run("w", tracker.run("w", "3", gate))
+    gate.set()
+    await asyncio.gather(running, queued)
+    assert tracker.order == ["1", "2"]
+    assert scheduler.stats().rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_wait_when_full() -> None:
+    scheduler = structured.WorkflowScheduler(max_concurrency=1, max_queued=1)
+    tracker = Tracker()
+    gate = asyncio.Event()
+    tasks = [
+        asyncio.create_task(scheduler.run("w", tracker.run("w", str(i), gate)))
+        for i in range(4)
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.stats().queued == 1
+    gate.set()
+    assert await asyncio.gather(*tasks) == ["0", "1", "2", "3"]
+    assert scheduler.stats().max_queued == 1
+
+
+@pytest.mark.asyncio
+async def test_cancel_queued_run() -> None:
+    scheduler = structured.WorkflowScheduler(max_concurrency=1)
+    tracker = Tracker()
+    gate = asyncio.Event()
+    running = asyncio.create_task(scheduler.run("w", tracker.run("w", "1", gate)))
+    queued = asyncio.create_task(scheduler.run("w", tracker.run("w", "2", gate)))
+    await asyncio.sleep(0)
+    queued.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await queued
+    assert scheduler.stats().queued == 0
+    gate.set()
+    await running
+    assert tracker.order == ["1"]
+
+
+@pytest.mark.asyncio
+async def test_run_workflow_with_scheduler() -> None:
+    @structured.workflow(id="my-workflow")
+    class Workflow:
+        @structured.workflow_entrypoint()
+        async def main(self, ctx: structured.WorkflowContext, x: int) -> int:
+            await asyncio.sleep(0.001)
+            return x * 2
+
+    scheduler = structured.WorkflowScheduler(max_concurrency=2)
+    run_config = structured.RunConfig.with_in_memory()
+    res = await asyncio.gather(
+        *[
+            structured.run_workflow(
+                Workflow.main,
+                run_config=run_config,
+                agents=[],
+                args=[i],
+                scheduler=scheduler,
+            )
+            for i in range(5)
+        ]
+    )
+    assert res == [0, 2, 4, 6, 8]
+    stats = scheduler.stats()
+    assert stats.completed == 5
+    assert stats.max_queued == 3
+    assert stats.total_run_s > 0
+
+
+@pytest.mark.asyncio
+async def test_stream_events_of_rejected_run(recwarn: pytest.WarningsRecorder) -> None:
+    gate = asyncio.Event()
+
+    @structured.workflow(id="gated-workflow")
+    class GatedWorkflow:
+        @structured.workflow_entrypoint()
+        async def main(self, _ctx: structured.WorkflowContext) -> str:
+            await gate.wait()
+            return "done"
+
+    scheduler = structured.WorkflowScheduler(
+        max_concurrency=1, max_queued=0, on_full="reject"
+    )
+    run_config = structured.RunConfig.with_in_memory()
+
+    def spawn() -> WorkflowRunHandle[str]:
+        return structured.spawn_workflow(
+            GatedWorkflow.main, run_config=run_config, agents=[], scheduler=scheduler
+        )
+
+    running = asyncio.ensure_future(spawn().result())
+    await asyncio.sleep(0)
+    rejected = spawn()
+    events = await asyncio.wait_for(_collect(rejected.events()), timeout=5)
+    # the run never started, but its stream still ends with its final status
+    assert [(event.kind, event.status) for event in events] == [
+        (WorkflowEventKind.RUN_STATUS, WorkflowStatus.FAILED)
+    ]
+    with pytest.raises(structured.SchedulerFullError):
+        await rejected.result()
+    run = rejected.finalized_workflow_run()
+    assert run is not None
+    assert run.status == WorkflowStatus.FAILED
+
+    gate.set()
+    assert await running == "done"
+    del rejected
+    gc.collect()
+    assert not [w for w in recwarn if "never awaited" in str(w.message)]
+
+
+async def _collect(events: AsyncIterator[WorkflowEvent]) -> List[WorkflowEvent]:
+    return [event async for event in events]
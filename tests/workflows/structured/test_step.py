@@ -1,7 +1,21 @@
 import asyncio
 from dataclasses import dataclass
+import inspect
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
 import pytest
-from fixpoint.workflows import imperative, structured, TASK_MAIN_ID, STEP_MAIN_ID
+from fixpoint.workflows import (
+    imperative,
+    structured,
+    TASK_MAIN_ID,
+    STEP_MAIN_ID,
+    WorkflowStatus,
+)
+from fixpoint.workflows.structured._callcache import serialize_args
 from fixpoint.workflows.structured._run_config import RunConfig
 
 
@@ -98,12 +112,433 @@ async def test_step_context() -> None:
     assert_ctx_main(ctx)
 
 
-def new_workflow_context(workflow_id: str) -> structured.WorkflowContext:
+@pytest.mark.asyncio
+async def test_step_global_memoize() -> None:
+    values = {"counter": 0}
+
+    @structured.step(id="memo_step", memoize="global")
+    async def memo_step(ctx: structured.WorkflowContext, args: StepArgs) -> int:
+        values["counter"] += 1
+        return args.x + args.y
+
+    run_config = RunConfig.with_in_memory()
+    ctx1 = new_workflow_context("my-workflow", run_config)
+    ctx2 = new_workflow_context("my-workflow", run_config)
+    assert ctx1.workflow_run.id != ctx2.workflow_run.id
+
+    assert await structured.call_step(ctx1, memo_step, args=[StepArgs(x=1, y=2)]) == 3
+    assert values["counter"] == 1
+
+    # a different run reuses the memoized result
+    assert await structured.call_step(ctx2, memo_step, args=[StepArgs(x=1, y=2)]) == 3
+    assert values["counter"] == 1
+
+    # different args are computed
+    assert await structured.call_step(ctx2, memo_step, args=[StepArgs(x=2, y=2)]) == 4
+    assert values["counter"] == 2
+
+    # invalidating a single call only recomputes that call
+    structured.invalidate_step(run_config, memo_step, args=[StepArgs(x=1, y=2)])
+    assert await structured.call_step(ctx1, memo_step, args=[StepArgs(x=1, y=2)]) == 3
+    assert values["counter"] == 3
+    assert await structured.call_step(ctx1, memo_step, args=[StepArgs(x=2, y=2)]) == 4
+    assert values["counter"] == 3
+
+    # invalidating the step recomputes every call
+    structured.invalidate_step(run_config, memo_step)
+    assert await structured.call_step(ctx2, memo_step, args=[StepArgs(x=1, y=2)]) == 3
+    assert await structured.call_step(ctx2, memo_step, args=[StepArgs(x=2, y=2)]) == 4
+    assert values["counter"] == 5
+
+
+@pytest.mark.asyncio
+async def test_step_global_memoize_version() -> None:
+    values = {"counter": 0}
+    run_config = RunConfig.with_in_memory()
+
+    def define_step(version: str) -> Any:
+        @structured.step(id="versioned_step", memoize="global", version=version)
+        async def versioned_step(ctx: structured.WorkflowContext) -> int:
+            values["counter"] += 1
+            return values["counter"]
+
+        return versioned_step
+
+    v1 = define_step("v1")
+    ctx1 = new_workflow_context("my-workflow", run_config)
+    ctx2 = new_workflow_context("my-workflow", run_config)
+    assert await structured.call_step(ctx1, v1) == 1
+    assert await structured.call_step(ctx2, define_step("v1")) == 1
+    # a new version does not reuse results of the old version
+    assert await structured.call_step(ctx2, define_step("v2")) == 2
+
+
+def test_step_memoize_definition() -> None:
+    with pytest.raises(structured.DefinitionError):
+
+        @structured.step(id="bad_version", version="v1")
+        async def bad_version(ctx: structured.WorkflowContext) -> None:
+            pass
+
+
+@pytest.mark.asyncio
+async def test_invalidate_run_scoped_step() -> None:
+    values = {"counter": 0}
+
+    @structured.step(id="my_step")
+    async def my_step(ctx: structured.WorkflowContext) -> int:
+        values["counter"] += 1
+        return values["counter"]
+
+    ctx = new_workflow_context("my-workflow")
+    assert await structured.call_step(ctx, my_step) == 1
+    assert await structured.call_step(ctx, my_step) == 1
+
+    with pytest.raises(ValueError):
+        structured.invalidate_step(ctx.run_config, my_step)
+    structured.invalidate_step(ctx.run_config, my_step, run_id=ctx.workflow_run.id)
+    assert await structured.call_step(ctx, my_step) == 2
+
+
+@pytest.mark.asyncio
+async def test_call_steps() -> None:
+    in_flight = {"now": 0, "max": 0, "calls": 0}
+
+    @structured.step(id="my_step")
+    async def my_step(ctx: structured.WorkflowContext, x: int, y: int = 0) -> int:
+        in_flight["calls"] += 1
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        # finish out of order
+        await asyncio.sleep(0.001 * (10 - x))
+        in_flight["now"] -= 1
+        return x + y
+
+    ctx = new_workflow_context("my-workflow")
+    res = await structured.call_steps(
+        ctx, my_step, args=[[i] for i in range(10)], max_concurrency=3
+    )
+    assert res == list(range(10))
+    assert in_flight["max"] == 3
+    # pylint: disable=protected-access
+    children = ctx.workflow_run._node_state.next_states
+    assert [c.info.step for c in children] == ["my_step"] * 10
+    assert all(c.info.status == WorkflowStatus.COMPLETED for c in children)
+
+    # results are cached per set of arguments
+    res = await structured.call_steps(
+        ctx, my_step, args=[[1], [2], [3]], kwargs=[{}, {}, {"y": 1}]
+    )
+    assert res == [1, 2, 4]
+    assert in_flight["calls"] == 11
+
+    with pytest.raises(ValueError):
+        await structured.call_steps(ctx, my_step, args=[[1]], kwargs=[])
+    with pytest.raises(ValueError):
+        await structured.call_steps(ctx, my_step, args=[[1]], max_concurrency=0)
+
+
+@pytest.mark.asyncio
+async def test_call_steps_cancels_on_failure() -> None:
+    cancelled = {"count": 0}
+
+    @structured.step(id="my_step")
+    async def my_step(ctx: structured.WorkflowContext, x: int) -> int:
+        if x == 0:
+            raise ValueError("step failed")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled["count"] += 1
+            raise
+        return x
+
+    ctx = new_workflow_context("my-workflow")
+    with pytest.raises(ExceptionGroup) as exc_info:
+        await structured.call_steps(ctx, my_step, args=[[1], [2], [0], [3]])
+    assert exc_info.group_contains(ValueError)
+    assert cancelled["count"] == 3
+    # pylint: disable=protected-access
+    statuses = [c.info.status for c in ctx.workflow_run._node_state.next_states]
+    assert statuses == [
+        WorkflowStatus.CANCELLED,
+        WorkflowStatus.CANCELLED,
+        WorkflowStatus.FAILED,
+        WorkflowStatus.CANCELLED,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_step_call_path_built_at_definition(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    @structured.step(id="my_step")
+    async def my_step(ctx: structured.WorkflowContext, x: int) -> int:
+        return x + 1
+
+    def fail_signature(*_args: Any, **_kwargs: Any) -> Any:
+        raise AssertionError("inspected a signature while calling a step")
+
+    monkeypatch.setattr(inspect, "signature", fail_signature)
+    ctx = new_workflow_context("my-workflow")
+    assert await structured.call_step(ctx, my_step, args=[1]) == 2
+    assert await structured.call_step(ctx, my_step, args=[1]) == 2
+
+
+step_threads = []
+
+
+@structured.step(id="thread_step", executor="thread")
+async def thread_step(ctx: structured.WorkflowContext, args: StepArgs) -> int:
+    step_threads.append(threading.current_thread().name)
+    # blocking here does not block the workflow's event loop
+    time.sleep(0.2)
+    return args.x + args.y
+
+
+@pytest.mark.asyncio
+async def test_step_thread_executor() -> None:
+    ctx = new_workflow_context("my-workflow")
+    ticks = 0
+
+    async def tick() -> None:
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    res = await structured.call_step(ctx, thread_step, args=[StepArgs(x=1, y=2)])
+    ticker.cancel()
+    assert res == 3
+    assert ticks > 5
+    assert step_threads[-1].startswith("fixpoint-step")
+
+    # the result is call-cached
+    step_threads.clear()
+    res = await structured.call_step(ctx, thread_step, args=[StepArgs(x=1, y=2)])
+    assert res == 3
+    assert not step_threads
+
+
+@structured.step(id="process_step", executor="process")
+async def process_step(
+    ctx: structured.StepProcessContext, x: int
+) -> Tuple[int, str, Optional[str], int]:
+    return os.getpid(), ctx.workflow_run_id, ctx.step_id, x * 2
+
+
+@pytest.mark.asyncio
+async def test_step_process_executor() -> None:
+    run_config = RunConfig.with_in_memory()
+    ctx = new_workflow_context("my-workflow", run_config)
+    try:
+        pid, run_id, step_id, res = await structured.call_step(
+            ctx, process_step, args=[21]
+        )
+    finally:
+        run_config.executors.shutdown()
+    assert pid != os.getpid()
+    assert run_id == ctx.workflow_run.id
+    assert step_id == "process_step"
+    assert res == 42
+
+
+def test_step_executor_definition() -> None:
+    with pytest.raises(structured.DefinitionError):
+
+        @structured.step(id="bad_executor", executor="fiber")  # type: ignore[arg-type]
+        async def bad_executor(ctx: structured.WorkflowContext) -> None:
+            pass
+
+
+@pytest.mark.asyncio
+async def test_step_dag() -> None:
+    calls: Dict[str, int] = {}
+    running: List[str] = []
+    overlapped: List[Tuple[str, ...]] = []
+
+    async def track(name: str) -> None:
+        calls[name] = calls.get(name, 0) + 1
+        running.append(name)
+        await asyncio.sleep(0.01)
+        overlapped.append(tuple(running))
+        running.remove(name)
+
+    @structured.step(id="extract")
+    async def extract(ctx: structured.WorkflowContext, doc: str) -> str:
+        await track("extract")
+        return doc.strip()
+
+    @structured.step(id="summarize")
+    async def summarize(ctx: structured.WorkflowContext, text: str) -> str:
+        await track("summarize")
+        return text[:5]
+
+    @structured.step(id="tag")
+    async def tag(ctx: structured.WorkflowContext, text: str) -> List[str]:
+        await track("tag")
+        return text.split()
+
+    @structured.step(id="publish", after=["summarize", "tag"])
+    async def publish(ctx: structured.WorkflowContext) -> str:
+        await track("publish")
+        return "published"
+
+    ctx = new_workflow_context("my-workflow")
+
+    async def run_dag() -> Tuple[str, List[str], str]:
+        dag = structured.StepDag(ctx, max_concurrency=2)
+        # added before its dependencies, which it waits for by definition
+        published = dag.add(publish)
+        text = dag.add(extract, args=["  hello dag world "])
+        summary = dag.add(summarize, args=[text])
+        tags = dag.add(tag, kwargs={"text": text})
+        with pytest.raises(RuntimeError):
+            summary.result()
+        await dag.run()
+        assert summary.done()
+        return summary.result(), tags.result(), published.result()
+
+    assert await run_dag() == ("hello", ["hello", "dag", "world"], "published")
+    # summarize and tag ran concurrently, after extract and before publish
+    assert ("summarize", "tag") in overlapped or ("tag", "summarize") in overlapped
+    # pylint: disable=protected-access
+    children = ctx.workflow_run._node_state.next_states
+    steps = [c.info.step for c in children]
+    assert steps[0] == "extract" and steps[-1] == "publish"
+    assert all(c.info.status == WorkflowStatus.COMPLETED for c in children)
+
+    # each step call is call-cached
+    assert await run_dag() == ("hello", ["hello", "dag", "world"], "published")
+    assert calls == {"extract": 1, "summarize": 1, "tag": 1, "publish": 1}
+
+
+@pytest.mark.asyncio
+async def test_step_dag_definition_errors() -> None:
+    @structured.step(id="first", after=["second"])
+    async def first(ctx: structured.WorkflowContext) -> int:
+        return 1
+
+    @structured.step(id="second", after=["first"])
+    async def second(ctx: structured.WorkflowContext) -> int:
+        return 2
+
+    with pytest.raises(structured.DefinitionError):
+
+        @structured.step(id="itself", after=["itself"])
+        async def itself(ctx: structured.WorkflowContext) -> int:
+            return 3
+
+    ctx = new_workflow_context("my-workflow")
+    dag = structured.StepDag(ctx)
+    dag.add(first)
+    # the DAG has no call to "second"
+    with pytest.raises(structured.DefinitionError):
+        await dag.run()
+    dag.add(second)
+    with pytest.raises(structured.DefinitionError):
+        await dag.run()
+
+    other = structured.StepDag(ctx).add(first)
+    with pytest.raises(structured.DefinitionError):
+        dag.add(second, args=[other])
+    with pytest.raises(ValueError):
+        structured.StepDag(ctx, max_concurrency=0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["memory", "disk"])
+async def test_step_checkpoints(tmp_path: pathlib.Path, backend: str) -> None:
+    processed: List[Tuple[str, int]] = []
+    fail_at = {"chunk": 3}
+
+    @structured.step(id="process")
+    async def process(ctx: structured.WorkflowContext, doc: str) -> List[int]:
+        results: List[int] = ctx.recall("results", default=[])
+        for i in range(ctx.recall("next_chunk", default=0), 5):
+            if i == fail_at["chunk"]:
+                raise RuntimeError("crashed")
+            processed.append((doc, i))
+            results.append(i * 10)
+            ctx.checkpoint("results", results)
+            ctx.checkpoint("next_chunk", i + 1)
+        return results
+
+    run_config = RunConfig.with_in_memory()
+    if backend == "disk":
+        run_config = RunConfig.with_disk(
+            storage_path=tmp_path.as_posix(), agent_cache_ttl_s=60, callcache_ttl_s=60
+        )
+    ctx = new_workflow_context("my-workflow", run_config)
+    with pytest.raises(RuntimeError):
+        await structured.call_step(ctx, process, args=["a"])
+    # checkpoints are scoped to the step call's arguments
+    with pytest.raises(RuntimeError):
+        await structured.call_step(ctx, process, args=["b"])
+    assert processed == [("a", 0), ("a", 1), ("a", 2), ("b", 0), ("b", 1), ("b", 2)]
+
+    fail_at["chunk"] = -1
+    processed.clear()
+    assert await structured.call_step(ctx, process, args=["a"]) == [0, 10, 20, 30, 40]
+    assert processed == [("a", 3), ("a", 4)]
+    # once the step finished, its checkpoints are gone
+    assert ctx.recall("next_chunk") is None
+    step_ctx = ctx.clone(new_step="process")
+    # pylint: disable=protected-access
+    step_ctx = step_ctx._for_call(serialize_args("a"))
+    assert step_ctx.recall("next_chunk", default="gone") == "gone"
+    step_ctx = step_ctx._for_call(serialize_args("b"))
+    assert step_ctx.recall("next_chunk") == 3
+
+
+def new_workflow_context(
+    workflow_id: str, run_config: Optional[RunConfig] = None
+) -> structured.WorkflowContext:
     workflow = imperative.Workflow(id=workflow_id)
     wrun = workflow.run()
     ctx = structured.WorkflowContext(
-        run_config=RunConfig.with_in_memory(),
+        run_config=run_config or RunConfig.with_in_memory(),
         agents=[],
         workflow_run=wrun,
     )
     return ctx
+
+
+@structured.step(id="failing-step")
+async def failing_step(_ctx: structured.WorkflowContext) -> None:
+    raise ValueError("step failed")
+
+
+@structured.workflow(id="failing-step-workflow")
+class FailingStepWorkflow:
+    @structured.workflow_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext) -> None:
+        await structured.call_step(ctx, failing_step)
+
+
+@pytest.mark.asyncio
+async def test_failing_step_raises_its_own_exception() -> None:
+    ctx = structured.WorkflowContext(
+        run_config=RunConfig.with_in_memory(),
+        agents=[],
+        workflow_run=imperative.Workflow(id="failing").run(),
+    )
+    # a failing step raises its own exception, not an ExceptionGroup
+    with pytest.raises(ValueError, match="step failed"):
+        await structured.call_step(ctx, failing_step)
+
+    # except* handlers still match it
+    caught: List[BaseException] = []
+    try:
+        await structured.call_step(ctx, failing_step)
+    except* ValueError as group:
+        caught.extend(group.exceptions)
+    assert [str(e) for e in caught] == ["step failed"]
+
+    with pytest.raises(structured.ExecutionError) as exc_info:
+        await structured.run_workflow(
+            FailingStepWorkflow.main, run_config=RunConfig.with_in_memory(), agents=[]
+        )
+    assert str(exc_info.value) == "step failed"
+    assert isinstance(exc_info.value.__cause__, ValueError)
@@ -70,6 +70,36 @@ async def test_call_task() -> None:
     assert res == "Hello, Dylan"
 
 
+@pytest.mark.asyncio
+async def test_call_tasks() -> None:
+    @structured.task("my-task")
+    class MyTask:
+        @structured.task_entrypoint()
+        async def run(
+            self, ctx: structured.WorkflowContext, name: str, greeting: str = "Hello"
+        ) -> str:
+            return f"{greeting}, {name}"
+
+    workflow = imperative.Workflow(id="my-workflow")
+    wrun = workflow.run()
+    ctx = structured.WorkflowContext(
+        run_config=RunConfig.with_in_memory(),
+        agents=[],
+        workflow_run=wrun,
+    )
+    res = await structured.call_tasks(
+        ctx,
+        MyTask.run,
+        args=[["Dylan"], ["Jakub"]],
+        kwargs=[{}, {"greeting": "Hi"}],
+        max_concurrency=1,
+    )
+    assert res == ["Hello, Dylan", "Hi, Jakub"]
+    # pylint: disable=protected-access
+    children = wrun._node_state.next_states
+    assert [c.info.task for c in children] == ["my-task", "my-task"]
+
+
 @pytest.mark.asyncio
 async def test_task_cahce() -> None:
     values = {"counter": 0}
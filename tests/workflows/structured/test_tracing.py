@@ -0,0 +1,140 @@
+import json
+import pathlib
+from typing import List
+
+import pytest
+
+from fixpoint.agents import BaseAgent
+from fixpoint.agents.mock import MockAgent, new_mock_completion
+from fixpoint.workflows import imperative, structured, tracing
+from fixpoint.workflows.imperative import WorkflowContext
+from fixpoint.workflows.tracing import SpanStatus, Tracer
+
+
+@structured.step(id="double")
+async def double(_ctx: structured.WorkflowContext, x: int) -> int:
+    return x * 2
+
+
+@structured.step(id="explode")
+async def explode(_ctx: structured.WorkflowContext) -> None:
+    raise ValueError("boom")
+
+
+@structured.task(id="doubler")
+class Doubler:
+    @structured.task_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, x: int) -> int:
+        first = await structured.call_step(ctx, double, args=[x])
+        # the same arguments, so this one is a call-cache hit
+        second = await structured.call_step(ctx, double, args=[x])
+        return first + second
+
+
+@structured.workflow(id="traced")
+class TracedWorkflow:
+    @structured.workflow_entrypoint()
+    async def main(self, ctx: structured.WorkflowContext, x: int) -> int:
+        res = await structured.call_task(ctx, Doubler.main, args=[x])
+        try:
+            await structured.call_step(ctx, explode)
+        except ValueError:
+            pass
+        return res
+
+
+@pytest.mark.asyncio
+async def test_trace_workflow_run(tmp_path: pathlib.Path) -> None:
+    tracer = Tracer()
+    run_config = structured.RunConfig.with_in_memory()
+    run_config.tracer = tracer
+    handle = structured.spawn_workflow(
+        TracedWorkflow.main, run_config=run_config, agents=[], args=[3]
+    )
+    assert await handle.result() == 12
+    run_id = handle.workflow_run_id()
+
+    spans = {s.name: s for s in tracer.spans()}
+    assert [s.name for s in tracer.spans()] == [
+        "step double",
+        "step double",
+        "task doubler",
+        "step explode",
+        "workflow traced",
+    ]
+    first_double, second_double = tracer.spans()[:2]
+    workflow_span = spans["workflow traced"]
+    task_span = spans["task doubler"]
+    explode_span = spans["step explode"]
+
+    assert workflow_span.parent_id is None
+    assert workflow_span.attributes["workflow.status"] == "COMPLETED"
+    assert task_span.parent_id == workflow_span.span_id
+    assert first_double.parent_id == task_span.span_id
+    assert {s.trace_id for s in tracer.spans()} == {workflow_span.trace_id}
+    assert all(s.attributes["workflow.run_id"] == run_id for s in tracer.spans())
+
+    assert first_double.attributes["workflow.task"] == "doubler"
+    assert first_double.attributes["workflow.step"] == "double"
+    assert first_double.attributes["callcache.hit"] is False
+    assert second_double.attributes["callcache.hit"] is True
+    assert task_span.attributes["callcache.hit"] is False
+    assert explode_span.status == SpanStatus.ERROR
+    assert explode_span.status_message == "ValueError: boom"
+    duration = workflow_span.duration_ns
+    assert duration is not None and duration > 0
+
+    tracer.export_otlp_json(str(tmp_path / "trace.otlp.json"))
+    with open(tmp_path / "trace.otlp.json", encoding="utf-8") as f:
+        otlp = json.load(f)
+    [resource_spans] = otlp["resourceSpans"]
+    otlp_spans = resource_spans["scopeSpans"][0]["spans"]
+    assert len(otlp_spans) == 5
+    assert otlp_spans[0]["parentSpanId"] == task_span.span_id
+    assert {"key": "callcache.hit", "value": {"boolValue": False}} in otlp_spans[0][
+        "attributes"
+    ]
+    assert otlp_spans[3]["status"] == {"code": 2, "message": "ValueError: boom"}
+
+    tracer.export_chrome_trace(str(tmp_path / "trace.chrome.json"))
+    with open(tmp_path / "trace.chrome.json", encoding="utf-8") as f:
+        chrome = json.load(f)
+    events = chrome["traceEvents"]
+    assert len(events) == 10
+    assert events[0]["ph"] == "b"
+    assert events[0]["name"] == "workflow traced"
+    assert events[-1]["ph"] == "e"
+
+
+def test_trace_agent_completions() -> None:
+    run = imperative.Workflow(id="traced-agents").run()
+    agents: List[BaseAgent] = [
+        MockAgent(completion_fn=new_mock_completion, agent_id="agent")
+    ]
+    ctx = WorkflowContext(agents=agents, workflow_run=run)
+
+    tracer = Tracer(max_spans=2)
+    with tracer.activate():
+        for _ in range(3):
+            ctx.agents["agent"].create_completion(
+                messages=[{"role": "user", "content": "hi"}], model="gpt-4o"
+            )
+    # without an active tracer, we don't record anything
+    ctx.agents["agent"].create_completion(messages=[{"role": "user", "content": "hi"}])
+    with tracing.span("ignored") as span:
+        assert span is None
+
+    assert tracer.dropped_spans == 1
+    assert len(tracer.spans()) == 2
+    agent_span = tracer.spans()[0]
+    assert agent_span.name == "agent agent"
+    assert agent_span.attributes == {
+        "workflow.id": "traced-agents",
+        "workflow.run_id": run.id,
+        "workflow.task": "__main__",
+        "workflow.step": "__main__",
+        "agent.model": "gpt-4o",
+        "llm.usage.prompt_tokens": 11,
+        "llm.usage.completion_tokens": 21,
+        "llm.usage.total_tokens": 32,
+    }
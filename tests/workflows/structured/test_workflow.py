@@ -1,10 +1,17 @@
+import asyncio
+import dataclasses
 from dataclasses import dataclass
+import gc
 import pathlib
 from typing import List, Optional, Tuple
+import warnings
 
 import pytest
 
 from fixpoint.workflows import structured
+from fixpoint.workflows.structured._callcache import StepBoundedInMemCallCache
+from fixpoint.workflows.structured._workflow import get_workflow_definition_meta_fixp
+from fixpoint.workflows.structured._workflow_run_handle import WorkflowRunHandle
 
 
 def test_workflow_declaration() -> None:
@@ -168,3 +175,198 @@ async def test_workflow_disk_durability(tmp_path: pathlib.Path) -> None:
     assert task_data["num_runs"] == 3
     assert step_from_task_data["num_runs"] == 2
     assert step_from_workflow_data["num_runs"] == 2
+
+
+@pytest.mark.asyncio
+async def test_bounded_callcache_drops_completed_runs() -> None:
+    @structured.workflow(id="workflow")
+    class Workflow:
+        @structured.workflow_entrypoint()
+        async def main(self, ctx: structured.WorkflowContext, fail: bool) -> str:
+            res = await structured.call_step(ctx, some_step)
+            if fail:
+                raise Exception("workflow failed")
+            return res
+
+    @structured.step(id="some-step")
+    async def some_step(ctx: structured.WorkflowContext) -> str:
+        return "some-step succeeded"
+
+    run_config = structured.RunConfig.with_in_memory(callcache_max_entries=100)
+    step_cache = run_config.call_cache.steps
+    assert isinstance(step_cache, StepBoundedInMemCallCache)
+
+    await structured.run_workflow(
+        Workflow.main, run_config=run_config, agents=[], args=[False]
+    )
+    assert step_cache.stats().runs == 0
+
+    with pytest.raises(structured.errors.ExecutionError):
+        await structured.run_workflow(
+            Workflow.main, run_config=run_config, agents=[], args=[True]
+        )
+    # we keep the results of failed runs so that we can retry them
+    assert step_cache.stats().runs == 1
+
+
+@pytest.mark.asyncio
+async def test_idempotent_workflow_runs(tmp_path: pathlib.Path) -> None:
+    calls: List[str] = []
+    release = asyncio.Event()
+
+    @dataclass
+    class Summary:
+        doc: str
+        length: int
+
+    @structured.workflow(id="idempotent_workflow")
+    class IdempotentWorkflow:
+        @structured.workflow_entrypoint()
+        async def main(self, _ctx: structured.WorkflowContext, doc: str) -> Summary:
+            calls.append(doc)
+            await release.wait()
+            if doc == "broken" and calls.count(doc) == 1:
+                raise ValueError("first attempt fails")
+            return Summary(doc=doc, length=len(doc))
+
+    run_config = structured.RunConfig.with_disk(
+        storage_path=tmp_path.as_posix(), agent_cache_ttl_s=60, callcache_ttl_s=60
+    )
+
+    def spawn(doc: str, version: Optional[str] = None) -> WorkflowRunHandle[Summary]:
+        return structured.spawn_workflow(
+            IdempotentWorkflow.main,
+            run_config=run_config,
+            agents=[],
+            args=[doc],
+            idempotent=True,
+            idempotency_version=version,
+        )
+
+    # duplicates of an in-flight run attach to it
+    first, second, other = spawn("doc"), spawn("doc"), spawn("other doc")
+    assert first.workflow_run_id() == second.workflow_run_id()
+    assert first.workflow_run_id() != other.workflow_run_id()
+    waiting = asyncio.gather(first.result(), second.result(), other.result())
+    await asyncio.sleep(0.01)
+    release.set()
+    assert list(await waiting) == [
+        Summary("doc", 3),
+        Summary("doc", 3),
+        Summary("other doc", 9),
+    ]
+    assert calls == ["doc", "other doc"]
+
+    # a duplicate of a completed run gets the stored result
+    third = spawn("doc")
+    assert third.is_closed()
+    assert third.workflow_run_id() == first.workflow_run_id()
+    assert await third.result() == Summary("doc", 3)
+    assert calls == ["doc", "other doc"]
+
+    # a new version runs again
+    assert await spawn("doc", version="v2").result() == Summary("doc", 3)
+    assert calls == ["doc", "other doc", "doc"]
+
+    # a failed run is retried under the same run ID
+    failed = spawn("broken")
+    with pytest.raises(structured.ExecutionError):
+        await failed.result()
+    retried = spawn("broken")
+    assert retried.workflow_run_id() == failed.workflow_run_id()
+    assert await retried.result() == Summary("broken", 6)
+
+
+@pytest.mark.asyncio
+async def test_idempotent_runs_leave_the_in_flight_table() -> None:
+    calls: List[str] = []
+
+    @structured.workflow(id="idempotent_in_flight_workflow")
+    class InFlightWorkflow:
+        @structured.workflow_entrypoint()
+        async def main(self, _ctx: structured.WorkflowContext, doc: str) -> str:
+            calls.append(doc)
+            return doc.upper()
+
+    run_config = structured.RunConfig.with_in_memory()
+    fixpmeta = get_workflow_definition_meta_fixp(InFlightWorkflow)
+    assert fixpmeta is not None
+    in_flight = fixpmeta.idempotent_runs
+
+    def spawn(doc: str) -> WorkflowRunHandle[str]:
+        return structured.spawn_workflow(
+            InFlightWorkflow.main,
+            run_config=run_config,
+            agents=[],
+            args=[doc],
+            idempotent=True,
+        )
+
+    # dropping every handle before the run starts forgets the run
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        spawn("dropped")
+        gc.collect()
+    assert len(in_flight) == 0
+    assert calls == []
+
+    # a run that finishes is forgotten, even if no handle waits on it anymore
+    handle = spawn("doc")
+    waiting = asyncio.ensure_future(handle.result())
+    assert len(in_flight) == 1
+    await asyncio.sleep(0)
+    waiting.cancel()
+    del handle
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert len(in_flight) == 0
+    assert calls == ["doc"]
+
+
+@pytest.mark.asyncio
+async def test_retry_unknown_run() -> None:
+    @structured.workflow(id="workflow")
+    class Workflow:
+        @structured.workflow_entrypoint()
+        async def main(self, ctx: structured.WorkflowContext, fail: bool) -> str:
+            res = await structured.call_step(ctx, some_step)
+            if fail:
+                raise Exception("workflow failed")
+            return res
+
+    step_data = {"num_runs": 0}
+
+    @structured.step(id="some-step")
+    async def some_step(ctx: structured.WorkflowContext) -> str:
+        step_data["num_runs"] += 1
+        return "some-step succeeded"
+
+    run_config = structured.RunConfig.with_in_memory()
+    with pytest.raises(ValueError):
+        await structured.retry_workflow(
+            Workflow.main,
+            run_id="wfrun-unknown",
+            run_config=run_config,
+            agents=[],
+            args=[False],
+        )
+    assert step_data["num_runs"] == 0
+
+    with pytest.raises(structured.errors.ExecutionError) as exc_info:
+        await structured.run_workflow(
+            Workflow.main, run_config=run_config, agents=[], args=[True]
+        )
+    # A run that only the call cache knows about, for example because it ran in
+    # another process, resumes from its cached results.
+    other_process_config = dataclasses.replace(
+        run_config, storage=structured.RunConfig.with_in_memory().storage
+    )
+    res = await structured.retry_workflow(
+        Workflow.main,
+        run_id=exc_info.value.workflow_run_id,
+        run_config=other_process_config,
+        agents=[],
+        args=[False],
+    )
+    assert res == "some-step succeeded"
+    assert step_data["num_runs"] == 1
@@ -1,5 +1,20 @@
-from fixpoint.workflows.node_state import WorkflowStatus
+import asyncio
+import json
+import threading
+import time
+from typing import List
+
+import pydantic
+import pytest
+
+from fixpoint.workflows.node_state import (
+    NodeState,
+    NodeTree,
+    SpawnGroup,
+    WorkflowStatus,
+)
 from fixpoint.workflows.imperative.workflow import Workflow
+from fixpoint.workflows.imperative._workflow_run_storage import load_node_tree
 
 
 class TestNodeStates:
@@ -121,3 +136,225 @@ class TestNodeStates:
         # Check that the spawned nodes are in failed state
         assert wfrun._node_state.next_states[0].info.status == WorkflowStatus.FAILED
         assert wfrun._node_state.next_states[1].info.status == WorkflowStatus.FAILED
+
+    def test_spawn_group_runs_work_on_threads(self) -> None:
+        wfrun = Workflow(id="test_workflow").run()
+        in_flight = 0
+        max_in_flight = 0
+        lock = threading.Lock()
+
+        def extract(field: str) -> str:
+            nonlocal in_flight, max_in_flight
+            with lock:
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+            time.sleep(0.02)
+            with lock:
+                in_flight -= 1
+            if field == "broken":
+                raise ValueError("extraction failed")
+            return field.upper()
+
+        with wfrun.spawn_group(max_workers=2) as sg:
+            for field in ["name", "date", "total"]:
+                sg.submit_step(f"extract-{field}", extract, field)
+            sg.spawn_step("manual")
+        assert sg.results() == ["NAME", "DATE", "TOTAL"]
+        assert max_in_flight == 2
+        states = wfrun._node_state.next_states
+        assert [s.info.id for s in states] == [
+            "__main__/extract-name",
+            "__main__/extract-date",
+            "__main__/extract-total",
+            "__main__/manual",
+        ]
+        assert all(s.info.status == WorkflowStatus.COMPLETED for s in states)
+
+        with pytest.raises(ExceptionGroup) as exc_info:
+            with wfrun.spawn_group() as sg:
+                sg.submit_task("ok", extract, "ok")
+                sg.submit_task("broken", extract, "broken")
+        [error] = exc_info.value.exceptions
+        assert isinstance(error, ValueError)
+        statuses = [s.info.status for s in wfrun._node_state.next_states[4:]]
+        assert statuses == [WorkflowStatus.COMPLETED, WorkflowStatus.FAILED]
+
+    @pytest.mark.asyncio
+    async def test_spawn_group_runs_coroutines(self) -> None:
+        wfrun = Workflow(id="test_workflow").run()
+        blocked = asyncio.Event()
+
+        async def extract(field: str) -> str:
+            if field == "slow":
+                await blocked.wait()
+            await asyncio.sleep(0)
+            return field.upper()
+
+        async with wfrun.spawn_group(max_workers=2) as sg:
+            sg.start_step("name", extract("name"))
+            sg.start_task("date", extract("date"))
+        assert sg.results() == ["NAME", "DATE"]
+
+        # if the group's block raises, the unfinished work is cancelled
+        with pytest.raises(ValueError):
+            async with wfrun.spawn_group() as sg:
+                sg.start_step("slow", extract("slow"))
+                await asyncio.sleep(0)
+                raise ValueError("give up")
+        statuses = [s.info.status for s in wfrun._node_state.next_states]
+        assert statuses == [
+            WorkflowStatus.COMPLETED,
+            WorkflowStatus.COMPLETED,
+            WorkflowStatus.CANCELLED,
+        ]
+
+    @pytest.mark.asyncio
+    async def test_sync_spawn_group_rejects_coroutines(self) -> None:
+        wfrun = Workflow(id="test_workflow").run()
+
+        async def extract() -> str:
+            return "value"
+
+        tasks_before = asyncio.all_tasks()
+        with wfrun.spawn_group() as sg:
+            with pytest.raises(RuntimeError, match="async with"):
+                sg.start_step("extract", extract())
+        # nothing was left running on the event loop
+        assert asyncio.all_tasks() == tasks_before
+
+    def test_spawn_group_propagates_base_exceptions(self) -> None:
+        wfrun = Workflow(id="test_workflow").run()
+
+        def interrupt() -> None:
+            raise KeyboardInterrupt()
+
+        def cancel() -> None:
+            raise asyncio.CancelledError()
+
+        with pytest.raises(KeyboardInterrupt):
+            with wfrun.spawn_group() as sg:
+                sg.submit_step("interrupt", interrupt)
+                sg.submit_step("ok", str)
+
+        with pytest.raises(BaseExceptionGroup) as exc_info:
+            with wfrun.spawn_group() as sg:
+                sg.submit_step("cancel", cancel)
+        [error] = exc_info.value.exceptions
+        assert isinstance(error, asyncio.CancelledError)
+        statuses = [s.info.status for s in wfrun._node_state.next_states]
+        assert statuses == [
+            WorkflowStatus.FAILED,
+            WorkflowStatus.COMPLETED,
+            WorkflowStatus.FAILED,
+        ]
+
+    def test_spawn_group_serializes_callbacks(self) -> None:
+        in_callback = 0
+        max_in_callback = 0
+        closed: List[int] = []
+
+        def on_close(node: NodeState) -> None:
+            nonlocal in_callback, max_in_callback
+            in_callback += 1
+            max_in_callback = max(max_in_callback, in_callback)
+            time.sleep(0.001)
+            closed.append(node.index)
+            in_callback -= 1
+
+        with SpawnGroup(NodeState(), on_close=on_close, max_workers=8) as sg:
+            for i in range(32):
+                sg.submit_step(f"step-{i}", time.sleep, 0.001)
+        assert max_in_callback == 1
+        assert sorted(closed) == list(range(1, 33))
+
+
+class TestNodeTree:
+    def test_append_and_views(self) -> None:
+        root = NodeState()
+        task = root.add_task("task_1")
+        steps = [task.add_step(f"step_{i % 3}") for i in range(6)]
+        steps[0].status = WorkflowStatus.COMPLETED
+
+        tree = root.tree
+        assert len(tree) == 8
+        # task and step IDs are interned
+        assert tree.to_dict()["names"] == [
+            "__main__",
+            "task_1",
+            "step_0",
+            "step_1",
+            "step_2",
+        ]
+        assert task.next_states == steps
+        assert steps[3].prev_state == task
+        assert steps[3].info.id == "task_1/step_0"
+        assert tree.node(steps[0].index).info.status == WorkflowStatus.COMPLETED
+
+        renamed = task.renamed(step="other")
+        assert renamed == task
+        assert renamed.info.id == "task_1/other"
+        assert renamed.add_step("next").info.id == "task_1/next"
+
+        with pytest.raises(IndexError):
+            tree.append(100, "task", "step")
+
+    def test_serialization_roundtrip(self) -> None:
+        wfrun = Workflow(id="test_workflow").run()
+        with wfrun.spawn_group() as sg:
+            sg.spawn_step("step_1")
+            sg.spawn_task("task_1")
+        wfrun.call_step("step_2")
+
+        data = json.loads(json.dumps(wfrun._node_state.tree.to_dict()))
+        root = NodeTree.from_dict(data).node(0)
+        assert [n.info.id for n in root.next_states] == [
+            "__main__/step_1",
+            "task_1/__main__",
+            "__main__/step_2",
+        ]
+        assert [n.info.status for n in root.next_states] == [
+            WorkflowStatus.COMPLETED,
+            WorkflowStatus.COMPLETED,
+            WorkflowStatus.RUNNING,
+        ]
+
+    def test_load_nested_node_tree(self) -> None:
+        root = load_node_tree(
+            {
+                "info": {"task": "__main__", "step": "__main__", "status": "FAILED"},
+                "next_states": [
+                    {
+                        "info": {"task": "t", "step": "__main__", "status": None},
+                        "next_states": [
+                            {
+                                "info": {"task": "t", "step": "s", "status": "FAILED"},
+                                "next_states": [],
+                            }
+                        ],
+                    },
+                    {
+                        "info": {"task": "__main__", "step": "s2"},
+                        "next_states": [],
+                    },
+                ],
+            }
+        )
+        assert root.info.status == WorkflowStatus.FAILED
+        task, step_2 = root.next_states
+        assert task.info.status is None
+        assert [n.info.id for n in task.next_states] == ["t/s"]
+        assert step_2.info.id == "__main__/s2"
+        assert step_2.info.status == WorkflowStatus.RUNNING
+
+
+def test_node_info_is_a_frozen_snapshot() -> None:
+    node = NodeState().add_step("step")
+    info = node.info
+    with pytest.raises(pydantic.ValidationError):
+        info.status = WorkflowStatus.FAILED  # type: ignore[misc]
+    assert node.status == WorkflowStatus.RUNNING
+
+    node.status = WorkflowStatus.COMPLETED
+    assert node.info.status == WorkflowStatus.COMPLETED
+    # the snapshot doesn't change with the node
+    assert info.status == WorkflowStatus.RUNNING